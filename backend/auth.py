@@ -0,0 +1,233 @@
+"""
+Verification of Supabase access tokens (JWTs) for get_current_user.
+
+AUTH_VERIFICATION selects the mode:
+- 'local' (default): tokens are verified in-process. Asymmetric tokens (ES256/RS256) are checked against the
+  project's signing keys (JWKS), which are cached and refreshed every AUTH_JWKS_REFRESH_SECONDS (and when a
+  token uses an unknown key id). HS256 tokens are checked with SUPABASE_JWT_SECRET.
+  When no key is available for a token, it is verified remotely instead.
+- 'remote': every token is verified by the Supabase Auth server (supabase.auth.get_user), as before.
+
+Verified tokens are cached for AUTH_TOKEN_CACHE_TTL seconds (never past their expiry), so repeated requests
+with the same token skip verification entirely. A locally verified JWT stays valid until it expires, even if
+the user signs out; with AUTH_REVOCATION_CHECK_SECONDS > 0 each session is also re-checked remotely at most
+once per interval, so revoked sessions are rejected within that interval.
+"""
+from dataclasses import dataclass, field
+from typing import Any, Callable, Dict, Optional
+import hashlib
+import os
+import threading
+import time
+import httpx
+import jwt
+from dotenv import load_dotenv
+from backend.ttl_cache import TTLLRUCache
+
+load_dotenv()
+
+AUTH_VERIFICATION = os.getenv("AUTH_VERIFICATION", "local") # 'local' or 'remote'
+SUPABASE_JWT_SECRET = os.getenv("SUPABASE_JWT_SECRET") # Legacy HS256 secret (Project Settings > API > JWT Secret)
+AUTH_JWT_AUDIENCE = os.getenv("AUTH_JWT_AUDIENCE", "authenticated")
+AUTH_JWKS_REFRESH_SECONDS = float(os.getenv("AUTH_JWKS_REFRESH_SECONDS", "600"))
+AUTH_JWKS_MIN_REFRESH_SECONDS = 30.0 # Unknown key ids do not trigger more than one refresh per 30 seconds
+AUTH_TOKEN_CACHE_TTL = float(os.getenv("AUTH_TOKEN_CACHE_TTL", "60"))
+AUTH_TOKEN_CACHE_SIZE = int(os.getenv("AUTH_TOKEN_CACHE_SIZE", "10000"))
+AUTH_REVOCATION_CHECK_SECONDS = float(os.getenv("AUTH_REVOCATION_CHECK_SECONDS", "300")) # 0 disables remote revocation checks
+AUTH_CLOCK_SKEW_SECONDS = 30
+
+
+class AuthError(Exception):
+    """Raised when a token cannot be verified."""
+
+
+class NoSigningKey(AuthError):
+    """Raised when no local key is available for a token, so it has to be verified remotely."""
+
+
+@dataclass
+class TokenUser:
+    """The authenticated user, built from the claims of a verified access token."""
+    id: str
+    email: Optional[str] = None
+    role: Optional[str] = None
+    aud: Optional[str] = None
+    session_id: Optional[str] = None
+    app_metadata: Dict[str, Any] = field(default_factory=dict)
+    user_metadata: Dict[str, Any] = field(default_factory=dict)
+
+    @classmethod
+    def from_claims(cls, claims: dict) -> "TokenUser":
+        return cls(
+            id=claims["sub"],
+            email=claims.get("email"),
+            role=claims.get("role"),
+            aud=claims.get("aud"),
+            session_id=claims.get("session_id"),
+            app_metadata=claims.get("app_metadata") or {},
+            user_metadata=claims.get("user_metadata") or {},
+        )
+
+
+class SigningKeyCache:
+    """The project's public signing keys (JWKS), fetched on first use and refreshed periodically."""
+
+    def __init__(self, jwks_url: str, refresh_seconds: float = AUTH_JWKS_REFRESH_SECONDS, fetch: Optional[Callable[[str], dict]] = None):
+        self.jwks_url = jwks_url
+        self.refresh_seconds = refresh_seconds
+        self.fetch = fetch or self._fetch
+        self._keys: Dict[str, jwt.PyJWK] = {}
+        self._fetched_at = None
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def _fetch(url: str) -> dict:
+        response = httpx.get(url, timeout=5)
+        response.raise_for_status()
+        return response.json()
+
+    def _refresh(self):
+        try:
+            jwks = self.fetch(self.jwks_url)
+        except Exception as e:
+            # Keep using the keys we have; try again after the minimum interval
+            print(f"Failed to refresh signing keys from {self.jwks_url}: {e}")
+            self._fetched_at = time.monotonic() - self.refresh_seconds + AUTH_JWKS_MIN_REFRESH_SECONDS
+            return
+        keys = {}
+        for data in jwks.get("keys", []):
+            try:
+                key = jwt.PyJWK(data)
+            except jwt.PyJWTError as e:
+                print(f"Skipping unsupported signing key {data.get('kid')}: {e}")
+                continue
+            keys[data.get("kid")] = key
+        self._keys = keys
+        self._fetched_at = time.monotonic()
+        print(f"Loaded {len(keys)} signing keys from {self.jwks_url}.")
+
+    def get(self, kid: Optional[str]) -> Optional[jwt.PyJWK]:
+        now = time.monotonic()
+        if self._fetched_at is None or now - self._fetched_at > self.refresh_seconds:
+            with self._lock:
+                if self._fetched_at is None or now - self._fetched_at > self.refresh_seconds:
+                    self._refresh()
+        key = self._keys.get(kid)
+        if key is None and now - self._fetched_at > AUTH_JWKS_MIN_REFRESH_SECONDS:
+            # The signing key may have been rotated since the last refresh
+            with self._lock:
+                if time.monotonic() - self._fetched_at > AUTH_JWKS_MIN_REFRESH_SECONDS:
+                    self._refresh()
+            key = self._keys.get(kid)
+        return key
+
+
+class TokenVerifier:
+    """
+    Verifies access tokens locally and caches the result. `remote_verify(token)` returns the user from the
+    Supabase Auth server; it is used as a fallback and for revocation checks.
+    """
+
+    def __init__(self, supabase_url: str, remote_verify: Callable[[str], Any], jwt_secret: Optional[str] = SUPABASE_JWT_SECRET,
+                 audience: str = AUTH_JWT_AUDIENCE, signing_keys: Optional[SigningKeyCache] = None,
+                 cache_ttl: float = AUTH_TOKEN_CACHE_TTL, cache_size: int = AUTH_TOKEN_CACHE_SIZE,
+                 revocation_check_seconds: float = AUTH_REVOCATION_CHECK_SECONDS):
+        self.issuer = f"{supabase_url.rstrip('/')}/auth/v1"
+        self.remote_verify = remote_verify
+        self.jwt_secret = jwt_secret
+        self.audience = audience
+        self.signing_keys = signing_keys or SigningKeyCache(f"{self.issuer}/.well-known/jwks.json")
+        self.cache_ttl = cache_ttl
+        self.tokens = TTLLRUCache(cache_size, cache_ttl)
+        self.revocation_check_seconds = revocation_check_seconds
+        self.sessions_checked = TTLLRUCache(cache_size, revocation_check_seconds or 1)
+
+    def _key_for(self, token: str):
+        try:
+            header = jwt.get_unverified_header(token)
+        except jwt.PyJWTError as e:
+            raise AuthError(f"Malformed token: {e}")
+        algorithm = header.get("alg")
+        if algorithm == "HS256":
+            if not self.jwt_secret:
+                raise NoSigningKey("SUPABASE_JWT_SECRET is not set")
+            return self.jwt_secret, algorithm
+        if algorithm in ("ES256", "RS256", "EdDSA"):
+            key = self.signing_keys.get(header.get("kid"))
+            if key is None:
+                raise NoSigningKey(f"No signing key with kid {header.get('kid')}")
+            return key, algorithm
+        raise AuthError(f"Unsupported token algorithm: {algorithm}")
+
+    def verify_locally(self, token: str) -> dict:
+        """Verify the signature and claims of a token and return its claims."""
+        key, algorithm = self._key_for(token)
+        try:
+            claims = jwt.decode(
+                token, key, algorithms=[algorithm], audience=self.audience, leeway=AUTH_CLOCK_SKEW_SECONDS,
+                options={"require": ["exp", "sub"]},
+            )
+        except jwt.PyJWTError as e:
+            raise AuthError(f"Invalid token: {e}")
+        if claims.get("iss") and claims["iss"] != self.issuer:
+            raise AuthError(f"Invalid token issuer: {claims['iss']}")
+        return claims
+
+    def _check_revocation(self, token: str, user: TokenUser):
+        """Re-check the session with the Supabase Auth server at most once per revocation_check_seconds."""
+        if not self.revocation_check_seconds:
+            return
+        session_key = user.session_id or user.id
+        if self.sessions_checked.get(session_key):
+            return
+        try:
+            remote_user = self.remote_verify(token)
+        except Exception as e:
+            raise AuthError(f"Session rejected by the auth server: {e}")
+        if not remote_user:
+            raise AuthError("Session rejected by the auth server")
+        self.sessions_checked.set(session_key, True)
+
+    @staticmethod
+    def _cache_key(token: str) -> bytes:
+        return hashlib.sha256(token.encode("utf-8")).digest()
+
+    def cached(self, token: str):
+        """Return the user for a recently verified token, or None. Never blocks."""
+        return self.tokens.get(self._cache_key(token))
+
+    def verify(self, token: str):
+        """Return the user for a valid token, or raise AuthError. Blocking (may call the auth server)."""
+        cache_key = self._cache_key(token)
+        user = self.tokens.get(cache_key)
+        if user is not None:
+            return user
+
+        try:
+            claims = self.verify_locally(token)
+        except NoSigningKey as e:
+            print(f"Verifying token remotely: {e}")
+            user = self.remote_verify(token)
+            if not user:
+                raise AuthError("Token rejected by the auth server")
+            self._cache(cache_key, token, user)
+            return user
+
+        user = TokenUser.from_claims(claims)
+        self._check_revocation(token, user)
+        self._cache(cache_key, token, user, claims["exp"])
+        return user
+
+    def _cache(self, cache_key: bytes, token: str, user, exp: Optional[float] = None):
+        """Cache a verified token for cache_ttl seconds, but never beyond its expiry."""
+        if exp is None:
+            try:
+                # Verified remotely: the claims are only read for the expiry
+                exp = jwt.decode(token, options={"verify_signature": False}).get("exp")
+            except jwt.PyJWTError:
+                exp = None
+            if exp is None:
+                return # Unknown expiry: verify again next time
+        ttl = min(self.cache_ttl, exp - time.time())
+        if ttl > 0:
+            self.tokens.set(cache_key, user, ttl=ttl)
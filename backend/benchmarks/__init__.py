@@ -0,0 +1,2 @@
+# This file makes the 'backend/benchmarks' directory a Python package.
+# Benchmarks are run as modules, e.g.: python -m backend.benchmarks.embedding_throughput
@@ -0,0 +1,138 @@
+"""
+Requests/s on GET /cases/ with remote token verification (a Supabase Auth round trip per request) vs. local
+JWT verification with cached signing keys.
+
+A fake Supabase Auth server is started on a local port: it serves the JWKS of a freshly generated ES256
+key and answers /auth/v1/user after a simulated network latency. The API is called in-process through
+httpx's ASGI transport; /cases/ queries the database in DATABASE_URL (read-only; the benchmark user has no cases).
+
+Usage:
+    python -m backend.benchmarks.auth_overhead --requests 500 --concurrency 20 --auth-latency 0.03
+"""
+import argparse
+import asyncio
+import json
+import time
+import uuid
+import httpx
+import jwt
+from cryptography.hazmat.primitives.asymmetric import ec
+from fastapi import FastAPI, Header, HTTPException
+from supabase import create_client
+from backend import dependencies
+from backend.auth import SigningKeyCache, TokenVerifier
+from backend.container import container, get_engine
+from backend.benchmarks.report_streaming import _start_server
+
+
+def create_fake_auth_app(public_jwk: dict, user_id: str, latency: float) -> FastAPI:
+    app = FastAPI()
+
+    @app.get("/auth/v1/.well-known/jwks.json")
+    async def jwks():
+        return {"keys": [public_jwk]}
+
+    @app.get("/auth/v1/user")
+    async def user(authorization: str = Header(None)):
+        await asyncio.sleep(latency) # Round trip to the Supabase Auth server
+        if not authorization:
+            raise HTTPException(status_code=401)
+        return {"id": user_id, "aud": "authenticated", "role": "authenticated", "app_metadata": {}, "user_metadata": {},
+                "created_at": "2025-01-01T00:00:00Z"}
+
+    return app
+
+
+async def measure(app, token: str, requests: int, concurrency: int) -> dict:
+    latencies = []
+    transport = httpx.ASGITransport(app=app)
+    async with httpx.AsyncClient(transport=transport, base_url="http://api") as client:
+        counter = iter(range(requests))
+
+        async def worker():
+            for _ in counter:
+                start = time.perf_counter()
+                response = await client.get("/cases/", headers={"Authorization": f"Bearer {token}"})
+                latencies.append(time.perf_counter() - start)
+                assert response.status_code == 200, response.text
+
+        await client.get("/cases/", headers={"Authorization": f"Bearer {token}"}) # Warm-up (keys, caches, DB pool)
+        start = time.perf_counter()
+        await asyncio.gather(*[worker() for _ in range(concurrency)])
+        elapsed = time.perf_counter() - start
+    latencies.sort()
+    return {
+        "requests_per_second": round(requests / elapsed, 1),
+        "p50_ms": round(latencies[len(latencies) // 2] * 1000, 2),
+        "p95_ms": round(latencies[int(len(latencies) * 0.95)] * 1000, 2),
+    }
+
+
+def per_call_microseconds(function, token: str, calls: int = 2000) -> float:
+    start = time.perf_counter()
+    for _ in range(calls):
+        function(token)
+    return round((time.perf_counter() - start) / calls * 1e6, 2)
+
+
+def run(requests: int, concurrency: int, auth_latency: float) -> dict:
+    from backend.main import app
+    get_engine().echo = False # SQL logging would dominate the measurement
+
+    private_key = ec.generate_private_key(ec.SECP256R1())
+    public_jwk = json.loads(jwt.algorithms.ECAlgorithm.to_jwk(private_key.public_key()))
+    public_jwk.update({"kid": "bench", "alg": "ES256", "use": "sig"})
+    user_id = str(uuid.uuid4())
+
+    server, thread, port = _start_server(create_fake_auth_app(public_jwk, user_id, auth_latency))
+    auth_url = f"http://127.0.0.1:{port}"
+    token = jwt.encode(
+        {"sub": user_id, "aud": "authenticated", "role": "authenticated", "iss": f"{auth_url}/auth/v1",
+         "exp": int(time.time()) + 3600, "session_id": str(uuid.uuid4())},
+        private_key, algorithm="ES256", headers={"kid": "bench"},
+    )
+
+    fake_supabase = create_client(auth_url, dependencies.SUPABASE_KEY)
+    def verify_remotely(token: str):
+        response = fake_supabase.auth.get_user(token)
+        return response.user if response else None
+
+    dependencies.verify_token_remotely = verify_remotely
+    results = {}
+    try:
+        dependencies.AUTH_VERIFICATION = "remote"
+        results["remote"] = asyncio.run(measure(app, token, requests, concurrency))
+
+        dependencies.AUTH_VERIFICATION = "local"
+        # Without the verified-token cache: every request checks the signature
+        container.override("token_verifier", TokenVerifier(auth_url, verify_remotely, cache_ttl=0,
+                                                            signing_keys=SigningKeyCache(f"{auth_url}/auth/v1/.well-known/jwks.json")))
+        results["local_signature_check"] = asyncio.run(measure(app, token, requests, concurrency))
+
+        container.override("token_verifier", TokenVerifier(auth_url, verify_remotely))
+        results["local_cached"] = asyncio.run(measure(app, token, requests, concurrency))
+
+        # Cost of authentication alone, per request
+        results["auth_microseconds"] = {
+            "remote": per_call_microseconds(verify_remotely, token, calls=20),
+            "local_signature_check": per_call_microseconds(dependencies.get_token_verifier().verify_locally, token),
+            "local_cached": per_call_microseconds(dependencies.get_token_verifier().cached, token),
+        }
+    finally:
+        server.should_exit = True
+        thread.join(timeout=5)
+    return {"config": {"requests": requests, "concurrency": concurrency, "auth_latency": auth_latency}, **results}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--requests", type=int, default=500)
+    parser.add_argument("--concurrency", type=int, default=20)
+    parser.add_argument("--auth-latency", type=float, default=0.03, help="Simulated Supabase Auth round trip (seconds)")
+    args = parser.parse_args()
+
+    print(json.dumps(run(args.requests, args.concurrency, args.auth_latency), indent=2))
+
+
+if __name__ == "__main__":
+    main()
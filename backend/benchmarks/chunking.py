@@ -0,0 +1,78 @@
+"""
+Chunking benchmark on the sample reports in memory-bank/Arbeidsdeskundige data.
+
+Compares the old paragraph chunking (one chunk per paragraph) with the token-aware sentence chunker:
+number of chunks (= embedding inputs and index rows), chunk size distribution in tokens, and throughput
+in pages per second on one core (a page is counted as 3000 characters).
+
+Usage:
+    python -m backend.benchmarks.chunking --repeat 50
+"""
+import argparse
+import json
+import os
+import statistics
+import time
+from backend.chunking import CHUNK_MAX_TOKENS, chunk_paragraphs, count_tokens
+from backend.ingestion import iter_lines, iter_paragraphs
+
+DATA_DIR = os.path.join(os.path.dirname(__file__), "..", "..", "memory-bank", "Arbeidsdeskundige data")
+CHARACTERS_PER_PAGE = 3000
+
+
+def load_paragraphs(data_dir: str) -> dict:
+    documents = {}
+    for filename in sorted(os.listdir(data_dir)):
+        extension = os.path.splitext(filename)[1].lower()
+        if extension not in (".docx", ".txt"):
+            continue
+        with open(os.path.join(data_dir, filename), "rb") as fileobj:
+            documents[filename] = list(iter_paragraphs(iter_lines(fileobj, extension)))
+    return documents
+
+
+def describe(chunks: list) -> dict:
+    tokens = [count_tokens(chunk) for chunk in chunks]
+    return {
+        "chunks": len(chunks),
+        "tokens_min": min(tokens),
+        "tokens_median": statistics.median(tokens),
+        "tokens_max": max(tokens),
+        "chunks_under_20_tokens": sum(1 for t in tokens if t < 20),
+        "chunks_over_max_tokens": sum(1 for t in tokens if t > CHUNK_MAX_TOKENS),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--data-dir", default=DATA_DIR)
+    parser.add_argument("--repeat", type=int, default=50, help="Times the corpus is chunked for the throughput measurement")
+    args = parser.parse_args()
+
+    documents = load_paragraphs(args.data_dir)
+    results = {"documents": {}}
+    for filename, paragraphs in documents.items():
+        results["documents"][filename] = {
+            "paragraph": describe(paragraphs),
+            "sentence": describe(list(chunk_paragraphs(paragraphs))),
+        }
+
+    all_paragraphs = [paragraph for paragraphs in documents.values() for paragraph in paragraphs]
+    characters = sum(len(paragraph) for paragraph in all_paragraphs)
+    start = time.perf_counter()
+    for _ in range(args.repeat):
+        for paragraphs in documents.values():
+            for _chunk in chunk_paragraphs(paragraphs):
+                pass
+    elapsed = time.perf_counter() - start
+    results["total"] = {
+        "paragraph_chunks": len(all_paragraphs),
+        "sentence_chunks": sum(document["sentence"]["chunks"] for document in results["documents"].values()),
+        "pages": round(characters / CHARACTERS_PER_PAGE, 1),
+        "pages_per_second": round(characters * args.repeat / CHARACTERS_PER_PAGE / elapsed, 1),
+    }
+    print(json.dumps(results, indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,105 @@
+"""
+Prompt context size and retrieval latency with and without context packing (backend/context_packing.py).
+
+A case with --documents synthetic reports of about --pages pages each is ingested into a scratch schema
+('context_packing_bench' by default) of the database in DATABASE_URL (or --database-url); every second document
+is a lightly edited copy of the previous one, like successive versions of a report uploaded to the same case.
+For --queries prompts the context is retrieved twice: the plain top REPORT_CONTEXT_CHUNKS chunks and the packed
+context. Embeddings come from the local stand-in backend, so the ranking itself is not meaningful; the
+benchmark measures context size (tokens) and the cost of packing.
+
+Usage:
+    python -m backend.benchmarks.context_packing --documents 4 --pages 20 --queries 20
+"""
+import argparse
+import json
+import os
+import statistics
+import time
+import uuid
+from dotenv import load_dotenv
+from sqlalchemy import text
+from sqlmodel import Session, SQLModel
+from backend import context_packing, report_generation
+from backend.benchmarks.hybrid_search import TOPICS
+from backend.benchmarks.reindex import edit_report, synthetic_report
+from backend.database import create_db_engine
+from backend.ingestion import ingest_document, iter_chunks
+from backend.models import Case, Document
+
+load_dotenv()
+
+
+def load_case(engine, documents: int, pages: int, seed: int):
+    with Session(engine) as session:
+        case = Case(user_id=uuid.uuid4(), name="Benchmark")
+        session.add(case)
+        session.commit()
+        paragraphs = None
+        for index in range(documents):
+            paragraphs = edit_report(paragraphs, 3, seed + index) if index % 2 else synthetic_report(pages, seed + index)
+            document = Document(case_id=case.id, file_name=f"rapport_{index}.txt", file_path=f"benchmark/rapport_{index}.txt", file_type="text/plain")
+            session.add(document)
+            session.commit()
+            ingest_document(session, document, None, ".txt", engine, chunks=list(iter_chunks(paragraphs)), parsed_content="\n\n".join(paragraphs))
+            session.commit()
+        return case.id
+
+
+def measure(engine, case_id, prompts, packing: bool) -> dict:
+    context_packing_enabled = report_generation.REPORT_CONTEXT_PACKING
+    report_generation.REPORT_CONTEXT_PACKING = packing
+    tokens, chunks, latencies = [], [], []
+    try:
+        for prompt in prompts:
+            with Session(engine) as session:
+                start = time.perf_counter()
+                context = report_generation.retrieve_context(session, case_id, prompt)
+                latencies.append((time.perf_counter() - start) * 1000)
+            tokens.append(context.tokens)
+            chunks.append(len(context.chunks))
+    finally:
+        report_generation.REPORT_CONTEXT_PACKING = context_packing_enabled
+    return {
+        "mean_context_tokens": round(statistics.mean(tokens)),
+        "max_context_tokens": max(tokens),
+        "mean_chunks": round(statistics.mean(chunks), 1),
+        "p50_ms": round(statistics.median(latencies), 2),
+        "p95_ms": round(sorted(latencies)[int(len(latencies) * 0.95) - 1], 2),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--database-url", default=os.getenv("DATABASE_URL"))
+    parser.add_argument("--schema", default="context_packing_bench")
+    parser.add_argument("--documents", type=int, default=4)
+    parser.add_argument("--pages", type=int, default=20)
+    parser.add_argument("--queries", type=int, default=20)
+    parser.add_argument("--seed", type=int, default=42)
+    args = parser.parse_args()
+
+    engine = create_db_engine(args.database_url, connect_args={"options": f"-csearch_path={args.schema},public,extensions"})
+    with engine.begin() as connection:
+        connection.execute(text(f"DROP SCHEMA IF EXISTS {args.schema} CASCADE"))
+        connection.execute(text(f"CREATE SCHEMA {args.schema}"))
+    # checkfirst=False: the application's tables in public are visible through the search path and would be taken as existing
+    SQLModel.metadata.create_all(engine, checkfirst=False)
+
+    try:
+        case_id = load_case(engine, args.documents, args.pages, args.seed)
+        prompts = [f"Beschrijf: {TOPICS[index % len(TOPICS)].lower()} (vraag {index})" for index in range(args.queries)]
+        results = {"config": {"documents": args.documents, "pages": args.pages, "queries": args.queries,
+                              "candidates": context_packing.REPORT_CONTEXT_CANDIDATES, "token_budget": context_packing.REPORT_CONTEXT_TOKEN_BUDGET,
+                              "mmr_lambda": context_packing.REPORT_CONTEXT_MMR_LAMBDA}}
+        results["top_k"] = measure(engine, case_id, prompts, packing=False)
+        results["packed"] = measure(engine, case_id, prompts, packing=True)
+        results["mean_tokens_saved"] = results["top_k"]["mean_context_tokens"] - results["packed"]["mean_context_tokens"]
+    finally:
+        with engine.begin() as connection:
+            connection.execute(text(f"DROP SCHEMA IF EXISTS {args.schema} CASCADE"))
+    print(json.dumps(results, indent=2))
+
+
+if __name__ == "__main__":
+    main()
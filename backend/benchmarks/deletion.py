@@ -0,0 +1,173 @@
+"""
+API time and memory of deleting a case: row-by-row ORM deletion (session.delete(), which loads the related rows
+into Python, as the routers did) against the set-based deletion of backend/deletion.py, and the batched removal
+of the documents' files from storage.
+
+A case with --documents documents, --chunks chunks in total (1536-dimension embeddings) and --reports reports is
+created in a scratch schema ('deletion_bench' by default) of the database in DATABASE_URL (or --database-url).
+- orm: loads the case's documents and their chunks through the relationships and deletes every row with
+  session.delete() (the old routers did the loading too, but then failed on the NOT NULL foreign keys); the
+  transaction is rolled back, so the same case is deleted again by
+- set_based: delete_case() and commit, as DELETE /cases/{case_id} now does,
+- storage: the documents' files, stored in a local fake Supabase Storage, are removed in batches of
+  --storage-batch-size paths, as the remove_storage_objects task does.
+Times are wall-clock; memory is the tracemalloc peak of the Python process (the ORM path is run once more for
+it, because tracing slows down allocating its many objects).
+
+Usage:
+    python -m backend.benchmarks.deletion --documents 50 --chunks 50000
+"""
+import argparse
+import json
+import os
+import time
+import tracemalloc
+import uuid
+import numpy as np
+from dotenv import load_dotenv
+from sqlalchemy import func, text
+from sqlmodel import Session, SQLModel, select
+from backend.benchmarks.fake_openai_server import start_server
+from backend.benchmarks.fake_supabase_server import FakeSupabaseState, create_app as create_supabase_app, create_signing_key
+from backend.database import create_db_engine
+from backend.deletion import delete_case, unreferenced_paths
+from backend.models import Case, Chunk, Document, GeneratedReport
+from backend.storage import STORAGE_BUCKET, STORAGE_DELETE_BATCH_SIZE, remove_objects
+
+load_dotenv()
+
+CHUNK_TEXT = ("De werknemer is sinds maart arbeidsongeschikt door rugklachten. De bedrijfsarts adviseert een "
+              "geleidelijke opbouw van de werkzaamheden, met aangepaste werktijden en zonder tillen boven 10 kg. ") * 4
+
+
+def create_case(engine, documents: int, chunks: int, reports: int, seed: int):
+    """Returns the case id and the storage paths of its documents."""
+    embedding = "[" + ",".join(f"{value:.6f}" for value in np.random.default_rng(seed).standard_normal(1536)) + "]"
+    with Session(engine) as session:
+        case = Case(user_id=uuid.uuid4(), name="Benchmark")
+        session.add(case)
+        session.flush()
+        rows = [Document(case_id=case.id, file_name=f"rapport_{index}.pdf", file_path=f"temp/{case.id}/{uuid.uuid4()}.pdf",
+                         file_type="application/pdf", processing_status="completed") for index in range(documents)]
+        session.add_all(rows)
+        session.add_all([GeneratedReport(case_id=case.id, content={"prompt": "Rapport"}, generation_status="completed") for _ in range(reports)])
+        session.flush()
+        # Generated in the database: every chunk gets the same embedding, which costs the same to store and delete
+        session.execute(text("""
+            INSERT INTO chunk (id, document_id, content, embedding, created_at)
+            SELECT gen_random_uuid(), documents[1 + n % cardinality(documents)], :content || n, CAST(:embedding AS vector), now()
+            FROM generate_series(1, :chunks) AS n, CAST(:documents AS uuid[]) AS documents
+        """), {"documents": [str(document.id) for document in rows], "content": CHUNK_TEXT, "embedding": embedding, "chunks": chunks})
+        session.commit()
+        case_id, paths = case.id, [document.file_path for document in rows]
+    with engine.connect().execution_options(isolation_level="AUTOCOMMIT") as connection:
+        connection.execute(text("VACUUM ANALYZE chunk"))
+        connection.execute(text("VACUUM ANALYZE document"))
+    return case_id, paths
+
+
+def measure(function, trace: bool = True) -> dict:
+    if trace:
+        tracemalloc.start()
+    start = time.perf_counter()
+    result = function()
+    seconds = time.perf_counter() - start
+    if trace:
+        result["peak_bytes"] = tracemalloc.get_traced_memory()[1]
+        tracemalloc.stop()
+    return {"ms": round(seconds * 1000, 1), **result}
+
+
+def orm_delete(engine, case_id) -> dict:
+    def run(session):
+        case = session.get(Case, case_id)
+        loaded = 0
+        for document in case.documents:
+            for chunk in document.chunks: # Loads every chunk with its embedding
+                session.delete(chunk)
+                loaded += 1
+            session.delete(document)
+        for report in case.reports:
+            session.delete(report)
+        session.delete(case)
+        session.flush()
+        return {"chunks_loaded": loaded}
+
+    with Session(engine) as session:
+        result = measure(lambda: run(session), trace=False)
+        session.rollback()
+    with Session(engine) as session:
+        result["peak_bytes"] = measure(lambda: run(session))["peak_bytes"]
+        session.rollback()
+    return result
+
+
+def set_based_delete(engine, case_id) -> dict:
+    with Session(engine) as session:
+        def run():
+            counts, paths = delete_case(session, case_id)
+            session.commit()
+            return {**counts, "storage_paths": len(paths)}
+
+        return measure(run)
+
+
+def storage_cleanup(engine, paths: list, batch_size: int) -> dict:
+    state = FakeSupabaseState()
+    for path in paths:
+        state.put(STORAGE_BUCKET, path, b"%PDF-1.7 benchmark")
+    server, thread, port = start_server(create_supabase_app(create_signing_key()[1], state))
+    try:
+        remove_objects(["warm-up"], supabase_url=f"http://127.0.0.1:{port}", supabase_key="benchmark") # One-time imports and TLS setup
+        def run():
+            removed = 0
+            with Session(engine) as session:
+                for start in range(0, len(paths), batch_size): # One remove_storage_objects task per batch
+                    batch = unreferenced_paths(session, paths[start:start + batch_size])
+                    removed += remove_objects(batch, batch_size=batch_size, supabase_url=f"http://127.0.0.1:{port}", supabase_key="benchmark")
+            return {"removed": removed, "tasks": -(-len(paths) // batch_size), "left_in_storage": len(state.objects)}
+
+        return measure(run)
+    finally:
+        server.should_exit = True
+        thread.join(timeout=5)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--database-url", default=os.getenv("DATABASE_URL"))
+    parser.add_argument("--schema", default="deletion_bench")
+    parser.add_argument("--documents", type=int, default=50)
+    parser.add_argument("--chunks", type=int, default=50000)
+    parser.add_argument("--reports", type=int, default=20)
+    parser.add_argument("--storage-batch-size", type=int, default=STORAGE_DELETE_BATCH_SIZE)
+    parser.add_argument("--skip-orm", action="store_true", help="Only measure the set-based deletion (the ORM path needs about 50 KB per chunk, 2.6 GB for 50,000)")
+    parser.add_argument("--seed", type=int, default=42)
+    args = parser.parse_args()
+
+    engine = create_db_engine(args.database_url, connect_args={"options": f"-csearch_path={args.schema},public,extensions"})
+    with engine.begin() as connection:
+        connection.execute(text(f"DROP SCHEMA IF EXISTS {args.schema} CASCADE"))
+        connection.execute(text(f"CREATE SCHEMA {args.schema}"))
+    # checkfirst=False: the application's tables in public are visible through the search path and would be taken as existing
+    SQLModel.metadata.create_all(engine, checkfirst=False)
+
+    results = {"config": {"documents": args.documents, "chunks": args.chunks, "reports": args.reports, "storage_batch_size": args.storage_batch_size}}
+    try:
+        start = time.perf_counter()
+        case_id, paths = create_case(engine, args.documents, args.chunks, args.reports, args.seed)
+        results["setup_seconds"] = round(time.perf_counter() - start, 1)
+        if not args.skip_orm:
+            results["orm"] = orm_delete(engine, case_id)
+        results["set_based"] = set_based_delete(engine, case_id)
+        with Session(engine) as session:
+            results["rows_left"] = {"case": session.get(Case, case_id) is not None, "chunks": session.execute(select(func.count()).select_from(Chunk)).scalar()}
+        results["storage"] = storage_cleanup(engine, paths, args.storage_batch_size)
+    finally:
+        with engine.begin() as connection:
+            connection.execute(text(f"DROP SCHEMA IF EXISTS {args.schema} CASCADE"))
+    print(json.dumps(results, indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,149 @@
+"""
+Row size, scan time and memory per request with the parsed text inline on the document row (the old
+document.parsed_content column) and after moving it to compressed out-of-row storage (backend/document_text.py).
+
+--documents documents with about --kb KB of parsed text each are created in a scratch schema ('document_text_bench'
+by default) of the database in DATABASE_URL (or --database-url) with the old layout. The same measurements run
+before and after `document_text.migrate`:
+- sizes: document table (heap, and including TOAST) and the text table; stored bytes per text,
+- scan: reading every document row, as `SELECT *` (select(Document) before the change),
+- lookup: fetching one document row by id, as ownership checks and status updates do; p50 over --lookups ids,
+- memory: tracemalloc peak of one lookup, and of loading one document's text (the detail request).
+Synthetic reports repeat their phrases and compress better than real reports; pass --text-file to use a real
+text instead (cut to --kb KB).
+
+Usage:
+    python -m backend.benchmarks.document_text --documents 200 --kb 200
+"""
+import argparse
+import json
+import os
+import random
+import statistics
+import time
+import tracemalloc
+import uuid
+from dotenv import load_dotenv
+from sqlalchemy import text
+from sqlmodel import Session, SQLModel
+from backend import document_text
+from backend.benchmarks.reindex import synthetic_report
+from backend.database import create_db_engine
+from backend.models import Case
+
+load_dotenv()
+
+
+def report_text(size_kb: int, seed: int, source: str = None) -> str:
+    content = source or "\n\n".join(synthetic_report(max(1, size_kb // 3), seed, run=f"text{seed}"))
+    return (content * (size_kb * 1024 // len(content) + 1))[:size_kb * 1024]
+
+
+def create_documents(engine, documents: int, size_kb: int, seed: int, source: str = None) -> list:
+    with engine.begin() as connection:
+        connection.execute(text("ALTER TABLE document ADD COLUMN parsed_content text")) # The old layout
+    ids = []
+    with Session(engine) as session:
+        case = Case(user_id=uuid.uuid4(), name="Benchmark")
+        session.add(case)
+        session.commit()
+        for index in range(documents):
+            document_id = uuid.uuid4()
+            session.execute(text("""
+                INSERT INTO document (id, case_id, file_name, file_path, file_type, uploaded_at, processing_status, parsed_content)
+                VALUES (:id, :case_id, :name, :path, 'text/plain', now(), 'completed', :content)
+            """), {"id": document_id, "case_id": case.id, "name": f"rapport_{index}.txt", "path": f"benchmark/rapport_{index}.txt",
+                   "content": report_text(size_kb, seed + index, source)})
+            ids.append(document_id)
+        session.commit()
+    with engine.connect().execution_options(isolation_level="AUTOCOMMIT") as connection:
+        connection.execute(text("VACUUM ANALYZE document"))
+    return ids
+
+
+def sizes(engine) -> dict:
+    with engine.connect() as connection:
+        result = dict(connection.execute(text("""
+            SELECT pg_relation_size('document') AS document_heap_bytes, pg_total_relation_size('document') AS document_total_bytes,
+                   coalesce(pg_total_relation_size(to_regclass('documenttext')), 0) AS text_table_bytes
+        """)).one()._mapping)
+        if "parsed_content" in [row[0] for row in connection.execute(text(
+                "SELECT column_name FROM information_schema.columns WHERE table_schema = current_schema() AND table_name = 'document'"))]:
+            stored = connection.execute(text("SELECT avg(pg_column_size(parsed_content)), avg(octet_length(parsed_content)) FROM document")).one()
+        else:
+            stored = connection.execute(text("SELECT avg(octet_length(data)), avg(size) FROM documenttext")).one()
+        result["avg_row_bytes"] = round(connection.execute(text("SELECT avg(pg_column_size(d.*)) FROM document d")).scalar())
+    result["avg_text_bytes"] = round(stored[1])
+    result["avg_stored_text_bytes"] = round(stored[0])
+    return result
+
+
+def measure(engine, ids: list, lookups: int, seed: int) -> dict:
+    result = {"sizes": sizes(engine)}
+    with Session(engine) as session:
+        start = time.perf_counter()
+        rows = session.execute(text("SELECT * FROM document")).all()
+        result["scan_ms"] = round((time.perf_counter() - start) * 1000, 2)
+        del rows
+
+        rng = random.Random(seed)
+        latencies = []
+        for document_id in rng.choices(ids, k=lookups):
+            start = time.perf_counter()
+            session.execute(text("SELECT * FROM document WHERE id = :id"), {"id": document_id}).one()
+            latencies.append((time.perf_counter() - start) * 1000)
+        result["lookup_p50_ms"] = round(statistics.median(latencies), 3)
+
+        tracemalloc.start()
+        session.execute(text("SELECT * FROM document WHERE id = :id"), {"id": ids[0]}).one()
+        result["lookup_peak_bytes"] = tracemalloc.get_traced_memory()[1]
+        tracemalloc.reset_peak()
+        if "parsed_content" in session.execute(text("SELECT * FROM document LIMIT 1")).keys():
+            content = session.execute(text("SELECT parsed_content FROM document WHERE id = :id"), {"id": ids[0]}).scalar()
+        else:
+            content = document_text.load_parsed_content(session, ids[0])
+        result["text_load_peak_bytes"] = tracemalloc.get_traced_memory()[1]
+        tracemalloc.stop()
+        assert content
+    return result
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--database-url", default=os.getenv("DATABASE_URL"))
+    parser.add_argument("--schema", default="document_text_bench")
+    parser.add_argument("--documents", type=int, default=200)
+    parser.add_argument("--kb", type=int, default=200, help="Parsed text per document (KB)")
+    parser.add_argument("--lookups", type=int, default=200)
+    parser.add_argument("--text-file", help="Use this (UTF-8) text instead of synthetic reports")
+    parser.add_argument("--seed", type=int, default=42)
+    args = parser.parse_args()
+    source = open(args.text_file, encoding="utf-8").read() if args.text_file else None
+
+    engine = create_db_engine(args.database_url, connect_args={"options": f"-csearch_path={args.schema},public,extensions"})
+    with engine.begin() as connection:
+        connection.execute(text(f"DROP SCHEMA IF EXISTS {args.schema} CASCADE"))
+        connection.execute(text(f"CREATE SCHEMA {args.schema}"))
+    # checkfirst=False: the application's tables in public are visible through the search path and would be taken as existing
+    SQLModel.metadata.create_all(engine, checkfirst=False)
+
+    results = {"config": {"documents": args.documents, "kb": args.kb, "codec": document_text.compress("", document_text.PARSED_CONTENT_CODEC)[0],
+                          "text": "file" if source else "synthetic"}}
+    try:
+        ids = create_documents(engine, args.documents, args.kb, args.seed, source)
+        results["inline"] = measure(engine, ids, args.lookups, args.seed)
+        start = time.perf_counter()
+        document_text.migrate(engine)
+        results["migration_seconds"] = round(time.perf_counter() - start, 2)
+        with engine.connect().execution_options(isolation_level="AUTOCOMMIT") as connection:
+            connection.execute(text("VACUUM FULL ANALYZE document")) # Reclaim the dropped column's TOAST data
+            connection.execute(text("VACUUM ANALYZE documenttext"))
+        results["out_of_row"] = measure(engine, ids, args.lookups, args.seed)
+    finally:
+        with engine.begin() as connection:
+            connection.execute(text(f"DROP SCHEMA IF EXISTS {args.schema} CASCADE"))
+    print(json.dumps(results, indent=2))
+
+
+if __name__ == "__main__":
+    main()
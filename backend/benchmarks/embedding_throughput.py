@@ -0,0 +1,56 @@
+"""
+Embedding throughput benchmark (chunks/s) using the local stand-in backend, so no network access is needed.
+
+Compares the old one-request-per-chunk behaviour with the batched, concurrent EmbeddingClient.
+
+Usage:
+    python -m backend.benchmarks.embedding_throughput --chunks 200 --latency 0.05
+"""
+import argparse
+import json
+import time
+from backend.embeddings import EmbeddingClient, LocalEmbeddingBackend
+
+
+def run(chunks: int, latency: float, per_item_latency: float, batch_size: int, max_in_flight: int, dimensions: int) -> dict:
+    texts = [f"Paragraaf {i}: de werknemer is sinds 1 januari arbeidsongeschikt." for i in range(chunks)]
+    results = {}
+
+    configurations = {
+        "sequential": (1, 1), # One request per chunk, like the original worker
+        "batched": (batch_size, max_in_flight),
+    }
+    for name, (size, in_flight) in configurations.items():
+        backend = LocalEmbeddingBackend(dimensions=dimensions, latency=latency, per_item_latency=per_item_latency)
+        client = EmbeddingClient(backend, batch_size=size, max_in_flight=in_flight)
+        start = time.perf_counter()
+        vectors = client.embed(texts)
+        elapsed = time.perf_counter() - start
+        client.close()
+        assert len(vectors) == len(texts)
+        results[name] = {
+            "batch_size": size,
+            "max_in_flight": in_flight,
+            "requests": backend.requests,
+            "seconds": round(elapsed, 4),
+            "chunks_per_second": round(chunks / elapsed, 1) if elapsed else None,
+        }
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--chunks", type=int, default=200)
+    parser.add_argument("--latency", type=float, default=0.05, help="Simulated round trip per request (seconds)")
+    parser.add_argument("--per-item-latency", type=float, default=0.001, help="Simulated time per text in a request (seconds)")
+    parser.add_argument("--batch-size", type=int, default=32)
+    parser.add_argument("--max-in-flight", type=int, default=4)
+    parser.add_argument("--dimensions", type=int, default=1536)
+    args = parser.parse_args()
+
+    results = run(args.chunks, args.latency, args.per_item_latency, args.batch_size, args.max_in_flight, args.dimensions)
+    print(json.dumps(results, indent=2))
+
+
+if __name__ == "__main__":
+    main()
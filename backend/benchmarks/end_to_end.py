@@ -0,0 +1,344 @@
+"""
+End-to-end benchmark suite: document ingestion, vector search and report generation through the real code
+paths, with local stand-ins for every external service.
+
+- Supabase (Storage, the embedding RPC, Auth signing keys): backend/benchmarks/fake_supabase_server.py,
+- OpenRouter: the fake OpenAI-compatible server (backend/benchmarks/fake_openai_server.py),
+- Postgres with pgvector: the database in DATABASE_URL (or --database-url), in a scratch schema
+  ('e2e_bench' by default) that is dropped afterwards.
+
+Both fake servers run on free local ports and the environment is pointed at them before the backend is
+imported, so the API and the Celery task run unmodified: requests are authenticated with ES256 tokens
+signed by the fake project, and embeddings are fetched over HTTP from the fake RPC.
+
+Scenarios (--scenarios):
+- ingest: --documents synthetic reports of --pages pages are put in storage and processed one after the
+  other by process_document_mvp (called in-process; documents stay below INGEST_FANOUT_MIN_BYTES, see
+  ingest_fanout.py for the fanned-out pipeline),
+- search: --search-requests POST /search/vector/{case_id} requests, --search-concurrency at a time, over
+  --distinct-queries different queries (repeats are served by the query embedding cache),
+- report: --report-requests POST /reports/generate/{case_id} requests, --report-concurrency at a time,
+  without the response cache unless --report-cache is given.
+The API is called in-process through httpx's ASGI transport.
+
+The results are printed as JSON, together with the configuration and the environment (git commit, Python,
+PostgreSQL and pgvector versions). --output writes them to a file; --compare prints the relative change of
+every metric against such a file from an earlier run, to compare commits.
+
+Usage:
+    python -m backend.benchmarks.end_to_end --output e2e.json
+    python -m backend.benchmarks.end_to_end --compare e2e.json --scenarios search report
+"""
+import argparse
+import asyncio
+import json
+import os
+import platform
+import statistics
+import subprocess
+import time
+import uuid
+from urllib.parse import quote
+import httpx
+from dotenv import load_dotenv
+from sqlalchemy import create_engine, text
+# Only modules that do not read the backend's configuration; the rest is imported once the environment is set
+from backend.benchmarks.fake_openai_server import create_app as create_openai_app, start_server
+from backend.benchmarks.fake_supabase_server import FakeSupabaseState, create_app as create_supabase_app, create_signing_key, sign_token
+
+load_dotenv()
+
+SCENARIOS = ("ingest", "search", "report")
+
+
+def percentiles(latencies: list) -> dict:
+    ordered = sorted(latencies)
+
+    def at(share: float) -> float:
+        return round(ordered[min(len(ordered) - 1, max(0, int(round(share * len(ordered))) - 1))] * 1000, 2)
+
+    return {"p50_ms": at(0.50), "p95_ms": at(0.95), "p99_ms": at(0.99), "mean_ms": round(statistics.mean(ordered) * 1000, 2)}
+
+
+def schema_url(database_url: str, schema: str) -> str:
+    """DATABASE_URL with the scratch schema first on the search path, for every engine the backend creates."""
+    separator = "&" if "?" in database_url else "?"
+    return f"{database_url}{separator}options={quote(f'-csearch_path={schema},public,extensions')}"
+
+
+def configure_environment(args):
+    # Must happen before the backend is imported: its modules read the configuration at import time.
+    # The service URLs are added once the fake servers are listening.
+    os.environ.update({
+        "DATABASE_URL": schema_url(args.database_url, args.schema),
+        "OPENROUTER_API_KEY": "benchmark",
+        "EMBEDDING_BACKEND": "supabase",
+        "AUTH_VERIFICATION": "local",
+        "DB_ECHO": "false",
+    })
+    if args.batch_rpc:
+        os.environ["EMBEDDING_BATCH_RPC"] = "generate_embeddings"
+    else:
+        os.environ.pop("EMBEDDING_BATCH_RPC", None)
+
+
+def environment_info(engine) -> dict:
+    try:
+        commit = subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True, timeout=10).stdout.strip() or None
+    except (OSError, subprocess.SubprocessError):
+        commit = None
+    with engine.connect() as connection:
+        postgres = connection.execute(text("SHOW server_version")).scalar()
+        pgvector = connection.execute(text("SELECT extversion FROM pg_extension WHERE extname = 'vector'")).scalar()
+    return {"git_commit": commit, "python": platform.python_version(), "postgres": postgres, "pgvector": pgvector,
+            "cpus": os.cpu_count(), "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S")}
+
+
+def create_case(engine, user_id: str) -> uuid.UUID:
+    from sqlmodel import Session
+    from backend.models import Case
+
+    with Session(engine) as session:
+        case = Case(user_id=uuid.UUID(user_id), name="Benchmark")
+        session.add(case)
+        session.commit()
+        return case.id
+
+
+def run_ingest(engine, state: FakeSupabaseState, case_id, user_id: str, documents: int, pages: int, seed: int) -> dict:
+    from sqlmodel import Session, func, select
+    from backend import celery_worker
+    from backend.benchmarks.reindex import synthetic_report
+    from backend.models import Chunk, Document
+    from backend.storage import STORAGE_BUCKET
+
+    celery_worker.INGEST_FANOUT_MIN_BYTES = 10 ** 12 # In-process pipeline only (no broker)
+    document_ids, total_bytes = [], 0
+    with Session(engine) as session:
+        for index in range(documents):
+            data = "\n\n".join(synthetic_report(pages, seed + index, run=f"e2e{seed}")).encode("utf-8")
+            path = f"{user_id}/{case_id}/rapport_{index}.txt"
+            state.put(STORAGE_BUCKET, path, data)
+            total_bytes += len(data)
+            document = Document(case_id=case_id, file_name=f"rapport_{index}.txt", file_path=path, file_type="text/plain", processing_status="uploaded")
+            session.add(document)
+            session.commit()
+            document_ids.append(document.id)
+
+    calls_before = dict(state.counters)
+    seconds = []
+    start = time.perf_counter()
+    for document_id in document_ids:
+        document_start = time.perf_counter()
+        celery_worker.process_document_mvp(str(document_id))
+        seconds.append(time.perf_counter() - document_start)
+    elapsed = time.perf_counter() - start
+
+    with Session(engine) as session:
+        statuses = session.exec(select(Document.processing_status).where(Document.id.in_(document_ids))).all()
+        chunks = session.exec(select(func.count()).select_from(Chunk).where(Chunk.document_id.in_(document_ids))).one()
+    return {
+        "documents": documents,
+        "failed_documents": sum(status != "completed" for status in statuses),
+        "pages": documents * pages,
+        "chunks": chunks,
+        "bytes": total_bytes,
+        "seconds": round(elapsed, 3),
+        "pages_per_second": round(documents * pages / elapsed, 2),
+        "chunks_per_second": round(chunks / elapsed, 2),
+        "document_seconds": {"p50": round(statistics.median(seconds), 3), "max": round(max(seconds), 3)},
+        "embedding_rpc_calls": state.counters["rpc_calls"] - calls_before["rpc_calls"],
+    }
+
+
+async def load(app, token: str, build_request, requests: int, concurrency: int, warmup: int) -> dict:
+    """Send `requests` requests (build_request(index) -> (method, url)) with `concurrency` in flight; return latency statistics."""
+    latencies, statuses, responses = [], {}, []
+    transport = httpx.ASGITransport(app=app, raise_app_exceptions=False) # Failed requests become 500 responses
+    headers = {"Authorization": f"Bearer {token}"}
+    async with httpx.AsyncClient(transport=transport, base_url="http://api", headers=headers, timeout=300) as client:
+        for index in range(warmup): # Connection pools, signing keys, prepared statements
+            method, url = build_request(index)
+            await client.request(method, url)
+        counter = iter(range(requests))
+
+        async def worker():
+            for index in counter:
+                method, url = build_request(index)
+                start = time.perf_counter()
+                response = await client.request(method, url)
+                latencies.append(time.perf_counter() - start)
+                statuses[response.status_code] = statuses.get(response.status_code, 0) + 1
+                if response.status_code == 200:
+                    responses.append(response.json())
+
+        start = time.perf_counter()
+        await asyncio.gather(*[worker() for _ in range(concurrency)])
+        elapsed = time.perf_counter() - start
+    return {
+        "requests": requests,
+        "concurrency": concurrency,
+        "requests_per_second": round(requests / elapsed, 2),
+        **percentiles(latencies),
+        "errors": requests - statuses.get(200, 0),
+        "status_codes": {str(code): count for code, count in sorted(statuses.items())},
+    }, responses
+
+
+def run_search(app, token: str, case_id, requests: int, concurrency: int, distinct_queries: int) -> dict:
+    from backend.benchmarks.hybrid_search import TOPICS, employer
+
+    queries = [f"Wat is er bekend over werkgever {employer(index)}? {TOPICS[index % len(TOPICS)]}" for index in range(distinct_queries)]
+
+    def build_request(index):
+        return "POST", f"/search/vector/{case_id}?{httpx.QueryParams({'query': queries[index % len(queries)], 'limit': 10})}"
+
+    result, responses = asyncio.run(load(app, token, build_request, requests, concurrency, warmup=min(5, distinct_queries)))
+    result["distinct_queries"] = distinct_queries
+    result["mean_results"] = round(statistics.mean(len(response) for response in responses), 1) if responses else 0
+    return result
+
+
+def run_report(app, token: str, case_id, requests: int, concurrency: int, use_cache: bool) -> dict:
+    from backend.benchmarks.hybrid_search import TOPICS
+
+    def build_request(index):
+        prompt = f"Schrijf een conclusie over: {TOPICS[index % len(TOPICS)].lower()} (rapport {index})"
+        return "POST", f"/reports/generate/{case_id}?{httpx.QueryParams({'prompt': prompt, 'use_cache': str(use_cache).lower()})}"
+
+    result, responses = asyncio.run(load(app, token, build_request, requests, concurrency, warmup=1))
+    contexts = [response["content"].get("context") for response in responses if response.get("content", {}).get("context")]
+    if contexts:
+        result["mean_context_tokens"] = round(statistics.mean(context["tokens"] for context in contexts))
+    return result
+
+
+def flatten(results: dict, prefix: str = "") -> dict:
+    metrics = {}
+    for key, value in results.items():
+        if isinstance(value, dict):
+            metrics.update(flatten(value, f"{prefix}{key}."))
+        elif isinstance(value, (int, float)) and not isinstance(value, bool):
+            metrics[f"{prefix}{key}"] = value
+    return metrics
+
+
+def direction(name: str) -> int:
+    """1 when a higher value of a metric is better, -1 when lower is better (latencies, durations, errors), 0 otherwise."""
+    if name.endswith("per_second"):
+        return 1
+    if name.endswith("_ms") or "seconds" in name or name.endswith("errors"):
+        return -1
+    return 0
+
+
+def compare(baseline: dict, current: dict) -> dict:
+    """Relative change of every metric that changed since a baseline run, with a verdict where the direction is clear."""
+    before, after = flatten(baseline.get("results", {})), flatten(current["results"])
+    changes = {}
+    for name, value in after.items():
+        if name not in before or value == before[name]:
+            continue
+        entry = {"baseline": before[name], "current": value}
+        if before[name]:
+            entry["change"] = f"{(value - before[name]) / before[name]:+.1%}"
+        if direction(name):
+            entry["verdict"] = "better" if (value - before[name]) * direction(name) > 0 else "worse"
+        changes[name] = entry
+    return changes
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--database-url", default=os.getenv("DATABASE_URL"))
+    parser.add_argument("--schema", default="e2e_bench")
+    parser.add_argument("--scenarios", nargs="+", choices=SCENARIOS, default=list(SCENARIOS))
+    parser.add_argument("--documents", type=int, default=4)
+    parser.add_argument("--pages", type=int, default=20, help="Pages per document")
+    parser.add_argument("--search-requests", type=int, default=200)
+    parser.add_argument("--search-concurrency", type=int, default=10)
+    parser.add_argument("--distinct-queries", type=int, default=50)
+    parser.add_argument("--report-requests", type=int, default=40)
+    parser.add_argument("--report-concurrency", type=int, default=8)
+    parser.add_argument("--report-cache", action="store_true", help="Serve repeated report prompts from the response cache")
+    parser.add_argument("--rpc-latency", type=float, default=0.05, help="Simulated seconds per embedding RPC call")
+    parser.add_argument("--rpc-item-latency", type=float, default=0.002, help="Simulated extra seconds per text in an RPC call")
+    parser.add_argument("--batch-rpc", action="store_true", help="Embed with a batch RPC instead of one RPC call per text")
+    parser.add_argument("--storage-latency", type=float, default=0.05, help="Simulated seconds before a storage response")
+    parser.add_argument("--storage-bandwidth", type=float, default=50e6, help="Simulated storage download bytes/s (0 = unlimited)")
+    parser.add_argument("--first-token-latency", type=float, default=0.5, help="Simulated seconds before the LLM's first token")
+    parser.add_argument("--token-latency", type=float, default=0.005, help="Simulated seconds per generated token")
+    parser.add_argument("--tokens", type=int, default=150, help="Generated tokens per report")
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--output", help="Write the results (JSON) to this file")
+    parser.add_argument("--compare", help="Results file of an earlier run to compare with")
+    args = parser.parse_args()
+    if not args.database_url:
+        parser.error("DATABASE_URL (or --database-url) must point to a PostgreSQL database with pgvector")
+
+    configure_environment(args)
+
+    # External services
+    private_key, public_jwk = create_signing_key()
+    state = FakeSupabaseState()
+    supabase_server, supabase_thread, supabase_port = start_server(create_supabase_app(
+        public_jwk, state, args.storage_latency, args.storage_bandwidth, args.rpc_latency, args.rpc_item_latency))
+    openai_server, openai_thread, openai_port = start_server(create_openai_app(args.first_token_latency, args.token_latency, args.tokens))
+    supabase_url = f"http://127.0.0.1:{supabase_port}"
+    os.environ.update({
+        "SUPABASE_URL": supabase_url,
+        "SUPABASE_KEY": sign_token(private_key, supabase_url, "service", role="service_role"),
+        "OPENROUTER_BASE_URL": f"http://127.0.0.1:{openai_port}/v1",
+    })
+
+    admin_engine = create_engine(args.database_url)
+    with admin_engine.begin() as connection:
+        connection.execute(text("CREATE EXTENSION IF NOT EXISTS vector")) # Before the scratch schema exists, so it is not created inside it
+        connection.execute(text(f"DROP SCHEMA IF EXISTS {args.schema} CASCADE"))
+        connection.execute(text(f"CREATE SCHEMA {args.schema}"))
+
+    results = {}
+    try:
+        from sqlmodel import SQLModel
+        from backend.container import get_engine
+        from backend.main import app
+
+        # checkfirst=False: the application's tables in public are visible through the search path and would be taken as existing
+        SQLModel.metadata.create_all(get_engine(), checkfirst=False)
+        user_id = str(uuid.uuid4())
+        token = sign_token(private_key, supabase_url, user_id)
+        case_id = create_case(get_engine(), user_id)
+
+        # Always runs: search and reports need documents in the case
+        print(f"Ingesting {args.documents} documents of {args.pages} pages...")
+        ingest = run_ingest(get_engine(), state, case_id, user_id, args.documents, args.pages, args.seed)
+        if "ingest" in args.scenarios:
+            results["ingest"] = ingest
+        if "search" in args.scenarios:
+            print(f"Sending {args.search_requests} search requests ({args.search_concurrency} concurrent)...")
+            results["search"] = run_search(app, token, case_id, args.search_requests, args.search_concurrency, args.distinct_queries)
+        if "report" in args.scenarios:
+            print(f"Sending {args.report_requests} report requests ({args.report_concurrency} concurrent)...")
+            results["report"] = run_report(app, token, case_id, args.report_requests, args.report_concurrency, args.report_cache)
+        environment = environment_info(admin_engine)
+    finally:
+        supabase_server.should_exit = True
+        openai_server.should_exit = True
+        supabase_thread.join(timeout=5)
+        openai_thread.join(timeout=5)
+        with admin_engine.begin() as connection:
+            connection.execute(text(f"DROP SCHEMA IF EXISTS {args.schema} CASCADE"))
+
+    config = {key: value for key, value in vars(args).items() if key not in ("database_url", "output", "compare")}
+    report = {"config": config, "environment": environment, "results": results}
+    if args.output:
+        with open(args.output, "w") as file:
+            json.dump(report, file, indent=2)
+    if args.compare:
+        with open(args.compare) as file:
+            report["compare"] = compare(json.load(file), report)
+    print(json.dumps(report, indent=2))
+
+
+if __name__ == "__main__":
+    main()
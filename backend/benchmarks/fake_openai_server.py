@@ -0,0 +1,115 @@
+"""
+Local fake OpenAI-compatible chat completions server, used as a stand-in for OpenRouter in benchmarks.
+
+Responds to POST /v1/chat/completions with a fixed Dutch report text, both non-streaming and streaming
+(`"stream": true`, Server-Sent Events with `data: [DONE]` at the end). Latency is simulated with a delay
+before the first token and a delay per token.
+
+Usage:
+    python -m backend.benchmarks.fake_openai_server --port 8001 --first-token-latency 0.5 --token-latency 0.02
+    OPENROUTER_BASE_URL=http://127.0.0.1:8001/v1 uvicorn backend.main:app
+"""
+import argparse
+import asyncio
+import json
+import socket
+import threading
+import time
+import uuid
+from fastapi import FastAPI, Request
+from fastapi.responses import StreamingResponse
+
+REPORT_TEXT = (
+    "Op basis van de beschikbare informatie is werknemer sinds 1 januari arbeidsongeschikt voor het eigen werk. "
+    "De belastbaarheid is beperkt ten aanzien van langdurig staan en tillen. "
+    "Aangepast werk binnen de eigen organisatie lijkt passend, mits de werkplek wordt aangepast. "
+    "Geadviseerd wordt om de re-integratie in overleg met de bedrijfsarts geleidelijk op te bouwen."
+)
+
+
+def create_app(first_token_latency: float = 0.5, token_latency: float = 0.02, tokens: int = 0) -> FastAPI:
+    """
+    Build the fake server. `tokens` repeats the report text until at least that many tokens (words) are
+    generated; 0 returns the text once.
+    """
+    words = REPORT_TEXT.split(" ")
+    while tokens and len(words) < tokens:
+        words += REPORT_TEXT.split(" ")
+    pieces = [word if index == 0 else " " + word for index, word in enumerate(words[:tokens or None])]
+    app = FastAPI()
+
+    @app.post("/v1/chat/completions")
+    async def chat_completions(request: Request):
+        body = await request.json()
+        model = body.get("model", "fake-model")
+        completion_id = f"chatcmpl-{uuid.uuid4().hex}"
+        created = int(time.time())
+        prompt_tokens = sum(len(str(message.get("content", "")).split()) for message in body.get("messages", [])) # Word count as token estimate
+
+        if not body.get("stream"):
+            # A non-streaming completion is only returned once everything has been "generated"
+            await asyncio.sleep(first_token_latency + token_latency * len(pieces))
+            return {
+                "id": completion_id,
+                "object": "chat.completion",
+                "created": created,
+                "model": model,
+                "choices": [{"index": 0, "message": {"role": "assistant", "content": "".join(pieces)}, "finish_reason": "stop"}],
+                "usage": {"prompt_tokens": prompt_tokens, "completion_tokens": len(pieces), "total_tokens": prompt_tokens + len(pieces)},
+            }
+
+        def chunk(delta: dict, finish_reason=None) -> str:
+            data = {
+                "id": completion_id,
+                "object": "chat.completion.chunk",
+                "created": created,
+                "model": model,
+                "choices": [{"index": 0, "delta": delta, "finish_reason": finish_reason}],
+            }
+            return f"data: {json.dumps(data)}\n\n"
+
+        async def stream():
+            await asyncio.sleep(first_token_latency)
+            yield chunk({"role": "assistant", "content": ""})
+            for piece in pieces:
+                yield chunk({"content": piece})
+                await asyncio.sleep(token_latency)
+            yield chunk({}, finish_reason="stop")
+            yield "data: [DONE]\n\n"
+
+        return StreamingResponse(stream(), media_type="text/event-stream")
+
+    return app
+
+
+def start_server(app) -> tuple:
+    """Serve an ASGI app on a free local port in a background thread; returns (server, thread, port)."""
+    import uvicorn
+
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        port = sock.getsockname()[1]
+    server = uvicorn.Server(uvicorn.Config(app, host="127.0.0.1", port=port, log_level="warning"))
+    thread = threading.Thread(target=server.run, daemon=True)
+    thread.start()
+    while not server.started:
+        time.sleep(0.01)
+    return server, thread, port
+
+
+def main():
+    import uvicorn
+
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8001)
+    parser.add_argument("--first-token-latency", type=float, default=0.5, help="Seconds before the first token")
+    parser.add_argument("--token-latency", type=float, default=0.02, help="Seconds between tokens")
+    parser.add_argument("--tokens", type=int, default=0, help="Minimum number of generated tokens (0 = report text once)")
+    args = parser.parse_args()
+
+    uvicorn.run(create_app(args.first_token_latency, args.token_latency, args.tokens), host=args.host, port=args.port)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,155 @@
+"""
+Local fake Supabase server, used as a stand-in for the Supabase project in benchmarks.
+
+Serves the parts of the Supabase API this service uses:
+- Storage: GET, POST/PUT and DELETE of objects under /storage/v1/object/..., kept in memory. Downloads are
+  streamed in 64 KB pieces after `storage_latency` seconds, optionally limited to `storage_bandwidth` bytes/s,
+- the embedding RPCs: POST /rest/v1/rpc/<name> with {"input_text": ...} (generate_embedding) or
+  {"input_texts": [...]} (a batch RPC, see EMBEDDING_BATCH_RPC). The vectors are deterministic (the same
+  hash-based vectors as LocalEmbeddingBackend); every call waits `rpc_latency` seconds plus `rpc_item_latency`
+  per text,
+- Auth: the signing keys (/auth/v1/.well-known/jwks.json) and /auth/v1/user, so tokens made with
+  `sign_token` pass the API's local and remote verification.
+
+Usage:
+    python -m backend.benchmarks.fake_supabase_server --port 8002 --rpc-latency 0.05
+    SUPABASE_URL=http://127.0.0.1:8002 SUPABASE_KEY=<printed service key> uvicorn backend.main:app
+"""
+import argparse
+import asyncio
+import json
+import threading
+import time
+import uuid
+import jwt
+from cryptography.hazmat.primitives.asymmetric import ec
+from fastapi import FastAPI, Header, HTTPException, Request
+from fastapi.responses import Response, StreamingResponse
+
+DOWNLOAD_PIECE_SIZE = 64 * 1024
+SIGNING_KEY_ID = "benchmark"
+
+
+class FakeSupabaseState:
+    """Objects in storage and request counters, shared with the benchmark that started the server."""
+
+    def __init__(self):
+        self.objects = {} # "bucket/path" -> bytes
+        self._lock = threading.Lock()
+        self.counters = {"storage_downloads": 0, "storage_bytes_sent": 0, "storage_uploads": 0, "storage_deletes": 0,
+                         "rpc_calls": 0, "rpc_texts": 0, "auth_user_calls": 0}
+
+    def count(self, name: str, amount: int = 1):
+        with self._lock:
+            self.counters[name] += amount
+
+    def put(self, bucket: str, path: str, data: bytes):
+        self.objects[f"{bucket}/{path.lstrip('/')}"] = data
+
+
+def create_signing_key():
+    """An ES256 key pair: (private key, public JWK as served by the JWKS endpoint)."""
+    private_key = ec.generate_private_key(ec.SECP256R1())
+    public_jwk = json.loads(jwt.algorithms.ECAlgorithm.to_jwk(private_key.public_key()))
+    public_jwk.update({"kid": SIGNING_KEY_ID, "alg": "ES256", "use": "sig"})
+    return private_key, public_jwk
+
+
+def sign_token(private_key, supabase_url: str, subject: str, role: str = "authenticated", lifetime: int = 24 * 3600) -> str:
+    """An access token for `subject` as Supabase Auth issues it (the service key uses role 'service_role')."""
+    claims = {"sub": subject, "aud": "authenticated", "role": role, "iss": f"{supabase_url.rstrip('/')}/auth/v1",
+              "exp": int(time.time()) + lifetime, "session_id": str(uuid.uuid4())}
+    return jwt.encode(claims, private_key, algorithm="ES256", headers={"kid": SIGNING_KEY_ID})
+
+
+def create_app(public_jwk: dict, state: FakeSupabaseState = None, storage_latency: float = 0.0, storage_bandwidth: float = 0.0,
+               rpc_latency: float = 0.0, rpc_item_latency: float = 0.0) -> FastAPI:
+    # Imported here, so a benchmark can configure the backend's environment before anything reads it
+    from backend.embeddings import LocalEmbeddingBackend
+
+    state = state or FakeSupabaseState()
+    embedder = LocalEmbeddingBackend()
+    app = FastAPI()
+    app.state.supabase = state
+
+    @app.get("/storage/v1/object/{bucket}/{path:path}")
+    async def download(bucket: str, path: str):
+        data = state.objects.get(f"{bucket}/{path}")
+        if data is None:
+            raise HTTPException(status_code=404, detail="Object not found")
+        state.count("storage_downloads")
+
+        async def pieces():
+            await asyncio.sleep(storage_latency)
+            for offset in range(0, len(data), DOWNLOAD_PIECE_SIZE):
+                piece = data[offset:offset + DOWNLOAD_PIECE_SIZE]
+                if storage_bandwidth:
+                    await asyncio.sleep(len(piece) / storage_bandwidth)
+                state.count("storage_bytes_sent", len(piece))
+                yield piece
+
+        return StreamingResponse(pieces(), media_type="application/octet-stream", headers={"Content-Length": str(len(data))})
+
+    @app.api_route("/storage/v1/object/{bucket}/{path:path}", methods=["POST", "PUT"])
+    async def upload(bucket: str, path: str, request: Request):
+        await asyncio.sleep(storage_latency)
+        state.put(bucket, path, await request.body())
+        state.count("storage_uploads")
+        return {"Key": f"{bucket}/{path}"}
+
+    @app.delete("/storage/v1/object/{bucket}")
+    async def remove(bucket: str, request: Request):
+        await asyncio.sleep(storage_latency)
+        prefixes = (await request.json()).get("prefixes", [])
+        removed = [prefix for prefix in prefixes if state.objects.pop(f"{bucket}/{prefix}", None) is not None]
+        state.count("storage_deletes", len(removed))
+        return [{"name": name, "bucket_id": bucket} for name in removed]
+
+    @app.post("/rest/v1/rpc/{name}")
+    async def rpc(name: str, request: Request):
+        body = await request.json()
+        texts = body["input_texts"] if "input_texts" in body else [body["input_text"]]
+        await asyncio.sleep(rpc_latency + rpc_item_latency * len(texts))
+        state.count("rpc_calls")
+        state.count("rpc_texts", len(texts))
+        # Vectors are serialized off the event loop; a batch of 1536-dimension vectors is several MB of JSON
+        content = await asyncio.to_thread(lambda: json.dumps([{"embedding": embedder.embed_text(text)} for text in texts]))
+        return Response(content, media_type="application/json")
+
+    @app.get("/auth/v1/.well-known/jwks.json")
+    async def jwks():
+        return {"keys": [public_jwk]}
+
+    @app.get("/auth/v1/user")
+    async def user(authorization: str = Header(None)):
+        if not authorization or not authorization.startswith("Bearer "):
+            raise HTTPException(status_code=401)
+        state.count("auth_user_calls")
+        claims = jwt.decode(authorization[len("Bearer "):], options={"verify_signature": False})
+        return {"id": claims["sub"], "aud": "authenticated", "role": claims.get("role", "authenticated"), "app_metadata": {},
+                "user_metadata": {}, "created_at": "2025-01-01T00:00:00Z"}
+
+    return app
+
+
+def main():
+    import uvicorn
+
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8002)
+    parser.add_argument("--storage-latency", type=float, default=0.0, help="Seconds before a storage response")
+    parser.add_argument("--rpc-latency", type=float, default=0.05, help="Seconds per embedding RPC call")
+    parser.add_argument("--rpc-item-latency", type=float, default=0.0, help="Extra seconds per text in an RPC call")
+    args = parser.parse_args()
+
+    private_key, public_jwk = create_signing_key()
+    url = f"http://{args.host}:{args.port}"
+    print(f"Service key: {sign_token(private_key, url, 'service', role='service_role')}")
+    print(f"User token:  {sign_token(private_key, url, str(uuid.uuid4()))}")
+    uvicorn.run(create_app(public_jwk, storage_latency=args.storage_latency, rpc_latency=args.rpc_latency,
+                           rpc_item_latency=args.rpc_item_latency), host=args.host, port=args.port)
+
+
+if __name__ == "__main__":
+    main()
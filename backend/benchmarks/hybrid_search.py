@@ -0,0 +1,167 @@
+"""
+Hit rate and latency of vector-only, hybrid (lexical + vector, rank fusion) and lexical-prefilter retrieval.
+
+A synthetic corpus is loaded into a scratch schema ('hybrid_bench' by default) of the database in DATABASE_URL
+(or --database-url). Every chunk is a Dutch sentence about one of a few topics and mentions a unique employer
+name and date. Its embedding is the topic centroid plus noise: like real embeddings, it captures what the chunk
+is about, but barely which employer it names. Each query asks about the employer of one target chunk; the hit
+rate is the share of queries whose target is in the top `limit` results.
+
+Usage:
+    python -m backend.benchmarks.hybrid_search --rows 20000 --queries 50
+"""
+import argparse
+import io
+import json
+import os
+import statistics
+import time
+import uuid
+import numpy as np
+from dotenv import load_dotenv
+from sqlalchemy import text
+from sqlmodel import Session
+from backend.database import create_db_engine
+from backend.text_search import SEARCH_MODES, TSVECTOR_EXPRESSION, retrieve_chunks
+from backend.vector_index import create_vector_index
+
+load_dotenv()
+
+TOPICS = [
+    "De werknemer heeft zich ziek gemeld en de bedrijfsarts adviseert een geleidelijke opbouw van de werkzaamheden",
+    "Het plan van aanpak beschrijft de re-integratie in het eigen werk met aangepaste werktijden",
+    "De belastbaarheid is beperkt ten aanzien van tillen, langdurig staan en werken boven schouderhoogte",
+    "Er is een WIA-aanvraag ingediend omdat de wachttijd van 104 weken bijna is verstreken",
+    "Het tweede spoor is ingezet via een re-integratiebureau dat passend werk buiten de organisatie zoekt",
+    "De werkgever heeft de functie aangepast en een ergonomische werkplek ingericht",
+    "Uit het gesprek blijkt dat de werknemer psychische klachten ervaart door een hoge werkdruk",
+    "De arbeidsdeskundige concludeert dat het eigen werk met aanpassingen passend is",
+]
+SURNAMES = ["Jansen", "de Vries", "Bakker", "Visser", "Smit", "Meijer", "de Boer", "Mulder", "de Groot", "Bos",
+            "Vos", "Peters", "Hendriks", "van Leeuwen", "Dekker", "Brouwer", "de Wit", "Dijkstra", "Smits", "de Graaf"]
+TRADES = ["Bouw", "Transport", "Installatietechniek", "Schoonmaak", "Zorg", "Logistiek", "Bakkerij", "Metaal",
+          "Horeca", "Techniek", "Groen", "Automotive", "Advies", "Detailhandel", "Drukkerij", "Elektro"]
+CITIES = ["Amsterdam", "Utrecht", "Zwolle", "Groningen", "Eindhoven", "Tilburg", "Breda", "Arnhem", "Leiden", "Delft",
+          "Almere", "Enschede", "Nijmegen", "Haarlem", "Maastricht", "Venlo", "Assen", "Emmen", "Hoorn", "Gouda"]
+MONTHS = ["januari", "februari", "maart", "april", "mei", "juni", "juli", "augustus", "september", "oktober", "november", "december"]
+
+
+def employer(index: int) -> str:
+    surname = SURNAMES[index % len(SURNAMES)]
+    trade = TRADES[(index // len(SURNAMES)) % len(TRADES)]
+    city = CITIES[(index // (len(SURNAMES) * len(TRADES))) % len(CITIES)]
+    return f"{surname} {trade} {city}"
+
+
+def load_corpus(engine, schema: str, rows: int, dimensions: int, large_case_share: float, noise: float, seed: int):
+    rng = np.random.default_rng(seed)
+    with engine.begin() as connection:
+        connection.execute(text("CREATE EXTENSION IF NOT EXISTS vector")) # Before the scratch schema exists, so it is not created inside it
+        connection.execute(text(f"DROP SCHEMA IF EXISTS {schema} CASCADE"))
+        connection.execute(text(f"CREATE SCHEMA {schema}"))
+        connection.execute(text("CREATE TABLE document (id uuid PRIMARY KEY, case_id uuid NOT NULL)"))
+        connection.execute(text("CREATE INDEX ON document (case_id)"))
+        connection.execute(text(f"""
+            CREATE TABLE chunk (id uuid PRIMARY KEY, document_id uuid NOT NULL, content text NOT NULL, embedding vector({dimensions}),
+                                content_tsv tsvector GENERATED ALWAYS AS ({TSVECTOR_EXPRESSION}) STORED)
+        """))
+        connection.execute(text("CREATE INDEX ON chunk (document_id)"))
+        connection.execute(text("CREATE INDEX ix_chunk_content_tsv ON chunk USING gin (content_tsv)"))
+
+    # One large case and one small case; the rest of the table belongs to other cases
+    large_case, small_case, other_case = uuid.uuid4(), uuid.uuid4(), uuid.uuid4()
+    large_rows = int(rows * large_case_share)
+    small_rows = min(2000, rows - large_rows)
+    case_of_row = [large_case] * large_rows + [small_case] * small_rows + [other_case] * (rows - large_rows - small_rows)
+    documents = {case_id: uuid.uuid4() for case_id in (large_case, small_case, other_case)}
+
+    centroids = rng.normal(size=(len(TOPICS), dimensions)).astype(np.float32)
+    topics = rng.integers(0, len(TOPICS), rows)
+    embeddings = centroids[topics] + rng.normal(scale=noise, size=(rows, dimensions)).astype(np.float32)
+    chunks = []
+    for index in range(rows):
+        content = (f"{TOPICS[topics[index]]}. Werkgever: {employer(index)}. "
+                   f"Datum eerste ziektedag: {1 + index % 28} {MONTHS[index % 12]} {2015 + index % 10}.")
+        chunks.append((uuid.uuid4(), documents[case_of_row[index]], content))
+
+    raw = engine.raw_connection()
+    try:
+        cursor = raw.cursor()
+        cursor.execute(f"SET search_path TO {schema}, public, extensions")
+        buffer = io.StringIO("".join(f"{document_id}\t{case_id}\n" for case_id, document_id in documents.items()))
+        cursor.copy_expert("COPY document (id, case_id) FROM STDIN", buffer)
+        buffer = io.StringIO()
+        for (chunk_id, document_id, content), vector in zip(chunks, embeddings):
+            buffer.write(f"{chunk_id}\t{document_id}\t{content}\t[{','.join(f'{v:.5f}' for v in vector)}]\n")
+        buffer.seek(0)
+        cursor.copy_expert("COPY chunk (id, document_id, content, embedding) FROM STDIN", buffer)
+        cursor.execute("ANALYZE")
+        raw.commit()
+    finally:
+        raw.close()
+    return {"large_case": (large_case, range(0, large_rows)), "small_case": (small_case, range(large_rows, large_rows + small_rows))}, \
+        chunks, embeddings, centroids, topics
+
+
+def measure(engine, case_id, queries, limit: int, mode: str, strategy: str) -> dict:
+    hits, latencies, used = 0, [], set()
+    for target_id, query_text, query_embedding in queries:
+        with Session(engine) as session:
+            start = time.perf_counter()
+            rows, used_strategy = retrieve_chunks(session, case_id, query_text, query_embedding, limit, mode=mode, strategy=strategy)
+            latencies.append((time.perf_counter() - start) * 1000)
+        used.add(used_strategy)
+        hits += any(row[0] == target_id for row in rows)
+    return {
+        "hit_rate": round(hits / len(queries), 3),
+        "p50_ms": round(statistics.median(latencies), 2),
+        "p95_ms": round(sorted(latencies)[int(len(latencies) * 0.95) - 1], 2),
+        "strategies": sorted(used),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--database-url", default=os.getenv("DATABASE_URL"))
+    parser.add_argument("--schema", default="hybrid_bench")
+    parser.add_argument("--rows", type=int, default=20000)
+    parser.add_argument("--dimensions", type=int, default=1536)
+    parser.add_argument("--large-case-share", type=float, default=0.5)
+    parser.add_argument("--noise", type=float, default=0.6, help="Spread of the chunk embeddings around their topic")
+    parser.add_argument("--query-signal", type=float, default=0.05, help="How much of the target's own embedding the query embedding shares")
+    parser.add_argument("--queries", type=int, default=50)
+    parser.add_argument("--limit", type=int, default=10)
+    parser.add_argument("--seed", type=int, default=42)
+    args = parser.parse_args()
+
+    engine = create_db_engine(args.database_url, connect_args={"options": f"-csearch_path={args.schema},public,extensions"}, echo=False)
+    print(f"Loading {args.rows} synthetic chunks ({args.dimensions} dimensions) into schema '{args.schema}'...")
+    cases, chunks, embeddings, centroids, topics = load_corpus(engine, args.schema, args.rows, args.dimensions,
+                                                               args.large_case_share, args.noise, args.seed)
+    create_vector_index(engine, "hnsw")
+
+    rng = np.random.default_rng(args.seed + 1)
+    results = {"config": {"rows": args.rows, "dimensions": args.dimensions, "queries": args.queries, "limit": args.limit,
+                          "query_signal": args.query_signal}}
+    try:
+        for label, (case_id, row_range) in cases.items():
+            queries = []
+            for index in rng.choice(row_range, size=args.queries, replace=False):
+                # The query is about the target's topic and slightly closer to the target than to its neighbours
+                embedding = centroids[topics[index]] + args.query_signal * (embeddings[index] - centroids[topics[index]]) \
+                    + rng.normal(scale=args.noise * 0.5, size=args.dimensions)
+                queries.append((chunks[index][0], f"Wat is er bekend over werkgever {employer(index)}?", embedding.tolist()))
+            strategies = ["auto", "ann"] if label == "large_case" else ["auto"]
+            results[label] = {
+                f"{mode}/{strategy}": measure(engine, case_id, queries, args.limit, mode, strategy)
+                for strategy in strategies for mode in SEARCH_MODES
+            }
+            results[label]["case_rows"] = len(row_range)
+    finally:
+        with engine.begin() as connection:
+            connection.execute(text(f"DROP SCHEMA IF EXISTS {args.schema} CASCADE"))
+    print(json.dumps(results, indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,130 @@
+"""
+Ingestion time of a large document with the chunk batches fanned out over Celery workers, for an increasing
+number of workers, against the in-process pipeline of a single worker (ingest_document).
+
+Celery runs with an in-memory broker and result backend, so no Redis is needed. Because an in-memory broker
+only exists within one process, the workers are simulated as thread-pool worker slots (concurrency N) of one
+in-process worker; every slot handles one task at a time, like a worker process. Embeddings come from the
+local stand-in backend with a simulated API latency per request; chunks are saved in a scratch schema
+('ingest_fanout_bench' by default) of the database in DATABASE_URL (or --database-url).
+
+Usage:
+    python -m backend.benchmarks.ingest_fanout --chunks 1200 --workers 1 2 4 8 --latency 0.2
+"""
+import argparse
+import json
+import os
+import time
+import uuid
+from dotenv import load_dotenv
+from sqlalchemy import func, text
+from sqlmodel import Session, SQLModel, select
+from backend import celery_worker, embeddings
+from backend.container import container
+from backend.database import create_db_engine
+from backend.embeddings import EmbeddingClient, LocalEmbeddingBackend
+from backend.ingestion import INGEST_BATCH_SIZE, StageTimings, ingest_document
+from backend.models import Case, Chunk, Document
+
+load_dotenv()
+
+QUEUES = ["celery", "parse", "embed", "persist"] # 'celery' runs the chord's unlock task
+
+
+def synthetic_chunks(count: int, run: str) -> list:
+    # A unique run id keeps the texts unique, so the embedding cache never answers for a previous run
+    run = f"{run}-{uuid.uuid4().hex[:8]}"
+    return [f"[{run}] Paragraaf {i}: de werknemer is sinds 1 januari arbeidsongeschikt voor het eigen werk en "
+            f"de belastbaarheid is beperkt ten aanzien van langdurig staan en tillen." for i in range(count)]
+
+
+def create_document(engine) -> str:
+    with Session(engine) as session:
+        case = Case(user_id=uuid.uuid4(), name="Benchmark")
+        session.add(case)
+        session.commit()
+        document = Document(case_id=case.id, file_name="rapport.txt", file_path="benchmark/rapport.txt", file_type="text/plain", processing_status="processing")
+        session.add(document)
+        session.commit()
+        return str(document.id)
+
+
+def document_state(engine, document_id: str):
+    with Session(engine) as session:
+        status = session.exec(select(Document.processing_status).where(Document.id == uuid.UUID(document_id))).one()
+        chunks = session.exec(select(func.count()).select_from(Chunk).where(Chunk.document_id == uuid.UUID(document_id))).one()
+    return status, chunks
+
+
+def run_in_process(engine, chunks: list) -> float:
+    document_id = create_document(engine)
+    start = time.perf_counter()
+    with Session(engine) as session:
+        document = session.get(Document, uuid.UUID(document_id))
+        ingest_document(session, document, None, ".txt", engine, StageTimings(), chunks=chunks, parsed_content="\n".join(chunks))
+        document.processing_status = "completed"
+        session.add(document)
+        session.commit()
+    elapsed = time.perf_counter() - start
+    assert document_state(engine, document_id) == ("completed", len(chunks))
+    return elapsed
+
+
+def run_fanout(engine, chunks: list, workers: int) -> float:
+    from celery.contrib.testing.worker import start_worker
+
+    document_id = create_document(engine)
+    with start_worker(celery_worker.celery_app, pool="threads", concurrency=workers, perform_ping_check=False,
+                      queues=QUEUES, loglevel="WARNING"):
+        start = time.perf_counter()
+        celery_worker.dispatch_chunk_batches(document_id, chunks)
+        while document_state(engine, document_id)[0] == "processing":
+            time.sleep(0.02)
+        elapsed = time.perf_counter() - start
+    assert document_state(engine, document_id) == ("completed", len(chunks))
+    return elapsed
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--database-url", default=os.getenv("DATABASE_URL"))
+    parser.add_argument("--schema", default="ingest_fanout_bench")
+    parser.add_argument("--chunks", type=int, default=1200, help="Chunks of the synthetic document (~4 per page)")
+    parser.add_argument("--workers", type=int, nargs="+", default=[1, 2, 4, 8])
+    parser.add_argument("--latency", type=float, default=0.2, help="Simulated seconds per embedding request")
+    parser.add_argument("--per-item-latency", type=float, default=0.002, help="Simulated extra seconds per text in a request")
+    args = parser.parse_args()
+
+    engine = create_db_engine(args.database_url, connect_args={"options": f"-csearch_path={args.schema},public,extensions"})
+    with engine.begin() as connection:
+        connection.execute(text(f"DROP SCHEMA IF EXISTS {args.schema} CASCADE"))
+        connection.execute(text(f"CREATE SCHEMA {args.schema}"))
+    # checkfirst=False: the application's tables in public are visible through the search path and would be taken as existing
+    SQLModel.metadata.create_all(engine, checkfirst=False)
+
+    container.override("engine", engine)
+    # The memory transport is polled (every second by default), and once a worker has reserved its prefetch
+    # limit it only fetches again after a 2 second drain timeout. Neither applies to Redis, so poll often and
+    # reserve ahead; tasks still run at most `workers` at a time.
+    celery_worker.celery_app.conf.update(broker_url="memory://", result_backend="cache+memory://",
+                                         broker_transport_options={"polling_interval": 0.01}, worker_prefetch_multiplier=64)
+    backend = LocalEmbeddingBackend(latency=args.latency, per_item_latency=args.per_item_latency)
+    # One embedding request at a time per client: every (simulated) worker sends its own requests
+    embeddings._client = EmbeddingClient(backend, batch_size=INGEST_BATCH_SIZE, max_in_flight=1)
+
+    results = {"config": {"chunks": args.chunks, "batch_size": INGEST_BATCH_SIZE, "latency": args.latency,
+                          "per_item_latency": args.per_item_latency}}
+    try:
+        elapsed = run_in_process(engine, synthetic_chunks(args.chunks, "in_process"))
+        results["in_process"] = {"seconds": round(elapsed, 2), "chunks_per_second": round(args.chunks / elapsed, 1)}
+        for workers in args.workers:
+            elapsed = run_fanout(engine, synthetic_chunks(args.chunks, f"fanout_{workers}"), workers)
+            results[f"fanout_{workers}_workers"] = {"seconds": round(elapsed, 2), "chunks_per_second": round(args.chunks / elapsed, 1)}
+    finally:
+        with engine.begin() as connection:
+            connection.execute(text(f"DROP SCHEMA IF EXISTS {args.schema} CASCADE"))
+    print(json.dumps(results, indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,117 @@
+"""
+Latency and payload size of a case's document listing: full documents with their parsed text (as
+GET /documents/case/{case_id} returned them before backend/listing.py) against one page of DocumentSummary projections.
+
+For every size in --sizes, a case with --documents documents whose parsed_content is that many KB is created
+in a scratch schema ('listing_bench' by default) of the database in DATABASE_URL (or --database-url), and both
+listings are requested --repeat times, including JSON serialization. The summary page should not grow with
+document size. Also reports whether the planner uses the composite listing index for a follow-up page.
+
+Usage:
+    python -m backend.benchmarks.listing --documents 40 --sizes 10 100 1000
+"""
+import argparse
+import json
+import os
+import statistics
+import time
+import uuid
+from datetime import datetime, timedelta
+from dotenv import load_dotenv
+from fastapi.encoders import jsonable_encoder
+from sqlalchemy import text
+from sqlmodel import Session, SQLModel, select
+from backend.benchmarks.reindex import synthetic_report
+from backend.database import create_db_engine
+from backend.document_text import load_parsed_contents, save_parsed_content
+from backend.listing import document_page
+from backend.models import Case, Document, DocumentDetail
+
+load_dotenv()
+
+
+def create_case(engine, documents: int, size_kb: int, seed: int):
+    report = "\n\n".join(synthetic_report(max(1, size_kb // 3), seed, run="listing")) # About 3 KB per page
+    content = (report * (size_kb * 1024 // len(report) + 1))[:size_kb * 1024]
+    with Session(engine) as session:
+        case = Case(user_id=uuid.uuid4(), name=f"Benchmark {size_kb} KB")
+        session.add(case)
+        session.commit()
+        start = datetime.utcnow()
+        rows = [
+            Document(case_id=case.id, file_name=f"rapport_{index}.txt", file_path=f"benchmark/rapport_{index}.txt", file_type="text/plain",
+                     processing_status="completed", uploaded_at=start + timedelta(seconds=index))
+            for index in range(documents)
+        ]
+        session.add_all(rows)
+        session.flush()
+        for document in rows:
+            save_parsed_content(session, document.id, content)
+        session.commit()
+        return case.id
+
+
+def measure(function, repeat: int) -> dict:
+    latencies = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        body = function()
+        latencies.append((time.perf_counter() - start) * 1000)
+    return {"p50_ms": round(statistics.median(latencies), 2), "max_ms": round(max(latencies), 2), "bytes": len(body)}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--database-url", default=os.getenv("DATABASE_URL"))
+    parser.add_argument("--schema", default="listing_bench")
+    parser.add_argument("--documents", type=int, default=40)
+    parser.add_argument("--sizes", type=int, nargs="+", default=[10, 100, 1000], help="parsed_content per document (KB)")
+    parser.add_argument("--page-size", type=int, default=50)
+    parser.add_argument("--repeat", type=int, default=20)
+    parser.add_argument("--seed", type=int, default=42)
+    args = parser.parse_args()
+
+    engine = create_db_engine(args.database_url, connect_args={"options": f"-csearch_path={args.schema},public,extensions"})
+    with engine.begin() as connection:
+        connection.execute(text(f"DROP SCHEMA IF EXISTS {args.schema} CASCADE"))
+        connection.execute(text(f"CREATE SCHEMA {args.schema}"))
+    # checkfirst=False: the application's tables in public are visible through the search path and would be taken as existing
+    SQLModel.metadata.create_all(engine, checkfirst=False)
+
+    results = {"config": {"documents": args.documents, "page_size": args.page_size, "repeat": args.repeat}}
+    try:
+        for size_kb in args.sizes:
+            case_id = create_case(engine, args.documents, size_kb, args.seed)
+            with engine.begin() as connection:
+                connection.execute(text("ANALYZE document"))
+            with Session(engine) as session:
+                def full_rows():
+                    documents = session.exec(select(Document).where(Document.case_id == case_id)).all()
+                    texts = load_parsed_contents(session, [document.id for document in documents])
+                    details = [DocumentDetail(**document.model_dump(), parsed_content=texts.get(document.id)) for document in documents]
+                    body = json.dumps(jsonable_encoder(details)).encode("utf-8")
+                    session.expunge_all() # Load again on every request, like a new request session
+                    return body
+
+                def summary_page():
+                    documents, _ = document_page(session, case_id, args.page_size)
+                    return json.dumps(jsonable_encoder(documents)).encode("utf-8")
+
+                results[f"{size_kb}_kb"] = {"full": measure(full_rows, args.repeat), "summary": measure(summary_page, args.repeat)}
+
+        with Session(engine) as session:
+            # The second page of the last case: keyset condition and order should be served by the listing index
+            documents, _ = document_page(session, case_id, 5)
+            plan = session.execute(text("""
+                EXPLAIN SELECT id FROM document WHERE case_id = :case_id AND (uploaded_at, id) < (:uploaded_at, :id)
+                ORDER BY uploaded_at DESC, id DESC LIMIT 6
+            """), {"case_id": case_id, "uploaded_at": documents[-1].uploaded_at, "id": documents[-1].id}).scalars().all()
+        results["listing_index_used"] = any("ix_document_case_id_uploaded_at_id" in line for line in plan)
+    finally:
+        with engine.begin() as connection:
+            connection.execute(text(f"DROP SCHEMA IF EXISTS {args.schema} CASCADE"))
+    print(json.dumps(results, indent=2))
+
+
+if __name__ == "__main__":
+    main()
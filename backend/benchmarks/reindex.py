@@ -0,0 +1,132 @@
+"""
+Cost of re-processing a lightly edited document: incremental re-indexing (ingestion.reindex_document)
+against deleting the chunks and ingesting the document again.
+
+A synthetic report of about --pages pages is ingested into a scratch schema ('reindex_bench' by default) of
+the database in DATABASE_URL (or --database-url). Then --edits paragraphs are changed, one is inserted and
+one removed, and both strategies process the edited text, with and without the embedding cache. Embeddings
+come from the local stand-in backend; the texts it receives are counted.
+
+Usage:
+    python -m backend.benchmarks.reindex --pages 100 --edits 3
+"""
+import argparse
+import json
+import os
+import random
+import time
+import uuid
+from dotenv import load_dotenv
+from sqlalchemy import delete, func, text
+from sqlmodel import Session, SQLModel, select
+from backend import embeddings, ingestion
+from backend.benchmarks.hybrid_search import TOPICS, employer
+from backend.database import create_db_engine
+from backend.embeddings import EmbeddingClient, LocalEmbeddingBackend
+from backend.ingestion import ingest_document, iter_chunks, reindex_document
+from backend.models import Case, Chunk, Document
+
+load_dotenv()
+
+WORDS_PER_PAGE = 450
+
+
+class CountingBackend(LocalEmbeddingBackend):
+    def __init__(self):
+        super().__init__()
+        self.texts = 0
+
+    def embed_batch(self, texts):
+        self.texts += len(texts)
+        return super().embed_batch(texts)
+
+
+def synthetic_report(pages: int, seed: int, run: str = None) -> list:
+    rng = random.Random(seed)
+    run = run or uuid.uuid4().hex[:8] # Unique texts by default, so the embedding cache never answers for a previous run
+    paragraphs, words = [], 0
+    while words < pages * WORDS_PER_PAGE:
+        index = len(paragraphs)
+        sentences = [f"{rng.choice(TOPICS)} ({employer(index)}, {run}-{index}-{i})." for i in range(rng.randint(2, 6))]
+        paragraphs.append(" ".join(sentences))
+        words += sum(len(sentence.split()) for sentence in sentences)
+    return paragraphs
+
+
+def edit_report(paragraphs: list, edits: int, seed: int) -> list:
+    rng = random.Random(seed)
+    edited = list(paragraphs)
+    for position in rng.sample(range(len(edited)), edits):
+        edited[position] += " De werknemer gaf aan dat de klachten de afgelopen weken zijn toegenomen."
+    edited.insert(rng.randrange(len(edited)), "Aanvulling: het re-integratieverslag is op verzoek van de werkgever bijgewerkt.")
+    del edited[rng.randrange(len(edited))]
+    return edited
+
+
+def chunk_count(session, document_id) -> int:
+    return session.exec(select(func.count()).select_from(Chunk).where(Chunk.document_id == document_id)).one()
+
+
+def run(engine, backend: CountingBackend, original: list, edited: list, strategy: str) -> dict:
+    with Session(engine) as session:
+        case = Case(user_id=uuid.uuid4(), name="Benchmark")
+        session.add(case)
+        session.commit()
+        document = Document(case_id=case.id, file_name="rapport.txt", file_path="benchmark/rapport.txt", file_type="text/plain")
+        session.add(document)
+        session.commit()
+        ingest_document(session, document, None, ".txt", engine, chunks=list(iter_chunks(original)), parsed_content="\n\n".join(original))
+        session.commit()
+
+        new_chunks = list(iter_chunks(edited))
+        texts_before = backend.texts
+        start = time.perf_counter()
+        if strategy == "reindex":
+            result = reindex_document(session, document, new_chunks, "\n\n".join(edited))
+            session.commit()
+            written, deleted = result["added"], result["removed"]
+        else:
+            deleted = session.execute(delete(Chunk).where(Chunk.document_id == document.id)).rowcount
+            session.commit()
+            written = ingest_document(session, document, None, ".txt", engine, chunks=new_chunks, parsed_content="\n\n".join(edited))["chunks"]
+            session.commit()
+        elapsed = time.perf_counter() - start
+        assert chunk_count(session, document.id) == len(new_chunks)
+    return {"chunks": len(new_chunks), "texts_embedded": backend.texts - texts_before, "rows_written": written, "rows_deleted": deleted,
+            "seconds": round(elapsed, 3)}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--database-url", default=os.getenv("DATABASE_URL"))
+    parser.add_argument("--schema", default="reindex_bench")
+    parser.add_argument("--pages", type=int, default=100)
+    parser.add_argument("--edits", type=int, default=3, help="Paragraphs changed (besides one inserted and one removed)")
+    parser.add_argument("--seed", type=int, default=42)
+    args = parser.parse_args()
+
+    engine = create_db_engine(args.database_url, connect_args={"options": f"-csearch_path={args.schema},public,extensions"})
+    with engine.begin() as connection:
+        connection.execute(text(f"DROP SCHEMA IF EXISTS {args.schema} CASCADE"))
+        connection.execute(text(f"CREATE SCHEMA {args.schema}"))
+    # checkfirst=False: the application's tables in public are visible through the search path and would be taken as existing
+    SQLModel.metadata.create_all(engine, checkfirst=False)
+
+    backend = CountingBackend()
+    embeddings._client = EmbeddingClient(backend)
+    results = {"config": {"pages": args.pages, "edits": args.edits}}
+    try:
+        for cache in (True, False):
+            ingestion.EMBEDDING_CACHE_ENABLED = cache
+            for strategy in ("recreate", "reindex"):
+                original = synthetic_report(args.pages, args.seed)
+                edited = edit_report(original, args.edits, args.seed)
+                results[f"{strategy}{'' if cache else '_without_embedding_cache'}"] = run(engine, backend, original, edited, strategy)
+    finally:
+        with engine.begin() as connection:
+            connection.execute(text(f"DROP SCHEMA IF EXISTS {args.schema} CASCADE"))
+    print(json.dumps(results, indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,107 @@
+"""
+Template report benchmark: sequential vs. concurrent per-section generation.
+
+A small case is loaded into a scratch schema ('report_bench' by default) of the database in DATABASE_URL
+(or --database-url), embeddings use the local stand-in backend and the LLM is the fake OpenAI-compatible
+server (backend/benchmarks/fake_openai_server.py), so no network access or API key is needed.
+
+Usage:
+    python -m backend.benchmarks.report_sections --sections 8 --concurrency 4 --first-token-latency 0.5 --tokens 150
+"""
+import argparse
+import json
+import os
+import time
+import uuid
+from dotenv import load_dotenv
+from sqlalchemy import create_engine, text
+from backend import embeddings, report_generation
+from backend.container import container
+from backend.benchmarks.fake_openai_server import create_app
+from backend.benchmarks.report_streaming import _start_server
+
+load_dotenv()
+
+SECTION_TITLES = [
+    "Aanleiding", "Medische situatie", "Belastbaarheid", "Eigen werk", "Passend werk",
+    "Re-integratie", "Loonwaarde", "Conclusie", "Advies", "Vervolg",
+]
+
+
+def load_case(engine, schema: str, chunks: int) -> uuid.UUID:
+    client = embeddings.get_embedding_client()
+    case_id, document_id = uuid.uuid4(), uuid.uuid4()
+    contents = [f"{SECTION_TITLES[i % len(SECTION_TITLES)]}: passage {i} uit het dossier van werknemer." for i in range(chunks)]
+    vectors = client.embed(contents)
+    with engine.begin() as connection:
+        connection.execute(text("CREATE EXTENSION IF NOT EXISTS vector"))
+        connection.execute(text(f"DROP SCHEMA IF EXISTS {schema} CASCADE"))
+        connection.execute(text(f"CREATE SCHEMA {schema}"))
+        connection.execute(text("CREATE TABLE document (id uuid PRIMARY KEY, case_id uuid NOT NULL)"))
+        connection.execute(text(f"""
+            CREATE TABLE chunk (id uuid PRIMARY KEY, document_id uuid NOT NULL, content text NOT NULL, embedding vector({len(vectors[0])}),
+                                position integer, created_at timestamp NOT NULL DEFAULT now())
+        """))
+        connection.execute(text("INSERT INTO document VALUES (:id, :case_id)"), {"id": document_id, "case_id": case_id})
+        connection.execute(
+            text("INSERT INTO chunk (id, document_id, content, embedding, position) VALUES (:id, :document_id, :content, CAST(:embedding AS vector), :position)"),
+            [{"id": uuid.uuid4(), "document_id": document_id, "content": content, "embedding": str(list(vector)), "position": position}
+             for position, (content, vector) in enumerate(zip(contents, vectors))],
+        )
+    return case_id
+
+
+def run(engine, case_id: uuid.UUID, sections: int, concurrency: int) -> dict:
+    template_schema = {"sections": [{"id": f"s{i}", "title": SECTION_TITLES[i % len(SECTION_TITLES)]} for i in range(sections)]}
+    results = {}
+    for name, workers in (("sequential", 1), ("concurrent", concurrency)):
+        start = time.perf_counter()
+        content = report_generation.generate_template_report_content(engine, case_id, template_schema, "Schrijf beknopt.", concurrency=workers)
+        elapsed = time.perf_counter() - start
+        section_seconds = [section["timings"]["total_seconds"] for section in content["sections"]]
+        results[name] = {
+            "concurrency": workers,
+            "wall_seconds": round(elapsed, 3),
+            "sum_of_sections_seconds": round(sum(section_seconds), 3),
+            "slowest_section_seconds": max(section_seconds),
+            "usage": content["usage"],
+            "sections": [{"id": section["id"], **section["timings"], "usage": section["usage"]} for section in content["sections"]],
+        }
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--database-url", default=os.getenv("DATABASE_URL"))
+    parser.add_argument("--schema", default="report_bench")
+    parser.add_argument("--sections", type=int, default=8)
+    parser.add_argument("--concurrency", type=int, default=4)
+    parser.add_argument("--chunks", type=int, default=200)
+    parser.add_argument("--first-token-latency", type=float, default=0.5, help="Simulated seconds before the first token")
+    parser.add_argument("--token-latency", type=float, default=0.005, help="Simulated seconds per generated token")
+    parser.add_argument("--tokens", type=int, default=150, help="Generated tokens per section")
+    parser.add_argument("--keep", action="store_true", help="Keep the scratch schema")
+    args = parser.parse_args()
+
+    # Local stand-ins for the embedding API and the LLM
+    container.override("embedding_client", embeddings.EmbeddingClient(embeddings.LocalEmbeddingBackend()))
+    server, thread, port = _start_server(create_app(args.first_token_latency, args.token_latency, args.tokens))
+    os.environ["OPENROUTER_BASE_URL"] = f"http://127.0.0.1:{port}/v1"
+    os.environ.setdefault("OPENROUTER_API_KEY", "benchmark")
+    container.reset("llm_client")
+
+    engine = create_engine(args.database_url, connect_args={"options": f"-csearch_path={args.schema},public,extensions"})
+    try:
+        case_id = load_case(engine, args.schema, args.chunks)
+        results = run(engine, case_id, args.sections, args.concurrency)
+    finally:
+        server.should_exit = True
+        thread.join(timeout=5)
+        if not args.keep:
+            with engine.begin() as connection:
+                connection.execute(text(f"DROP SCHEMA IF EXISTS {args.schema} CASCADE"))
+    print(json.dumps(results, indent=2))
+
+
+if __name__ == "__main__":
+    main()
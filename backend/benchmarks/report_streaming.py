@@ -0,0 +1,84 @@
+"""
+Time-to-first-token benchmark for report generation: blocking completion vs. streamed completion.
+
+Starts the fake OpenAI-compatible server (backend/benchmarks/fake_openai_server.py) on a free local port
+and points the report generation LLM clients at it, so no network access or API key is needed.
+
+Usage:
+    python -m backend.benchmarks.report_streaming --first-token-latency 0.5 --token-latency 0.02 --tokens 400
+"""
+import argparse
+import asyncio
+import json
+import os
+import time
+from backend.benchmarks.fake_openai_server import create_app, start_server as _start_server
+from backend import report_generation
+from backend.container import container
+
+
+def _blocking(messages: list) -> dict:
+    start = time.perf_counter()
+    response = report_generation.get_llm_client().chat.completions.create(model=report_generation.GENERATION_MODEL, messages=messages)
+    elapsed = time.perf_counter() - start
+    text = response.choices[0].message.content
+    # Nothing can be shown before the whole completion has arrived
+    return {"first_token_seconds": round(elapsed, 4), "total_seconds": round(elapsed, 4), "characters": len(text)}
+
+
+async def _streamed(messages: list) -> dict:
+    start = time.perf_counter()
+    first_token = None
+    parts = []
+    async for text in report_generation.stream_completion(messages):
+        if first_token is None:
+            first_token = time.perf_counter() - start
+        parts.append(text)
+    elapsed = time.perf_counter() - start
+    return {"first_token_seconds": round(first_token, 4), "total_seconds": round(elapsed, 4), "characters": len("".join(parts)), "events": len(parts)}
+
+
+def run(first_token_latency: float, token_latency: float, tokens: int, repeat: int) -> dict:
+    server, thread, port = _start_server(create_app(first_token_latency, token_latency, tokens))
+    os.environ["OPENROUTER_BASE_URL"] = f"http://127.0.0.1:{port}/v1"
+    os.environ.setdefault("OPENROUTER_API_KEY", "benchmark")
+    container.reset("llm_client", "async_llm_client") # Recreate the clients with the fake server's base URL
+
+    messages = report_generation.build_messages("Belastbaarheid: beperkt.", "Schrijf de conclusie van het rapport.")
+
+    async def streamed_runs():
+        # All streamed runs share one event loop, like the API process; the async client is bound to it
+        return [await _streamed(messages) for _ in range(repeat)]
+
+    results = {}
+    try:
+        results["blocking"] = [_blocking(messages) for _ in range(repeat)]
+        results["streaming"] = asyncio.run(streamed_runs())
+    finally:
+        server.should_exit = True
+        thread.join(timeout=5)
+
+    def summary(runs: list) -> dict:
+        return {key: round(sum(run[key] for run in runs) / len(runs), 4) for key in ("first_token_seconds", "total_seconds", "characters")}
+
+    return {
+        "config": {"first_token_latency": first_token_latency, "token_latency": token_latency, "tokens": tokens, "repeat": repeat},
+        "blocking": summary(results["blocking"]),
+        "streaming": summary(results["streaming"]),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--first-token-latency", type=float, default=0.5, help="Simulated seconds before the first token")
+    parser.add_argument("--token-latency", type=float, default=0.02, help="Simulated seconds between tokens")
+    parser.add_argument("--tokens", type=int, default=400, help="Generated tokens per completion")
+    parser.add_argument("--repeat", type=int, default=3)
+    args = parser.parse_args()
+
+    results = run(args.first_token_latency, args.token_latency, args.tokens, args.repeat)
+    print(json.dumps(results, indent=2))
+
+
+if __name__ == "__main__":
+    main()
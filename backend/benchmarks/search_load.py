@@ -0,0 +1,141 @@
+"""
+Load test of concurrent vector search requests with the synchronous and the async database paths.
+
+Three variants of the search handler are served by one FastAPI app and called concurrently in-process
+(httpx ASGI transport):
+- sync_session: `async def` handler with a synchronous Session, as search.py did before; every query
+  blocks the event loop, so requests are effectively handled one at a time. When more requests are in flight
+  than the pool has connections, a handler blocks the loop waiting for a connection that can only be returned
+  by another request's cleanup on that same loop, so it fails after DB_POOL_TIMEOUT (reported as errors),
+- threadpool: `def` handler with a synchronous Session, run in FastAPI's threadpool,
+- async_session: `async def` handler with an AsyncSession (search_chunks through run_sync), as search.py does now.
+
+A synthetic corpus is loaded into a scratch schema ('search_load_bench' by default) of the database in
+DATABASE_URL (or --database-url). Exact search over one case keeps each query at a realistic cost.
+
+Usage:
+    python -m backend.benchmarks.search_load --rows 20000 --requests 200 --concurrency 20
+"""
+import argparse
+import asyncio
+import json
+import os
+import time
+import httpx
+import numpy as np
+from dotenv import load_dotenv
+from fastapi import Depends, FastAPI
+from sqlalchemy import text
+from sqlmodel import Session
+from sqlmodel.ext.asyncio.session import AsyncSession
+from backend.benchmarks.vector_index_recall import load_corpus
+from backend.database import DB_MAX_OVERFLOW, DB_POOL_SIZE, create_async_db_engine, create_db_engine
+from backend.vector_index import search_chunks
+
+load_dotenv()
+
+
+def create_search_app(engine, async_engine, case_id, queries: list, limit: int) -> FastAPI:
+    app = FastAPI()
+
+    def get_session():
+        with Session(engine) as session:
+            yield session
+
+    async def get_async_session():
+        async with AsyncSession(async_engine, expire_on_commit=False) as session:
+            yield session
+
+    @app.get("/sync_session/{query_index}")
+    async def sync_session(query_index: int, session: Session = Depends(get_session)):
+        rows, _ = search_chunks(session, case_id, queries[query_index], limit, strategy="exact")
+        return len(rows)
+
+    @app.get("/threadpool/{query_index}")
+    def threadpool(query_index: int, session: Session = Depends(get_session)):
+        rows, _ = search_chunks(session, case_id, queries[query_index], limit, strategy="exact")
+        return len(rows)
+
+    @app.get("/async_session/{query_index}")
+    async def async_session(query_index: int, session: AsyncSession = Depends(get_async_session)):
+        rows, _ = await session.run_sync(search_chunks, case_id, queries[query_index], limit, strategy="exact")
+        return len(rows)
+
+    return app
+
+
+async def measure(app, variant: str, query_count: int, requests: int, concurrency: int) -> dict:
+    latencies = []
+    errors = 0
+    transport = httpx.ASGITransport(app=app, raise_app_exceptions=False) # Failed requests become 500 responses
+    async with httpx.AsyncClient(transport=transport, base_url="http://bench", timeout=120) as client:
+        counter = iter(range(requests))
+
+        async def worker():
+            nonlocal errors
+            for index in counter:
+                start = time.perf_counter()
+                response = await client.get(f"/{variant}/{index % query_count}")
+                latencies.append(time.perf_counter() - start)
+                if response.status_code != 200:
+                    errors += 1
+
+        for index in range(query_count): # Warm up
+            await client.get(f"/{variant}/{index}")
+        start = time.perf_counter()
+        await asyncio.gather(*[worker() for _ in range(concurrency)])
+        elapsed = time.perf_counter() - start
+    latencies.sort()
+    return {
+        "requests_per_second": round(requests / elapsed, 1),
+        "p50_ms": round(latencies[len(latencies) // 2] * 1000, 2),
+        "p95_ms": round(latencies[int(len(latencies) * 0.95)] * 1000, 2),
+        "errors": errors,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--database-url", default=os.getenv("DATABASE_URL"))
+    parser.add_argument("--schema", default="search_load_bench")
+    parser.add_argument("--rows", type=int, default=20000)
+    parser.add_argument("--dimensions", type=int, default=1536)
+    parser.add_argument("--cases", type=int, default=20)
+    parser.add_argument("--requests", type=int, default=200)
+    parser.add_argument("--concurrency", type=int, default=20)
+    parser.add_argument("--limit", type=int, default=10)
+    parser.add_argument("--pool-timeout", type=float, default=5, help="Seconds to wait for a pooled connection")
+    parser.add_argument("--seed", type=int, default=42)
+    args = parser.parse_args()
+
+    connect_args = {"options": f"-csearch_path={args.schema},public,extensions"}
+    engine = create_db_engine(args.database_url, connect_args=connect_args, pool_timeout=args.pool_timeout)
+    async_engine = create_async_db_engine(args.database_url, connect_args=connect_args, pool_timeout=args.pool_timeout)
+    print(f"Loading {args.rows} synthetic chunks ({args.dimensions} dimensions) into schema '{args.schema}'...")
+    case_ids, centroids = load_corpus(engine, args.schema, args.rows, args.dimensions, args.cases, 0.2, args.seed)
+
+    rng = np.random.default_rng(args.seed + 1)
+    queries = [(centroids[rng.integers(0, len(centroids))] + rng.normal(scale=0.6, size=args.dimensions)).tolist() for _ in range(20)]
+    app = create_search_app(engine, async_engine, case_ids[0], queries, args.limit)
+
+    async def run_all():
+        results = {}
+        for variant in ("sync_session", "threadpool", "async_session"):
+            results[variant] = await measure(app, variant, len(queries), args.requests, args.concurrency)
+        await async_engine.dispose()
+        return results
+
+    try:
+        results = {
+            "config": {"rows": args.rows, "case_rows": int(args.rows * 0.2), "requests": args.requests, "concurrency": args.concurrency,
+                       "pool_size": DB_POOL_SIZE, "max_overflow": DB_MAX_OVERFLOW},
+            **asyncio.run(run_all()),
+        }
+    finally:
+        with engine.begin() as connection:
+            connection.execute(text(f"DROP SCHEMA IF EXISTS {args.schema} CASCADE"))
+    print(json.dumps(results, indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,139 @@
+"""
+Cold start of the API and the Celery worker: the time a fresh interpreter needs to import backend.main (and
+serve its first request) and backend.celery_worker. Exits with status 1 when the median exceeds the budget,
+so it can run as a CI check; replicas started by the autoscaler and restarted workers pay this on every start.
+
+Every run is a new Python process (--runs per target). Also fails when importing creates clients or engines
+(see backend/container.py), lists which libraries that should be imported on first use were imported anyway,
+and with --profile the packages that take the most import time (python -X importtime). Nothing is connected: the
+database, Redis and Supabase do not have to be reachable.
+
+Usage:
+    python -m backend.benchmarks.startup --runs 5 --api-budget-ms 2000 --worker-budget-ms 1500
+"""
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+import time
+
+TARGETS = {
+    "api": "backend.main",
+    "worker": "backend.celery_worker",
+}
+
+# Libraries that are only needed by some requests or tasks and should be imported on first use
+LAZY_LIBRARIES = {
+    "api": ("openai", "supabase", "psycopg", "celery", "docx", "backend.celery_worker"),
+    "worker": ("openai", "supabase", "psycopg", "docx"),
+}
+
+# Container instances that may exist right after the import: the worker defines its tasks on the Celery app
+CREATED_AT_IMPORT = {
+    "api": (),
+    "worker": ("celery_app",),
+}
+
+PROBE = """
+import json, sys, time
+start = time.perf_counter()
+module = __import__(sys.argv[1], fromlist=["_"])
+result = {"import_ms": (time.perf_counter() - start) * 1000}
+if sys.argv[2] == "api":
+    from fastapi.testclient import TestClient
+    with TestClient(module.app) as client: # Runs the startup handlers
+        assert client.get("/").status_code == 200
+    result["first_request_ms"] = (time.perf_counter() - start) * 1000
+from backend.container import container
+result["created"] = container.created()
+result["lazy_libraries_loaded"] = [name for name in json.loads(sys.argv[3]) if name in sys.modules]
+print(json.dumps(result))
+"""
+
+
+def probe(target: str, module: str) -> dict:
+    start = time.perf_counter()
+    completed = subprocess.run(
+        [sys.executable, "-c", PROBE, module, target, json.dumps(LAZY_LIBRARIES[target])],
+        capture_output=True, text=True, check=True,
+    )
+    result = json.loads(completed.stdout.strip().splitlines()[-1]) # The routers print debugging lines
+    result["process_ms"] = (time.perf_counter() - start) * 1000 # Including interpreter start and exit
+    return result
+
+
+def interpreter_ms(runs: int) -> float:
+    """Median wall time of a bare `python -c pass`, for reference."""
+    timings = []
+    for _ in range(runs):
+        start = time.perf_counter()
+        subprocess.run([sys.executable, "-c", "pass"], check=True)
+        timings.append((time.perf_counter() - start) * 1000)
+    return round(statistics.median(timings), 1)
+
+
+def slowest_imports(module: str, count: int) -> list:
+    """Import time (ms) per package (modules of backend/ separately), summed over all of its modules."""
+    completed = subprocess.run([sys.executable, "-X", "importtime", "-c", f"import {module}"], capture_output=True, text=True, check=True)
+    packages = {}
+    for line in completed.stderr.splitlines():
+        fields = line[len("import time:"):].split("|")
+        if not line.startswith("import time:") or not fields[0].strip().isdigit():
+            continue # Header or unrelated output
+        name = fields[2].strip()
+        package = name if name.startswith("backend.") else name.split(".")[0]
+        packages[package] = packages.get(package, 0) + int(fields[0]) / 1000 # Self time, so nothing is counted twice
+    return [[name, round(ms, 1)] for name, ms in sorted(packages.items(), key=lambda item: -item[1])[:count]]
+
+
+def summarize(samples: list, key: str) -> dict:
+    values = [sample[key] for sample in samples]
+    return {"p50_ms": round(statistics.median(values), 1), "max_ms": round(max(values), 1)}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--runs", type=int, default=5)
+    parser.add_argument("--targets", nargs="+", choices=list(TARGETS), default=list(TARGETS))
+    parser.add_argument("--api-budget-ms", type=float, default=float(os.getenv("STARTUP_BUDGET_API_MS", "2000")),
+                        help="Budget for the median import + first request of the API")
+    parser.add_argument("--worker-budget-ms", type=float, default=float(os.getenv("STARTUP_BUDGET_WORKER_MS", "1500")),
+                        help="Budget for the median import of the worker")
+    parser.add_argument("--profile", type=int, default=0, metavar="N", help="List the N slowest top-level imports per target")
+    args = parser.parse_args()
+
+    budgets = {"api": args.api_budget_ms, "worker": args.worker_budget_ms}
+    results = {"config": {"runs": args.runs, "python": sys.version.split()[0], "budgets_ms": {t: budgets[t] for t in args.targets}},
+               "interpreter_process_ms": interpreter_ms(args.runs)}
+    failures = []
+    for target in args.targets:
+        module = TARGETS[target]
+        probe(target, module) # Not measured: writes the bytecode caches and warms the OS file cache
+        samples = [probe(target, module) for _ in range(args.runs)]
+        result = {"import": summarize(samples, "import_ms"), "process": summarize(samples, "process_ms")}
+        measured = "import"
+        if target == "api":
+            result["first_request"] = summarize(samples, "first_request_ms")
+            measured = "first_request"
+        result["created_at_import"] = samples[-1]["created"]
+        result["lazy_libraries_loaded"] = samples[-1]["lazy_libraries_loaded"]
+        if args.profile:
+            result["slowest_imports_ms"] = slowest_imports(module, args.profile)
+
+        if result[measured]["p50_ms"] > budgets[target]:
+            failures.append(f"{target}: {measured} p50 {result[measured]['p50_ms']} ms exceeds the budget of {budgets[target]} ms")
+        unexpected = [name for name in result["created_at_import"] if name not in CREATED_AT_IMPORT[target]]
+        if unexpected:
+            failures.append(f"{target}: created at import: {', '.join(unexpected)}")
+        results[target] = result
+
+    results["failures"] = failures
+    print(json.dumps(results, indent=2))
+    if failures:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,137 @@
+"""
+Recall-vs-latency benchmark of the ANN index and the case-filtered search strategies against exact search.
+
+A synthetic, clustered corpus is loaded into a scratch schema ('vector_bench' by default) of the database
+in DATABASE_URL (or --database-url), so existing data is never touched. The corpus has one large case
+and many small ones, to show how the index behaves when a case only holds a small share of the table.
+
+Usage:
+    python -m backend.benchmarks.vector_index_recall --rows 20000 --dimensions 1536 --index hnsw
+"""
+import argparse
+import io
+import json
+import os
+import statistics
+import time
+import uuid
+import numpy as np
+from dotenv import load_dotenv
+from sqlalchemy import create_engine, text
+from sqlmodel import Session
+from backend.vector_index import ANN_SEARCH_SQL, create_vector_index, search_chunks
+
+load_dotenv()
+
+
+def load_corpus(engine, schema: str, rows: int, dimensions: int, cases: int, large_case_share: float, seed: int):
+    rng = np.random.default_rng(seed)
+    with engine.begin() as connection:
+        connection.execute(text("CREATE EXTENSION IF NOT EXISTS vector")) # Before the scratch schema exists, so it is not created inside it
+        connection.execute(text(f"DROP SCHEMA IF EXISTS {schema} CASCADE"))
+        connection.execute(text(f"CREATE SCHEMA {schema}"))
+        connection.execute(text("CREATE TABLE document (id uuid PRIMARY KEY, case_id uuid NOT NULL)"))
+        connection.execute(text("CREATE INDEX ON document (case_id)"))
+        connection.execute(text(f"CREATE TABLE chunk (id uuid PRIMARY KEY, document_id uuid NOT NULL, content text NOT NULL, embedding vector({dimensions}))"))
+
+    # One large case holding `large_case_share` of the rows, the rest spread over small cases
+    case_ids = [uuid.uuid4() for _ in range(cases)]
+    large_rows = int(rows * large_case_share)
+    case_of_row = [case_ids[0]] * large_rows + [case_ids[1 + i % (cases - 1)] for i in range(rows - large_rows)]
+    documents = {case_id: uuid.uuid4() for case_id in case_ids} # One document per case is enough here
+
+    centroids = rng.normal(size=(64, dimensions)).astype(np.float32)
+    embeddings = centroids[rng.integers(0, len(centroids), rows)] + rng.normal(scale=0.6, size=(rows, dimensions)).astype(np.float32)
+
+    raw = engine.raw_connection()
+    try:
+        cursor = raw.cursor()
+        cursor.execute(f"SET search_path TO {schema}, public, extensions")
+        buffer = io.StringIO("".join(f"{document_id}\t{case_id}\n" for case_id, document_id in documents.items()))
+        cursor.copy_expert("COPY document (id, case_id) FROM STDIN", buffer)
+        buffer = io.StringIO()
+        for case_id, vector in zip(case_of_row, embeddings):
+            buffer.write(f"{uuid.uuid4()}\t{documents[case_id]}\tchunk\t[{','.join(f'{v:.5f}' for v in vector)}]\n")
+        buffer.seek(0)
+        cursor.copy_expert("COPY chunk (id, document_id, content, embedding) FROM STDIN", buffer)
+        cursor.execute("ANALYZE")
+        raw.commit()
+    finally:
+        raw.close()
+    return case_ids, centroids
+
+
+def measure(engine, queries, case_id, limit: int, run) -> dict:
+    """Run `run(session, query)` for each query and compare the returned ids with exact search."""
+    recalls, latencies = [], []
+    for query in queries:
+        with Session(engine) as session:
+            expected, _ = search_chunks(session, case_id, query, limit, strategy="exact")
+            expected_ids = {row[0] for row in expected}
+        with Session(engine) as session:
+            start = time.perf_counter()
+            rows = run(session, query)
+            latencies.append((time.perf_counter() - start) * 1000)
+        recalls.append(len(expected_ids & {row[0] for row in rows}) / max(len(expected_ids), 1))
+    return {
+        "recall": round(statistics.mean(recalls), 4),
+        "p50_ms": round(statistics.median(latencies), 3),
+        "p95_ms": round(sorted(latencies)[int(len(latencies) * 0.95) - 1], 3),
+    }
+
+
+def naive_ann(session, case_id, query, limit: int, ef_search: int):
+    # Plain index scan with a post-filter, without scaling the candidate list to the case's share
+    session.execute(text("SELECT set_config('hnsw.ef_search', :value, true)"), {"value": str(ef_search)})
+    session.execute(text("SELECT set_config('ivfflat.probes', :value, true)"), {"value": str(max(ef_search // 4, 1))})
+    return session.execute(text(ANN_SEARCH_SQL), {"query_embedding": str(list(query)), "case_id": str(case_id), "limit": limit}).all()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--database-url", default=os.getenv("DATABASE_URL"))
+    parser.add_argument("--schema", default="vector_bench")
+    parser.add_argument("--rows", type=int, default=20000)
+    parser.add_argument("--dimensions", type=int, default=1536)
+    parser.add_argument("--cases", type=int, default=50)
+    parser.add_argument("--large-case-share", type=float, default=0.5)
+    parser.add_argument("--index", choices=["hnsw", "ivfflat"], default="hnsw")
+    parser.add_argument("--ef-search", default="10,20,40,80,200", help="Comma separated ef_search (HNSW) / probes*4 (IVFFlat) values")
+    parser.add_argument("--queries", type=int, default=30)
+    parser.add_argument("--limit", type=int, default=10)
+    parser.add_argument("--seed", type=int, default=42)
+    args = parser.parse_args()
+
+    engine = create_engine(args.database_url, connect_args={"options": f"-csearch_path={args.schema},public,extensions"})
+    print(f"Loading {args.rows} synthetic chunks ({args.dimensions} dimensions) into schema '{args.schema}'...")
+    case_ids, centroids = load_corpus(engine, args.schema, args.rows, args.dimensions, args.cases, args.large_case_share, args.seed)
+
+    rng = np.random.default_rng(args.seed + 1)
+    queries = [(centroids[rng.integers(0, len(centroids))] + rng.normal(scale=0.6, size=args.dimensions)).tolist() for _ in range(args.queries)]
+    cases = {"large_case": case_ids[0], "small_case": case_ids[1]}
+
+    start = time.perf_counter()
+    create_vector_index(engine, args.index)
+    results = {"index": args.index, "rows": args.rows, "dimensions": args.dimensions, "index_build_seconds": round(time.perf_counter() - start, 2), "cases": {}}
+
+    for label, case_id in cases.items():
+        case_results = {
+            "exact": measure(engine, queries, case_id, args.limit, lambda s, q: search_chunks(s, case_id, q, args.limit, strategy="exact")[0]),
+            "auto": measure(engine, queries, case_id, args.limit, lambda s, q: search_chunks(s, case_id, q, args.limit)[0]),
+        }
+        for ef_search in (int(value) for value in args.ef_search.split(",")):
+            probes = max(ef_search // 4, 1)
+            case_results[f"ann_filtered@{ef_search}"] = measure(
+                engine, queries, case_id, args.limit,
+                lambda s, q: search_chunks(s, case_id, q, args.limit, ef_search=ef_search, probes=probes, strategy="ann")[0],
+            )
+            case_results[f"ann_naive@{ef_search}"] = measure(engine, queries, case_id, args.limit, lambda s, q: naive_ann(s, case_id, q, args.limit, ef_search))
+        results["cases"][label] = case_results
+
+    print(json.dumps(results, indent=2))
+    with engine.begin() as connection:
+        connection.execute(text(f"DROP SCHEMA IF EXISTS {args.schema} CASCADE"))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,170 @@
+"""
+Table size, index size, latency and recall@k of the embedding storage modes (backend/vector_storage.py).
+
+The clustered corpus of vector_index_recall is loaded once into a scratch schema ('vector_storage_bench' by
+default) of the database in DATABASE_URL (or --database-url) and copied into one schema per storage mode. Each
+copy is migrated with vector_storage.migrate, compacted where the mode allows it (float32 values cleared,
+VACUUM FULL) and gets an HNSW index on its search column. Recall is measured against exact search on the
+full-precision embeddings of the original corpus. Modes the installed pgvector cannot run (halfvec needs
+pgvector >= 0.7) are reported as unsupported.
+
+Usage:
+    python -m backend.benchmarks.vector_storage --rows 20000 --queries 30
+"""
+import argparse
+import json
+import os
+import statistics
+import time
+import numpy as np
+from dotenv import load_dotenv
+from sqlalchemy import text
+from sqlmodel import Session
+from backend import text_search, vector_storage
+from backend.benchmarks.vector_index_recall import load_corpus
+from backend.database import create_db_engine
+from backend.vector_index import create_vector_index, search_chunks
+
+load_dotenv()
+
+# label: (storage, rerank column of binary storage)
+MODES = {
+    "vector": ("vector", None),
+    "halfvec": ("halfvec", None),
+    "binary_rerank_halfvec": ("binary", "halfvec"),
+    "binary_rerank_vector": ("binary", "vector"),
+}
+
+
+def schema_engine(database_url: str, schema: str):
+    return create_db_engine(database_url, connect_args={"options": f"-csearch_path={schema},public,extensions"}, echo=False)
+
+
+def use_rerank_column(column: str):
+    # The rerank column is process-wide configuration; the cached SQL has to be rebuilt after changing it
+    vector_storage.EMBEDDING_RERANK_COLUMN = column or "halfvec"
+    vector_storage.nearest_chunks_sql.cache_clear()
+    text_search.hybrid_sql.cache_clear()
+    text_search.prefilter_sql.cache_clear()
+
+
+def copy_corpus(engine, source: str, schema: str):
+    with engine.begin() as connection:
+        connection.execute(text(f"DROP SCHEMA IF EXISTS {schema} CASCADE"))
+        connection.execute(text(f"CREATE SCHEMA {schema}"))
+        connection.execute(text(f"CREATE TABLE {schema}.document AS SELECT * FROM {source}.document"))
+        connection.execute(text(f"CREATE TABLE {schema}.chunk AS SELECT * FROM {source}.chunk"))
+        connection.execute(text(f"ALTER TABLE {schema}.chunk ADD PRIMARY KEY (id)"))
+        connection.execute(text(f"CREATE INDEX ON {schema}.document (case_id)"))
+        connection.execute(text(f"CREATE INDEX ON {schema}.chunk (document_id)"))
+
+
+def sizes(engine) -> dict:
+    with engine.connect() as connection:
+        return dict(connection.execute(text("""
+            SELECT pg_table_size('chunk') AS table_bytes,
+                   (SELECT coalesce(sum(pg_relation_size(indexrelid)), 0)::bigint FROM pg_index i JOIN pg_am am ON am.oid = (SELECT relam FROM pg_class WHERE oid = i.indexrelid)
+                    WHERE i.indrelid = 'chunk'::regclass AND am.amname IN ('hnsw', 'ivfflat')) AS ann_index_bytes
+        """)).mappings().one())
+
+
+def measure(engine, queries, expected, case_id, limit: int, storage: str, strategy: str) -> dict:
+    recalls, latencies = [], []
+    for query, expected_ids in zip(queries, expected):
+        with Session(engine) as session:
+            start = time.perf_counter()
+            rows, _ = search_chunks(session, case_id, query, limit, strategy=strategy, storage=storage)
+            latencies.append((time.perf_counter() - start) * 1000)
+        recalls.append(len(expected_ids & {row[0] for row in rows}) / max(len(expected_ids), 1))
+    return {
+        "recall": round(statistics.mean(recalls), 4),
+        "p50_ms": round(statistics.median(latencies), 2),
+        "p95_ms": round(sorted(latencies)[int(len(latencies) * 0.95) - 1], 2),
+    }
+
+
+def run_mode(engine, storage: str, rerank: str, version: tuple, queries, expected, cases, limit: int) -> dict:
+    use_rerank_column(rerank)
+    try:
+        vector_storage.migrate(engine, storage)
+    except RuntimeError as e:
+        return {"unsupported": str(e)}
+    result = {}
+    try:
+        vector_storage.compact(engine, storage)
+        result["compacted"] = True
+    except RuntimeError:
+        result["compacted"] = False # The float32 embeddings are still needed
+    with engine.connect().execution_options(isolation_level="AUTOCOMMIT") as connection:
+        connection.execute(text("VACUUM FULL chunk"))
+        connection.execute(text("ANALYZE chunk"))
+
+    if storage == "binary" and version < (0, 7):
+        result["index"] = "none (indexing bit vectors needs pgvector >= 0.7; 'ann' scans the bit column)"
+    else:
+        start = time.perf_counter()
+        create_vector_index(engine, "hnsw", storage=storage)
+        result["index"] = "hnsw"
+        result["index_build_seconds"] = round(time.perf_counter() - start, 2)
+    result.update(sizes(engine))
+
+    for label, case_id in cases.items():
+        result[label] = {strategy: measure(engine, queries, expected[label], case_id, limit, storage, strategy) for strategy in ("exact", "ann")}
+    return result
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--database-url", default=os.getenv("DATABASE_URL"))
+    parser.add_argument("--schema", default="vector_storage_bench")
+    parser.add_argument("--rows", type=int, default=20000)
+    parser.add_argument("--dimensions", type=int, default=vector_storage.EMBEDDING_DIMENSIONS)
+    parser.add_argument("--cases", type=int, default=50)
+    parser.add_argument("--large-case-share", type=float, default=0.5)
+    parser.add_argument("--modes", nargs="+", choices=list(MODES), default=list(MODES))
+    parser.add_argument("--queries", type=int, default=30)
+    parser.add_argument("--limit", type=int, default=10)
+    parser.add_argument("--seed", type=int, default=42)
+    args = parser.parse_args()
+    if args.dimensions != vector_storage.EMBEDDING_DIMENSIONS:
+        parser.error("--dimensions must match EMBEDDING_DIMENSIONS (the compact column types are declared with it)")
+
+    engine = schema_engine(args.database_url, args.schema)
+    print(f"Loading {args.rows} synthetic chunks ({args.dimensions} dimensions) into schema '{args.schema}'...")
+    case_ids, centroids = load_corpus(engine, args.schema, args.rows, args.dimensions, args.cases, args.large_case_share, args.seed)
+    with engine.connect() as connection:
+        version = vector_storage._pgvector_version(connection)
+
+    rng = np.random.default_rng(args.seed + 1)
+    queries = [(centroids[rng.integers(0, len(centroids))] + rng.normal(scale=0.6, size=args.dimensions)).tolist() for _ in range(args.queries)]
+    cases = {"large_case": case_ids[0], "small_case": case_ids[1]}
+    # Ground truth: exact search on the full-precision embeddings
+    expected = {}
+    for label, case_id in cases.items():
+        with Session(engine) as session:
+            expected[label] = [{row[0] for row in search_chunks(session, case_id, query, args.limit, strategy="exact", storage="vector")[0]}
+                               for query in queries]
+
+    results = {"config": {"rows": args.rows, "dimensions": args.dimensions, "queries": args.queries, "limit": args.limit,
+                          "rerank_factor": vector_storage.EMBEDDING_RERANK_FACTOR, "pgvector": ".".join(map(str, version))}}
+    try:
+        for label in args.modes:
+            storage, rerank = MODES[label]
+            mode_schema = f"{args.schema}_{label}"
+            print(f"Measuring '{label}'...")
+            copy_corpus(engine, args.schema, mode_schema)
+            mode_engine = schema_engine(args.database_url, mode_schema)
+            try:
+                results[label] = run_mode(mode_engine, storage, rerank, version, queries, expected, cases, args.limit)
+            finally:
+                mode_engine.dispose()
+                with engine.begin() as connection:
+                    connection.execute(text(f"DROP SCHEMA IF EXISTS {mode_schema} CASCADE"))
+    finally:
+        with engine.begin() as connection:
+            connection.execute(text(f"DROP SCHEMA IF EXISTS {args.schema} CASCADE"))
+    print(json.dumps(results, indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -1,57 +1,89 @@
-from celery import Celery
+from celery import chain, chord, group
+from celery.signals import worker_process_init
 import os
 from dotenv import load_dotenv
-from sqlmodel import Session, select, create_engine
-from backend.models import Document
-from backend.dependencies import supabase # Import supabase client from dependencies
-import docx # For .docx parsing
-import io # To read file content from bytes
+from sqlmodel import Session, select
+from sqlalchemy import delete, exists, text
+from backend.models import Document, Chunk
+from backend.document_text import save_parsed_content
+from backend.embedding_cache import cache_stats
+from backend.embeddings import get_embedding_client
+from backend.ingestion import (
+    ingest_document, parse_document, reindex_document, embed_texts, iter_batches, pack_embeddings, unpack_embeddings,
+    StageTimings, INGEST_BATCH_SIZE, SUPPORTED_EXTENSIONS, UnsupportedFileType
+)
+from backend.deletion import unreferenced_paths
+from backend.storage import download_to_file, remove_objects
+from backend.ingest_queue import get_ingest_queue
+from backend.response_cache import invalidate_case
+from backend.container import get_celery_app, get_engine
+from backend.metrics import INGEST_BATCH_SECONDS, INGEST_CHUNKS, INGEST_DOCUMENTS, span, start_metrics_server, timed
+import tempfile
+import time
+import uuid
 
 load_dotenv()
 
-REDIS_URL = os.getenv("REDIS_URL", "redis://localhost:6379/0")
-DATABASE_URL = os.getenv("DATABASE_URL") # Assuming DATABASE_URL is also in .env
-
-if not DATABASE_URL:
-     raise ValueError("DATABASE_URL must be set in the environment variables")
-
-engine = create_engine(DATABASE_URL) # Database engine for Celery worker
+# Port of the /metrics endpoint of worker processes (see backend/metrics.py); disabled when not set.
+# Every pool process takes the next free port, e.g. 9100-9103 for a prefork worker with -c 4.
+METRICS_PORT = os.getenv("METRICS_PORT")
 
 def get_session():
-    with Session(engine) as session:
+    # The engine is created on first use in every pool process (see backend/container.py)
+    with Session(get_engine()) as session:
         yield session
 
-celery_app = Celery(
-    "ad_rapport_generator",
-    broker=REDIS_URL,
-    backend=REDIS_URL
-)
-
-celery_app.conf.update(
-    task_ignore_result=False,
-    task_track_started=True,
-)
-
-
-celery_app = Celery(
-    "ad_rapport_generator",
-    broker=REDIS_URL,
-    backend=REDIS_URL
-)
+# Broker, queues and routes are configured in backend/container.py; the API sends tasks to this app by name
+celery_app = get_celery_app()
+
+# Documents of at least this many downloaded bytes are embedded and persisted in parallel batch tasks
+# (a chord of embed -> persist chains per batch, followed by finalize_document); the default is about 256 chunks
+# of plain text. Smaller documents are streamed from the downloaded file by the in-process pipeline of the parse
+# task, so they are never held in memory as a whole.
+INGEST_FANOUT_MIN_BYTES = int(os.getenv("INGEST_FANOUT_MIN_BYTES", str(256 * 1024)))
+
+# Seconds a queued report may take; also the lease of the worker generating it (see report_generation.run_queued_report)
+REPORT_GENERATION_TIME_LIMIT = int(os.getenv("REPORT_GENERATION_TIME_LIMIT", "900"))
+
+@worker_process_init.connect
+def serve_metrics(**kwargs):
+    """Serve the metrics of each worker process (prefork and solo pools) when METRICS_PORT is set."""
+    if not METRICS_PORT:
+        return
+    port = start_metrics_server(int(METRICS_PORT), attempts=64)
+    print(f"Serving worker metrics on port {port}." if port else f"No free metrics port from {METRICS_PORT}.")
+
+def release_ingest_slot(user_id: str, document_id: str):
+    """Free the per-user processing slot of a document dispatched by the fair ingest queue."""
+    if not user_id:
+        return # Not dispatched through the ingest queue
+    try:
+        get_ingest_queue().release(user_id, document_id)
+    except Exception as e:
+        # The slot expires after INGEST_LEASE_SECONDS
+        print(f"Failed to release the ingest slot of document {document_id}: {e}")
 
-celery_app.conf.update(
-    task_ignore_result=False,
-    task_track_started=True,
-)
+@celery_app.task
+def dispatch_ingest_queue():
+    """Periodically dispatch queued documents, e.g. after leases of crashed workers expired."""
+    return len(get_ingest_queue().dispatch())
 
 @celery_app.task
-def process_document_mvp(document_id: str):
+def process_document_mvp(document_id: str, user_id: str = None):
     """
     Celery task to process an uploaded document.
     (MVP: Placeholder for actual processing logic)
+    `user_id` is set when the document was dispatched by the fair ingest queue (backend/ingest_queue.py);
+    its slot is released when the processing has finished.
     """
+    with span("ingest.document", document_id=document_id):
+        return _process_document(document_id, user_id)
+
+def _process_document(document_id: str, user_id: str = None):
     print(f"Processing document with ID: {document_id}")
     session = next(get_session()) # Get a database session
+    fanned_out = False
+    reindexing = False
 
     try:
         # 1. Retrieve the Document object
@@ -61,133 +93,79 @@ def process_document_mvp(document_id: str):
             return
 
         # Update status to processing
-        document.status = "processing"
+        document.processing_status = "processing"
         session.add(document)
         session.commit()
         session.refresh(document)
         print(f"Document {document_id} status updated to processing.")
 
         # 2. Download the document from Supabase Storage
-        response = supabase.storage.from_('documents').download(document.storage_path)
-
-        if response.get('error'):
-            raise Exception(f"Supabase Storage download failed: {response['error']['message']}")
-
-        file_content = response # response is the file content bytes
-
-        # 3. Parse the document content
-        file_extension = os.path.splitext(document.filename)[1].lower()
-        content = ""
-
-        if file_extension == ".docx":
-            try:
-                doc = docx.Document(io.BytesIO(file_content))
-                content = "\n".join([paragraph.text for paragraph in doc.paragraphs])
-            except Exception as e:
-                raise Exception(f"Error parsing DOCX file: {e}")
-        elif file_extension == ".txt":
-            try:
-                content = file_content.decode('utf-8') # Assuming UTF-8 encoding
-            except Exception as e:
-                raise Exception(f"Error parsing TXT file: {e}")
-        else:
-            raise Exception(f"Unsupported file type: {file_extension}")
-
-        print(f"Successfully parsed document {document_id}. Content length: {len(content)}")
-
-        # Store parsed content
-        document.parsed_content = content
-        session.add(document)
-        session.commit()
-        session.refresh(document)
-        print(f"Document {document_id} parsed content saved.")
-
-        # 4. Implement Document Chunking (Task 2.2)
-        # Split into paragraphs and create chunks
-        paragraphs = [p.strip() for p in content.split('\n\n') if p.strip()] # Split by double newline for paragraphs
-
-        new_chunks = []
-        # Simple paragraph-based chunking for now. More advanced methods (sliding window, sentence tokenization) could be used.
-        for paragraph_text in paragraphs:
-            # You might want to add logic here to split very long paragraphs or combine short ones
-            if paragraph_text: # Ensure paragraph is not empty after stripping
-                chunk = Chunk(document_id=document.id, content=paragraph_text, embedding=[]) # Placeholder for embedding
-                new_chunks.append(chunk)
-
-        if new_chunks:
-            session.add_all(new_chunks)
-            session.commit()
-            # Refresh the session to get the newly created chunks with their IDs
-            session.refresh(document)
-            print(f"Created {len(new_chunks)} chunks for document {document_id}.")
-        else:
-            print(f"No chunks created for document {document_id}.")
-
-
-        # 5. Implement Text Embedding (Task 2.3)
-        # Using Supabase built-in embeddings via RPC.
-        # Ensure your Supabase client is initialized correctly and the 'pgvector' extension is enabled in your database.
-        # You might need to install the Supabase Python client with embeddings support: pip install supabase-py[embeddings]
-        # The embedding model name might need to be configured (e.g., 'text-embedding-ada-002').
-
-        # Retrieve the chunks again to ensure they are attached to the session
-        chunks_to_embed = session.exec(select(Chunk).where(Chunk.document_id == document.id)).all()
-
-        for chunk in chunks_to_embed:
-            try:
-                # Call Supabase embeddings API
-                # The exact method name and parameters might vary based on the Supabase client version and setup.
-                # This example assumes a 'generate_embedding' RPC function is set up in Supabase.
-                # Alternatively, the Supabase client might have a dedicated embeddings method.
-                # Refer to Supabase documentation for the exact API call.
-
-                # Example using a hypothetical RPC call:
-                # response = supabase.rpc('generate_embedding', {'input_text': chunk.content}).execute()
-                # if response.data and response.data[0].get('embedding'):
-                #     embedding_vector = response.data[0]['embedding']
-                # else:
-                #     raise Exception("Supabase embedding generation failed or returned no embedding.")
-
-                # Call Supabase embeddings API using the 'generate_embedding' RPC
-                # Ensure this RPC is set up in your Supabase project and uses the desired embedding model.
-                # The input parameter name ('input_text') and output structure ('embedding') must match the RPC definition.
-                response = supabase.rpc('generate_embedding', {'input_text': chunk.content}).execute()
-
-                if response.data and response.data[0] and response.data[0].get('embedding'):
-                    embedding_vector = response.data[0]['embedding']
-                    chunk.embedding = embedding_vector
-                    session.add(chunk)
-                    session.commit()
-                    session.refresh(chunk)
-                    print(f"Saved embedding for chunk {chunk.id}.")
-                else:
-                    # Handle cases where embedding generation fails or returns no embedding
-                    print(f"Supabase embedding generation failed or returned no embedding for chunk {chunk.id}. Response: {response}")
-                    # Optionally, mark the chunk or document as failed or needing re-processing
-                    # For now, we'll just log and continue
-
-            except Exception as e:
-                print(f"Error generating or saving embedding for chunk {chunk.id}: {e}")
-                # Decide how to handle embedding failures - e.g., mark chunk as failed, log error, etc.
-                # For now, we'll just print the error and continue
+        # The file is streamed into a temporary file (spilled to disk above 1 MB) instead of being held in memory
+        file_extension = os.path.splitext(document.file_name)[1].lower()
+        if file_extension not in SUPPORTED_EXTENSIONS:
+            raise UnsupportedFileType(f"Unsupported file type: {file_extension}")
+
+        timings = StageTimings()
+        with tempfile.SpooledTemporaryFile(max_size=1024 * 1024) as file_content:
+            start = time.perf_counter()
+            with span("ingest.download"):
+                size = download_to_file(document.file_path, file_content)
+            timings.add("download", time.perf_counter() - start)
+            print(f"Downloaded document {document_id} ({size} bytes).")
+
+            if session.exec(select(exists().where(Chunk.document_id == document.id))).one():
+                # 3-5. Already indexed (re-processing after a change): only embed the chunks that changed
+                reindexing = True
+                mode = "reindex"
+                chunks, parsed_content = parse_document(file_content, file_extension, timings)
+                result = reindex_document(session, document, chunks, parsed_content, timings)
+            elif size >= INGEST_FANOUT_MIN_BYTES:
+                # 3-5. Large document: embed and save the chunk batches in parallel on the embed/persist workers.
+                # finalize_document marks the document completed once all batches are saved.
+                chunks, parsed_content = parse_document(file_content, file_extension, timings)
+                save_parsed_content(session, document.id, parsed_content)
+                session.commit()
+                batches = dispatch_chunk_batches(document_id, chunks, user_id=user_id)
+                fanned_out = True # The slot is released by finalize_document / mark_document_failed
+                timings.record("fanout", stages=("download", "parse", "chunk")) # Embed/persist are timed per batch
+                print(f"Dispatched {len(chunks)} chunks of document {document_id} in {batches} batches.")
+                return {"document_id": document_id, "chunks": len(chunks), "batches": batches, "timings": timings.as_dict()}
+            else:
+                # 3-5. Parse, chunk, embed and save the chunks as a streaming pipeline (see backend/ingestion.py)
+                # Chunks are committed in batches, so they become searchable while the document is still being processed.
+                mode = "stream"
+                result = ingest_document(session, document, file_content, file_extension, get_engine(), timings)
+                print(f"Created {result['chunks']} chunks with embeddings for document {document_id}. Stage timings: {result['timings']}")
 
         # TODO: Implement Task 2.4 (Vector Search) - This is implemented in backend/routers/search.py
         # TODO: Implement Task 2.5 (Report Generation using RAG) - This is implemented in backend/routers/reports.py
 
-        # Update status to completed after chunking and embedding (even if some embeddings failed)
+        # Update status to completed after chunking and embedding (the parsed text was stored by the pipeline)
         document.processing_status = "completed" # Use processing_status field
         session.add(document)
+        invalidate_case(session, document.case_id) # Reports of the case can now use the new chunks
         session.commit()
         session.refresh(document)
+        timings.record(mode)
+        INGEST_DOCUMENTS.inc(status="completed")
         print(f"Document {document_id} processing_status updated to completed.")
+        print(f"Embedding cache stats: {cache_stats.snapshot()}")
+        return {"document_id": document_id, **result, "embedding_cache": cache_stats.snapshot()}
 
 
     except Exception as e:
+        INGEST_DOCUMENTS.inc(status="failed")
         # Update status to failed on error
         if 'document' in locals() and document:
+            session.rollback()
+            if not reindexing:
+                # Remove the chunks that were already committed by the pipeline
+                # (a failed re-index has not changed the previous chunks, which stay searchable)
+                session.execute(delete(Chunk).where(Chunk.document_id == document.id))
             document.processing_status = "failed" # Use processing_status field
             # TODO: Store error details in the document model (add a field to Document model)
             session.add(document)
+            invalidate_case(session, document.case_id)
             session.commit()
             session.refresh(document)
             print(f"Document {document_id} processing failed: {e}")
@@ -196,6 +174,110 @@ def process_document_mvp(document_id: str):
 
     finally:
         session.close() # Close the session
+        if not fanned_out:
+            release_ingest_slot(user_id, document_id)
+
+def dispatch_chunk_batches(document_id: str, chunks: list, batch_size: int = INGEST_BATCH_SIZE, user_id: str = None) -> int:
+    """
+    Start the parallel embedding and persistence of a document's chunks. Every batch is embedded on the
+    'embed' queue and saved on the 'persist' queue; finalize_document runs when all batches are saved,
+    mark_document_failed when one of them fails. Returns the number of batches.
+    """
+    batches = [
+        chain(embed_chunk_batch.s(batch), persist_chunk_batch.s(document_id, index * batch_size))
+        for index, batch in enumerate(iter_batches(chunks, batch_size))
+    ]
+    finalizer = finalize_document.s(document_id, user_id).on_error(mark_document_failed.si(document_id, user_id))
+    chord(group(batches), finalizer).apply_async()
+    return len(batches)
+
+@celery_app.task(acks_late=True)
+def embed_chunk_batch(texts: list):
+    """Embed a batch of chunk texts. The embeddings are passed on packed (see ingestion.pack_embeddings)."""
+    with Session(get_engine()) as session, timed(INGEST_BATCH_SECONDS, "ingest.embed", stage="embed"):
+        vectors = embed_texts(session, texts, get_embedding_client())
+    return {"texts": texts, "embeddings": pack_embeddings(vectors)}
+
+@celery_app.task(acks_late=True)
+def persist_chunk_batch(batch: dict, document_id: str, first_position: int = 0):
+    """
+    Save one embedded batch of chunks at positions first_position, first_position + 1, ...; returns the number
+    of chunks saved. A redelivered batch (acks_late) replaces the chunks it saved before instead of adding them again.
+    """
+    texts = batch["texts"]
+    vectors = unpack_embeddings(batch["embeddings"], len(texts))
+    document = uuid.UUID(document_id)
+    with Session(get_engine()) as session, timed(INGEST_BATCH_SECONDS, "ingest.persist", stage="persist"):
+        # Serializes a redelivery with a first delivery that is still saving the same batch
+        session.execute(text("SELECT pg_advisory_xact_lock(hashtext(:document_id), :position)"), {"document_id": document_id, "position": first_position})
+        session.execute(delete(Chunk).where(Chunk.document_id == document, Chunk.position >= first_position, Chunk.position < first_position + len(texts)))
+        session.add_all([Chunk(document_id=document, content=content, embedding=vector, position=first_position + index)
+                         for index, (content, vector) in enumerate(zip(texts, vectors))])
+        session.commit()
+    INGEST_CHUNKS.inc(len(texts), operation="added")
+    return len(texts)
+
+@celery_app.task
+def finalize_document(chunk_counts: list, document_id: str, user_id: str = None):
+    """Mark the document completed once all of its chunk batches have been saved."""
+    release_ingest_slot(user_id, document_id)
+    with Session(get_engine()) as session:
+        document = session.exec(select(Document).where(Document.id == document_id)).first()
+        if not document:
+            print(f"Document with ID {document_id} not found.")
+            return
+        document.processing_status = "completed"
+        session.add(document)
+        invalidate_case(session, document.case_id)
+        session.commit()
+    INGEST_DOCUMENTS.inc(status="completed")
+    print(f"Document {document_id} processing_status updated to completed ({sum(chunk_counts)} chunks in {len(chunk_counts)} batches).")
+    return {"document_id": document_id, "chunks": sum(chunk_counts), "batches": len(chunk_counts)}
+
+@celery_app.task
+def mark_document_failed(document_id: str, user_id: str = None):
+    """Error callback of the batch chord: remove the chunks saved so far and mark the document failed."""
+    release_ingest_slot(user_id, document_id)
+    with Session(get_engine()) as session:
+        document = session.exec(select(Document).where(Document.id == document_id)).first()
+        if not document:
+            return
+        session.execute(delete(Chunk).where(Chunk.document_id == document.id))
+        document.processing_status = "failed"
+        session.add(document)
+        invalidate_case(session, document.case_id)
+        session.commit()
+    INGEST_DOCUMENTS.inc(status="failed")
+    print(f"Document {document_id} processing failed in a chunk batch.")
+
+@celery_app.task(acks_late=True, autoretry_for=(Exception,), retry_backoff=True, max_retries=5)
+def remove_storage_objects(storage_paths: list):
+    """Remove the files of deleted documents from Supabase Storage; one batch, queued by backend/deletion.py."""
+    with Session(get_engine()) as session:
+        paths = unreferenced_paths(session, storage_paths) # Keep files that another document (still) uses
+    removed = remove_objects(paths)
+    print(f"Removed {removed} of {len(storage_paths)} storage objects of deleted documents.")
+    return {"requested": len(storage_paths), "removed": removed, "kept": len(storage_paths) - len(paths)}
+
+@celery_app.task(acks_late=True, soft_time_limit=REPORT_GENERATION_TIME_LIMIT, time_limit=REPORT_GENERATION_TIME_LIMIT + 30)
+def generate_report_task(report_id: str):
+    """
+    Celery task to generate a queued report (see backend/report_generation.py).
+    Moves GeneratedReport.generation_status from 'pending' through 'generating' to 'completed' or 'failed'.
+    The soft time limit ends a generation (as failed) before its lease on the report expires.
+    """
+    from backend.report_generation import run_queued_report # Only the 'reports' workers load the LLM client library
+    print(f"Generating report with ID: {report_id}")
+    # The number of reports generated at the same time is set with -c on the 'reports' worker (see backend/container.py)
+    session = next(get_session()) # Get a database session
+    try:
+        generation_status = run_queued_report(session, uuid.UUID(report_id), lease_seconds=REPORT_GENERATION_TIME_LIMIT)
+    finally:
+        session.close() # Close the session
+    if generation_status == "generating":
+        # Claimed by a worker that is still running, or that stopped: check again once its lease has expired
+        generate_report_task.apply_async(args=[report_id], countdown=REPORT_GENERATION_TIME_LIMIT)
+    return {"report_id": report_id, "generation_status": generation_status}
 
-# Example of how to run this worker:
-# celery -A backend.celery_worker worker -l info
+# Example of how to run a single worker for all queues:
+# celery -A backend.celery_worker worker -Q parse,embed,persist,reports -l info
@@ -0,0 +1,227 @@
+"""
+Token-aware sliding-window chunker with sentence segmentation tuned for Dutch AD reports.
+
+Paragraphs are split into sentences, and sentences are packed into chunks of about CHUNK_TARGET_TOKENS
+tokens (never more than CHUNK_MAX_TOKENS). Consecutive chunks share CHUNK_OVERLAP_TOKENS tokens of
+trailing sentences. Short fragments such as headers are merged with the text that follows them instead
+of becoming chunks of their own, and a too short final chunk is merged into the previous one.
+
+Token counts are estimated from the text length (CHUNK_CHARS_PER_TOKEN), which keeps chunking at
+thousands of pages per second; set CHUNK_TOKENIZER=tiktoken to count exactly when tiktoken is installed.
+
+Chunk boundaries are partly content-defined, so an edit only changes the chunks around it: about one in
+CHUNK_ANCHOR_INTERVAL paragraphs (chosen by a hash of its text) always starts a new chunk, without overlap.
+After an edit, chunking is back in step at the next anchor and the remaining chunks are identical, which
+keeps re-indexing a changed document cheap (see ingestion.reindex_document). 0 disables anchors.
+"""
+from typing import Iterable, Iterator, List, Tuple
+import hashlib
+import os
+import re
+from dotenv import load_dotenv
+
+load_dotenv()
+
+CHUNK_TARGET_TOKENS = int(os.getenv("CHUNK_TARGET_TOKENS", "350"))
+CHUNK_MAX_TOKENS = int(os.getenv("CHUNK_MAX_TOKENS", "512"))
+CHUNK_OVERLAP_TOKENS = int(os.getenv("CHUNK_OVERLAP_TOKENS", "50"))
+CHUNK_MIN_TOKENS = int(os.getenv("CHUNK_MIN_TOKENS", "80"))
+CHUNK_CHARS_PER_TOKEN = float(os.getenv("CHUNK_CHARS_PER_TOKEN", "3.5")) # Dutch text averages fewer characters per token than English
+CHUNK_TOKENIZER = os.getenv("CHUNK_TOKENIZER", "chars") # 'chars' or 'tiktoken'
+CHUNK_ANCHOR_INTERVAL = int(os.getenv("CHUNK_ANCHOR_INTERVAL", "16")) # Paragraphs per anchor, on average
+
+# Abbreviations that end with a period but do not end a sentence. Abbreviations with internal
+# periods (d.d., i.v.m., o.a., m.b.t., t.a.v., z.s.m., ...) are recognised by their shape.
+DUTCH_ABBREVIATIONS = {
+    "dhr", "mevr", "mw", "hr", "dr", "drs", "ir", "ing", "mr", "prof", "bc", "ds",
+    "nr", "nrs", "blz", "art", "hfst", "par", "bijv", "bv", "vnl", "resp", "incl", "excl", "evt",
+    "enz", "etc", "ca", "cf", "vs", "zgn", "jl", "jr", "sr", "st", "tel", "fam", "ong", "max",
+    "jan", "feb", "mrt", "apr", "jun", "jul", "aug", "sep", "sept", "okt", "nov", "dec",
+    "wk", "mnd", "pag", "afd", "tav", "ivm", "mbt",
+}
+
+# Candidate boundary: sentence punctuation, optional closing quotes/brackets, whitespace,
+# followed by the start of a new sentence (capital letter, digit, opening quote/bracket or bullet)
+_BOUNDARY = re.compile(r"[.!?…]+[\"'”’)\]]*\s+(?=[\"'“‘(\[•\-–]?[A-ZÀ-ÖØ-Þ0-9])")
+_ABBREVIATION_SHAPE = re.compile(r"^(?:[^\W\d_]\.)+[^\W\d_]?\.?$") # d.d. / i.v.m / J.
+
+
+def _count_tokens_chars(text: str) -> int:
+    return max(1, int(len(text) / CHUNK_CHARS_PER_TOKEN + 0.5))
+
+
+def _make_token_counter():
+    if CHUNK_TOKENIZER == "tiktoken":
+        import tiktoken
+        encoding = tiktoken.get_encoding("cl100k_base")
+        return lambda text: len(encoding.encode_ordinary(text))
+    return _count_tokens_chars
+
+
+count_tokens = _make_token_counter()
+
+
+def _is_abbreviation(text: str, end: int) -> bool:
+    """Whether the period at text[end - 1] belongs to an abbreviation or initial rather than ending a sentence."""
+    word_start = max(text.rfind(" ", 0, end), text.rfind("\n", 0, end), text.rfind("\t", 0, end)) + 1
+    word = text[word_start:end].lstrip("(\"'“‘")
+    if word.rstrip(".").lower() in DUTCH_ABBREVIATIONS:
+        return True
+    return bool(_ABBREVIATION_SHAPE.match(word))
+
+
+def split_sentences(text: str) -> List[str]:
+    """Split a paragraph into sentences, keeping Dutch abbreviations, initials and dates intact."""
+    sentences = []
+    start = 0
+    for match in _BOUNDARY.finditer(text):
+        punctuation_end = match.start() + 1
+        if text[match.start()] == "." and _is_abbreviation(text, punctuation_end):
+            continue
+        if text[start:punctuation_end].strip().rstrip(".").replace(".", "").isdigit():
+            continue # Section number such as "1." or "2.3." in "2.3. Belastbaarheid"
+        sentence = text[start:match.end()].strip()
+        if sentence:
+            sentences.append(sentence)
+        start = match.end()
+    tail = text[start:].strip()
+    if tail:
+        sentences.append(tail)
+    return sentences
+
+
+def truncate_to_tokens(text: str, max_tokens: int) -> str:
+    """The longest prefix of `text` of at most `max_tokens` tokens, cut at any character."""
+    low, high = 0, len(text)
+    while low < high:
+        middle = (low + high + 1) // 2
+        if count_tokens(text[:middle]) <= max_tokens:
+            low = middle
+        else:
+            high = middle - 1
+    return text[:low]
+
+
+def _split_long_word(word: str, max_tokens: int) -> Iterator[str]:
+    """Split a word without whitespace (a URL, base64 data, a table row) that exceeds max_tokens by characters."""
+    while count_tokens(word) > max_tokens:
+        part = truncate_to_tokens(word, max_tokens) or word[0]
+        yield part
+        word = word[len(part):]
+    if word:
+        yield word
+
+
+def _split_long_sentence(sentence: str, max_tokens: int) -> List[Tuple[str, int]]:
+    """Hard-split a sentence that exceeds max_tokens on word boundaries (and too long words by characters)."""
+    pieces, current, current_tokens = [], [], 0
+    for word in (part for word in sentence.split() for part in _split_long_word(word, max_tokens)):
+        word_tokens = count_tokens(word + " ")
+        if current and current_tokens + word_tokens > max_tokens:
+            piece = " ".join(current)
+            pieces.append((piece, count_tokens(piece)))
+            current, current_tokens = [], 0
+        current.append(word)
+        current_tokens += word_tokens
+    if current:
+        piece = " ".join(current)
+        pieces.append((piece, count_tokens(piece)))
+    return pieces
+
+
+def _units(paragraphs: Iterable[str], max_tokens: int) -> Iterator[Tuple[str, int, bool]]:
+    """Yield (sentence, tokens, starts_paragraph) units."""
+    for paragraph in paragraphs:
+        first = True
+        for sentence in split_sentences(paragraph):
+            tokens = count_tokens(sentence)
+            pieces = [(sentence, tokens)] if tokens <= max_tokens else _split_long_sentence(sentence, max_tokens)
+            for piece, piece_tokens in pieces:
+                yield piece, piece_tokens, first
+                first = False
+
+
+def _join(units: List[Tuple[str, int, bool]]) -> str:
+    parts = []
+    for index, (text, _, starts_paragraph) in enumerate(units):
+        if index:
+            parts.append("\n\n" if starts_paragraph else " ")
+        parts.append(text)
+    return "".join(parts)
+
+
+def chunk_units(chunk: str, max_tokens: int = CHUNK_MAX_TOKENS) -> List[Tuple[str, int, bool]]:
+    """Split a chunk back into its (sentence, tokens, starts_paragraph) units; join_units reverses it."""
+    return list(_units(chunk.split("\n\n"), max_tokens))
+
+
+def join_units(units: List[Tuple[str, int, bool]]) -> str:
+    return _join(units)
+
+
+def _is_anchor(paragraph: str, interval: int) -> bool:
+    digest = hashlib.blake2b(paragraph.encode("utf-8"), digest_size=4).digest()
+    return int.from_bytes(digest, "big") % interval == 0
+
+
+def _segments(paragraphs: Iterable[str], min_tokens: int, anchor_interval: int) -> Iterator[List[str]]:
+    """Split the paragraphs before every anchor paragraph, unless the segment so far is shorter than min_tokens."""
+    segment: List[str] = []
+    tokens = 0
+    for paragraph in paragraphs:
+        if segment and anchor_interval > 0 and tokens >= min_tokens and _is_anchor(paragraph, anchor_interval):
+            yield segment
+            segment, tokens = [], 0
+        segment.append(paragraph)
+        tokens += count_tokens(paragraph)
+    if segment:
+        yield segment
+
+
+def chunk_paragraphs(paragraphs: Iterable[str], target_tokens: int = CHUNK_TARGET_TOKENS, max_tokens: int = CHUNK_MAX_TOKENS,
+                     overlap_tokens: int = CHUNK_OVERLAP_TOKENS, min_tokens: int = CHUNK_MIN_TOKENS,
+                     anchor_interval: int = CHUNK_ANCHOR_INTERVAL) -> Iterator[str]:
+    """
+    Consume paragraphs incrementally and yield chunks of about `target_tokens` tokens.
+    Chunks may span paragraph boundaries (except anchors); paragraphs are separated by a blank line within a chunk.
+    """
+    if not 0 < min_tokens <= target_tokens <= max_tokens or overlap_tokens >= target_tokens:
+        raise ValueError("Expected 0 < min_tokens <= target_tokens <= max_tokens and overlap_tokens < target_tokens")
+    for segment in _segments(paragraphs, min_tokens, anchor_interval):
+        yield from _chunk_segment(segment, target_tokens, max_tokens, overlap_tokens, min_tokens)
+
+
+def _chunk_segment(paragraphs: List[str], target_tokens: int, max_tokens: int, overlap_tokens: int, min_tokens: int) -> Iterator[str]:
+    current: List[Tuple[str, int, bool]] = []
+    current_tokens = 0
+    overlap_units = 0 # Units at the start of `current` repeated from the previous chunk
+    pending = None # Last finished chunk, held back so a short final chunk can be merged into it
+
+    for unit in _units(paragraphs, max_tokens):
+        tokens = unit[1]
+        if current and current_tokens + tokens > target_tokens and (current_tokens >= min_tokens or current_tokens + tokens > max_tokens):
+            if pending is not None:
+                yield _join(pending[0])
+            pending = (current, current_tokens)
+            # Start the next chunk with the trailing sentences of this one, up to overlap_tokens
+            overlap, overlap_count = [], 0
+            for previous in reversed(current):
+                if overlap_count + previous[1] > overlap_tokens or overlap_count + previous[1] + tokens > max_tokens:
+                    break
+                overlap.insert(0, previous)
+                overlap_count += previous[1]
+            current, current_tokens, overlap_units = overlap, overlap_count, len(overlap)
+        current.append(unit)
+        current_tokens += tokens
+
+    new_units = current[overlap_units:]
+    if pending is not None:
+        previous_units, previous_tokens = pending
+        new_tokens = sum(unit[1] for unit in new_units)
+        if new_units and new_tokens < min_tokens and previous_tokens + new_tokens <= max_tokens:
+            # Merge the short tail into the previous chunk (without repeating the overlap)
+            yield _join(previous_units + new_units)
+            return
+        yield _join(previous_units)
+    if new_units:
+        yield _join(current)
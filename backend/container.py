@@ -0,0 +1,177 @@
+"""
+Clients, engines and the Celery app shared by a process (the API or a worker), created on first use.
+
+Nothing is connected or even imported at import time, so importing backend.main or backend.celery_worker only
+costs the module code itself: new API replicas and restarted workers come up fast, and a prefork worker's
+pool processes each create their own connection pools instead of inheriting the parent's. Configuration
+errors (e.g. a missing SUPABASE_URL) are raised by the first request that needs the resource.
+
+    from backend.container import get_engine
+    with Session(get_engine()) as session:
+        ...
+
+Providers are registered by name; benchmarks and scripts can replace an instance with `container.override()`.
+The database schema is not created here: run `python -m backend.migrate` (see backend/migrate.py).
+"""
+from typing import Any, Callable, Dict, List
+import os
+import threading
+from dotenv import load_dotenv
+
+load_dotenv()
+
+SUPABASE_URL = os.getenv("SUPABASE_URL")
+SUPABASE_KEY = os.getenv("SUPABASE_KEY")
+DATABASE_URL = os.getenv("DATABASE_URL") # Assuming DATABASE_URL is also in .env
+REDIS_URL = os.getenv("REDIS_URL", "redis://localhost:6379/0")
+OPENROUTER_BASE_URL = "https://openrouter.ai/api/v1"
+
+
+class Container:
+    """Named, lazily created singletons. Thread-safe: every instance is created once, on first `get()`."""
+
+    def __init__(self):
+        self._factories: Dict[str, Callable[[], Any]] = {}
+        self._instances: Dict[str, Any] = {}
+        self._lock = threading.RLock() # Reentrant: factories may get other instances
+
+    def register(self, name: str, factory: Callable[[], Any]):
+        self._factories[name] = factory
+
+    def get(self, name: str) -> Any:
+        instance = self._instances.get(name)
+        if instance is None:
+            with self._lock:
+                instance = self._instances.get(name)
+                if instance is None:
+                    instance = self._instances[name] = self._factories[name]()
+        return instance
+
+    def override(self, name: str, instance: Any):
+        """Use `instance` instead of creating one (benchmarks, tests, scripts)."""
+        with self._lock:
+            self._instances[name] = instance
+
+    def reset(self, *names: str):
+        """Forget the given (default: all) instances; they are created again on next use."""
+        with self._lock:
+            for name in names or list(self._instances):
+                self._instances.pop(name, None)
+
+    def created(self) -> List[str]:
+        return sorted(self._instances)
+
+
+container = Container()
+
+
+def _create_engine():
+    from backend.database import create_db_engine
+    # Pool settings and SQL echo are configured with DB_* environment variables (see backend/database.py)
+    return create_db_engine(DATABASE_URL)
+
+
+def _create_async_engine():
+    from backend.database import create_async_db_engine
+    # Used by async def handlers, so DB I/O does not block the event loop
+    return create_async_db_engine(DATABASE_URL)
+
+
+def _create_supabase():
+    if not SUPABASE_URL or not SUPABASE_KEY:
+        raise ValueError("SUPABASE_URL and SUPABASE_KEY must be set in the environment variables")
+    from supabase import create_client # Slow to import (HTTP/2 clients, auth, storage, realtime)
+    return create_client(SUPABASE_URL, SUPABASE_KEY)
+
+
+def _create_celery_app():
+    from celery import Celery
+    app = Celery("ad_rapport_generator", broker=REDIS_URL, backend=REDIS_URL)
+    app.conf.update(
+        task_ignore_result=False,
+        task_track_started=True,
+        # Every stage runs on its own queue, so each can get its own workers and concurrency, e.g.:
+        # celery -A backend.celery_worker worker -Q parse -c 2 -l info
+        # celery -A backend.celery_worker worker -Q embed -c 16 -l info      (waits on the embedding API)
+        # celery -A backend.celery_worker worker -Q persist -c 4 -l info     (bounded by DB connections)
+        # celery -A backend.celery_worker worker -Q reports -c 2 -l info
+        task_routes={
+            "backend.celery_worker.process_document_mvp": {"queue": "parse"},
+            "backend.celery_worker.embed_chunk_batch": {"queue": "embed"},
+            "backend.celery_worker.persist_chunk_batch": {"queue": "persist"},
+            "backend.celery_worker.finalize_document": {"queue": "persist"},
+            "backend.celery_worker.mark_document_failed": {"queue": "persist"},
+            "backend.celery_worker.remove_storage_objects": {"queue": "persist"},
+            "backend.celery_worker.dispatch_ingest_queue": {"queue": "parse"},
+            "backend.celery_worker.generate_report_task": {"queue": "reports"},
+        },
+        worker_prefetch_multiplier=1, # Do not reserve slow tasks that another worker could start earlier
+        # Re-dispatches documents whose worker crashed (see backend/ingest_queue.py); needs `celery -A backend.celery_worker beat`
+        beat_schedule={"dispatch-ingest-queue": {"task": "backend.celery_worker.dispatch_ingest_queue", "schedule": 60.0}},
+    )
+    return app
+
+
+def _create_embedding_client():
+    from backend.embeddings import EmbeddingClient, create_embedding_backend
+    # EMBEDDING_BACKEND selects the backend (see backend/embeddings.py)
+    return EmbeddingClient(create_embedding_backend())
+
+
+def _create_query_embedding_cache():
+    from backend.query_cache import QueryEmbeddingCache
+    return QueryEmbeddingCache(container.get("embedding_client"))
+
+
+def _create_ingest_queue():
+    import redis
+    from backend.ingest_queue import INGEST_QUEUE_REDIS_URL, FairIngestQueue, send_to_celery
+    return FairIngestQueue(redis.Redis.from_url(INGEST_QUEUE_REDIS_URL), send_to_celery)
+
+
+def _llm_client_settings() -> dict:
+    # Read on creation, so benchmarks can point the client at a local server
+    api_key = os.getenv("OPENROUTER_API_KEY")
+    if not api_key:
+        raise ValueError("OPENROUTER_API_KEY must be set in the environment variables")
+    return {"base_url": os.getenv("OPENROUTER_BASE_URL", OPENROUTER_BASE_URL), "api_key": api_key}
+
+
+def _create_llm_client():
+    from openai import OpenAI # Takes about half a second to import
+    return OpenAI(**_llm_client_settings())
+
+
+def _create_async_llm_client():
+    from openai import AsyncOpenAI
+    # Used for streaming responses on the event loop
+    return AsyncOpenAI(**_llm_client_settings())
+
+
+container.register("engine", _create_engine)
+container.register("async_engine", _create_async_engine)
+container.register("supabase", _create_supabase)
+# One app per process: the worker defines its tasks on it, the API only sends tasks by name (without importing the worker)
+container.register("celery_app", _create_celery_app)
+container.register("embedding_client", _create_embedding_client)
+container.register("query_embedding_cache", _create_query_embedding_cache)
+container.register("ingest_queue", _create_ingest_queue)
+container.register("llm_client", _create_llm_client) # OpenRouter, OpenAI-compatible
+container.register("async_llm_client", _create_async_llm_client)
+
+
+def get_engine():
+    return container.get("engine")
+
+
+def get_async_engine():
+    return container.get("async_engine")
+
+
+def get_supabase():
+    return container.get("supabase")
+
+
+def get_celery_app():
+    return container.get("celery_app")
+
@@ -0,0 +1,178 @@
+"""
+Context assembly for report generation: which retrieved chunks go into the prompt, and in what order.
+
+Instead of joining the top REPORT_CONTEXT_CHUNKS chunks as they are, `pack_context` takes the best
+REPORT_CONTEXT_CANDIDATES chunks of the retrieval (vector or hybrid, see backend/text_search.py) and:
+1. picks chunks by maximal marginal relevance (MMR): score = lambda * relevance - (1 - lambda) * the highest
+   cosine similarity to a chunk already picked. Relevance follows the retrieval's own ranking (1 for the best
+   candidate, decreasing linearly), so lexical matches of hybrid search keep their place;
+2. drops sentences that are already in the context (the overlap between neighbouring chunks, paragraphs that
+   appear in several documents) and skips a chunk when less than REPORT_CONTEXT_MIN_NEW_SHARE of it is new;
+3. stops adding chunks at REPORT_CONTEXT_TOKEN_BUDGET tokens (counted like the chunker, backend/chunking.py).
+   A first chunk that is larger than the whole budget is truncated (by characters if it has no sentence or
+   word boundary to cut at);
+4. orders the picked chunks by document (most relevant document first) and by their position in the
+   document (Chunk.position, stored at ingestion; chunks saved before it existed by creation time), so the LLM
+   reads excerpts in reading order.
+
+REPORT_CONTEXT_PACKING=false restores the plain top REPORT_CONTEXT_CHUNKS context.
+"""
+from datetime import datetime
+from typing import List, Optional
+import os
+import numpy as np
+from dotenv import load_dotenv
+from sqlalchemy import literal_column, select
+from sqlmodel import Session
+from pgvector.sqlalchemy import Vector
+from backend.chunking import chunk_units, count_tokens, join_units, truncate_to_tokens
+from backend.models import Chunk
+from backend.vector_storage import EMBEDDING_STORAGE, embedding_sql
+
+load_dotenv()
+
+REPORT_CONTEXT_PACKING = os.getenv("REPORT_CONTEXT_PACKING", "true").lower() == "true"
+REPORT_CONTEXT_CHUNKS = 10 # Number of most similar chunks used as RAG context without packing
+REPORT_CONTEXT_CANDIDATES = int(os.getenv("REPORT_CONTEXT_CANDIDATES", "30")) # Retrieved chunks packing chooses from
+REPORT_CONTEXT_TOKEN_BUDGET = int(os.getenv("REPORT_CONTEXT_TOKEN_BUDGET", "2500"))
+REPORT_CONTEXT_MMR_LAMBDA = float(os.getenv("REPORT_CONTEXT_MMR_LAMBDA", "0.7")) # 1 ranks on relevance only
+REPORT_CONTEXT_MIN_NEW_SHARE = float(os.getenv("REPORT_CONTEXT_MIN_NEW_SHARE", "0.3"))
+
+
+
+class PackedContext:
+    """The chunk texts for the prompt, with the token counts of the packed and of the unpacked (top-k) context."""
+
+    def __init__(self, chunks: List[str], candidates: int, baseline_tokens: int):
+        self.chunks = chunks
+        self.candidates = candidates
+        self.tokens = sum(count_tokens(chunk) for chunk in chunks)
+        self.baseline_tokens = baseline_tokens
+
+    @property
+    def tokens_saved(self) -> int:
+        return self.baseline_tokens - self.tokens
+
+    def stats(self) -> dict:
+        return {
+            "candidates": self.candidates,
+            "chunks": len(self.chunks),
+            "tokens": self.tokens,
+            "baseline_tokens": self.baseline_tokens,
+            "tokens_saved": self.tokens_saved,
+        }
+
+
+def _sentence_key(sentence: str) -> str:
+    return " ".join(sentence.split()).casefold()
+
+
+def _candidate_embeddings(session: Session, chunk_ids: List, storage: str) -> dict:
+    """Chunk id -> normalized embedding (None when the column is empty, e.g. after compacting)."""
+    embedding = literal_column(embedding_sql(storage), type_=Vector())
+    rows = session.execute(select(Chunk.id, embedding).where(Chunk.id.in_(chunk_ids))).all()
+    result = {}
+    for chunk_id, vector in rows:
+        if vector is None:
+            result[chunk_id] = None
+            continue
+        vector = np.asarray(vector, dtype=np.float32)
+        norm = np.linalg.norm(vector)
+        result[chunk_id] = vector / norm if norm else None
+    return result
+
+
+def _positions(session: Session, chunk_ids: List) -> dict:
+    """Chunk id -> (position of the chunk in its document or None, created_at)."""
+    rows = session.execute(select(Chunk.id, Chunk.position, Chunk.created_at).where(Chunk.id.in_(chunk_ids))).all()
+    return {chunk_id: (position, created_at) for chunk_id, position, created_at in rows}
+
+
+def _redundancy(a, b, units_a: set, units_b: set) -> float:
+    if a is not None and b is not None:
+        return float(np.dot(a, b))
+    # Without embeddings: share of sentences in common
+    return len(units_a & units_b) / max(1, len(units_a | units_b))
+
+
+def pack_context(session: Session, rows: List, token_budget: int = REPORT_CONTEXT_TOKEN_BUDGET, mmr_lambda: float = REPORT_CONTEXT_MMR_LAMBDA,
+                 min_new_share: float = REPORT_CONTEXT_MIN_NEW_SHARE, storage: Optional[str] = None) -> PackedContext:
+    """
+    Choose and order the context for a prompt from retrieved (id, content, document_id, similarity) rows, best first.
+    """
+    baseline_tokens = sum(count_tokens(row[1]) for row in rows[:REPORT_CONTEXT_CHUNKS])
+    if not rows:
+        return PackedContext([], 0, 0)
+
+    embeddings = _candidate_embeddings(session, [row[0] for row in rows], storage or EMBEDDING_STORAGE)
+    units = [chunk_units(row[1]) for row in rows]
+    keys = [{_sentence_key(unit[0]) for unit in chunk} for chunk in units]
+    relevance = [1 - index / len(rows) for index in range(len(rows))]
+
+    seen = set() # Sentences already in the context
+    picked = [] # (candidate index, kept units)
+    remaining = list(range(len(rows)))
+    budget = token_budget
+    while remaining and budget > 0:
+        def mmr(index):
+            redundancy = max((_redundancy(embeddings.get(rows[index][0]), embeddings.get(rows[other][0]), keys[index], keys[other])
+                              for other, _ in picked), default=0.0)
+            return mmr_lambda * relevance[index] - (1 - mmr_lambda) * redundancy
+
+        remaining.sort(key=mmr, reverse=True)
+        choice = None
+        for index in list(remaining):
+            new_units = [unit for unit in units[index] if _sentence_key(unit[0]) not in seen]
+            if sum(unit[1] for unit in new_units) < min_new_share * sum(unit[1] for unit in units[index]):
+                remaining.remove(index) # (Nearly) everything is already in the context
+                continue
+            new_tokens = count_tokens(join_units(new_units)) # Including the separators, as PackedContext counts
+            if new_tokens > budget:
+                if picked:
+                    remaining.remove(index) # The budget only shrinks, so it will not fit later either
+                    continue
+                # The first chunk alone exceeds the budget: keep its leading sentences (long ones split to fit)
+                kept = []
+                for unit in chunk_units(join_units(new_units), max_tokens=budget):
+                    if count_tokens(join_units(kept + [unit])) > budget:
+                        break
+                    kept.append(unit)
+                if not kept:
+                    # Not even one piece fits (text without whitespace, e.g. a long table row or URL): cut it by
+                    # characters, so the prompt never goes out without context
+                    text = truncate_to_tokens(join_units(new_units), budget)
+                    kept = [(text, count_tokens(text), True)] if text else []
+                new_units = kept
+                new_tokens = count_tokens(join_units(kept)) if kept else 0
+                if not new_units:
+                    remaining.remove(index)
+                    continue
+            choice = (index, new_units, new_tokens)
+            break
+        if choice is None:
+            break
+        index, new_units, new_tokens = choice
+        remaining.remove(index)
+        picked.append((index, new_units))
+        seen.update(_sentence_key(unit[0]) for unit in new_units)
+        budget -= new_tokens + 1 # Separator between chunks
+
+    # Reading order: documents by their best candidate, chunks by position in the document
+    positions = _positions(session, [rows[index][0] for index, _ in picked])
+    document_rank = {}
+    for index, _ in sorted(picked):
+        document_rank.setdefault(rows[index][2], len(document_rank))
+
+    def reading_order(item):
+        index, _ = item
+        position, created_at = positions.get(rows[index][0], (None, None))
+        return document_rank[rows[index][2]], position is None, position or 0, created_at or datetime.min, index
+
+    chunks = [join_units(kept) for _, kept in sorted(picked, key=reading_order)]
+    return PackedContext(chunks, len(rows), baseline_tokens)
+
+
+def top_context(rows: List) -> PackedContext:
+    """The unpacked context: the best REPORT_CONTEXT_CHUNKS chunks in retrieval order."""
+    chunks = [row[1] for row in rows[:REPORT_CONTEXT_CHUNKS]]
+    return PackedContext(chunks, len(rows), sum(count_tokens(chunk) for chunk in chunks))
@@ -0,0 +1,70 @@
+"""
+Database engines shared by the API and the Celery worker.
+
+All engines are created here with the same pool settings:
+- DB_POOL_SIZE / DB_MAX_OVERFLOW: persistent and extra connections per process,
+- DB_POOL_TIMEOUT: seconds to wait for a free connection,
+- DB_POOL_RECYCLE: seconds after which a connection is replaced (Supabase's pooler closes idle connections),
+- DB_POOL_PRE_PING: test connections before use, so dropped connections are replaced transparently,
+- DB_ECHO: log all SQL statements (off by default; very verbose).
+
+The async engine uses psycopg 3 (postgresql+psycopg) with the same DATABASE_URL. psycopg 3 prepares
+statements that are executed repeatedly; set DB_USES_TRANSACTION_POOLER=true when connecting through
+Supabase's transaction pooler (port 6543), which does not support prepared statements.
+"""
+from typing import Optional
+import os
+from dotenv import load_dotenv
+from sqlalchemy.ext.asyncio import AsyncEngine, create_async_engine
+from sqlmodel import create_engine
+
+load_dotenv()
+
+DATABASE_URL = os.getenv("DATABASE_URL")
+DB_POOL_SIZE = int(os.getenv("DB_POOL_SIZE", "5"))
+DB_MAX_OVERFLOW = int(os.getenv("DB_MAX_OVERFLOW", "10"))
+DB_POOL_TIMEOUT = float(os.getenv("DB_POOL_TIMEOUT", "30"))
+DB_POOL_RECYCLE = int(os.getenv("DB_POOL_RECYCLE", "1800"))
+DB_POOL_PRE_PING = os.getenv("DB_POOL_PRE_PING", "true").lower() in ("1", "true", "yes")
+DB_ECHO = os.getenv("DB_ECHO", "false").lower() in ("1", "true", "yes")
+DB_USES_TRANSACTION_POOLER = os.getenv("DB_USES_TRANSACTION_POOLER", "false").lower() in ("1", "true", "yes")
+
+
+def _engine_options(overrides: dict) -> dict:
+    options = {
+        "echo": DB_ECHO,
+        "pool_size": DB_POOL_SIZE,
+        "max_overflow": DB_MAX_OVERFLOW,
+        "pool_timeout": DB_POOL_TIMEOUT,
+        "pool_recycle": DB_POOL_RECYCLE,
+        "pool_pre_ping": DB_POOL_PRE_PING,
+    }
+    options.update(overrides)
+    return options
+
+
+def _require_url(url: Optional[str]) -> str:
+    url = url or DATABASE_URL
+    if not url:
+        raise ValueError("DATABASE_URL must be set in the environment variables")
+    return url
+
+
+def async_database_url(url: str) -> str:
+    """Return the URL with the async psycopg driver (postgresql://, postgres:// and postgresql+psycopg2:// are converted)."""
+    for prefix in ("postgresql+psycopg2://", "postgresql://", "postgres://"):
+        if url.startswith(prefix):
+            return "postgresql+psycopg://" + url[len(prefix):]
+    return url
+
+
+def create_db_engine(url: Optional[str] = None, **overrides):
+    """Create a synchronous engine with the configured pool settings; keyword arguments override them."""
+    return create_engine(_require_url(url), **_engine_options(overrides))
+
+
+def create_async_db_engine(url: Optional[str] = None, **overrides) -> AsyncEngine:
+    """Create an async engine (psycopg 3) with the configured pool settings; keyword arguments override them."""
+    if DB_USES_TRANSACTION_POOLER:
+        overrides["connect_args"] = {"prepare_threshold": None, **overrides.get("connect_args", {})}
+    return create_async_engine(async_database_url(_require_url(url)), **_engine_options(overrides))
@@ -0,0 +1,138 @@
+"""
+Deletion of cases and documents with set-based SQL, and removal of their files from Supabase Storage.
+
+DELETE /cases/{case_id} and DELETE /documents/{document_id} used session.delete(): the ORM loads the related
+rows into Python first (a document's chunks with their embeddings), and the files were never removed from
+Storage. Now every table is cleared with one DELETE statement in the request's transaction:
+
+    chunk -> documenttext -> document (RETURNING file_path) -> generatedreport -> case
+
+so the API only waits for PostgreSQL, however many chunks a case has. The foreign keys to case and document
+are ON DELETE CASCADE as well (new databases; existing ones: `python -m backend.deletion migrate`), so rows
+deleted in any other way take their dependent rows with them.
+
+The files of the deleted documents are removed after the commit by the remove_storage_objects Celery task
+('persist' queue): one task and one Storage request per STORAGE_DELETE_BATCH_SIZE paths. Paths that are
+still used by another document are kept.
+
+    python -m backend.deletion migrate   # Make the existing foreign keys ON DELETE CASCADE
+    python -m backend.deletion status
+"""
+from typing import Dict, List, Tuple
+import argparse
+from sqlalchemy import delete, select, text
+from sqlmodel import Session
+from backend.models import Case, Chunk, Document, DocumentText, GeneratedReport
+from backend.response_cache import invalidate_case
+from backend.storage import STORAGE_DELETE_BATCH_SIZE
+
+# (table, column, referenced table) of the foreign keys that cascade deletes
+CASCADING_FOREIGN_KEYS = [
+    ("document", "case_id", "case"),
+    ("generatedreport", "case_id", "case"),
+    ("chunk", "document_id", "document"),
+    ("documenttext", "document_id", "document"),
+]
+
+# No synchronization of the session: the ORM would otherwise fetch the ids of all deleted rows
+_SET_BASED = {"synchronize_session": False}
+
+
+def delete_documents(session: Session, condition) -> Tuple[Dict[str, int], List[str]]:
+    """
+    Delete the documents matching `condition` (e.g. Document.case_id == case_id) with their chunks and text, in
+    the caller's transaction. Returns the number of deleted rows and the storage paths of the documents.
+    """
+    # Lock the documents first: no chunks can be added to them (by a running ingest) until the transaction ends
+    session.execute(select(Document.id).where(condition).with_for_update())
+    documents = select(Document.id).where(condition)
+    chunks = session.execute(delete(Chunk).where(Chunk.document_id.in_(documents)), execution_options=_SET_BASED).rowcount
+    session.execute(delete(DocumentText).where(DocumentText.document_id.in_(documents)), execution_options=_SET_BASED)
+    paths = session.execute(delete(Document).where(condition).returning(Document.file_path), execution_options=_SET_BASED).scalars().all()
+    return {"documents": len(paths), "chunks": chunks}, list(paths)
+
+
+def delete_case(session: Session, case_id) -> Tuple[Dict[str, int], List[str]]:
+    """Delete a case with its documents, chunks and reports in the caller's transaction (see delete_documents)."""
+    counts, paths = delete_documents(session, Document.case_id == case_id)
+    counts["reports"] = session.execute(delete(GeneratedReport).where(GeneratedReport.case_id == case_id), execution_options=_SET_BASED).rowcount
+    session.execute(delete(Case).where(Case.id == case_id), execution_options=_SET_BASED)
+    invalidate_case(session, case_id)
+    return counts, paths
+
+
+def schedule_storage_cleanup(storage_paths: List[str], batch_size: int = STORAGE_DELETE_BATCH_SIZE) -> int:
+    """Queue the removal of deleted documents' files; call after the commit. Returns the number of tasks sent."""
+    from backend.container import get_celery_app # Sent by name, so the API does not load the worker module
+    tasks = 0
+    for start in range(0, len(storage_paths), batch_size):
+        batch = storage_paths[start:start + batch_size]
+        try:
+            get_celery_app().send_task("backend.celery_worker.remove_storage_objects", args=[batch])
+            tasks += 1
+        except Exception as e:
+            # The rows are already deleted; the files stay in Storage until they are removed by hand
+            print(f"Failed to queue the removal of {len(batch)} storage objects (e.g. {batch[0]}): {e}")
+    return tasks
+
+
+def unreferenced_paths(session: Session, storage_paths: List[str]) -> List[str]:
+    """The paths that no (remaining) document refers to."""
+    referenced = set(session.execute(select(Document.file_path).where(Document.file_path.in_(storage_paths))).scalars())
+    return [path for path in storage_paths if path not in referenced]
+
+
+def _foreign_key(connection, table: str, column: str):
+    """(name, on delete action, validated) of the foreign key on table.column, or None."""
+    return connection.execute(text("""
+        SELECT con.conname, con.confdeltype, con.convalidated
+        FROM pg_constraint con
+        JOIN pg_class cls ON cls.oid = con.conrelid
+        JOIN pg_attribute att ON att.attrelid = con.conrelid AND att.attnum = con.conkey[1]
+        WHERE con.contype = 'f' AND cls.relname = :table AND cls.relnamespace = current_schema()::regnamespace AND att.attname = :column
+    """), {"table": table, "column": column}).first()
+
+
+def migrate(engine):
+    """Replace the foreign keys of CASCADING_FOREIGN_KEYS on an existing database by ON DELETE CASCADE ones."""
+    for table, column, referenced in CASCADING_FOREIGN_KEYS:
+        with engine.connect() as connection:
+            existing = _foreign_key(connection, table, column)
+        if existing and existing[1] == "c" and existing[2]:
+            continue
+        name = existing[0] if existing else f"{table}_{column}_fkey"
+        with engine.begin() as connection:
+            if not existing or existing[1] != "c":
+                # NOT VALID: only takes a short lock; existing rows are checked by VALIDATE without blocking writes
+                drop = f'DROP CONSTRAINT "{name}", ' if existing else ""
+                connection.execute(text(f'ALTER TABLE "{table}" {drop}ADD CONSTRAINT "{name}" FOREIGN KEY ({column}) '
+                                        f'REFERENCES "{referenced}" (id) ON DELETE CASCADE NOT VALID'))
+        with engine.begin() as connection:
+            connection.execute(text(f'ALTER TABLE "{table}" VALIDATE CONSTRAINT "{name}"'))
+        print(f"{table}.{column} -> {referenced}.id is ON DELETE CASCADE ({name}).")
+
+
+def status(engine) -> dict:
+    actions = {"a": "no action", "r": "restrict", "c": "cascade", "n": "set null", "d": "set default"}
+    result = {}
+    with engine.connect() as connection:
+        for table, column, referenced in CASCADING_FOREIGN_KEYS:
+            existing = _foreign_key(connection, table, column)
+            result[f"{table}.{column}"] = {"constraint": existing[0], "on_delete": actions[existing[1]], "validated": existing[2]} if existing else None
+    return result
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Manage the cascading foreign keys used when deleting cases and documents.")
+    parser.add_argument("action", choices=["migrate", "status"])
+    args = parser.parse_args()
+
+    from backend.container import get_engine
+    engine = get_engine()
+    if args.action == "migrate":
+        migrate(engine)
+    print(status(engine))
+
+
+if __name__ == "__main__":
+    main()
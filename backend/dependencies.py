@@ -1,45 +1,63 @@
 from fastapi import Depends, HTTPException, status
+from fastapi.concurrency import run_in_threadpool
 from fastapi.security import OAuth2PasswordBearer
-from supabase import create_client, Client
-import os
-from dotenv import load_dotenv
-from sqlmodel import Session, create_engine
+from sqlmodel import Session
+from sqlmodel.ext.asyncio.session import AsyncSession
 from typing import Annotated
+from backend.auth import AUTH_VERIFICATION, TokenVerifier
+from backend.container import (
+    container, get_async_engine, get_engine, get_supabase, SUPABASE_URL, SUPABASE_KEY, DATABASE_URL
+)
 
-load_dotenv()
+# Engines and the Supabase client are created on first use (see backend/container.py);
+# `dependencies.engine` etc. still work for scripts, see __getattr__ below.
 
-SUPABASE_URL = os.getenv("SUPABASE_URL")
-SUPABASE_KEY = os.getenv("SUPABASE_KEY")
-DATABASE_URL = os.getenv("DATABASE_URL") # Assuming DATABASE_URL is also in .env
+def get_session():
+    with Session(get_engine()) as session:
+        yield session
+
+async def get_async_session():
+    # expire_on_commit=False: objects stay usable after commit without an (implicit, blocking) refresh
+    async with AsyncSession(get_async_engine(), expire_on_commit=False) as session:
+        yield session
 
-if not SUPABASE_URL or not SUPABASE_KEY:
-    raise ValueError("SUPABASE_URL and SUPABASE_KEY must be set in the environment variables")
+oauth2_scheme = OAuth2PasswordBearer(tokenUrl="token") # We will implement token endpoint later
 
-if not DATABASE_URL:
-     raise ValueError("DATABASE_URL must be set in the environment variables")
+def verify_token_remotely(token: str):
+    """Verify the token with the Supabase Auth server (one network round trip)."""
+    response = get_supabase().auth.get_user(token)
+    return response.user if response else None
 
-supabase: Client = create_client(SUPABASE_URL, SUPABASE_KEY)
+# Verifies tokens in-process with cached signing keys and caches verified tokens (see backend/auth.py).
+# The lambda looks verify_token_remotely up on every call, so it can be replaced (e.g. by benchmarks).
+container.register("token_verifier", lambda: TokenVerifier(SUPABASE_URL, lambda token: verify_token_remotely(token)))
 
-# Database setup
-engine = create_engine(DATABASE_URL, echo=True) # echo=True for development to see SQL queries
+def get_token_verifier() -> TokenVerifier:
+    return container.get("token_verifier")
 
-def get_session():
-    with Session(engine) as session:
-        yield session
+_LAZY_ATTRIBUTES = {"engine": get_engine, "async_engine": get_async_engine, "supabase": get_supabase, "token_verifier": get_token_verifier}
 
-oauth2_scheme = OAuth2PasswordBearer(tokenUrl="token") # We will implement token endpoint later
+def __getattr__(name):
+    """Module attributes created on first access (PEP 562), e.g. `from backend.dependencies import engine`."""
+    if name in _LAZY_ATTRIBUTES:
+        return _LAZY_ATTRIBUTES[name]()
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
 
 async def get_current_user(token: str = Depends(oauth2_scheme)):
     try:
-        # Verify the token with Supabase
-        user = supabase.auth.get_user(token)
+        if AUTH_VERIFICATION == "remote":
+            user = await run_in_threadpool(verify_token_remotely, token)
+        else:
+            # Recently verified tokens are served from memory without leaving the event loop
+            token_verifier = get_token_verifier()
+            user = token_verifier.cached(token) or await run_in_threadpool(token_verifier.verify, token)
         if not user:
             raise HTTPException(
                 status_code=status.HTTP_401_UNAUTHORIZED,
                 detail="Invalid authentication credentials",
                 headers={"WWW-Authenticate": "Bearer"},
             )
-        return user.user
+        return user
     except Exception as e:
         raise HTTPException(
             status_code=status.HTTP_401_UNAUTHORIZED,
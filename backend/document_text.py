@@ -0,0 +1,220 @@
+"""
+Compressed, out-of-row storage of the parsed text of documents (the DocumentText table, backend/models.py).
+
+The extracted text of a document can be megabytes. It used to be the document.parsed_content column, so every
+select(Document) (ownership checks, status updates in the worker, listings) read and detoasted it. It is now
+stored compressed in its own table and only loaded where it is used: GET /documents/{document_id}.
+
+PARSED_CONTENT_CODEC selects the compression of new texts:
+- "zstd" (default): needs the zstandard package; falls back to "zlib" when it is not installed,
+- "zlib": standard library,
+- "none": uncompressed.
+The codec is stored per row, so it can be changed at any time and rows with different codecs can coexist.
+
+Move the texts of an existing database out of the document table with:
+
+    python -m backend.document_text migrate    # In batches; drops document.parsed_content when done
+    python -m backend.document_text status
+"""
+from typing import IO, Dict, Iterable, Iterator, Optional, Tuple, Union
+import argparse
+import os
+import zlib
+from dotenv import load_dotenv
+from sqlalchemy import func, inspect, select, text
+from sqlalchemy.dialects.postgresql import insert
+from sqlmodel import Session, SQLModel
+from backend.models import DocumentText
+
+load_dotenv()
+
+PARSED_CONTENT_CODEC = os.getenv("PARSED_CONTENT_CODEC", "zstd")
+ZSTD_LEVEL = int(os.getenv("PARSED_CONTENT_ZSTD_LEVEL", "9")) # Written once, read often: favour ratio over speed
+ZLIB_LEVEL = 6
+MIGRATION_BATCH_SIZE = 100
+READ_CHARS = 1024 * 1024 # Text read from a file per compression step
+
+
+def _zstandard():
+    try:
+        import zstandard
+    except ImportError:
+        return None
+    return zstandard
+
+
+def compress(content: str, codec: str = PARSED_CONTENT_CODEC) -> Tuple[str, bytes]:
+    """Return the codec actually used and the compressed UTF-8 text."""
+    data = content.encode("utf-8")
+    if codec == "zstd":
+        zstandard = _zstandard()
+        if zstandard is not None:
+            # Compressor objects are not thread-safe; creating one is cheap compared to compressing a document
+            return "zstd", zstandard.ZstdCompressor(level=ZSTD_LEVEL).compress(data)
+        codec = "zlib"
+    if codec == "zlib":
+        return "zlib", zlib.compress(data, ZLIB_LEVEL)
+    if codec == "none":
+        return "none", data
+    raise ValueError(f"Unknown PARSED_CONTENT_CODEC: {codec}")
+
+
+def compress_pieces(pieces: Iterable[str], codec: str = PARSED_CONTENT_CODEC) -> Tuple[str, bytes, int]:
+    """Like compress, for text that is read piece by piece; also returns the size of the UTF-8 text."""
+    compressor = None
+    if codec == "zstd":
+        zstandard = _zstandard()
+        if zstandard is not None:
+            compressor = zstandard.ZstdCompressor(level=ZSTD_LEVEL).compressobj()
+        else:
+            codec = "zlib"
+    if codec == "zlib":
+        compressor = zlib.compressobj(ZLIB_LEVEL)
+    elif codec not in ("zstd", "none"):
+        raise ValueError(f"Unknown PARSED_CONTENT_CODEC: {codec}")
+    parts, size = [], 0
+    for piece in pieces:
+        data = piece.encode("utf-8")
+        size += len(data)
+        parts.append(compressor.compress(data) if compressor else data)
+    if compressor:
+        parts.append(compressor.flush())
+    return codec, b"".join(parts), size
+
+
+def _read_pieces(fileobj: IO[str]) -> Iterator[str]:
+    while True:
+        piece = fileobj.read(READ_CHARS)
+        if not piece:
+            return
+        yield piece
+
+
+def decompress(codec: str, data: bytes) -> str:
+    if codec == "zstd":
+        zstandard = _zstandard()
+        if zstandard is None:
+            raise RuntimeError("The zstandard package is required to read zstd-compressed document text")
+        # decompressobj also reads frames written by compress_pieces, which have no content size in their header
+        return zstandard.ZstdDecompressor().decompressobj().decompress(data).decode("utf-8")
+    if codec == "zlib":
+        return zlib.decompress(data).decode("utf-8")
+    if codec == "none":
+        return bytes(data).decode("utf-8")
+    raise ValueError(f"Unknown document text codec: {codec}")
+
+
+def save_parsed_content(session: Session, document_id, content: Union[str, IO[str], None], overwrite: bool = True):
+    """
+    Store (replace) the parsed text of a document in `session`; the caller commits. `content` can also be a text
+    file (read from its current position), which is compressed piece by piece instead of being read into memory.
+    """
+    if content is None:
+        session.execute(DocumentText.__table__.delete().where(DocumentText.document_id == document_id))
+        return
+    if isinstance(content, str):
+        codec, data = compress(content)
+        size = len(content.encode("utf-8"))
+    else:
+        codec, data, size = compress_pieces(_read_pieces(content))
+    statement = insert(DocumentText.__table__).values(document_id=document_id, codec=codec, size=size, data=data)
+    if overwrite:
+        statement = statement.on_conflict_do_update(
+            index_elements=["document_id"],
+            set_={"codec": statement.excluded.codec, "size": statement.excluded.size, "data": statement.excluded.data},
+        )
+    else:
+        statement = statement.on_conflict_do_nothing(index_elements=["document_id"])
+    session.execute(statement)
+
+
+def load_parsed_contents(session: Session, document_ids: Iterable) -> Dict:
+    """Document id -> parsed text, for the documents that have one."""
+    document_ids = list(document_ids)
+    if not document_ids:
+        return {}
+    rows = session.execute(
+        select(DocumentText.document_id, DocumentText.codec, DocumentText.data).where(DocumentText.document_id.in_(document_ids))
+    ).all()
+    return {document_id: decompress(codec, data) for document_id, codec, data in rows}
+
+
+def load_parsed_content(session: Session, document_id) -> Optional[str]:
+    return load_parsed_contents(session, [document_id]).get(document_id)
+
+
+def _legacy_column(connection) -> bool:
+    return any(column["name"] == "parsed_content" for column in inspect(connection).get_columns("document"))
+
+
+def migrate(engine, batch_size: int = MIGRATION_BATCH_SIZE, drop_column: bool = True) -> int:
+    """
+    Move document.parsed_content of an existing database into DocumentText, batch by batch (each batch is
+    compressed and committed on its own, so the migration can be interrupted and resumed). Texts that were
+    already written by the new code are kept. Returns the number of documents moved.
+    """
+    SQLModel.metadata.create_all(engine, tables=[DocumentText.__table__])
+    with engine.connect() as connection:
+        if not _legacy_column(connection):
+            print("document.parsed_content does not exist; nothing to migrate.")
+            return 0
+
+    moved = 0
+    while True:
+        with Session(engine) as session:
+            rows = session.execute(text("""
+                SELECT id, parsed_content FROM document WHERE parsed_content IS NOT NULL
+                ORDER BY id LIMIT :limit FOR UPDATE SKIP LOCKED
+            """), {"limit": batch_size}).all()
+            if not rows:
+                break
+            for document_id, content in rows:
+                save_parsed_content(session, document_id, content, overwrite=False)
+            # Clearing the column frees the TOAST data of the old rows (reclaimed by VACUUM)
+            session.execute(text("UPDATE document SET parsed_content = NULL WHERE id = ANY(:ids)"), {"ids": [row[0] for row in rows]})
+            session.commit()
+        moved += len(rows)
+        print(f"Moved the parsed text of {moved} documents.")
+
+    if drop_column:
+        with engine.begin() as connection:
+            connection.execute(text("ALTER TABLE document DROP COLUMN IF EXISTS parsed_content"))
+        print("Dropped document.parsed_content.")
+    return moved
+
+
+def status(engine) -> dict:
+    with Session(engine) as session:
+        documents, text_bytes, stored_bytes = session.execute(
+            select(func.count(), func.coalesce(func.sum(DocumentText.size), 0), func.coalesce(func.sum(func.octet_length(DocumentText.data)), 0))
+        ).one()
+        codecs = dict(session.execute(select(DocumentText.codec, func.count()).group_by(DocumentText.codec)).all())
+        legacy = _legacy_column(session.connection())
+        remaining = session.execute(text("SELECT count(*) FROM document WHERE parsed_content IS NOT NULL")).scalar() if legacy else 0
+    return {
+        "documents": documents,
+        "text_bytes": int(text_bytes),
+        "stored_bytes": int(stored_bytes),
+        "compression_ratio": round(text_bytes / stored_bytes, 2) if stored_bytes else None,
+        "codecs": codecs,
+        "legacy_column": legacy,
+        "legacy_rows_remaining": remaining,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Manage the compressed storage of the parsed text of documents.")
+    parser.add_argument("action", choices=["migrate", "status"])
+    parser.add_argument("--batch-size", type=int, default=MIGRATION_BATCH_SIZE)
+    parser.add_argument("--keep-column", action="store_true", help="Do not drop document.parsed_content after moving the texts")
+    args = parser.parse_args()
+
+    from backend.container import get_engine
+    engine = get_engine()
+    if args.action == "migrate":
+        migrate(engine, args.batch_size, drop_column=not args.keep_column)
+    print(status(engine))
+
+
+if __name__ == "__main__":
+    main()
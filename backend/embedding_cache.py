@@ -0,0 +1,166 @@
+"""
+Persistent, content-addressed embedding cache stored in Postgres (table 'embeddingcacheentry').
+
+Chunks are keyed on sha256(embedding model id + normalized chunk text), so the same letter,
+medical summary or boilerplate paragraph is only embedded once across documents and cases.
+The table is bounded to EMBEDDING_CACHE_MAX_ENTRIES rows; the least recently used rows are evicted. The size is
+counted every EMBEDDING_CACHE_EVICT_INTERVAL inserted entries (per process) instead of on every insert, so the
+table can exceed the bound by that many rows per process until the next check.
+"""
+from datetime import datetime
+from typing import Dict, List
+import hashlib
+import os
+import re
+import threading
+import time
+import unicodedata
+from dotenv import load_dotenv
+from sqlalchemy import delete, func, select, update
+from sqlalchemy.dialects.postgresql import insert
+from sqlmodel import Session
+from backend.models import EmbeddingCacheEntry
+
+load_dotenv()
+
+EMBEDDING_CACHE_ENABLED = os.getenv("EMBEDDING_CACHE_ENABLED", "true").lower() == "true"
+EMBEDDING_CACHE_MAX_ENTRIES = int(os.getenv("EMBEDDING_CACHE_MAX_ENTRIES", "200000"))
+EMBEDDING_CACHE_EVICT_INTERVAL = int(os.getenv("EMBEDDING_CACHE_EVICT_INTERVAL", "1000")) # Inserted entries between size checks
+
+_whitespace = re.compile(r"\s+")
+
+
+def normalize_text(text: str) -> str:
+    """Normalize chunk text so trivially different copies (whitespace, unicode forms) share a cache key."""
+    return _whitespace.sub(" ", unicodedata.normalize("NFKC", text)).strip()
+
+
+def cache_key(text: str, model: str) -> str:
+    return hashlib.sha256(f"{model}\x00{normalize_text(text)}".encode("utf-8")).hexdigest()
+
+
+class EmbeddingCacheStats:
+    """Process-wide hit/miss counters, including an estimate of the embedding time saved by hits."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.embedding_seconds = 0.0 # Time spent embedding misses
+
+    def record(self, hits: int, misses: int, embedding_seconds: float):
+        with self._lock:
+            self.hits += hits
+            self.misses += misses
+            self.embedding_seconds += embedding_seconds
+
+    def snapshot(self) -> dict:
+        with self._lock:
+            lookups = self.hits + self.misses
+            seconds_per_text = self.embedding_seconds / self.misses if self.misses else 0.0
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": round(self.hits / lookups, 4) if lookups else 0.0,
+                "embedding_seconds": round(self.embedding_seconds, 3),
+                "estimated_seconds_saved": round(self.hits * seconds_per_text, 3),
+            }
+
+
+cache_stats = EmbeddingCacheStats()
+
+_inserted_lock = threading.Lock()
+_inserted_since_check = 0 # Entries inserted by this process since the cache size was last counted
+
+
+def _eviction_due(inserted: int) -> bool:
+    """Count inserted entries; True (and restart counting) once EMBEDDING_CACHE_EVICT_INTERVAL is reached."""
+    global _inserted_since_check
+    with _inserted_lock:
+        _inserted_since_check += inserted
+        if _inserted_since_check < EMBEDDING_CACHE_EVICT_INTERVAL:
+            return False
+        _inserted_since_check = 0
+        return True
+
+
+def _as_list(vector) -> List[float]:
+    # pgvector returns numpy arrays; the rest of the code works with plain lists
+    return vector.tolist() if hasattr(vector, "tolist") else list(vector)
+
+
+class EmbeddingCache:
+    """
+    Looks up embeddings in bulk and only sends the misses to the embedding client.
+    New entries are written in the caller's session, so they are committed together with the chunks.
+    """
+
+    def __init__(self, session: Session, max_entries: int = EMBEDDING_CACHE_MAX_ENTRIES):
+        self.session = session
+        self.max_entries = max_entries
+
+    def get_many(self, keys: List[str]) -> Dict[str, List[float]]:
+        if not keys:
+            return {}
+        rows = self.session.execute(
+            select(EmbeddingCacheEntry.key, EmbeddingCacheEntry.embedding).where(EmbeddingCacheEntry.key.in_(keys))
+        ).all()
+        found = {row[0]: _as_list(row[1]) for row in rows}
+        if found:
+            self.session.execute(
+                update(EmbeddingCacheEntry)
+                .where(EmbeddingCacheEntry.key.in_(list(found)))
+                .values(last_used_at=datetime.utcnow())
+            )
+        return found
+
+    def put_many(self, model: str, entries: Dict[str, List[float]]):
+        if not entries:
+            return
+        now = datetime.utcnow()
+        statement = insert(EmbeddingCacheEntry).values([
+            {"key": key, "model": model, "embedding": vector, "created_at": now, "last_used_at": now}
+            for key, vector in entries.items()
+        ]).on_conflict_do_nothing(index_elements=["key"])
+        inserted = self.session.execute(statement).rowcount
+        # count(*) scans the whole table, so the size is only checked now and then
+        if _eviction_due(inserted):
+            self.evict()
+
+    def evict(self):
+        """Delete the least recently used entries beyond max_entries."""
+        count = self.session.execute(select(func.count()).select_from(EmbeddingCacheEntry)).scalar_one()
+        excess = count - self.max_entries
+        if excess <= 0:
+            return
+        oldest = select(EmbeddingCacheEntry.key).order_by(EmbeddingCacheEntry.last_used_at).limit(excess)
+        self.session.execute(delete(EmbeddingCacheEntry).where(EmbeddingCacheEntry.key.in_(oldest.scalar_subquery())))
+        print(f"Evicted {excess} entries from the embedding cache.")
+
+    def embed(self, texts: List[str], client) -> List[List[float]]:
+        """Return embeddings for `texts` in input order, embedding only texts that are not cached yet."""
+        if not texts:
+            return []
+        keys = [cache_key(text, client.model) for text in texts]
+        unique_keys = list(dict.fromkeys(keys))
+        cached = self.get_many(unique_keys)
+
+        # Embed each missing text once, even when it occurs several times in the input
+        missing = {}
+        for key, text in zip(keys, texts):
+            if key not in cached and key not in missing:
+                missing[key] = text
+
+        embedding_seconds = 0.0
+        if missing:
+            start = time.perf_counter()
+            vectors = client.embed(list(missing.values()))
+            embedding_seconds = time.perf_counter() - start
+            new_entries = dict(zip(missing.keys(), vectors))
+            self.put_many(client.model, new_entries)
+            cached.update(new_entries)
+
+        hits = len(texts) - len(missing)
+        cache_stats.record(hits, len(missing), embedding_seconds)
+        print(f"Embedding cache: {hits} hits, {len(missing)} misses for {len(texts)} texts.")
+        return [cached[key] for key in keys]
@@ -0,0 +1,161 @@
+"""
+Embedding client shared by the Celery worker, the search router and the reports router.
+
+Texts are sent to the embedding backend in batches of EMBEDDING_BATCH_SIZE, with at most
+EMBEDDING_MAX_IN_FLIGHT batches being processed at the same time. Vectors are always
+returned in the same order as the input texts.
+
+Two backends are available (selected with EMBEDDING_BACKEND):
+- "supabase" (default): calls the 'generate_embedding' RPC in Supabase.
+- "local": a deterministic, offline stand-in used for development and benchmarks.
+"""
+from concurrent.futures import ThreadPoolExecutor
+from typing import List, Optional
+import hashlib
+import math
+import os
+import random
+import threading
+import time
+from dotenv import load_dotenv
+from backend.container import container, get_supabase
+
+load_dotenv()
+
+EMBEDDING_BACKEND = os.getenv("EMBEDDING_BACKEND", "supabase") # 'supabase' or 'local'
+EMBEDDING_MODEL = os.getenv("EMBEDDING_MODEL", "text-embedding-ada-002") # Model used by the 'generate_embedding' RPC
+EMBEDDING_DIMENSIONS = int(os.getenv("EMBEDDING_DIMENSIONS", "1536")) # Must match Chunk.embedding
+EMBEDDING_BATCH_SIZE = int(os.getenv("EMBEDDING_BATCH_SIZE", "32"))
+EMBEDDING_MAX_IN_FLIGHT = int(os.getenv("EMBEDDING_MAX_IN_FLIGHT", "4"))
+# Optional RPC that accepts a list of texts ('input_texts') and returns one row per text.
+# When not set, every text in a batch is sent to the single-text 'generate_embedding' RPC.
+EMBEDDING_BATCH_RPC = os.getenv("EMBEDDING_BATCH_RPC")
+
+
+class EmbeddingError(Exception):
+    """Raised when the embedding backend fails or returns an unusable response."""
+
+
+class SupabaseRPCEmbeddingBackend:
+    """Generates embeddings through the Supabase 'generate_embedding' RPC."""
+
+    name = "supabase"
+
+    def __init__(self, supabase_client=None, rpc_name: str = "generate_embedding", batch_rpc_name: Optional[str] = EMBEDDING_BATCH_RPC):
+        if supabase_client is None:
+            supabase_client = get_supabase() # Created on first use, so the local backend works without Supabase credentials
+        self.supabase = supabase_client
+        self.rpc_name = rpc_name
+        self.batch_rpc_name = batch_rpc_name
+        self.model = EMBEDDING_MODEL
+
+    def embed_batch(self, texts: List[str]) -> List[List[float]]:
+        if self.batch_rpc_name:
+            response = self.supabase.rpc(self.batch_rpc_name, {'input_texts': texts}).execute()
+            rows = response.data or []
+            if len(rows) != len(texts) or not all(row and row.get('embedding') for row in rows):
+                raise EmbeddingError(f"Batch embedding RPC returned {len(rows)} embeddings for {len(texts)} texts.")
+            return [row['embedding'] for row in rows]
+
+        vectors = []
+        for text in texts:
+            # The input parameter name ('input_text') and output structure ('embedding') must match the RPC definition.
+            response = self.supabase.rpc(self.rpc_name, {'input_text': text}).execute()
+            if response.data and response.data[0] and response.data[0].get('embedding'):
+                vectors.append(response.data[0]['embedding'])
+            else:
+                raise EmbeddingError("Supabase embedding generation failed or returned no embedding.")
+        return vectors
+
+
+class LocalEmbeddingBackend:
+    """
+    Deterministic stand-in for the embedding RPC. The same text always maps to the same
+    unit-length vector, so it can be used for benchmarks and local development without
+    network access. `latency` simulates the round trip of one request (in seconds),
+    `per_item_latency` the extra time per text in the request.
+    """
+
+    name = "local"
+
+    def __init__(self, dimensions: int = EMBEDDING_DIMENSIONS, latency: float = 0.0, per_item_latency: float = 0.0):
+        self.dimensions = dimensions
+        self.latency = latency
+        self.per_item_latency = per_item_latency
+        self.model = f"local-hash-{dimensions}"
+        self.requests = 0
+        self._lock = threading.Lock()
+
+    def embed_text(self, text: str) -> List[float]:
+        seed = int.from_bytes(hashlib.sha256(text.encode("utf-8")).digest()[:8], "big")
+        rng = random.Random(seed)
+        vector = [rng.gauss(0.0, 1.0) for _ in range(self.dimensions)]
+        norm = math.sqrt(sum(v * v for v in vector)) or 1.0
+        return [v / norm for v in vector]
+
+    def embed_batch(self, texts: List[str]) -> List[List[float]]:
+        with self._lock:
+            self.requests += 1
+        if self.latency or self.per_item_latency:
+            time.sleep(self.latency + self.per_item_latency * len(texts))
+        return [self.embed_text(text) for text in texts]
+
+
+class EmbeddingClient:
+    """
+    Sends texts to an embedding backend in batches with a bounded number of requests in flight.
+    """
+
+    def __init__(self, backend, batch_size: int = EMBEDDING_BATCH_SIZE, max_in_flight: int = EMBEDDING_MAX_IN_FLIGHT):
+        if batch_size < 1 or max_in_flight < 1:
+            raise ValueError("batch_size and max_in_flight must be at least 1")
+        self.backend = backend
+        self.batch_size = batch_size
+        self.max_in_flight = max_in_flight
+        self._executor = ThreadPoolExecutor(max_workers=max_in_flight, thread_name_prefix="embedding")
+
+    @property
+    def model(self) -> str:
+        return getattr(self.backend, "model", EMBEDDING_MODEL)
+
+    def embed(self, texts: List[str]) -> List[List[float]]:
+        """Embed a list of texts. The returned vectors are in the same order as `texts`."""
+        if not texts:
+            return []
+        batches = [texts[i:i + self.batch_size] for i in range(0, len(texts), self.batch_size)]
+        if len(batches) == 1:
+            return self._embed_batch(batches[0])
+
+        # executor.map keeps the batch order, and the pool size bounds the requests in flight
+        vectors = []
+        for batch_vectors in self._executor.map(self._embed_batch, batches):
+            vectors.extend(batch_vectors)
+        return vectors
+
+    def embed_one(self, text: str) -> List[float]:
+        return self.embed([text])[0]
+
+    def _embed_batch(self, batch: List[str]) -> List[List[float]]:
+        vectors = self.backend.embed_batch(batch)
+        if len(vectors) != len(batch):
+            raise EmbeddingError(f"Embedding backend returned {len(vectors)} embeddings for {len(batch)} texts.")
+        for vector in vectors:
+            if not isinstance(vector, list) or not all(isinstance(i, (int, float)) for i in vector):
+                raise EmbeddingError("Embedding is not a valid list of floats.")
+        return vectors
+
+    def close(self):
+        self._executor.shutdown(wait=False)
+
+
+def create_embedding_backend(name: str = EMBEDDING_BACKEND):
+    if name == "local":
+        return LocalEmbeddingBackend()
+    if name == "supabase":
+        return SupabaseRPCEmbeddingBackend()
+    raise ValueError(f"Unknown EMBEDDING_BACKEND: {name}")
+
+
+def get_embedding_client() -> EmbeddingClient:
+    """Return the process-wide embedding client, creating it on first use (see backend/container.py)."""
+    return container.get("embedding_client")
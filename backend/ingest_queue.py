@@ -0,0 +1,234 @@
+"""
+Fair scheduling of document processing over users.
+
+Documents are not sent to the Celery 'parse' queue directly. They wait in per-user queues in Redis, and a
+dispatcher moves them to Celery round-robin over the users (keyed on Case.user_id):
+- at most INGEST_USER_CONCURRENCY documents per user are processed at the same time,
+- at most INGEST_DISPATCH_WINDOW documents over all users are in flight (match the 'parse' worker concurrency),
+  so the Celery queue itself stays short and a new upload never waits behind a whole bulk import,
+- interactive uploads (a single document) have their own queues, which are served first, and
+  INGEST_INTERACTIVE_RESERVED slots of the window can only be used by them.
+
+A dispatched document holds a slot until its processing has finished (see celery_worker), or at most
+INGEST_LEASE_SECONDS. When the lease expires (its worker crashed), the slot is freed and the document is put back
+in front of its user's queue, so it is dispatched again. Dispatching happens after every enqueue and release,
+and periodically (dispatch_ingest_queue task).
+
+All queue operations are Lua scripts, so multiple API and worker processes can share the queues safely. All
+keys share the hash tag of the prefix ('{ingest}'), so the queue also works on Redis Cluster.
+
+Usage (queue depth per user, for operations):
+    python -m backend.ingest_queue
+"""
+from typing import Callable, Dict, Iterable, List, Optional, Tuple
+import json
+import os
+import time
+from dotenv import load_dotenv
+from backend.container import container, get_celery_app
+
+load_dotenv()
+
+INGEST_QUEUE_REDIS_URL = os.getenv("INGEST_QUEUE_REDIS_URL", os.getenv("REDIS_URL", "redis://localhost:6379/0"))
+INGEST_USER_CONCURRENCY = int(os.getenv("INGEST_USER_CONCURRENCY", "2"))
+INGEST_DISPATCH_WINDOW = int(os.getenv("INGEST_DISPATCH_WINDOW", "8"))
+INGEST_INTERACTIVE_RESERVED = int(os.getenv("INGEST_INTERACTIVE_RESERVED", "2"))
+INGEST_LEASE_SECONDS = float(os.getenv("INGEST_LEASE_SECONDS", "3600"))
+
+QUEUE_KINDS = ("interactive", "bulk") # Served in this order
+
+# Keys are passed in KEYS so Redis (Cluster) can route the scripts. The per-user keys the dispatch script
+# visits are only known from the rings, so it builds them from the prefix; the default prefix has a hash tag,
+# which puts all keys of the queue in the same cluster slot.
+
+# Adds documents to the queue of a user and puts the user in the ring of that kind.
+# KEYS: pending (of the user and kind), members (of the kind), ring (of the kind)
+# ARGV: user, front (1 = in front of the user's queue), document ids...
+_ENQUEUE_SCRIPT = """
+local pending, members, ring = KEYS[1], KEYS[2], KEYS[3]
+for i = 3, #ARGV do
+  if ARGV[2] == '1' then redis.call('LPUSH', pending, ARGV[i]) else redis.call('RPUSH', pending, ARGV[i]) end
+end
+if redis.call('SADD', members, ARGV[1]) == 1 then
+  redis.call('RPUSH', ring, ARGV[1])
+end
+return redis.call('LLEN', pending)
+"""
+
+# Puts documents whose lease expired (their worker crashed) back in front of their queues, then takes documents
+# from the user queues round-robin while there is room, and leases a slot for each.
+# KEYS: in_flight, owners, ring:interactive, members:interactive, ring:bulk, members:bulk
+# ARGV: prefix, now, user concurrency, window, interactive reserved, lease seconds, max documents
+# Returns a flat list: user, kind, document, user, kind, document, ...
+_DISPATCH_SCRIPT = """
+local in_flight_key, owners = KEYS[1], KEYS[2]
+local rings = {interactive = {KEYS[3], KEYS[4]}, bulk = {KEYS[5], KEYS[6]}}
+local prefix = ARGV[1]
+local now, cap, window = tonumber(ARGV[2]), tonumber(ARGV[3]), tonumber(ARGV[4])
+local reserved, lease, max_documents = tonumber(ARGV[5]), tonumber(ARGV[6]), tonumber(ARGV[7])
+
+for _, document in ipairs(redis.call('ZRANGEBYSCORE', in_flight_key, '-inf', now)) do
+  local owner = redis.call('HGET', owners, document) -- 'user kind'
+  if owner then
+    local user, kind = string.match(owner, '^(.*) (%a+)$')
+    redis.call('ZREM', prefix .. 'running:' .. user, document)
+    redis.call('LPUSH', prefix .. 'pending:' .. kind .. ':' .. user, document)
+    if redis.call('SADD', rings[kind][2], user) == 1 then
+      redis.call('RPUSH', rings[kind][1], user)
+    end
+    redis.call('HDEL', owners, document)
+  end
+end
+redis.call('ZREMRANGEBYSCORE', in_flight_key, '-inf', now)
+local in_flight = redis.call('ZCARD', in_flight_key)
+local dispatched = {}
+local count = 0
+
+local function serve(kind, limit)
+  local ring, members = rings[kind][1], rings[kind][2]
+  local users = redis.call('LLEN', ring)
+  local blocked = 0 -- Users in a row that are at their concurrency limit
+  while count < max_documents and in_flight < limit and users > 0 and blocked < users do
+    local user = redis.call('RPOPLPUSH', ring, ring) -- Next user; moves to the head of the list
+    local running = prefix .. 'running:' .. user
+    redis.call('ZREMRANGEBYSCORE', running, '-inf', now)
+    if redis.call('ZCARD', running) >= cap then
+      blocked = blocked + 1
+    else
+      local pending = prefix .. 'pending:' .. kind .. ':' .. user
+      local document = redis.call('LPOP', pending)
+      if document then
+        redis.call('ZADD', running, now + lease, document)
+        redis.call('ZADD', in_flight_key, now + lease, document)
+        redis.call('HSET', owners, document, user .. ' ' .. kind)
+        in_flight = in_flight + 1
+        count = count + 1
+        dispatched[#dispatched + 1] = user
+        dispatched[#dispatched + 1] = kind
+        dispatched[#dispatched + 1] = document
+        blocked = 0
+      end
+      if redis.call('LLEN', pending) == 0 then
+        redis.call('LREM', ring, 1, user)
+        redis.call('SREM', members, user)
+        users = users - 1
+      end
+    end
+  end
+end
+
+serve('interactive', window)
+serve('bulk', window - reserved)
+return dispatched
+"""
+
+# Frees the slot of a processed document. KEYS: running (of the user), in_flight, owners. ARGV: document
+_RELEASE_SCRIPT = """
+redis.call('ZREM', KEYS[1], ARGV[1])
+redis.call('HDEL', KEYS[3], ARGV[1])
+return redis.call('ZREM', KEYS[2], ARGV[1])
+"""
+
+
+class FairIngestQueue:
+    """
+    Per-user document queues in Redis. `send(document_id, user_id)` starts the processing of a
+    dispatched document (by default: process_document_mvp on the 'parse' queue).
+    """
+
+    def __init__(self, redis_client, send: Callable[[str, str], None], user_concurrency: int = INGEST_USER_CONCURRENCY,
+                 window: int = INGEST_DISPATCH_WINDOW, interactive_reserved: int = INGEST_INTERACTIVE_RESERVED,
+                 lease_seconds: float = INGEST_LEASE_SECONDS, prefix: str = "{ingest}:"):
+        self.redis = redis_client
+        self.send = send
+        self.user_concurrency = user_concurrency
+        self.window = window
+        self.interactive_reserved = min(interactive_reserved, window - 1) # Bulk imports always get at least one slot
+        self.lease_seconds = lease_seconds
+        self.prefix = prefix
+        self._enqueue = redis_client.register_script(_ENQUEUE_SCRIPT)
+        self._dispatch = redis_client.register_script(_DISPATCH_SCRIPT)
+        self._release = redis_client.register_script(_RELEASE_SCRIPT)
+
+    def _key(self, *parts: str) -> str:
+        return self.prefix + ":".join(parts)
+
+    def _push(self, user_id: str, kind: str, document_ids: List[str], front: bool = False):
+        self._enqueue(keys=[self._key("pending", kind, user_id), self._key("members", kind), self._key("ring", kind)],
+                      args=[user_id, "1" if front else "0", *document_ids])
+
+    def _free(self, user_id: str, document_id: str):
+        self._release(keys=[self._key("running", user_id), self._key("in_flight"), self._key("owners")], args=[document_id])
+
+    def enqueue(self, user_id: str, document_ids: Iterable[str], interactive: bool = False) -> List[Tuple[str, str]]:
+        """
+        Queue documents of a user and dispatch what fits. Interactive documents (single uploads) go in the
+        user's interactive queue, which is served before all bulk queues. Returns the dispatched (user, document) pairs.
+        """
+        document_ids = [str(document_id) for document_id in document_ids]
+        if document_ids:
+            kind = "interactive" if interactive else "bulk"
+            self._push(str(user_id), kind, document_ids)
+        return self.dispatch()
+
+    def dispatch(self, max_documents: Optional[int] = None) -> List[Tuple[str, str]]:
+        """Send queued documents to Celery while there is room; returns the dispatched (user, document) pairs."""
+        keys = [self._key("in_flight"), self._key("owners")]
+        for kind in QUEUE_KINDS:
+            keys += [self._key("ring", kind), self._key("members", kind)]
+        result = self._dispatch(keys=keys, args=[self.prefix, time.time(), self.user_concurrency, self.window,
+                                                 self.interactive_reserved, self.lease_seconds, max_documents or self.window])
+        result = [value.decode() if isinstance(value, bytes) else value for value in result]
+        dispatched = list(zip(result[0::3], result[1::3], result[2::3]))
+        for position, (user_id, kind, document_id) in enumerate(dispatched):
+            try:
+                self.send(document_id, user_id)
+            except Exception as e:
+                # Put the documents that were not sent back in front of their queues
+                print(f"Failed to dispatch document {document_id}: {e}")
+                for user_id, kind, document_id in reversed(dispatched[position:]):
+                    self._free(user_id, document_id)
+                    self._push(user_id, kind, [document_id], front=True)
+                dispatched = dispatched[:position]
+                break
+        return [(user_id, document_id) for user_id, _, document_id in dispatched]
+
+    def release(self, user_id: str, document_id: str) -> List[Tuple[str, str]]:
+        """Free the slot of a processed document and dispatch the next ones."""
+        self._free(str(user_id), str(document_id))
+        return self.dispatch()
+
+    def depth(self, user_id: str) -> Dict[str, int]:
+        """Queued and running documents of one user."""
+        user_id = str(user_id)
+        pipe = self.redis.pipeline()
+        for kind in QUEUE_KINDS:
+            pipe.llen(self._key("pending", kind, user_id))
+        pipe.zcount(self._key("running", user_id), time.time(), "+inf")
+        *queued, running = pipe.execute()
+        return {**{f"queued_{kind}": count for kind, count in zip(QUEUE_KINDS, queued)}, "running": running}
+
+    def depths(self) -> Dict[str, Dict[str, int]]:
+        """Queue depth of every user with queued or running documents."""
+        users = set()
+        for kind in QUEUE_KINDS:
+            users.update(member.decode() if isinstance(member, bytes) else member
+                         for member in self.redis.smembers(self._key("members", kind)))
+        running_prefix = self._key("running", "")
+        for key in self.redis.scan_iter(match=f"{running_prefix}*"):
+            users.add((key.decode() if isinstance(key, bytes) else key)[len(running_prefix):])
+        return {user_id: self.depth(user_id) for user_id in sorted(users)}
+
+
+def send_to_celery(document_id: str, user_id: str):
+    # Sent by name, so the API does not load the worker module
+    get_celery_app().send_task("backend.celery_worker.process_document_mvp", args=[document_id], kwargs={"user_id": user_id})
+
+
+def get_ingest_queue() -> FairIngestQueue:
+    """Return the shared queue (connected lazily, see backend/container.py)."""
+    return container.get("ingest_queue")
+
+
+if __name__ == "__main__":
+    print(json.dumps(get_ingest_queue().depths(), indent=2))
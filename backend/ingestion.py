@@ -0,0 +1,431 @@
+"""
+Streaming document ingestion: parse -> chunk -> embed -> persist.
+
+Each stage consumes the output of the previous one incrementally:
+- parse: yields the lines (docx paragraphs / text lines) of the document as they are read,
+- chunk: groups lines into paragraphs (separated by blank lines) and packs their sentences into
+  token-sized chunks (see backend/chunking.py), yielding chunks one by one,
+- embed: embeds paragraphs in batches (through the embedding cache when enabled),
+- persist: inserts each batch of chunks and commits, so chunks become searchable while the rest
+  of the document is still being processed.
+
+Parsing/chunking and embedding run in their own threads, connected to the persist stage by bounded
+queues (INGEST_QUEUE_SIZE batches), so memory use stays flat regardless of document size and the
+embedding round trips overlap with parsing and DB writes.
+
+Large documents (by downloaded size) are instead split into batches that are embedded and persisted by
+separate Celery tasks (see backend/celery_worker.py); the helpers for that are parse_document, embed_texts and
+pack_embeddings/unpack_embeddings.
+
+A document that already has chunks is re-indexed incrementally (reindex_document): the new chunks are
+matched to the existing rows by a fingerprint of their text, and only added or changed chunks are embedded.
+
+Every chunk stores its position in the document (Chunk.position), also when its batch was saved by another
+task. Existing databases get the column with `python -m backend.ingestion migrate`.
+
+Stage times are collected per document in StageTimings and recorded as metrics (see backend/metrics.py).
+"""
+from collections import defaultdict
+from typing import Iterable, Iterator, List, Optional, Tuple
+import argparse
+import base64
+import hashlib
+import io
+import os
+import queue
+import tempfile
+import threading
+import time
+import numpy as np
+from dotenv import load_dotenv
+from sqlalchemy import delete, select, text, update
+from sqlmodel import Session
+from backend.models import Chunk
+from backend.embeddings import get_embedding_client
+from backend.embedding_cache import EmbeddingCache, EMBEDDING_CACHE_ENABLED
+from backend.chunking import chunk_paragraphs
+from backend.document_text import save_parsed_content
+from backend.metrics import INGEST_CHUNKS, INGEST_DOCUMENT_SECONDS, INGEST_STAGE_SECONDS, propagate, span
+
+load_dotenv()
+
+INGEST_BATCH_SIZE = int(os.getenv("INGEST_BATCH_SIZE", "64")) # Chunks per embed/persist batch
+INGEST_QUEUE_SIZE = int(os.getenv("INGEST_QUEUE_SIZE", "4")) # Batches buffered between stages
+CHUNKING_STRATEGY = os.getenv("CHUNKING_STRATEGY", "sentence") # 'sentence' (token-aware) or 'paragraph' (one chunk per paragraph)
+
+SUPPORTED_EXTENSIONS = (".docx", ".txt")
+
+
+class UnsupportedFileType(Exception):
+    pass
+
+
+def iter_lines(fileobj, file_extension: str) -> Iterator[str]:
+    """Parse stage: yield the text lines of a document without building the full text."""
+    if file_extension == ".docx":
+        import docx # For .docx parsing; imported on first use (python-docx loads lxml)
+        try:
+            doc = docx.Document(fileobj)
+        except Exception as e:
+            raise Exception(f"Error parsing DOCX file: {e}")
+        for paragraph in doc.paragraphs:
+            yield paragraph.text
+    elif file_extension == ".txt":
+        try:
+            for line in io.TextIOWrapper(fileobj, encoding="utf-8"): # Assuming UTF-8 encoding
+                yield line.rstrip("\r\n")
+        except UnicodeDecodeError as e:
+            raise Exception(f"Error parsing TXT file: {e}")
+    else:
+        raise UnsupportedFileType(f"Unsupported file type: {file_extension}")
+
+
+def iter_paragraphs(lines: Iterable[str]) -> Iterator[str]:
+    """Chunk stage: group lines into paragraphs separated by blank lines."""
+    current: List[str] = []
+    for line in lines:
+        if line.strip():
+            current.append(line)
+        elif current:
+            yield "\n".join(current).strip()
+            current = []
+    if current:
+        yield "\n".join(current).strip()
+
+
+def iter_chunks(paragraphs: Iterable[str], strategy: str = CHUNKING_STRATEGY) -> Iterator[str]:
+    if strategy == "paragraph":
+        return iter(paragraphs)
+    if strategy == "sentence":
+        return chunk_paragraphs(paragraphs)
+    raise ValueError(f"Unknown CHUNKING_STRATEGY: {strategy}")
+
+
+def iter_batches(items: Iterable, size: int) -> Iterator[list]:
+    batch = []
+    for item in items:
+        batch.append(item)
+        if len(batch) >= size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+
+def parse_document(fileobj, file_extension: str, timings: "StageTimings" = None) -> Tuple[List[str], str]:
+    """Parse and chunk a whole document; returns the chunks and the parsed text."""
+    timings = timings or StageTimings()
+    parsed_text = io.StringIO()
+    parsed = timings.seconds["parse"]
+    start = time.perf_counter()
+    with span("ingest.parse_chunk"):
+        chunks = list(iter_chunks(iter_paragraphs(_spool(_timed(iter_lines(fileobj, file_extension), timings, "parse"), parsed_text))))
+    timings.add("chunk", time.perf_counter() - start - (timings.seconds["parse"] - parsed))
+    return chunks, parsed_text.getvalue()
+
+
+def embed_texts(session: Session, texts: List[str], client) -> List[List[float]]:
+    """Embed a batch of chunk texts, through the embedding cache when it is enabled (committed in `session`)."""
+    if EMBEDDING_CACHE_ENABLED:
+        vectors = EmbeddingCache(session).embed(texts, client)
+        session.commit()
+        return vectors
+    return client.embed(texts)
+
+
+def pack_embeddings(vectors: List[List[float]]) -> str:
+    """Encode embeddings as base64 float32, about 4x smaller than JSON floats in a Celery message."""
+    return base64.b64encode(np.asarray(vectors, dtype="<f4").tobytes()).decode("ascii")
+
+
+def unpack_embeddings(data: str, count: int) -> List[List[float]]:
+    return np.frombuffer(base64.b64decode(data), dtype="<f4").reshape(count, -1).tolist()
+
+
+class StageTimings:
+    """
+    Accumulated wall-clock seconds per stage, plus the time until the first chunks were committed.
+    Parsing and chunking are interleaved generators; 'parse' is the time spent reading lines from the file
+    and 'chunk' the rest of the time spent producing chunks.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.started = time.perf_counter()
+        self.seconds = {"download": 0.0, "parse": 0.0, "chunk": 0.0, "embed": 0.0, "persist": 0.0}
+        self.first_chunk_seconds = None
+
+    def add(self, stage: str, seconds: float):
+        with self._lock:
+            self.seconds[stage] = self.seconds.get(stage, 0.0) + seconds
+
+    def mark_first_chunk(self):
+        with self._lock:
+            if self.first_chunk_seconds is None:
+                self.first_chunk_seconds = time.perf_counter() - self.started
+
+    def as_dict(self) -> dict:
+        with self._lock:
+            result = {stage: round(seconds, 4) for stage, seconds in self.seconds.items()}
+            result["first_chunk"] = round(self.first_chunk_seconds, 4) if self.first_chunk_seconds is not None else None
+            result["total"] = round(time.perf_counter() - self.started, 4)
+            return result
+
+    def record(self, mode: str, stages: Optional[Iterable[str]] = None):
+        """
+        Record the stage times of the document as metrics; `mode` is 'stream', 'fanout' or 'reindex'.
+        `stages` limits the stages recorded (a fanned-out document is embedded and persisted by other tasks).
+        """
+        with self._lock:
+            seconds = dict(self.seconds)
+        for stage, value in seconds.items():
+            if stages is None or stage in stages:
+                INGEST_STAGE_SECONDS.observe(value, stage=stage)
+        INGEST_DOCUMENT_SECONDS.observe(time.perf_counter() - self.started, mode=mode)
+
+
+def _timed(items: Iterable, timings: StageTimings, stage: str) -> Iterator:
+    """Yield from `items`, adding the time spent producing each item to `stage`."""
+    iterator = iter(items)
+    while True:
+        start = time.perf_counter()
+        try:
+            item = next(iterator)
+        except StopIteration:
+            timings.add(stage, time.perf_counter() - start)
+            return
+        timings.add(stage, time.perf_counter() - start)
+        yield item
+
+
+_DONE = object()
+
+
+class _Stage(threading.Thread):
+    """Runs `work(put)` in a thread; items are passed on through a bounded queue, errors are re-raised by the consumer."""
+
+    def __init__(self, name: str, work, cancelled: threading.Event):
+        super().__init__(name=name, daemon=True)
+        self.output = queue.Queue(maxsize=INGEST_QUEUE_SIZE)
+        self.work = propagate(work) # Spans of the stage belong to the document's trace
+        self.cancelled = cancelled
+        self.error = None
+
+    def put(self, item):
+        # Put with a timeout so the stage stops when a later stage failed
+        while not self.cancelled.is_set():
+            try:
+                self.output.put(item, timeout=0.1)
+                return
+            except queue.Full:
+                continue
+        raise InterruptedError("Ingestion cancelled")
+
+    def run(self):
+        try:
+            self.work(self.put)
+        except InterruptedError:
+            pass
+        except Exception as e:
+            self.error = e
+        finally:
+            try:
+                self.output.put(_DONE, timeout=1)
+            except queue.Full:
+                pass
+
+    def __iter__(self):
+        while True:
+            try:
+                item = self.output.get(timeout=0.1)
+            except queue.Empty:
+                if self.cancelled.is_set():
+                    raise InterruptedError("Ingestion cancelled")
+                continue
+            if item is _DONE:
+                if self.error is not None:
+                    raise self.error
+                return
+            yield item
+
+
+def ingest_document(session: Session, document, fileobj, file_extension: str, engine, timings: StageTimings = None,
+                    chunks: Optional[List[str]] = None, parsed_content: Optional[str] = None) -> dict:
+    """
+    Run the streaming pipeline for one downloaded document. Chunks are committed batch by batch.
+    Returns the number of chunks and the per-stage timings; the parsed text is stored (compressed, see
+    backend/document_text.py) in `session` without being committed.
+    Documents are streamed from `fileobj`; benchmarks that ingest pre-chunked text pass `chunks` and
+    `parsed_content` instead.
+    """
+    timings = timings or StageTimings()
+    cancelled = threading.Event()
+    client = get_embedding_client()
+    # The parsed text is spooled to disk while parsing instead of being kept in memory
+    parsed_text = tempfile.SpooledTemporaryFile(max_size=1024 * 1024, mode="w+", encoding="utf-8")
+
+    def parse_and_chunk(put):
+        if chunks is not None:
+            parsed_text.write(parsed_content or "")
+            batches = iter_batches(chunks, INGEST_BATCH_SIZE)
+        else:
+            lines = _timed(iter_lines(fileobj, file_extension), timings, "parse")
+            paragraphs = iter_paragraphs(_spool(lines, parsed_text))
+            batches = iter_batches(iter_chunks(paragraphs), INGEST_BATCH_SIZE)
+        while True:
+            parsed = timings.seconds["parse"] # Only this thread parses
+            start = time.perf_counter()
+            batch = next(batches, None)
+            timings.add("chunk", time.perf_counter() - start - (timings.seconds["parse"] - parsed))
+            if batch is None:
+                return
+            put(batch)
+
+    parser = _Stage("ingest-parse", parse_and_chunk, cancelled)
+
+    def embed(put):
+        # The embedding stage runs in its own thread, so it uses its own session for the cache
+        with Session(engine) as cache_session:
+            for batch in parser:
+                start = time.perf_counter()
+                with span("ingest.embed", chunks=len(batch)):
+                    vectors = embed_texts(cache_session, batch, client)
+                timings.add("embed", time.perf_counter() - start)
+                put(list(zip(batch, vectors)))
+
+    embedder = _Stage("ingest-embed", embed, cancelled)
+
+    chunk_count = 0
+    try:
+        parser.start()
+        embedder.start()
+        for batch in embedder:
+            start = time.perf_counter()
+            with span("ingest.persist", chunks=len(batch)):
+                session.add_all([Chunk(document_id=document.id, content=text, embedding=vector, position=chunk_count + index)
+                                 for index, (text, vector) in enumerate(batch)])
+                session.commit()
+            timings.add("persist", time.perf_counter() - start)
+            timings.mark_first_chunk()
+            chunk_count += len(batch)
+            INGEST_CHUNKS.inc(len(batch), operation="added")
+    except BaseException:
+        cancelled.set()
+        raise
+    finally:
+        parser.join(timeout=5)
+        embedder.join(timeout=5)
+
+    parsed_text.seek(0)
+    save_parsed_content(session, document.id, parsed_text) # Compressed as it is read from the spooled file
+    parsed_text.close()
+    return {"chunks": chunk_count, "timings": timings.as_dict()}
+
+
+def chunk_fingerprint(text: str) -> str:
+    return hashlib.sha256(text.encode("utf-8")).hexdigest()
+
+
+def diff_chunks(existing: Iterable[Tuple[object, str, Optional[int]]], chunks: List[str]) -> Tuple[List[object], List[Tuple[int, str]], List[Tuple[object, int]]]:
+    """
+    Match the new chunk texts to existing (id, content, position) rows by fingerprint. Duplicate texts are matched
+    one to one, in order. Returns the ids of the rows that are no longer in the document, the (position, text) of
+    the chunks that have to be added and the (id, position) of the kept rows whose position changed.
+    """
+    unmatched = defaultdict(list) # Fingerprint -> (id, position) of existing rows without a new chunk yet
+    for chunk_id, content, position in existing:
+        unmatched[chunk_fingerprint(content)].append((chunk_id, position))
+    added, moved = [], []
+    for position, text in enumerate(chunks):
+        rows = unmatched.get(chunk_fingerprint(text))
+        if rows:
+            chunk_id, previous = rows.pop(0)
+            if previous != position:
+                moved.append((chunk_id, position))
+        else:
+            added.append((position, text))
+    removed = [chunk_id for rows in unmatched.values() for chunk_id, _ in rows]
+    return removed, added, moved
+
+
+def reindex_document(session: Session, document, chunks: List[str], parsed_content: str, timings: StageTimings = None) -> dict:
+    """
+    Bring the chunks of an already indexed document in line with its new content: unchanged chunks keep their
+    rows and embeddings, removed chunks are deleted and only added chunks are embedded. The changes and
+    the new parsed text are left in the session for the caller to commit in one transaction, so searches
+    never see a partly re-indexed document (and a failure leaves the previous chunks in place).
+    """
+    timings = timings or StageTimings()
+    existing = session.execute(select(Chunk.id, Chunk.content, Chunk.position).where(Chunk.document_id == document.id)
+                               .order_by(Chunk.position)).all()
+    removed, added, moved = diff_chunks(existing, chunks)
+
+    start = time.perf_counter()
+    client = get_embedding_client()
+    vectors = []
+    with span("ingest.embed", chunks=len(added)):
+        for batch in iter_batches([text for _, text in added], INGEST_BATCH_SIZE):
+            vectors.extend(embed_texts(session, batch, client)) # Commits the embedding cache entries only
+    timings.add("embed", time.perf_counter() - start)
+
+    start = time.perf_counter()
+    with span("ingest.persist", chunks=len(added), removed=len(removed)):
+        for batch in iter_batches(removed, 1000):
+            session.execute(delete(Chunk).where(Chunk.id.in_(batch)))
+        if moved:
+            # Only the position column changes; the embeddings of the kept rows are not rewritten
+            session.execute(update(Chunk), [{"id": chunk_id, "position": position} for chunk_id, position in moved])
+        session.add_all([Chunk(document_id=document.id, content=text, embedding=vector, position=position)
+                         for (position, text), vector in zip(added, vectors)])
+        save_parsed_content(session, document.id, parsed_content)
+        session.flush()
+    timings.add("persist", time.perf_counter() - start)
+    INGEST_CHUNKS.inc(len(added), operation="added")
+    INGEST_CHUNKS.inc(len(chunks) - len(added), operation="unchanged")
+    INGEST_CHUNKS.inc(len(removed), operation="removed")
+    print(f"Re-indexed document {document.id}: {len(chunks) - len(added)} unchanged, {len(added)} added, {len(removed)} removed chunks.")
+    return {"chunks": len(chunks), "unchanged": len(chunks) - len(added), "added": len(added), "removed": len(removed),
+            "timings": timings.as_dict()}
+
+
+def migrate(engine):
+    """Add the chunk position column to an existing database (nullable without default: no table rewrite)."""
+    with engine.begin() as connection:
+        connection.execute(text('ALTER TABLE chunk ADD COLUMN IF NOT EXISTS "position" integer'))
+    print("chunk.position is in place.")
+
+
+def status(engine) -> dict:
+    with engine.connect() as connection:
+        present = connection.execute(text("""
+            SELECT count(*) FROM information_schema.columns
+            WHERE table_schema = current_schema() AND table_name = 'chunk' AND column_name = 'position'
+        """)).scalar() > 0
+        result = {"chunk.position": present}
+        if present:
+            result["chunks_without_position"] = connection.execute(text('SELECT count(*) FROM chunk WHERE "position" IS NULL')).scalar()
+    return result
+
+
+def _spool(lines: Iterable[str], target) -> Iterator[str]:
+    first = True
+    for line in lines:
+        target.write(line if first else "\n" + line)
+        first = False
+        yield line
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Manage the chunk position column written by document ingestion.")
+    parser.add_argument("action", choices=["migrate", "status"])
+    args = parser.parse_args()
+
+    from backend.container import get_engine
+    engine = get_engine()
+    if args.action == "migrate":
+        migrate(engine)
+    print(status(engine))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,128 @@
+"""
+Paginated, lightweight listings of cases and documents.
+
+Listings return summary projections (CaseSummary, DocumentSummary in backend/models.py): only the selected
+columns are loaded, so a document's parsed_content is never read or sent. Responses therefore stay small
+regardless of document size.
+
+Pages are ordered newest first and paginated by keyset, (created_at, id) for cases and (uploaded_at, id) for
+documents, instead of OFFSET: the next page starts right after the last row of the previous one, so every page
+is a range scan of the composite listing index (ix_case_user_id_created_at_id, ix_document_case_id_uploaded_at_id)
+no matter how deep the client pages. The body stays a JSON list; the cursor of the next page is returned in the
+X-Next-Cursor header (and a Link rel="next" header) and is absent on the last page.
+
+Every page carries a weak ETag computed over its body. A client that sends it back in If-None-Match gets
+304 Not Modified without the body when nothing on the page changed.
+
+New databases get the listing indexes from SQLModel.metadata.create_all; add them to an existing database with:
+
+    python -m backend.listing migrate
+    python -m backend.listing status
+"""
+from datetime import datetime
+from typing import List, Optional, Tuple
+import argparse
+import base64
+import hashlib
+import json
+import uuid
+from fastapi import HTTPException, Request, Response, status
+from fastapi.encoders import jsonable_encoder
+from sqlalchemy import Index, text, tuple_
+from sqlmodel import Session, select
+from backend.models import CASE_LISTING_INDEX, DOCUMENT_LISTING_INDEX, Case, CaseSummary, Document, DocumentSummary
+
+DEFAULT_PAGE_SIZE = 50
+MAX_PAGE_SIZE = 200
+
+
+def encode_cursor(timestamp: datetime, row_id: uuid.UUID) -> str:
+    return base64.urlsafe_b64encode(f"{timestamp.isoformat()}|{row_id}".encode("utf-8")).decode("ascii").rstrip("=")
+
+
+def decode_cursor(cursor: str) -> Tuple[datetime, uuid.UUID]:
+    try:
+        value = base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4)).decode("utf-8")
+        timestamp, row_id = value.split("|")
+        return datetime.fromisoformat(timestamp), uuid.UUID(row_id)
+    except Exception:
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="Invalid cursor")
+
+
+def _page(session: Session, model, summary, sort_column, condition, limit: int, cursor: Optional[str]) -> Tuple[list, Optional[str]]:
+    """One page of `summary` rows of `model` matching `condition`, newest first, and the cursor of the next page."""
+    columns = [getattr(model, name) for name in summary.model_fields]
+    query = select(*columns).where(condition)
+    if cursor:
+        timestamp, row_id = decode_cursor(cursor)
+        query = query.where(tuple_(sort_column, model.id) < tuple_(timestamp, row_id))
+    # One extra row tells whether there is a next page
+    rows = session.exec(query.order_by(sort_column.desc(), model.id.desc()).limit(limit + 1)).all()
+    items = [summary(**row._mapping) for row in rows[:limit]]
+    next_cursor = None
+    if len(rows) > limit:
+        last = items[-1]
+        next_cursor = encode_cursor(getattr(last, sort_column.key), last.id)
+    return items, next_cursor
+
+
+def case_page(session: Session, user_id: uuid.UUID, limit: int = DEFAULT_PAGE_SIZE, cursor: Optional[str] = None) -> Tuple[List[CaseSummary], Optional[str]]:
+    return _page(session, Case, CaseSummary, Case.created_at, Case.user_id == user_id, limit, cursor)
+
+
+def document_page(session: Session, case_id: uuid.UUID, limit: int = DEFAULT_PAGE_SIZE, cursor: Optional[str] = None) -> Tuple[List[DocumentSummary], Optional[str]]:
+    return _page(session, Document, DocumentSummary, Document.uploaded_at, Document.case_id == case_id, limit, cursor)
+
+
+def page_response(request: Request, items: list, next_cursor: Optional[str]) -> Response:
+    """The JSON list response of a page, with its ETag and next-page headers; 304 when If-None-Match matches."""
+    body = json.dumps(jsonable_encoder(items), separators=(",", ":")).encode("utf-8")
+    etag = f'W/"{hashlib.sha256(body).hexdigest()[:32]}"'
+    headers = {"ETag": etag, "Cache-Control": "private, no-cache"} # Clients revalidate with If-None-Match
+    if next_cursor:
+        headers["X-Next-Cursor"] = next_cursor
+        headers["Link"] = f'<{request.url.include_query_params(cursor=next_cursor)}>; rel="next"'
+    if_none_match = request.headers.get("if-none-match")
+    if if_none_match and (if_none_match.strip() == "*" or etag in [tag.strip() for tag in if_none_match.split(",")]):
+        return Response(status_code=status.HTTP_304_NOT_MODIFIED, headers=headers)
+    return Response(body, media_type="application/json", headers=headers)
+
+
+def _listing_indexes() -> List[Index]:
+    return [index for table in (Case.__table__, Document.__table__) for index in table.indexes
+            if index.name in (CASE_LISTING_INDEX, DOCUMENT_LISTING_INDEX)]
+
+
+def migrate(engine):
+    """Add the listing indexes to an existing database."""
+    with engine.connect().execution_options(isolation_level="AUTOCOMMIT") as connection:
+        # Built without blocking writes; CREATE INDEX CONCURRENTLY cannot run inside a transaction block
+        for index in _listing_indexes():
+            columns = ", ".join(column.name for column in index.columns)
+            connection.execute(text(f'CREATE INDEX CONCURRENTLY IF NOT EXISTS {index.name} ON "{index.table.name}" ({columns})'))
+    print(f"{', '.join(index.name for index in _listing_indexes())} are in place.")
+
+
+def index_status(engine) -> dict:
+    with engine.connect() as connection:
+        sizes = dict(connection.execute(text("""
+            SELECT indexname, pg_relation_size(format('%I.%I', schemaname, indexname)::regclass)
+            FROM pg_indexes WHERE schemaname = current_schema() AND indexname = ANY(:names)
+        """), {"names": [index.name for index in _listing_indexes()]}).all())
+    return {index.name: {"size_bytes": sizes.get(index.name)} if index.name in sizes else None for index in _listing_indexes()}
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Manage the composite indexes used by the paginated listings.")
+    parser.add_argument("action", choices=["migrate", "status"])
+    args = parser.parse_args()
+
+    from backend.container import get_engine
+    engine = get_engine()
+    if args.action == "migrate":
+        migrate(engine)
+    print(index_status(engine))
+
+
+if __name__ == "__main__":
+    main()
@@ -1,21 +1,18 @@
-from fastapi import FastAPI, Depends, Request, status # Add Request, status
-from sqlmodel import SQLModel # Keep SQLModel for create_db_and_tables
+from fastapi import FastAPI, Depends, Header, HTTPException, Request, status # Add Request, status
 from backend.routers import cases # Import the cases router
 from backend.routers import documents # Import the documents router
 from backend.routers import search # Import the search router
 from backend.routers import reports # Import the reports router
-from backend.dependencies import get_current_user, engine # Import dependencies and engine
+from backend.dependencies import get_current_user # Import dependencies
 from fastapi.exceptions import RequestValidationError
-from fastapi.responses import JSONResponse
+from fastapi.responses import JSONResponse, Response
+from backend import metrics
+import hmac
 
 app = FastAPI()
 
-def create_db_and_tables():
-    SQLModel.metadata.create_all(engine)
-
-@app.on_event("startup")
-def on_startup():
-    create_db_and_tables()
+# The schema is created by `python -m backend.migrate` before deployment, not on startup, and clients and
+# engines are created on first use (see backend/container.py): a new replica is ready as soon as it is imported.
 
 
 # Include routers
@@ -40,6 +37,15 @@ async def validation_exception_handler(request: Request, exc: RequestValidationE
 async def read_root():
     return {"message": "AD-Rapport Generator AI Backend"}
 
+@app.get("/metrics", include_in_schema=False)
+async def get_metrics(authorization: str = Header(None)):
+    """Metrics of this API process in the Prometheus text format (see backend/metrics.py)."""
+    if not metrics.METRICS_ENABLED:
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Not Found")
+    if metrics.METRICS_TOKEN and not hmac.compare_digest(authorization or "", f"Bearer {metrics.METRICS_TOKEN}"):
+        raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED, detail="Invalid metrics token")
+    return Response(metrics.render(), media_type=metrics.CONTENT_TYPE)
+
 @app.get("/protected")
 async def protected_route(current_user: dict = Depends(get_current_user)):
     return {"message": "This is a protected route", "user": current_user}
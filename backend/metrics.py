@@ -0,0 +1,255 @@
+"""
+Stage-level metrics and optional tracing for ingestion, search and report generation.
+
+Metrics are counters and histograms kept in memory per process and rendered in the Prometheus text format
+by `render()`:
+- the API serves them at GET /metrics (protected with METRICS_TOKEN when it is set),
+- Celery workers serve them over HTTP when METRICS_PORT is set (see backend/celery_worker.py).
+
+Labels only take a small, fixed set of values (stage names, statuses), never ids or user input.
+
+Tracing (TRACING_ENABLED=true) opens OpenTelemetry spans around the same stages. Only the OpenTelemetry API is
+used here; the SDK and exporter are configured by the deployment (e.g. `opentelemetry-instrument`), without
+them the spans are no-ops. With tracing disabled `span()` does not import OpenTelemetry at all.
+"""
+from contextlib import contextmanager
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Dict, Optional, Tuple
+import bisect
+import os
+import threading
+import time
+from dotenv import load_dotenv
+
+load_dotenv()
+
+METRICS_ENABLED = os.getenv("METRICS_ENABLED", "true").lower() == "true"
+METRICS_TOKEN = os.getenv("METRICS_TOKEN") # Bearer token required for GET /metrics when set
+TRACING_ENABLED = os.getenv("TRACING_ENABLED", "false").lower() == "true"
+
+# Seconds; covers cache hits (milliseconds) up to LLM calls and large documents (minutes)
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0, 120.0, 300.0)
+
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+
+def _escape(value) -> str:
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _format_labels(names: Tuple[str, ...], values: Tuple, extra: str = "") -> str:
+    parts = [f'{name}="{_escape(value)}"' for name, value in zip(names, values)]
+    if extra:
+        parts.append(extra)
+    return "{" + ",".join(parts) + "}" if parts else ""
+
+
+def _format_value(value: float) -> str:
+    return repr(float(value)) if value != int(value) else str(int(value))
+
+
+class _Metric:
+    type = ""
+
+    def __init__(self, name: str, documentation: str, labelnames: Tuple[str, ...] = ()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._lock = threading.Lock()
+        _registry.append(self)
+
+    def _key(self, labels: dict) -> Tuple:
+        if set(labels) != set(self.labelnames):
+            raise ValueError(f"Metric {self.name} takes the labels {self.labelnames}, got {tuple(labels)}")
+        return tuple(labels[name] for name in self.labelnames)
+
+    def render(self) -> str:
+        return f"# HELP {self.name} {self.documentation}\n# TYPE {self.name} {self.type}\n" + "".join(self._samples())
+
+    def _samples(self):
+        raise NotImplementedError
+
+
+class Counter(_Metric):
+    """A value that only goes up, e.g. processed chunks or failures."""
+
+    type = "counter"
+
+    def __init__(self, name: str, documentation: str, labelnames: Tuple[str, ...] = ()):
+        super().__init__(name, documentation, labelnames)
+        self._values: Dict[Tuple, float] = {}
+
+    def inc(self, amount: float = 1, **labels):
+        if not METRICS_ENABLED:
+            return
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def value(self, **labels) -> float:
+        with self._lock:
+            return self._values.get(self._key(labels), 0)
+
+    def _samples(self):
+        with self._lock:
+            values = sorted(self._values.items())
+        for key, value in values:
+            yield f"{self.name}{_format_labels(self.labelnames, key)} {_format_value(value)}\n"
+
+
+class Histogram(_Metric):
+    """Distribution of durations (or sizes) in cumulative buckets, with their sum and count."""
+
+    type = "histogram"
+
+    def __init__(self, name: str, documentation: str, labelnames: Tuple[str, ...] = (), buckets: Tuple[float, ...] = DEFAULT_BUCKETS):
+        super().__init__(name, documentation, labelnames)
+        self.buckets = tuple(sorted(buckets))
+        self._values: Dict[Tuple, list] = {} # Label values -> [count per bucket (last one +Inf), sum]
+
+    def observe(self, value: float, **labels):
+        if not METRICS_ENABLED:
+            return
+        key = self._key(labels)
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            entry = self._values.get(key)
+            if entry is None:
+                entry = self._values[key] = [[0] * (len(self.buckets) + 1), 0.0]
+            entry[0][index] += 1
+            entry[1] += value
+
+    @contextmanager
+    def time(self, **labels):
+        """Observe the duration of the block (also when it raises)."""
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - start, **labels)
+
+    def count(self, **labels) -> int:
+        with self._lock:
+            entry = self._values.get(self._key(labels))
+            return sum(entry[0]) if entry else 0
+
+    def _samples(self):
+        with self._lock:
+            values = sorted((key, (list(entry[0]), entry[1])) for key, entry in self._values.items())
+        for key, (counts, total) in values:
+            cumulative = 0
+            for bound, count in zip(self.buckets + (float("inf"),), counts):
+                cumulative += count
+                le = "+Inf" if bound == float("inf") else _format_value(bound)
+                labels = _format_labels(self.labelnames, key, f'le="{le}"')
+                yield f"{self.name}_bucket{labels} {cumulative}\n"
+            yield f"{self.name}_sum{_format_labels(self.labelnames, key)} {_format_value(round(total, 6))}\n"
+            yield f"{self.name}_count{_format_labels(self.labelnames, key)} {cumulative}\n"
+
+
+_registry = []
+
+
+def render() -> str:
+    """All metrics of this process in the Prometheus text exposition format."""
+    return "".join(metric.render() for metric in list(_registry))
+
+
+# Ingestion (backend/celery_worker.py, backend/ingestion.py). Stage times are observed once per document
+# (summed over the document's batches); parse and chunk are interleaved, see ingestion.StageTimings.
+INGEST_STAGE_SECONDS = Histogram("ingest_stage_seconds", "Time per document spent in an ingestion stage", ("stage",))
+INGEST_DOCUMENT_SECONDS = Histogram("ingest_document_seconds", "Total processing time per document", ("mode",))
+INGEST_DOCUMENTS = Counter("ingest_documents_total", "Processed documents by outcome", ("status",))
+INGEST_BATCH_SECONDS = Histogram("ingest_batch_seconds", "Time per chunk batch of a fanned-out document spent in a stage", ("stage",))
+INGEST_CHUNKS = Counter("ingest_chunks_total", "Chunks written, kept or deleted by ingestion and re-indexing", ("operation",))
+
+# Vector/hybrid search (backend/routers/search.py)
+SEARCH_STAGE_SECONDS = Histogram("search_stage_seconds", "Time per search request spent in a stage", ("stage",))
+SEARCH_FAILURES = Counter("search_failures_total", "Failed search requests by stage", ("stage",))
+
+# Report generation (backend/report_generation.py, backend/routers/reports.py)
+REPORT_STAGE_SECONDS = Histogram("report_stage_seconds", "Time per report (or template section) spent in a stage", ("stage",))
+REPORT_TOKENS = Counter("report_tokens_total", "Tokens of report generation: packed context, and LLM prompt/completion usage", ("kind",))
+REPORT_FAILURES = Counter("report_failures_total", "Failed report generations by stage", ("stage",))
+
+
+_tracer = None
+
+
+def _get_tracer():
+    global _tracer
+    if _tracer is None:
+        from opentelemetry import trace
+        _tracer = trace.get_tracer("backend")
+    return _tracer
+
+
+@contextmanager
+def span(name: Optional[str], **attributes):
+    """A trace span around the block when TRACING_ENABLED (and a name is given); otherwise nothing."""
+    if not TRACING_ENABLED or not name:
+        yield None
+        return
+    with _get_tracer().start_as_current_span(name, attributes={key: value for key, value in attributes.items() if value is not None}) as current:
+        yield current
+
+
+@contextmanager
+def timed(histogram: Histogram, span_name: Optional[str] = None, **labels):
+    """Observe the duration of the block in `histogram` and, when tracing, wrap it in a span with the labels as attributes."""
+    start = time.perf_counter()
+    try:
+        with span(span_name, **labels):
+            yield
+    finally:
+        histogram.observe(time.perf_counter() - start, **labels)
+
+
+def propagate(function):
+    """Wrap `function` so it runs in the caller's trace context when called from another thread."""
+    if not TRACING_ENABLED:
+        return function
+    from opentelemetry import context
+
+    parent = context.get_current()
+
+    def run(*args, **kwargs):
+        token = context.attach(parent)
+        try:
+            return function(*args, **kwargs)
+        finally:
+            context.detach(token)
+
+    return run
+
+
+class _Handler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        if self.path.split("?")[0] != "/metrics":
+            self.send_error(404)
+            return
+        body = render().encode("utf-8")
+        self.send_response(200)
+        self.send_header("Content-Type", CONTENT_TYPE)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass # Scrapes are not logged
+
+
+def start_metrics_server(port: int, host: str = "0.0.0.0", attempts: int = 1) -> Optional[int]:
+    """
+    Serve /metrics of this process from a daemon thread. When `port` is taken the next ports are tried
+    (`attempts` in total), so the processes of a worker pool each get their own port.
+    Returns the port, or None when none was free.
+    """
+    for candidate in range(port, port + attempts):
+        try:
+            server = ThreadingHTTPServer((host, candidate), _Handler)
+        except OSError:
+            continue
+        threading.Thread(target=server.serve_forever, name="metrics-server", daemon=True).start()
+        return candidate
+    return None
@@ -0,0 +1,49 @@
+"""
+Explicit schema creation, run once per deployment before the API and workers are started.
+
+The API used to run SQLModel.metadata.create_all on startup: every replica (and every restart) inspected the
+schema table by table before serving requests, and concurrently starting replicas raced to create the same
+tables. Run it as a release / init step instead:
+
+    python -m backend.migrate          # Create the tables (and their indexes) that do not exist yet
+    python -m backend.migrate status   # List the tables that are missing
+
+create_all does not change existing tables. Databases created before a schema change are migrated by the
+feature's own command, e.g. `python -m backend.listing migrate`, `python -m backend.text_search migrate`,
+`python -m backend.document_text migrate`, `python -m backend.vector_storage migrate`,
+`python -m backend.ingestion migrate` and `python -m backend.deletion migrate`.
+"""
+from typing import List
+import argparse
+from sqlalchemy import inspect
+from sqlmodel import SQLModel
+import backend.models # noqa: F401 - registers all tables on SQLModel.metadata
+
+
+def missing_tables(engine) -> List[str]:
+    with engine.connect() as connection:
+        existing = set(inspect(connection).get_table_names())
+    return [table.name for table in SQLModel.metadata.sorted_tables if table.name not in existing]
+
+
+def migrate(engine) -> List[str]:
+    """Create the missing tables; returns their names."""
+    missing = missing_tables(engine)
+    SQLModel.metadata.create_all(engine)
+    print(f"Created tables: {', '.join(missing)}." if missing else "All tables exist.")
+    return missing
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Create the database schema (run before starting the API and workers).")
+    parser.add_argument("action", nargs="?", default="migrate", choices=["migrate", "status"])
+    args = parser.parse_args()
+
+    from backend.container import get_engine
+    if args.action == "migrate":
+        migrate(get_engine())
+    print({"missing_tables": missing_tables(get_engine())})
+
+
+if __name__ == "__main__":
+    main()
@@ -2,10 +2,13 @@ from typing import List, Optional
 from sqlmodel import Field, SQLModel, Relationship
 from datetime import datetime
 import uuid
-from sqlalchemy import Column # Import Column
-from sqlalchemy.dialects.postgresql import JSONB # Import JSONB
+from sqlalchemy import DDL, Column, Computed, Index, LargeBinary, event # Import Column
+from sqlalchemy.dialects.postgresql import JSONB, TSVECTOR # Import JSONB
 from pgvector.sqlalchemy import Vector # Import Vector
-from backend.dependencies import engine # Import the database engine
+from backend.text_search import TSVECTOR_EXPRESSION, TSVECTOR_INDEX_NAME
+
+CASE_LISTING_INDEX = "ix_case_user_id_created_at_id"
+DOCUMENT_LISTING_INDEX = "ix_document_case_id_uploaded_at_id"
 
 class Case(SQLModel, table=True):
     id: Optional[uuid.UUID] = Field(default_factory=uuid.uuid4, primary_key=True, index=True)
@@ -13,21 +16,56 @@ class Case(SQLModel, table=True):
     name: str = Field(index=True)
     created_at: datetime = Field(default_factory=datetime.utcnow, nullable=False)
 
-    documents: List["Document"] = Relationship(back_populates="case")
-    reports: List["GeneratedReport"] = Relationship(back_populates="case")
+    # passive_deletes: deleting a case leaves its documents and reports to ON DELETE CASCADE (see backend/deletion.py)
+    documents: List["Document"] = Relationship(back_populates="case", sa_relationship_kwargs={"passive_deletes": True})
+    reports: List["GeneratedReport"] = Relationship(back_populates="case", sa_relationship_kwargs={"passive_deletes": True})
 
 class Document(SQLModel, table=True):
     id: Optional[uuid.UUID] = Field(default_factory=uuid.uuid4, primary_key=True, index=True)
-    case_id: uuid.UUID = Field(foreign_key="case.id", index=True)
+    case_id: uuid.UUID = Field(foreign_key="case.id", index=True, ondelete="CASCADE")
     file_name: str
     file_path: str # Path in Supabase Storage
     file_type: str # e.g., 'docx', 'txt'
     uploaded_at: datetime = Field(default_factory=datetime.utcnow, nullable=False)
-    processing_status: str = Field(default="uploaded") # e.g., 'uploaded', 'processing', 'completed', 'failed'
-    parsed_content: Optional[str] = Field(default=None) # Store extracted text content
+    processing_status: str = Field(default="uploaded") # e.g., 'uploaded', 'queued', 'processing', 'completed', 'failed'
+    # The extracted text content is stored compressed in DocumentText (see backend/document_text.py)
 
     case: Case = Relationship(back_populates="documents")
-    chunks: List["Chunk"] = Relationship(back_populates="document")
+    chunks: List["Chunk"] = Relationship(back_populates="document", sa_relationship_kwargs={"passive_deletes": True})
+
+# Keyset pagination of listings (see backend/listing.py): newest first, with the id as tie-breaker
+Index(CASE_LISTING_INDEX, Case.user_id, Case.created_at, Case.id)
+Index(DOCUMENT_LISTING_INDEX, Document.case_id, Document.uploaded_at, Document.id)
+
+class DocumentText(SQLModel, table=True):
+    # Parsed text of a document, compressed and stored out of the document row (see backend/document_text.py)
+    document_id: uuid.UUID = Field(primary_key=True, foreign_key="document.id", ondelete="CASCADE")
+    codec: str = Field(max_length=8) # 'zstd', 'zlib' or 'none'
+    size: int # Length of the text in UTF-8 bytes
+    data: bytes = Field(sa_column=Column(LargeBinary, nullable=False))
+
+# The data is already compressed: store it out of line without another (pglz) compression attempt
+event.listen(DocumentText.__table__, "after_create", DDL("ALTER TABLE %(table)s ALTER COLUMN data SET STORAGE EXTERNAL"))
+
+class CaseSummary(SQLModel):
+    # Listing projection of Case (GET /cases/)
+    id: uuid.UUID
+    name: str
+    created_at: datetime
+
+class DocumentSummary(SQLModel):
+    # Listing projection of Document without parsed_content (GET /documents/case/{case_id})
+    id: uuid.UUID
+    case_id: uuid.UUID
+    file_name: str
+    file_path: str
+    file_type: str
+    uploaded_at: datetime
+    processing_status: str
+
+class DocumentDetail(DocumentSummary):
+    # A document with its parsed text (GET /documents/{document_id})
+    parsed_content: Optional[str] = None
 
 class ReportTemplate(SQLModel, table=True):
     id: Optional[uuid.UUID] = Field(default_factory=uuid.uuid4, primary_key=True, index=True)
@@ -39,8 +77,8 @@ class ReportTemplate(SQLModel, table=True):
 
 class GeneratedReport(SQLModel, table=True):
     id: Optional[uuid.UUID] = Field(default_factory=uuid.uuid4, primary_key=True, index=True)
-    case_id: uuid.UUID = Field(foreign_key="case.id", index=True)
-    template_id: uuid.UUID = Field(foreign_key="reporttemplate.id", index=True)
+    case_id: uuid.UUID = Field(foreign_key="case.id", index=True, ondelete="CASCADE")
+    template_id: Optional[uuid.UUID] = Field(default=None, foreign_key="reporttemplate.id", index=True) # None when no template is used
     generated_at: datetime = Field(default_factory=datetime.utcnow, nullable=False)
     content: dict = Field(sa_column=Column(JSONB)) # Use JSONB for dict
     generation_status: str = Field(default="pending") # e.g., 'pending', 'generating', 'completed', 'failed'
@@ -50,12 +88,46 @@ class GeneratedReport(SQLModel, table=True):
 
 class Chunk(SQLModel, table=True):
     id: Optional[uuid.UUID] = Field(default_factory=uuid.uuid4, primary_key=True, index=True)
-    document_id: uuid.UUID = Field(foreign_key="document.id", index=True)
+    document_id: uuid.UUID = Field(foreign_key="document.id", index=True, ondelete="CASCADE")
     content: str
     embedding: Vector = Field(sa_column=Column(Vector(1536))) # Change type hint to Vector
+    position: Optional[int] = None # Order of the chunk in its document; None for chunks saved before it was added
     created_at: datetime = Field(default_factory=datetime.utcnow, nullable=False)
 
     document: Document = Relationship(back_populates="chunks")
 
     class Config:
         arbitrary_types_allowed = True
+
+# Dutch full-text search vector of the content, generated by PostgreSQL (see backend/text_search.py).
+# Not mapped on the model, so it is never sent on insert nor loaded with the chunks.
+Chunk.__table__.append_column(Column("content_tsv", TSVECTOR, Computed(TSVECTOR_EXPRESSION, persisted=True)))
+Index(TSVECTOR_INDEX_NAME, Chunk.__table__.c.content_tsv, postgresql_using="gin")
+
+class EmbeddingCacheEntry(SQLModel, table=True):
+    # Content-addressed embedding cache: key is sha256(model + normalized chunk text), see backend/embedding_cache.py
+    key: str = Field(primary_key=True, max_length=64)
+    model: str = Field(index=True)
+    embedding: Vector = Field(sa_column=Column(Vector(1536)))
+    created_at: datetime = Field(default_factory=datetime.utcnow, nullable=False)
+    last_used_at: datetime = Field(default_factory=datetime.utcnow, nullable=False, index=True) # Used for LRU eviction
+
+    class Config:
+        arbitrary_types_allowed = True
+
+class ResponseCacheEntry(SQLModel, table=True):
+    # Cached report text: key is sha256(model + normalized prompt + chunk fingerprint), see backend/response_cache.py
+    key: str = Field(primary_key=True, max_length=64)
+    case_id: uuid.UUID = Field(index=True) # No foreign key: entries are deleted explicitly when the case's documents change
+    model: str
+    prompt: str # Normalized prompt
+    chunk_fingerprint: str = Field(max_length=64)
+    prompt_embedding: Optional[Vector] = Field(default=None, sa_column=Column(Vector(1536))) # For matching near-identical prompts
+    response: dict = Field(sa_column=Column(JSONB))
+    generation_seconds: float = 0.0 # LLM time the entry saves on every hit
+    hits: int = 0
+    created_at: datetime = Field(default_factory=datetime.utcnow, nullable=False)
+    last_used_at: datetime = Field(default_factory=datetime.utcnow, nullable=False, index=True) # Used for LRU eviction
+
+    class Config:
+        arbitrary_types_allowed = True
@@ -0,0 +1,120 @@
+"""
+Cache for query and prompt embeddings used by the search and reports routers.
+
+Lookups go through two tiers:
+1. An in-process LRU cache with a TTL (QUERY_EMBEDDING_CACHE_SIZE entries, QUERY_EMBEDDING_CACHE_TTL seconds).
+2. An optional Redis tier shared by all API workers (QUERY_EMBEDDING_CACHE_REDIS_URL, disabled when not set).
+
+Only misses in both tiers are sent to the embedding client.
+"""
+from typing import List, Optional
+import hashlib
+import os
+import struct
+import threading
+import time
+from dotenv import load_dotenv
+from backend.container import container
+from backend.embedding_cache import normalize_text
+from backend.ttl_cache import TTLLRUCache
+
+load_dotenv()
+
+QUERY_EMBEDDING_CACHE_SIZE = int(os.getenv("QUERY_EMBEDDING_CACHE_SIZE", "1024"))
+QUERY_EMBEDDING_CACHE_TTL = float(os.getenv("QUERY_EMBEDDING_CACHE_TTL", "3600"))
+QUERY_EMBEDDING_CACHE_REDIS_URL = os.getenv("QUERY_EMBEDDING_CACHE_REDIS_URL")
+
+
+class QueryEmbeddingCache:
+    def __init__(self, client, max_entries: int = QUERY_EMBEDDING_CACHE_SIZE, ttl: float = QUERY_EMBEDDING_CACHE_TTL, redis_url: Optional[str] = QUERY_EMBEDDING_CACHE_REDIS_URL):
+        self.client = client
+        self.ttl = ttl
+        self.local = TTLLRUCache(max_entries, ttl)
+        self.redis = None
+        if redis_url:
+            import redis
+            self.redis = redis.Redis.from_url(redis_url, socket_timeout=0.1, socket_connect_timeout=0.1)
+        self._lock = threading.Lock()
+        self.local_hits = 0
+        self.redis_hits = 0
+        self.misses = 0
+        self.embedding_seconds = 0.0 # Time spent embedding misses
+        self.lookup_seconds = 0.0 # Time spent serving hits
+
+    def _key(self, text: str) -> str:
+        digest = hashlib.sha256(f"{self.client.model}\x00{normalize_text(text)}".encode("utf-8")).hexdigest()
+        return f"query_embedding:{digest}"
+
+    def _redis_get(self, key: str) -> Optional[List[float]]:
+        try:
+            packed = self.redis.get(key)
+        except Exception as e:
+            print(f"Query embedding cache: Redis lookup failed: {e}")
+            return None
+        if not packed:
+            return None
+        return list(struct.unpack(f"<{len(packed) // 4}f", packed))
+
+    def _redis_set(self, key: str, vector: List[float]):
+        try:
+            self.redis.set(key, struct.pack(f"<{len(vector)}f", *vector), ex=int(self.ttl))
+        except Exception as e:
+            print(f"Query embedding cache: Redis store failed: {e}")
+
+    def embed(self, text: str) -> List[float]:
+        """Return the embedding for a query, from cache when possible."""
+        start = time.perf_counter()
+        key = self._key(text)
+
+        vector = self.local.get(key)
+        if vector is not None:
+            self._record("local", time.perf_counter() - start)
+            return vector
+
+        if self.redis is not None:
+            vector = self._redis_get(key)
+            if vector is not None:
+                self.local.set(key, vector)
+                self._record("redis", time.perf_counter() - start)
+                return vector
+
+        vector = self.client.embed_one(text)
+        self.local.set(key, vector)
+        if self.redis is not None:
+            self._redis_set(key, vector)
+        self._record("miss", time.perf_counter() - start)
+        return vector
+
+    def _record(self, outcome: str, seconds: float):
+        with self._lock:
+            if outcome == "miss":
+                self.misses += 1
+                self.embedding_seconds += seconds
+            else:
+                if outcome == "local":
+                    self.local_hits += 1
+                else:
+                    self.redis_hits += 1
+                self.lookup_seconds += seconds
+
+    def stats(self) -> dict:
+        with self._lock:
+            hits = self.local_hits + self.redis_hits
+            lookups = hits + self.misses
+            seconds_per_miss = self.embedding_seconds / self.misses if self.misses else 0.0
+            return {
+                "local_hits": self.local_hits,
+                "redis_hits": self.redis_hits,
+                "misses": self.misses,
+                "hit_rate": round(hits / lookups, 4) if lookups else 0.0,
+                "entries": len(self.local),
+                "redis_enabled": self.redis is not None,
+                "avg_miss_ms": round(seconds_per_miss * 1000, 3),
+                "avg_hit_ms": round(self.lookup_seconds / hits * 1000, 3) if hits else 0.0,
+                "estimated_seconds_saved": round(max(hits * seconds_per_miss - self.lookup_seconds, 0.0), 3),
+            }
+
+
+def get_query_embedding_cache() -> QueryEmbeddingCache:
+    """Return the process-wide query embedding cache, creating it on first use (see backend/container.py)."""
+    return container.get("query_embedding_cache")
@@ -0,0 +1,510 @@
+"""
+Report generation (RAG) shared by the reports router and the Celery worker.
+
+Steps: embed the prompt -> vector search for relevant chunks -> prepare context -> call the LLM
+via OpenRouter -> structure the generated content.
+
+Reports can be generated inline by the API, streamed to the client token by token (Server-Sent Events),
+or queued: the API creates a GeneratedReport in 'pending'
+state and the generate_report_task Celery task moves generation_status through
+'pending' -> 'generating' -> 'completed' / 'failed'.
+
+With a ReportTemplate, every section of template_schema gets its own retrieval query and LLM call.
+Sections are generated concurrently (REPORT_SECTION_CONCURRENCY) and assembled in schema order.
+
+The retrieved chunks are packed into a token-budgeted, de-duplicated context in reading order (see
+backend/context_packing.py); every result reports the tokens saved against the plain top-k context.
+
+Generated text is cached per model, prompt and retrieved chunks (see backend/response_cache.py); `use_cache=False`
+skips the lookup and replaces the cached text with a freshly generated one.
+
+The time of every stage (query_embed, vector_query, context_pack, llm, save), the context and LLM tokens and
+failures are recorded as metrics (see backend/metrics.py).
+"""
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import nullcontext
+from datetime import datetime, timedelta
+from typing import TYPE_CHECKING, AsyncIterator, List, Optional, Tuple
+from uuid import UUID
+import asyncio
+import os
+import time
+from dotenv import load_dotenv
+from sqlmodel import Session, select
+from sqlmodel.ext.asyncio.session import AsyncSession
+from backend.container import container
+from backend.context_packing import (
+    REPORT_CONTEXT_CANDIDATES, REPORT_CONTEXT_CHUNKS, REPORT_CONTEXT_PACKING, PackedContext, pack_context, top_context
+)
+from backend.metrics import REPORT_FAILURES, REPORT_STAGE_SECONDS, REPORT_TOKENS, timed
+from backend.models import GeneratedReport, ReportTemplate
+from backend.query_cache import get_query_embedding_cache
+from backend.response_cache import RESPONSE_CACHE_ENABLED, cache_stats as response_cache_stats, response_cache
+from backend.text_search import retrieve_chunks
+
+if TYPE_CHECKING:
+    from openai import AsyncOpenAI, OpenAI # Imported on first use: the openai package takes about half a second to import
+
+load_dotenv()
+
+# Choose a model (using openrouter/auto for automatic selection)
+GENERATION_MODEL = os.getenv("GENERATION_MODEL", "openrouter/auto")
+REPORT_SECTION_CONCURRENCY = int(os.getenv("REPORT_SECTION_CONCURRENCY", "4")) # Template sections generated at the same time
+REPORT_MAX_ATTEMPTS = int(os.getenv("REPORT_MAX_ATTEMPTS", "3")) # Generations of a queued report interrupted by a worker crash
+
+SYSTEM_PROMPT = "You are a helpful assistant that generates report sections based on provided context."
+
+
+class ReportGenerationError(Exception):
+    """Raised when a step of report generation fails. `detail` is safe to return to the client."""
+
+    def __init__(self, detail: str):
+        super().__init__(detail)
+        self.detail = detail
+
+
+def get_llm_client() -> "OpenAI":
+    """Return the OpenAI client configured for OpenRouter, creating it on first use (see backend/container.py)."""
+    return container.get("llm_client")
+
+
+def get_async_llm_client() -> "AsyncOpenAI":
+    """Async variant of get_llm_client, used for streaming responses on the event loop."""
+    return container.get("async_llm_client")
+
+
+def build_messages(context: str, prompt: str) -> List[dict]:
+    """Construct the messages for the LLM, including the context and user prompt."""
+    return [
+        {"role": "system", "content": SYSTEM_PROMPT},
+        {"role": "user", "content": f"""
+            Based on the following document excerpts (context) and the user's request (prompt), generate a draft report section.
+
+            Context:
+            {context}
+
+            User Request:
+            {prompt}
+
+            Generated Report Section:
+            """}
+    ]
+
+
+def embed_prompt(prompt: str) -> List[float]:
+    try:
+        # Repeated prompts are served from the query embedding cache (see backend/query_cache.py)
+        with timed(REPORT_STAGE_SECONDS, "report.query_embed", stage="query_embed"):
+            return get_query_embedding_cache().embed(prompt)
+    except Exception as e:
+        REPORT_FAILURES.inc(stage="query_embed")
+        print(f"Error during embedding generation: {e}")
+        raise ReportGenerationError(f"Failed to generate prompt embedding: {e}")
+
+
+def search_context(session: Session, case_id: UUID, prompt_embedding: List[float], prompt: Optional[str] = None) -> PackedContext:
+    limit = REPORT_CONTEXT_CANDIDATES if REPORT_CONTEXT_PACKING else REPORT_CONTEXT_CHUNKS
+    try:
+        # Vector search (exact or ANN, see backend/vector_index.py), fused with Dutch full-text matches
+        # of the prompt when SEARCH_MODE is 'hybrid' (see backend/text_search.py)
+        with timed(REPORT_STAGE_SECONDS, "report.vector_query", stage="vector_query"):
+            results, used_strategy = retrieve_chunks(session, case_id, prompt, prompt_embedding, limit=limit)
+        print(f"Found {len(results)} relevant chunks for case {case_id} ('{used_strategy}' strategy).")
+    except Exception as e:
+        REPORT_FAILURES.inc(stage="vector_query")
+        print(f"Error during vector search for case {case_id}: {e}")
+        raise ReportGenerationError(f"Vector search failed: {e}")
+    if not REPORT_CONTEXT_PACKING:
+        context = top_context(results)
+        REPORT_TOKENS.inc(context.tokens, kind="context")
+        return context
+    try:
+        with timed(REPORT_STAGE_SECONDS, "report.context_pack", stage="context_pack"):
+            context = pack_context(session, results)
+    except Exception as e:
+        REPORT_FAILURES.inc(stage="context_pack")
+        print(f"Error during context packing for case {case_id}: {e}")
+        raise ReportGenerationError(f"Context packing failed: {e}")
+    REPORT_TOKENS.inc(context.tokens, kind="context")
+    print(f"Packed {len(context.chunks)} of {context.candidates} chunks into {context.tokens} tokens "
+          f"({context.tokens_saved} fewer than the top {REPORT_CONTEXT_CHUNKS}).")
+    return context
+
+
+def retrieve_context(session: Session, case_id: UUID, prompt: str) -> PackedContext:
+    """Embed the prompt and return the packed context of the most similar chunks of the case."""
+    return search_context(session, case_id, embed_prompt(prompt), prompt)
+
+
+async def retrieve_context_async(session: AsyncSession, case_id: UUID, prompt: str) -> PackedContext:
+    """retrieve_context for async handlers: the embedding call runs in a thread, the search on the async session."""
+    prompt_embedding = await asyncio.to_thread(embed_prompt, prompt)
+    return await session.run_sync(search_context, case_id, prompt_embedding, prompt)
+
+
+def _messages_for(context: PackedContext, prompt: str) -> List[dict]:
+    return build_messages("\n\n".join(context.chunks), prompt) # Join chunks with double newline
+
+
+def prepare_generation(session: Session, case_id: UUID, prompt: str) -> Tuple[List[dict], PackedContext]:
+    """Retrieve the context for a prompt and return the LLM messages and the packed context."""
+    context = retrieve_context(session, case_id, prompt)
+    return _messages_for(context, prompt), context
+
+
+async def prepare_generation_async(session: AsyncSession, case_id: UUID, prompt: str) -> Tuple[List[dict], PackedContext]:
+    context = await retrieve_context_async(session, case_id, prompt)
+    return _messages_for(context, prompt), context
+
+
+def build_content(prompt: str, generated_text: str, used_chunks_count: int, context: Optional[PackedContext] = None) -> dict:
+    # Structure the generated content (this might need refinement based on template)
+    content = {
+        "prompt": prompt,
+        "generated_text": generated_text,
+        "used_chunks_count": used_chunks_count,
+    }
+    if context is not None:
+        content["context"] = context.stats()
+    return content
+
+
+def complete(messages: List[dict]) -> str:
+    """Send the messages to the LLM and return the generated text."""
+    try:
+        with timed(REPORT_STAGE_SECONDS, "report.llm", stage="llm"):
+            response = get_llm_client().chat.completions.create(
+                model=GENERATION_MODEL,
+                messages=messages,
+                # Add optional headers for OpenRouter if needed for tracking/ranking
+                # extra_headers={
+                #     "HTTP-Referer": "YOUR_SITE_URL", # Replace with your site URL
+                #     "X-Title": "AD-Rapport Generator AI", # Replace with your site name
+                # },
+            )
+    except Exception as e:
+        REPORT_FAILURES.inc(stage="llm")
+        raise ReportGenerationError(f"LLM report generation failed: {e}")
+    record_usage(response)
+    print(f"Generated report content using {GENERATION_MODEL} via OpenRouter.")
+    return response.choices[0].message.content
+
+
+async def complete_async(messages: List[dict]) -> str:
+    """complete() with the async client, for async handlers."""
+    try:
+        with timed(REPORT_STAGE_SECONDS, "report.llm", stage="llm"):
+            response = await get_async_llm_client().chat.completions.create(model=GENERATION_MODEL, messages=messages)
+    except Exception as e:
+        REPORT_FAILURES.inc(stage="llm")
+        raise ReportGenerationError(f"LLM report generation failed: {e}")
+    record_usage(response)
+    print(f"Generated report content using {GENERATION_MODEL} via OpenRouter.")
+    return response.choices[0].message.content
+
+
+def cached_response(session: Session, case_id: UUID, prompt: str, relevant_chunks_content: List[str],
+                    prompt_embedding: Optional[List[float]] = None, use_cache: bool = True) -> Optional[dict]:
+    """Return the cached response for a prompt and its context, or None. Cache errors never fail generation."""
+    if not RESPONSE_CACHE_ENABLED:
+        return None
+    if not use_cache:
+        response_cache_stats.record("bypass")
+        return None
+    try:
+        return response_cache.lookup(session, case_id, GENERATION_MODEL, prompt, relevant_chunks_content, prompt_embedding)
+    except Exception as e:
+        print(f"Response cache lookup failed: {e}")
+        session.rollback()
+        return None
+
+
+def cache_response(session: Session, case_id: UUID, prompt: str, relevant_chunks_content: List[str], response: dict,
+                   generation_seconds: float, prompt_embedding: Optional[List[float]] = None):
+    if not RESPONSE_CACHE_ENABLED:
+        return
+    try:
+        response_cache.store(session, case_id, GENERATION_MODEL, prompt, relevant_chunks_content, response, generation_seconds, prompt_embedding)
+    except Exception as e:
+        print(f"Response cache store failed: {e}")
+        session.rollback()
+
+
+def generate_report_content(session: Session, case_id: UUID, prompt: str, use_cache: bool = True) -> dict:
+    """Run retrieval and generation for a prompt and return the structured report content."""
+    prompt_embedding = embed_prompt(prompt)
+    context = search_context(session, case_id, prompt_embedding, prompt)
+    cached = cached_response(session, case_id, prompt, context.chunks, prompt_embedding, use_cache)
+    if cached:
+        return {"prompt": prompt, **cached, "context": context.stats()}
+
+    start = time.perf_counter()
+    content = build_content(prompt, complete(_messages_for(context, prompt)), len(context.chunks), context)
+    cache_response(session, case_id, prompt, context.chunks, {"generated_text": content["generated_text"], "used_chunks_count": len(context.chunks)},
+                   time.perf_counter() - start, prompt_embedding)
+    return {**content, "cache": "miss" if use_cache else "bypass"}
+
+
+async def generate_report_content_async(session: AsyncSession, case_id: UUID, prompt: str, use_cache: bool = True) -> dict:
+    """generate_report_content for async handlers; database work runs on the async session."""
+    prompt_embedding = await asyncio.to_thread(embed_prompt, prompt)
+    context = await session.run_sync(search_context, case_id, prompt_embedding, prompt)
+    cached = await session.run_sync(cached_response, case_id, prompt, context.chunks, prompt_embedding, use_cache)
+    if cached:
+        return {"prompt": prompt, **cached, "context": context.stats()}
+
+    start = time.perf_counter()
+    content = build_content(prompt, await complete_async(_messages_for(context, prompt)), len(context.chunks), context)
+    await session.run_sync(cache_response, case_id, prompt, context.chunks,
+                           {"generated_text": content["generated_text"], "used_chunks_count": len(context.chunks)},
+                           time.perf_counter() - start, prompt_embedding)
+    return {**content, "cache": "miss" if use_cache else "bypass"}
+
+
+def template_sections(template_schema) -> List[dict]:
+    """
+    Return the sections of a template schema as [{"id", "title", "prompt", "query"}], in schema order.
+    Supported shapes:
+    - {"sections": [{"id": ..., "title": ..., "prompt": ..., "query": ...}, ...]} ("query" defaults to the prompt,
+      "prompt" to the title; a section may also be just a title string),
+    - a JSON Schema with "properties": {"<id>": {"title": ..., "description": ..., "order": ...}, ...}.
+      JSONB does not keep the key order of objects, so properties are sorted by their "order" value.
+    """
+    if isinstance(template_schema, dict) and isinstance(template_schema.get("properties"), dict):
+        properties = sorted(template_schema["properties"].items(), key=lambda item: item[1].get("order", 0))
+        sections = [{"id": key, "title": value.get("title", key), "prompt": value.get("description")} for key, value in properties]
+    elif isinstance(template_schema, dict):
+        sections = template_schema.get("sections")
+    else:
+        sections = template_schema
+    if not isinstance(sections, list) or not sections:
+        raise ReportGenerationError("Report template has no sections")
+
+    result = []
+    for index, section in enumerate(sections):
+        if isinstance(section, str):
+            section = {"title": section}
+        title = section.get("title") or section.get("id") or f"Section {index + 1}"
+        prompt = section.get("prompt") or title
+        result.append({
+            "id": section.get("id") or f"section_{index + 1}",
+            "title": title,
+            "prompt": prompt,
+            "query": section.get("query") or prompt,
+        })
+    return result
+
+
+def _usage(response) -> Optional[dict]:
+    usage = getattr(response, "usage", None)
+    if usage is None:
+        return None
+    return {"prompt_tokens": usage.prompt_tokens, "completion_tokens": usage.completion_tokens, "total_tokens": usage.total_tokens}
+
+
+def record_usage(response):
+    """Count the prompt and completion tokens the LLM reported for a response."""
+    usage = _usage(response)
+    if usage:
+        REPORT_TOKENS.inc(usage["prompt_tokens"] or 0, kind="prompt")
+        REPORT_TOKENS.inc(usage["completion_tokens"] or 0, kind="completion")
+
+
+def _section_prompt(section: dict, prompt: str) -> str:
+    """The LLM prompt for a template section; `prompt` is added as additional instructions."""
+    section_prompt = f"{section['title']}\n{section['prompt']}"
+    if prompt:
+        section_prompt += f"\n\nAdditional instructions: {prompt}"
+    return section_prompt
+
+
+async def prepare_template_generation_async(session: AsyncSession, case_id: UUID, template_schema,
+                                            prompt: str = "") -> List[Tuple[dict, List[dict], PackedContext]]:
+    """Retrieve the context of every template section and return (section, LLM messages, packed context) in schema order."""
+    prepared = []
+    for section in template_sections(template_schema):
+        context = await retrieve_context_async(session, case_id, section["query"])
+        prepared.append((section, _messages_for(context, _section_prompt(section, prompt)), context))
+    return prepared
+
+
+def assemble_template_content(prompt: str, results: List[dict]) -> dict:
+    """Combine generated template sections (each with id, title, generated_text, used_chunks_count and context) into report content."""
+    return {
+        "prompt": prompt,
+        # The assembled report, one Markdown heading per section
+        "generated_text": "\n\n".join(f"## {result['title']}\n\n{result['generated_text']}" for result in results),
+        "used_chunks_count": sum(result["used_chunks_count"] for result in results),
+        "sections": results,
+        "context": {key: sum(result["context"][key] for result in results) for key in ("tokens", "baseline_tokens", "tokens_saved")},
+    }
+
+
+def _generate_section(engine, case_id: UUID, section: dict, prompt: str, use_cache: bool = True) -> dict:
+    """Retrieve context for one template section and generate its text. Runs in a worker thread with its own session."""
+    start = time.perf_counter()
+    section_prompt = _section_prompt(section, prompt)
+
+    with Session(engine) as session:
+        context = retrieve_context(session, case_id, section["query"])
+        retrieval_seconds = time.perf_counter() - start
+        # Exact matches only: the prompt embedding is that of the section query, not of the full section prompt
+        cached = cached_response(session, case_id, section_prompt, context.chunks, use_cache=use_cache)
+        if cached:
+            total_seconds = time.perf_counter() - start
+            return {
+                "id": section["id"],
+                "title": section["title"],
+                "generated_text": cached["generated_text"],
+                "used_chunks_count": cached["used_chunks_count"],
+                "timings": {"retrieval_seconds": round(retrieval_seconds, 3), "generation_seconds": 0.0, "total_seconds": round(total_seconds, 3)},
+                "usage": None,
+                "cache": cached["cache"],
+                "context": context.stats(),
+            }
+
+        messages = _messages_for(context, section_prompt)
+        try:
+            with timed(REPORT_STAGE_SECONDS, "report.llm", stage="llm"):
+                response = get_llm_client().chat.completions.create(model=GENERATION_MODEL, messages=messages)
+        except Exception as e:
+            REPORT_FAILURES.inc(stage="llm")
+            raise ReportGenerationError(f"LLM report generation failed: {e}")
+        record_usage(response)
+        total_seconds = time.perf_counter() - start
+        generated_text = response.choices[0].message.content
+        cache_response(session, case_id, section_prompt, context.chunks,
+                       {"generated_text": generated_text, "used_chunks_count": len(context.chunks)}, total_seconds - retrieval_seconds)
+
+    return {
+        "id": section["id"],
+        "title": section["title"],
+        "generated_text": generated_text,
+        "used_chunks_count": len(context.chunks),
+        "timings": {
+            "retrieval_seconds": round(retrieval_seconds, 3),
+            "generation_seconds": round(total_seconds - retrieval_seconds, 3),
+            "total_seconds": round(total_seconds, 3),
+        },
+        "usage": _usage(response),
+        "cache": "miss" if use_cache else "bypass",
+        "context": context.stats(),
+    }
+
+
+def generate_template_report_content(engine, case_id: UUID, template_schema, prompt: str = "",
+                                     concurrency: int = REPORT_SECTION_CONCURRENCY, use_cache: bool = True) -> dict:
+    """
+    Generate every section of a report template concurrently and assemble them in schema order.
+    The wall-clock time approaches that of the slowest section instead of the sum of all sections.
+    `prompt` is added to every section as additional instructions. Every section uses its own session
+    from the (synchronous) `engine`; sessions are not thread-safe.
+    """
+    sections = template_sections(template_schema)
+    start = time.perf_counter()
+
+    executor = ThreadPoolExecutor(max_workers=max(1, min(concurrency, len(sections))), thread_name_prefix="report-section")
+    futures = [executor.submit(_generate_section, engine, case_id, section, prompt, use_cache) for section in sections]
+    results = []
+    try:
+        for section, future in zip(sections, futures):
+            try:
+                results.append(future.result())
+            except ReportGenerationError as e:
+                raise ReportGenerationError(f"Section '{section['title']}': {e.detail}")
+    finally:
+        # On failure the remaining sections are not started
+        executor.shutdown(wait=True, cancel_futures=True)
+    total_seconds = time.perf_counter() - start
+
+    usage = None
+    if all(result["usage"] for result in results):
+        usage = {key: sum(result["usage"][key] for result in results) for key in ("prompt_tokens", "completion_tokens", "total_tokens")}
+    for result in results:
+        print(f"Section '{result['id']}': {result['timings']['total_seconds']}s, usage {result['usage']}")
+    print(f"Generated {len(results)} sections for case {case_id} in {total_seconds:.2f}s "
+          f"(sum of sections {sum(result['timings']['total_seconds'] for result in results):.2f}s).")
+
+    content = assemble_template_content(prompt, results)
+    content["timings"] = {"total_seconds": round(total_seconds, 3), "concurrency": concurrency}
+    content["usage"] = usage
+    return content
+
+
+async def stream_completion(messages: List[dict]) -> AsyncIterator[str]:
+    """Yield the generated text piece by piece as the LLM produces it (streaming chat completion)."""
+    try:
+        with timed(REPORT_STAGE_SECONDS, "report.llm", stage="llm"): # Until the last piece
+            stream = await get_async_llm_client().chat.completions.create(
+                model=GENERATION_MODEL,
+                messages=messages,
+                stream=True,
+            )
+            async for event in stream:
+                if event.choices and event.choices[0].delta and event.choices[0].delta.content:
+                    yield event.choices[0].delta.content
+    except Exception:
+        REPORT_FAILURES.inc(stage="llm")
+        raise
+
+
+def _set_status(session: Session, report: GeneratedReport, generation_status: str, content: Optional[dict] = None):
+    report.generation_status = generation_status
+    if content is not None:
+        report.content = content
+    session.add(report)
+    with timed(REPORT_STAGE_SECONDS, "report.save", stage="save") if generation_status == "completed" else nullcontext():
+        session.commit()
+    session.refresh(report)
+
+
+def run_queued_report(session: Session, report_id: UUID, lease_seconds: float) -> str:
+    """
+    Generate the content of a queued (pending) report. The prompt is stored in report.content['prompt']
+    (and the cache flag in report.content['use_cache']) when the report is queued. Returns the final generation_status.
+
+    The worker that generates a report holds it for `lease_seconds` from report.content['claimed_at'] (the task's
+    time limit, see generate_report_task). A delivery that finds the report 'generating' within the lease leaves it
+    alone and returns 'generating': the first worker may still be running. After the lease, the worker that claimed
+    it has stopped, and the report is generated again, up to REPORT_MAX_ATTEMPTS times, then marked failed.
+    """
+    # The row lock makes the check and the claim atomic; it is released when the claim is committed
+    report = session.exec(select(GeneratedReport).where(GeneratedReport.id == report_id).with_for_update()).first()
+    if not report:
+        print(f"Report {report_id} not found.")
+        return "missing"
+    if report.generation_status not in ("pending", "generating"):
+        session.rollback()
+        print(f"Report {report_id} is already {report.generation_status}; skipping.")
+        return report.generation_status
+
+    prompt = (report.content or {}).get("prompt", "")
+    use_cache = (report.content or {}).get("use_cache", True)
+    attempts = (report.content or {}).get("attempts", 0)
+    if report.generation_status == "generating":
+        claimed_at = (report.content or {}).get("claimed_at")
+        if claimed_at and datetime.utcnow() - datetime.fromisoformat(claimed_at) < timedelta(seconds=lease_seconds):
+            session.rollback()
+            print(f"Report {report_id} is being generated by another worker (claimed at {claimed_at}); skipping.")
+            return "generating"
+        if attempts >= REPORT_MAX_ATTEMPTS:
+            print(f"Report {report_id} was interrupted {attempts} times; marking it failed.")
+            _set_status(session, report, "failed", {"prompt": prompt, "error": f"Generation was interrupted {attempts} times"})
+            return "failed"
+        print(f"Report {report_id} was interrupted (attempt {attempts}); generating it again.")
+    # The claim is committed before generating, so a later delivery can tell whether the lease has expired
+    _set_status(session, report, "generating", {**(report.content or {}), "attempts": attempts + 1, "claimed_at": datetime.utcnow().isoformat()})
+    try:
+        template = session.get(ReportTemplate, report.template_id) if report.template_id else None
+        if template:
+            content = generate_template_report_content(session.get_bind(), report.case_id, template.template_schema, prompt, use_cache=use_cache)
+        else:
+            content = generate_report_content(session, report.case_id, prompt, use_cache=use_cache)
+    except Exception as e:
+        print(f"Report {report_id} generation failed: {e}")
+        session.rollback()
+        _set_status(session, report, "failed", {"prompt": prompt, "error": getattr(e, "detail", str(e))})
+        return "failed"
+    _set_status(session, report, "completed", content)
+    print(f"Saved generated report {report_id} for case {report.case_id}.")
+    return "completed"
@@ -0,0 +1,205 @@
+"""
+Cache of generated report text, stored in Postgres (table 'responsecacheentry') so it is shared by the API
+workers and the Celery worker.
+
+Entries are keyed on sha256(generation model + normalized prompt + chunk fingerprint). The chunk fingerprint
+is a hash of the set of retrieved chunk contents, so a cached text is only reused for exactly the context it
+was generated from. When RESPONSE_CACHE_SIMILARITY < 1, a prompt without an exact match may also reuse the
+entry of a near-identical prompt of the same case, model and chunk set whose prompt embedding has a cosine
+similarity of at least RESPONSE_CACHE_SIMILARITY.
+
+All entries of a case are deleted when its documents change (invalidate_case). Entries expire after
+RESPONSE_CACHE_TTL seconds, and the table is bounded to RESPONSE_CACHE_MAX_ENTRIES rows; the least recently
+used rows are evicted. Expired and excess rows are deleted every RESPONSE_CACHE_EVICT_INTERVAL stored entries
+(per process) instead of on every store, so the table can exceed the bound by that many rows per process until
+the next check. Lookups ignore expired rows that have not been deleted yet.
+"""
+from datetime import datetime, timedelta
+from typing import List, Optional
+from uuid import UUID
+import hashlib
+import os
+import threading
+from dotenv import load_dotenv
+from sqlalchemy import delete, func, select, update
+from sqlalchemy.dialects.postgresql import insert
+from sqlmodel import Session
+from backend.embedding_cache import normalize_text
+from backend.models import ResponseCacheEntry
+
+load_dotenv()
+
+RESPONSE_CACHE_ENABLED = os.getenv("RESPONSE_CACHE_ENABLED", "true").lower() == "true"
+RESPONSE_CACHE_MAX_ENTRIES = int(os.getenv("RESPONSE_CACHE_MAX_ENTRIES", "10000"))
+RESPONSE_CACHE_TTL = float(os.getenv("RESPONSE_CACHE_TTL", str(7 * 24 * 3600)))
+RESPONSE_CACHE_SIMILARITY = float(os.getenv("RESPONSE_CACHE_SIMILARITY", "0.97")) # 1 disables near-identical matching
+RESPONSE_CACHE_EVICT_INTERVAL = int(os.getenv("RESPONSE_CACHE_EVICT_INTERVAL", "100")) # Stored entries between size checks
+
+
+def normalize_prompt(prompt: str) -> str:
+    return normalize_text(prompt).casefold()
+
+
+def chunk_fingerprint(chunk_contents: List[str]) -> str:
+    """Order-independent hash of the retrieved chunks."""
+    digests = sorted(hashlib.sha256(content.encode("utf-8")).hexdigest() for content in chunk_contents)
+    return hashlib.sha256("\n".join(digests).encode("utf-8")).hexdigest()
+
+
+def cache_key(model: str, prompt: str, fingerprint: str) -> str:
+    return hashlib.sha256(f"{model}\x00{normalize_prompt(prompt)}\x00{fingerprint}".encode("utf-8")).hexdigest()
+
+
+class ResponseCacheStats:
+    """Process-wide counters, including an estimate of the generation time saved by hits."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.exact_hits = 0
+        self.similar_hits = 0
+        self.misses = 0
+        self.bypassed = 0
+        self.seconds_saved = 0.0 # Generation time of the cached responses that were served
+
+    def record(self, outcome: str, seconds_saved: float = 0.0):
+        with self._lock:
+            if outcome == "exact":
+                self.exact_hits += 1
+            elif outcome == "similar":
+                self.similar_hits += 1
+            elif outcome == "bypass":
+                self.bypassed += 1
+            else:
+                self.misses += 1
+            self.seconds_saved += seconds_saved
+
+    def snapshot(self) -> dict:
+        with self._lock:
+            hits = self.exact_hits + self.similar_hits
+            lookups = hits + self.misses
+            return {
+                "exact_hits": self.exact_hits,
+                "similar_hits": self.similar_hits,
+                "misses": self.misses,
+                "bypassed": self.bypassed,
+                "hit_rate": round(hits / lookups, 4) if lookups else 0.0,
+                "estimated_seconds_saved": round(self.seconds_saved, 3),
+            }
+
+
+cache_stats = ResponseCacheStats()
+
+_stored_lock = threading.Lock()
+_stored_since_check = 0 # Entries stored by this process since the cache size was last counted
+
+
+def _eviction_due() -> bool:
+    """Count a stored entry; True (and restart counting) once RESPONSE_CACHE_EVICT_INTERVAL is reached."""
+    global _stored_since_check
+    with _stored_lock:
+        _stored_since_check += 1
+        if _stored_since_check < RESPONSE_CACHE_EVICT_INTERVAL:
+            return False
+        _stored_since_check = 0
+        return True
+
+
+class ResponseCache:
+    """
+    Looks up and stores generated report text. Every operation commits the given session, so use it before
+    adding anything else to the session (report generation does).
+    """
+
+    def __init__(self, max_entries: int = RESPONSE_CACHE_MAX_ENTRIES, ttl: float = RESPONSE_CACHE_TTL,
+                 similarity: float = RESPONSE_CACHE_SIMILARITY):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.similarity = similarity
+
+    def lookup(self, session: Session, case_id: UUID, model: str, prompt: str, chunk_contents: List[str],
+               prompt_embedding: Optional[List[float]] = None) -> Optional[dict]:
+        """
+        Return the cached response ({"generated_text", "used_chunks_count", "usage", "cache"}) for a prompt and its
+        retrieved chunks, or None. `prompt_embedding` enables matching near-identical prompts.
+        """
+        fingerprint = chunk_fingerprint(chunk_contents)
+        fresh = ResponseCacheEntry.created_at > datetime.utcnow() - timedelta(seconds=self.ttl)
+        entry = session.execute(
+            select(ResponseCacheEntry).where(ResponseCacheEntry.key == cache_key(model, prompt, fingerprint), fresh)
+        ).scalars().first()
+        outcome = "exact"
+
+        if entry is None and prompt_embedding is not None and self.similarity < 1:
+            distance = ResponseCacheEntry.prompt_embedding.cosine_distance(prompt_embedding)
+            row = session.execute(
+                select(ResponseCacheEntry, distance)
+                .where(ResponseCacheEntry.case_id == case_id, ResponseCacheEntry.model == model,
+                       ResponseCacheEntry.chunk_fingerprint == fingerprint, ResponseCacheEntry.prompt_embedding.is_not(None), fresh)
+                .order_by(distance)
+                .limit(1)
+            ).first()
+            if row is not None and 1 - row[1] >= self.similarity:
+                entry, outcome = row[0], "similar"
+
+        if entry is None:
+            cache_stats.record("miss")
+            return None
+        session.execute(
+            update(ResponseCacheEntry)
+            .where(ResponseCacheEntry.key == entry.key)
+            .values(last_used_at=datetime.utcnow(), hits=ResponseCacheEntry.hits + 1)
+        )
+        session.commit()
+        cache_stats.record(outcome, entry.generation_seconds)
+        print(f"Response cache: {outcome} hit for case {case_id}.")
+        return {**entry.response, "cache": outcome}
+
+    def store(self, session: Session, case_id: UUID, model: str, prompt: str, chunk_contents: List[str], response: dict,
+              generation_seconds: float, prompt_embedding: Optional[List[float]] = None):
+        """Cache a generated response ({"generated_text", "used_chunks_count", "usage"})."""
+        fingerprint = chunk_fingerprint(chunk_contents)
+        now = datetime.utcnow()
+        values = {
+            "key": cache_key(model, prompt, fingerprint), "case_id": case_id, "model": model, "prompt": normalize_prompt(prompt),
+            "chunk_fingerprint": fingerprint, "prompt_embedding": prompt_embedding, "response": response,
+            "generation_seconds": generation_seconds, "hits": 0, "created_at": now, "last_used_at": now,
+        }
+        # Concurrent requests for the same prompt both miss; the last one wins
+        statement = insert(ResponseCacheEntry).values(values)
+        statement = statement.on_conflict_do_update(index_elements=["key"], set_={
+            key: statement.excluded[key] for key in ("response", "prompt_embedding", "generation_seconds", "created_at", "last_used_at")
+        })
+        session.execute(statement)
+        # count(*) scans the whole table, so the size is only checked now and then
+        if _eviction_due():
+            self.evict(session)
+        session.commit()
+
+    def evict(self, session: Session):
+        """Delete expired entries and the least recently used entries beyond max_entries."""
+        session.execute(delete(ResponseCacheEntry).where(ResponseCacheEntry.created_at <= datetime.utcnow() - timedelta(seconds=self.ttl)))
+        count = session.execute(select(func.count()).select_from(ResponseCacheEntry)).scalar_one()
+        excess = count - self.max_entries
+        if excess <= 0:
+            return
+        oldest = select(ResponseCacheEntry.key).order_by(ResponseCacheEntry.last_used_at).limit(excess)
+        session.execute(delete(ResponseCacheEntry).where(ResponseCacheEntry.key.in_(oldest.scalar_subquery())))
+        print(f"Evicted {excess} entries from the response cache.")
+
+    def summary(self, session: Session) -> dict:
+        """Size of the cache table and the hits recorded on its entries (over all processes)."""
+        entries, hits = session.execute(select(func.count(), func.coalesce(func.sum(ResponseCacheEntry.hits), 0))).one()
+        return {"entries": entries, "entry_hits": hits, "max_entries": self.max_entries}
+
+
+response_cache = ResponseCache()
+
+
+def invalidate_case(session: Session, case_id: UUID):
+    """
+    Delete the cached responses of a case, because its documents changed. Runs in the caller's session and is
+    committed together with the change.
+    """
+    result = session.execute(delete(ResponseCacheEntry).where(ResponseCacheEntry.case_id == case_id))
+    if result.rowcount:
+        print(f"Response cache: invalidated {result.rowcount} entries of case {case_id}.")
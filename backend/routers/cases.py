@@ -1,7 +1,9 @@
-from fastapi import APIRouter, Depends, HTTPException, status
+from fastapi import APIRouter, Depends, HTTPException, Query, Request, status
 from sqlmodel import Session, select
-from typing import List
-from backend.models import Case
+from typing import List, Optional
+from backend.deletion import delete_case as delete_case_rows, schedule_storage_cleanup
+from backend.listing import DEFAULT_PAGE_SIZE, MAX_PAGE_SIZE, case_page, page_response
+from backend.models import Case, CaseSummary
 from backend.dependencies import get_session, get_current_user # Import dependencies from backend.dependencies
 import uuid
 
@@ -17,12 +19,21 @@ def create_case(case: Case, current_user: dict = Depends(get_current_user), sess
     session.refresh(case)
     return case
 
-@router.get("/", response_model=List[Case])
-def read_cases(current_user: dict = Depends(get_current_user), session: Session = Depends(get_session)):
-    """Retrieve all cases for the current user."""
+@router.get("/", response_model=List[CaseSummary])
+def read_cases(
+    request: Request,
+    limit: int = Query(default=DEFAULT_PAGE_SIZE, ge=1, le=MAX_PAGE_SIZE),
+    cursor: Optional[str] = None, # X-Next-Cursor of the previous page
+    current_user: dict = Depends(get_current_user),
+    session: Session = Depends(get_session)
+):
+    """
+    Retrieve the current user's cases, newest first, one page at a time (see backend/listing.py).
+    The X-Next-Cursor header holds the cursor of the next page; it is absent on the last page.
+    """
     user_uuid = uuid.UUID(current_user.id)
-    cases = session.exec(select(Case).where(Case.user_id == user_uuid)).all()
-    return cases
+    cases, next_cursor = case_page(session, user_uuid, limit, cursor)
+    return page_response(request, cases, next_cursor)
 
 @router.get("/{case_id}", response_model=Case)
 def read_case(case_id: uuid.UUID, current_user: dict = Depends(get_current_user), session: Session = Depends(get_session)):
@@ -54,12 +65,17 @@ def update_case(case_id: uuid.UUID, case_update: Case, current_user: dict = Depe
 
 @router.delete("/{case_id}", response_model=dict)
 def delete_case(case_id: uuid.UUID, current_user: dict = Depends(get_current_user), session: Session = Depends(get_session)):
-    """Delete a specific case by ID for the current user."""
+    """
+    Delete a specific case by ID for the current user, with its documents, chunks and reports (set-based, see
+    backend/deletion.py). The documents' files are removed from storage by a background task.
+    """
     user_uuid = uuid.UUID(current_user.id)
-    case = session.exec(select(Case).where(Case.id == case_id, Case.user_id == user_uuid)).first()
-    if not case:
+    case_exists = session.exec(select(Case.id).where(Case.id == case_id, Case.user_id == user_uuid)).first()
+    if not case_exists:
         raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Case not found")
 
-    session.delete(case)
+    counts, storage_paths = delete_case_rows(session, case_id)
     session.commit()
+    schedule_storage_cleanup(storage_paths)
+    print(f"Deleted case {case_id}: {counts}.")
     return {"ok": True}
@@ -1,13 +1,24 @@
-from fastapi import APIRouter, Depends, HTTPException, status, UploadFile, File
+from fastapi import APIRouter, Depends, HTTPException, Query, status, UploadFile, File, Request
+from fastapi.concurrency import run_in_threadpool
 from fastapi.responses import JSONResponse
 from sqlmodel import Session, select
-from typing import List
-from backend.models import Document, Case
-from backend.dependencies import get_session, get_current_user, supabase # Import dependencies from backend.dependencies
+from typing import List, Optional
+from backend.deletion import delete_documents, schedule_storage_cleanup
+from backend.listing import DEFAULT_PAGE_SIZE, MAX_PAGE_SIZE, document_page, page_response
+from backend.document_text import load_parsed_content
+from backend.models import Document, DocumentDetail, DocumentSummary, Case
+from backend.container import get_supabase
+from backend.dependencies import get_session, get_current_user # Import dependencies from backend.dependencies
 import uuid
 import os
-from backend.celery_worker import celery_app
+from backend.ingest_queue import get_ingest_queue
+from backend.response_cache import invalidate_case
+from backend.storage import UPLOAD_MAX_BYTES, StreamingStorageUpload
 from sqlalchemy.exc import SQLAlchemyError # Import SQLAlchemyError
+try:
+    from python_multipart.multipart import MultipartParser, parse_options_header
+except ImportError: # python-multipart < 0.0.13
+    from multipart.multipart import MultipartParser, parse_options_header
 
 print("--- Loading backend/routers/documents.py ---") # Debugging: Check if module is loaded
 
@@ -27,21 +38,102 @@ def create_document(document: Document, current_user: dict = Depends(get_current
     session.refresh(document)
     return document
 
-@router.get("/case/{case_id}", response_model=List[Document])
-def read_documents_for_case(case_id: uuid.UUID, current_user: dict = Depends(get_current_user), session: Session = Depends(get_session)):
-    """Retrieve all documents for a specific case owned by the current user."""
+@router.get("/case/{case_id}", response_model=List[DocumentSummary])
+def read_documents_for_case(
+    case_id: uuid.UUID,
+    request: Request,
+    limit: int = Query(default=DEFAULT_PAGE_SIZE, ge=1, le=MAX_PAGE_SIZE),
+    cursor: Optional[str] = None, # X-Next-Cursor of the previous page
+    current_user: dict = Depends(get_current_user),
+    session: Session = Depends(get_session)
+):
+    """
+    Retrieve the documents of a case owned by the current user, newest first, one page at a time.
+    Documents are listed without their parsed content (GET /documents/{document_id} returns it); the
+    X-Next-Cursor header holds the cursor of the next page (see backend/listing.py).
+    """
     user_uuid = uuid.UUID(current_user.id)
     # Verify the case exists and belongs to the current user
+    case = session.exec(select(Case.id).where(Case.id == case_id, Case.user_id == user_uuid)).first()
+    if not case:
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Case not found or does not belong to the current user")
+
+    documents, next_cursor = document_page(session, case_id, limit, cursor)
+    return page_response(request, documents, next_cursor)
+
+def _queue_documents(session: Session, user_id: str, documents: List[Document], interactive: bool) -> dict:
+    """Mark documents 'queued' and add them to the user's ingest queue (see backend/ingest_queue.py)."""
+    previous_status = {document.id: document.processing_status for document in documents}
+    for document in documents:
+        document.processing_status = "queued"
+        session.add(document)
+    session.commit()
+    try:
+        dispatched = get_ingest_queue().enqueue(user_id, [document.id for document in documents], interactive=interactive)
+    except Exception as e:
+        print(f"Failed to queue documents for processing: {e}")
+        for document in documents:
+            document.processing_status = previous_status[document.id]
+            session.add(document)
+        session.commit()
+        raise HTTPException(status_code=status.HTTP_503_SERVICE_UNAVAILABLE, detail="The processing queue is not available")
+    return {"queued": len(documents), "dispatched": len(dispatched), "queue": get_ingest_queue().depth(user_id)}
+
+@router.get("/queue", response_model=dict)
+def read_processing_queue(current_user: dict = Depends(get_current_user)):
+    """Number of the current user's documents waiting for processing (per queue) and being processed."""
+    try:
+        return get_ingest_queue().depth(current_user.id)
+    except Exception as e:
+        print(f"Failed to read the processing queue: {e}")
+        raise HTTPException(status_code=status.HTTP_503_SERVICE_UNAVAILABLE, detail="The processing queue is not available")
+
+@router.post("/case/{case_id}/process", response_model=dict)
+def process_documents_for_case(case_id: uuid.UUID, current_user: dict = Depends(get_current_user), session: Session = Depends(get_session)):
+    """
+    Queue all unprocessed (or failed) documents of a case as a bulk import. Bulk imports are processed
+    fairly alongside other users' documents and never take the slots reserved for single uploads.
+    """
+    user_uuid = uuid.UUID(current_user.id)
     case = session.exec(select(Case).where(Case.id == case_id, Case.user_id == user_uuid)).first()
     if not case:
         raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Case not found or does not belong to the current user")
 
-    documents = session.exec(select(Document).where(Document.case_id == case_id)).all()
-    return documents
+    documents = session.exec(
+        select(Document).where(Document.case_id == case_id, Document.processing_status.in_(["uploaded", "failed"]))
+    ).all()
+    return _queue_documents(session, current_user.id, documents, interactive=False)
+
+@router.post("/{document_id}/process", response_model=dict)
+def process_document(document_id: uuid.UUID, current_user: dict = Depends(get_current_user), session: Session = Depends(get_session)):
+    """
+    Queue a single document for processing; single documents are served before bulk imports.
+    A document that was processed before is re-indexed incrementally: only changed chunks are embedded again.
+    """
+    user_uuid = uuid.UUID(current_user.id)
+    document = session.exec(
+        select(Document)
+        .join(Case)
+        .where(Document.id == document_id, Case.user_id == user_uuid)
+    ).first()
+
+    if not document:
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Document not found or does not belong to a case owned by the current user")
+    if document.processing_status in ("queued", "processing"):
+        raise HTTPException(status_code=status.HTTP_409_CONFLICT, detail=f"Document is already {document.processing_status}")
+    return _queue_documents(session, current_user.id, [document], interactive=True)
 
-@router.get("/{document_id}", response_model=Document)
-def read_document(document_id: uuid.UUID, current_user: dict = Depends(get_current_user), session: Session = Depends(get_session)):
-    """Retrieve a specific document by ID for a case owned by the current user."""
+@router.get("/{document_id}", response_model=DocumentDetail)
+def read_document(
+    document_id: uuid.UUID,
+    include_content: bool = True, # False: leave out the parsed text
+    current_user: dict = Depends(get_current_user),
+    session: Session = Depends(get_session)
+):
+    """
+    Retrieve a specific document by ID for a case owned by the current user, with its parsed text
+    (stored compressed out of the document row and only loaded here, see backend/document_text.py).
+    """
     user_uuid = uuid.UUID(current_user.id)
     # Select the document and join with Case to verify ownership
     document = session.exec(
@@ -52,11 +144,16 @@ def read_document(document_id: uuid.UUID, current_user: dict = Depends(get_curre
 
     if not document:
         raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Document not found or does not belong to a case owned by the current user")
-    return document
+    parsed_content = load_parsed_content(session, document.id) if include_content else None
+    return DocumentDetail(**document.model_dump(), parsed_content=parsed_content)
 
 @router.put("/{document_id}", response_model=Document)
 def update_document(document_id: uuid.UUID, document_update: Document, current_user: dict = Depends(get_current_user), session: Session = Depends(get_session)):
-    """Update a specific document by ID for a case owned by the current user."""
+    """
+    Update a specific document by ID for a case owned by the current user.
+    When the file changes (file_path, file_name or file_type) of a processed document, it is queued for
+    re-processing, which only embeds the chunks that changed (see ingestion.reindex_document).
+    """
     user_uuid = uuid.UUID(current_user.id)
     # Select the document and join with Case to verify ownership
     document = session.exec(
@@ -70,31 +167,44 @@ def update_document(document_id: uuid.UUID, document_update: Document, current_u
 
     # Update fields, excluding id, case_id, uploaded_at
     update_data = document_update.model_dump(exclude_unset=True)
+    file_changed = any(key in update_data and update_data[key] != getattr(document, key) for key in ["file_path", "file_name", "file_type"])
     for key, value in update_data.items():
         if key not in ["id", "case_id", "uploaded_at"]:
             setattr(document, key, value)
 
     session.add(document)
+    invalidate_case(session, document.case_id) # Cached report text may depend on the old document
     session.commit()
+    if file_changed and document.processing_status in ("completed", "failed"):
+        try:
+            _queue_documents(session, current_user.id, [document], interactive=True)
+        except HTTPException:
+            pass # Saved; re-process later with POST /documents/{document_id}/process
     session.refresh(document)
     return document
 
 @router.delete("/{document_id}", response_model=dict)
 def delete_document(document_id: uuid.UUID, current_user: dict = Depends(get_current_user), session: Session = Depends(get_session)):
-    """Delete a specific document by ID for a case owned by the current user."""
+    """
+    Delete a specific document by ID for a case owned by the current user, with its chunks (set-based, see
+    backend/deletion.py). The file is removed from storage by a background task.
+    """
     user_uuid = uuid.UUID(current_user.id)
-    # Select the document and join with Case to verify ownership
-    document = session.exec(
-        select(Document)
+    # Select the document's case and join with Case to verify ownership
+    case_id = session.exec(
+        select(Document.case_id)
         .join(Case)
         .where(Document.id == document_id, Case.user_id == user_uuid)
     ).first()
 
-    if not document:
+    if not case_id:
         raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Document not found or does not belong to a case owned by the current user")
 
-    session.delete(document)
+    counts, storage_paths = delete_documents(session, Document.id == document_id)
+    invalidate_case(session, case_id)
     session.commit()
+    schedule_storage_cleanup(storage_paths)
+    print(f"Deleted document {document_id}: {counts}.")
     return {"ok": True}
 
 @router.post("/{case_id}/upload_mvp")
@@ -116,11 +226,12 @@ async def upload_document_mvp(case_id: uuid.UUID, file: UploadFile = File(...),
         storage_filename = f"{uuid.uuid4()}{file_extension}"
         storage_path = f"temp/{case_id}/{storage_filename}" # Store under temp/case_id
 
-        # Read the file content in chunks to avoid loading large files into memory
+        # Reads the whole file into memory; use /{case_id}/upload_mvp/stream for large files
         file_content = await file.read()
 
         # Upload file to Supabase Storage
-        response = supabase.storage.from_('documents').upload(storage_path, file_content)
+        # The Supabase client is synchronous, so run it in the threadpool to keep the event loop free
+        response = await run_in_threadpool(get_supabase().storage.from_('documents').upload, storage_path, file_content)
 
         # If no exception was raised, the upload was successful.
         print(f"Received filename: {file.filename}") # Debugging: Check the received filename
@@ -139,7 +250,7 @@ async def upload_document_mvp(case_id: uuid.UUID, file: UploadFile = File(...),
         new_document.file_type = file.content_type
         new_document.processing_status = "uploaded"
         # uploaded_at will be set by default_factory
-        # parsed_content defaults to None
+        # The parsed text is stored by the worker (see backend/document_text.py)
 
         # Print the new_document object before adding to session
         print(f"New document object before session.add: {new_document}")
@@ -148,7 +259,7 @@ async def upload_document_mvp(case_id: uuid.UUID, file: UploadFile = File(...),
         session.commit()
         session.refresh(new_document) # Refresh the new document object
 
-        # Temporarily skip Celery task
+        # Temporarily skip Celery task; POST /documents/{document_id}/process queues the document (fair per-user queue)
         # celery_app.send_task('backend.celery_worker.process_document_mvp', args=[str(document.id)]) # document is not created
 
         return JSONResponse(status_code=status.HTTP_201_CREATED, content={"message": "Document upload test successful (Celery task skipped)"})
@@ -166,3 +277,157 @@ async def upload_document_mvp(case_id: uuid.UUID, file: UploadFile = File(...),
         session.rollback() # Rollback DB transaction if upload fails
         # TODO: Clean up uploaded file from Supabase Storage if DB record creation fails (need to implement cleanup logic)
         raise HTTPException(status_code=status.HTTP_500_INTERNAL_SERVER_ERROR, detail=f"Failed to upload document: {e}")
+
+
+ALLOWED_UPLOAD_TYPES = ["application/vnd.openxmlformats-officedocument.wordprocessingml.document", "text/plain"]
+# Room for the multipart boundaries and part headers around the file
+MULTIPART_OVERHEAD_BYTES = 64 * 1024
+
+
+class _MultipartFileReceiver:
+    """
+    Incremental multipart parser for a single 'file' field. The parser callbacks are synchronous,
+    so received file data is collected in `pending` and forwarded to storage by the endpoint after
+    every network chunk. Memory use is bounded by one network chunk plus one storage part.
+    """
+
+    def __init__(self, boundary: bytes):
+        self.filename = None
+        self.content_type = None
+        self.pending = []
+        self.complete = False
+        self._headers = {}
+        self._header_field = b""
+        self._header_value = b""
+        self._in_file = False
+        self.parser = MultipartParser(boundary, callbacks={
+            "on_part_begin": self._on_part_begin,
+            "on_header_field": self._on_header_field,
+            "on_header_value": self._on_header_value,
+            "on_header_end": self._on_header_end,
+            "on_headers_finished": self._on_headers_finished,
+            "on_part_data": self._on_part_data,
+            "on_part_end": self._on_part_end,
+        })
+
+    def _on_part_begin(self):
+        self._headers = {}
+
+    def _on_header_field(self, data, start, end):
+        self._header_field += data[start:end]
+
+    def _on_header_value(self, data, start, end):
+        self._header_value += data[start:end]
+
+    def _on_header_end(self):
+        self._headers[self._header_field.lower()] = self._header_value
+        self._header_field, self._header_value = b"", b""
+
+    def _on_headers_finished(self):
+        _, options = parse_options_header(self._headers.get(b"content-disposition", b""))
+        if options.get(b"name") == b"file" and self.filename is None:
+            self._in_file = True
+            self.filename = options.get(b"filename", b"").decode("utf-8")
+            self.content_type = self._headers.get(b"content-type", b"application/octet-stream").decode("latin-1")
+
+    def _on_part_data(self, data, start, end):
+        if self._in_file:
+            self.pending.append(bytes(data[start:end]))
+
+    def _on_part_end(self):
+        if self._in_file:
+            self._in_file = False
+            self.complete = True
+
+    def write(self, chunk: bytes):
+        self.parser.write(chunk)
+
+
+@router.post("/{case_id}/upload_mvp/stream")
+async def upload_document_mvp_stream(case_id: uuid.UUID, request: Request, current_user: dict = Depends(get_current_user), session: Session = Depends(get_session)):
+    """
+    Streaming variant of upload_mvp for large files, for a case owned by the current user. The multipart body is
+    parsed while it arrives and the 'file' field is forwarded to Supabase Storage in fixed-size parts, so memory
+    use stays constant. The content hash (SHA-256) and size are computed on the fly. Files larger than
+    UPLOAD_MAX_BYTES are rejected with 413.
+    """
+    # Verify the case exists and belongs to the current user before anything is sent to storage
+    user_uuid = uuid.UUID(current_user.id)
+    case = await run_in_threadpool(lambda: session.exec(select(Case.id).where(Case.id == case_id, Case.user_id == user_uuid)).first())
+    if not case:
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Case not found or does not belong to the current user")
+
+    content_type, options = parse_options_header(request.headers.get("content-type", ""))
+    if content_type != b"multipart/form-data" or b"boundary" not in options:
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="Expected a multipart/form-data request with a 'file' field.")
+    too_large = HTTPException(status_code=status.HTTP_413_CONTENT_TOO_LARGE, detail=f"The file is larger than {UPLOAD_MAX_BYTES} bytes.")
+    max_body = UPLOAD_MAX_BYTES + MULTIPART_OVERHEAD_BYTES
+    if request.headers.get("content-length", "").isdigit() and int(request.headers["content-length"]) > max_body:
+        raise too_large
+
+    receiver = _MultipartFileReceiver(options[b"boundary"])
+    upload = None
+    stored = None
+    received = 0 # Bytes of the request body, including parts other than 'file'
+    try:
+        async for chunk in request.stream():
+            received += len(chunk)
+            if received > max_body:
+                raise too_large
+            receiver.write(chunk)
+            if receiver.filename is not None and upload is None:
+                # Validate file type (basic check) before anything is sent to storage
+                if receiver.content_type not in ALLOWED_UPLOAD_TYPES:
+                    raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="Invalid file type. Only .docx and .txt are allowed.")
+                file_extension = os.path.splitext(receiver.filename)[1]
+                storage_path = f"temp/{case_id}/{uuid.uuid4()}{file_extension}" # Store under temp/case_id
+                upload = StreamingStorageUpload(storage_path, receiver.content_type)
+            if upload is not None:
+                for data in receiver.pending:
+                    if upload.size + len(data) > UPLOAD_MAX_BYTES:
+                        raise too_large
+                    await upload.write(data)
+            receiver.pending.clear()
+
+        if upload is None or not receiver.complete:
+            raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="No complete 'file' field in the request.")
+        stored = await upload.finish()
+        print(f"Streamed {stored['size']} bytes to {stored['storage_path']} (sha256 {stored['sha256']}).")
+
+        new_document = Document(
+            case_id=case_id,
+            file_name=receiver.filename,
+            file_path=stored["storage_path"],
+            file_type=receiver.content_type,
+            processing_status="uploaded",
+        )
+        # The DB session is synchronous, so run the insert in the threadpool as well
+        def save_document():
+            session.add(new_document)
+            session.commit()
+            session.refresh(new_document)
+        await run_in_threadpool(save_document)
+
+        # Temporarily skip Celery task, as in upload_mvp (POST /documents/{document_id}/process queues the document)
+        # celery_app.send_task('backend.celery_worker.process_document_mvp', args=[str(new_document.id)])
+
+        return JSONResponse(status_code=status.HTTP_201_CREATED, content={
+            "document_id": str(new_document.id),
+            "file_path": stored["storage_path"],
+            "size": stored["size"],
+            "sha256": stored["sha256"],
+        })
+
+    except HTTPException:
+        if upload is not None:
+            await upload.abort()
+        raise
+    except Exception as e:
+        print(f"--- An error occurred in upload_document_mvp_stream: {type(e)}: {e}")
+        if stored is not None:
+            # The upload completed but the DB record could not be created
+            await run_in_threadpool(get_supabase().storage.from_('documents').remove, [stored["storage_path"]])
+        elif upload is not None:
+            await upload.abort() # Remove the partial upload from storage
+        session.rollback()
+        raise HTTPException(status_code=status.HTTP_500_INTERNAL_SERVER_ERROR, detail=f"Failed to upload document: {e}")
@@ -1,29 +1,21 @@
 from fastapi import APIRouter, Depends, HTTPException, status
+from fastapi.concurrency import run_in_threadpool
+from fastapi.responses import JSONResponse, StreamingResponse
 from sqlmodel import Session, select
+from sqlmodel.ext.asyncio.session import AsyncSession
 from typing import List, Optional
 from backend.models import Case, Document, Chunk, GeneratedReport, ReportTemplate
-from backend.dependencies import get_session, get_current_user, supabase # Import dependencies from backend.dependencies
+from backend.container import get_async_engine, get_celery_app, get_engine
+from backend.dependencies import get_session, get_async_session, get_current_user # Import dependencies from backend.dependencies
+from backend.report_generation import (
+    ReportGenerationError, assemble_template_content, build_content, generate_report_content_async, generate_template_report_content,
+    prepare_generation_async, prepare_template_generation_async, stream_completion
+)
+from backend.metrics import REPORT_STAGE_SECONDS, timed
+from backend.response_cache import cache_stats as response_cache_stats, response_cache
 from uuid import UUID
 from datetime import datetime
-from openai import OpenAI
-import os
-from dotenv import load_dotenv
-
-load_dotenv()
-
-# Configure OpenRouter API
-OPENROUTER_API_KEY = os.getenv("OPENROUTER_API_KEY")
-if not OPENROUTER_API_KEY:
-    raise ValueError("OPENROUTER_API_KEY must be set in the environment variables")
-
-# Initialize OpenAI client with OpenRouter base URL
-client = OpenAI(
-  base_url="https://openrouter.ai/api/v1",
-  api_key=OPENROUTER_API_KEY,
-)
-
-# Choose a model (using openrouter/auto for automatic selection)
-GENERATION_MODEL = "openrouter/auto"
+import json
 
 router = APIRouter(prefix="/reports", tags=["reports"])
 
@@ -32,148 +24,72 @@ async def generate_report(
     case_id: UUID,
     prompt: str, # User's prompt for the report
     template_id: Optional[UUID] = None, # Optional template to use
-    session: Session = Depends(get_session),
+    queued: bool = False, # Generate in a Celery task and return immediately; poll /reports/{report_id}/status
+    use_cache: bool = True, # False: always call the LLM (the new text replaces the cached one)
+    session: AsyncSession = Depends(get_async_session),
     user: dict = Depends(get_current_user)
 ):
     """
     Generates a report for a specific case based on a prompt and relevant document chunks.
+    With a template, every section of the template is generated (concurrently) and the prompt is added to each
+    section as additional instructions.
+    Text generated earlier for the same prompt and retrieved chunks is reused unless `use_cache` is false;
+    content["cache"] (per section for templates) tells whether it was an 'exact' or 'similar' hit, a 'miss' or a 'bypass'.
     """
-    print(f"Received generate report request for case_id: {case_id}, prompt: {prompt}")
+    print(f"Received generate report request for case_id: {case_id}")
     # 1. Verify case ownership
-    case = session.exec(select(Case).where(Case.id == case_id, Case.user_id == user.id)).first()
+    # The async session and LLM client keep the event loop free while waiting for the database and OpenRouter
+    case = (await session.exec(select(Case).where(Case.id == case_id, Case.user_id == user.id))).first()
     if not case:
         raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Case not found or not owned by user")
 
     # 2. (Optional) Retrieve Report Template
     template = None
     if template_id:
-        template = session.exec(select(ReportTemplate).where(ReportTemplate.id == template_id)).first()
+        template = (await session.exec(select(ReportTemplate).where(ReportTemplate.id == template_id))).first()
         if not template:
             raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Report template not found")
         # TODO: Add logic to ensure user can use this template (e.g., public or owned by user)
 
-    # 3. Generate embedding for the user prompt
-    # This will use the same Supabase embedding method as in the Celery worker and search router
-    # The Supabase RPC 'generate_embedding' is assumed to use an appropriate embedding model (e.g., OpenAI's text-embedding-ada-002)
+    if queued:
+        # Create the report in 'pending' state and let the Celery worker do retrieval and generation.
+        # The API response no longer depends on LLM latency.
+        new_report = GeneratedReport(
+            case_id=case_id,
+            template_id=template_id, # Can be None if no template is used
+            content={"prompt": prompt, "use_cache": use_cache},
+            generation_status="pending"
+        )
+        session.add(new_report)
+        await session.commit() # All fields have client-side defaults, so no refresh is needed
+
+        # Sent by name: the API does not import the worker module (and its parsing and embedding dependencies)
+        try:
+            await run_in_threadpool(get_celery_app().send_task, "backend.celery_worker.generate_report_task", args=[str(new_report.id)])
+        except Exception as e:
+            print(f"Failed to queue report {new_report.id}: {e}")
+            # No worker will pick the report up: mark it failed instead of leaving it 'pending'
+            new_report.generation_status = "failed"
+            new_report.content = {"prompt": prompt, "error": "The report queue is not available"}
+            session.add(new_report)
+            await session.commit()
+            raise HTTPException(status_code=status.HTTP_503_SERVICE_UNAVAILABLE, detail="The report queue is not available")
+        print(f"Queued report {new_report.id} for case {case_id}.")
+        return JSONResponse(status_code=status.HTTP_202_ACCEPTED, content={
+            "report_id": str(new_report.id),
+            "generation_status": new_report.generation_status,
+            "status_url": f"/reports/{new_report.id}/status",
+        })
+
+    # 3-6. Embed the prompt, retrieve relevant chunks and generate the report section (see backend/report_generation.py)
     try:
-        print("Attempting to generate embedding for prompt...")
-        # Call Supabase embeddings API using the 'generate_embedding' RPC
-        # Ensure this RPC is set up in your Supabase project and uses the desired embedding model.
-        # The input parameter name ('content') and output structure ('embedding') must match the RPC definition.
-        response = supabase.rpc('generate_embedding', {'content': prompt}).execute()
-
-        print(f"Supabase embedding RPC raw response: {response}")
-
-        if response.data and response.data[0] and response.data[0].get('embedding'):
-            prompt_embedding = response.data[0]['embedding']
-            print(f"Generated embedding for prompt: '{prompt}'. Extracted embedding data: {prompt_embedding}")
+        if template:
+            # Sections are generated concurrently in worker threads, each with its own (synchronous) session
+            generated_content = await run_in_threadpool(generate_template_report_content, get_engine(), case_id, template.template_schema, prompt, use_cache=use_cache)
         else:
-            # Handle cases where embedding generation fails or returns no embedding
-            print(f"Supabase embedding generation failed or returned no embedding for prompt: '{prompt}'. Response: {response}")
-            raise Exception("Failed to generate prompt embedding.")
-
-    except Exception as e:
-        print(f"Error during Supabase embedding generation: {e}")
-        raise HTTPException(status_code=status.HTTP_500_INTERNAL_SERVER_ERROR, detail=f"Failed to generate prompt embedding: {e}")
-
-    # 4. Perform vector similarity search to find relevant chunks
-    # This requires the 'pgvector' extension enabled in your Supabase database
-    # and the 'embedding' column in the 'chunk' table to be of type 'vector'.
-    # The '<->' operator is used for the cosine similarity search in pgvector (lower is better).
-    # You might need to adjust the query based on your specific pgvector setup and desired similarity metric/threshold.
-
-    try:
-        print("Attempting vector similarity search...")
-        # Ensure the prompt_embedding is a list of floats
-        if not isinstance(prompt_embedding, list) or not all(isinstance(i, (int, float)) for i in prompt_embedding):
-             raise ValueError("Prompt embedding is not a valid list of floats.")
-
-        # Convert UUIDs to strings for the raw SQL query parameters
-        case_id_str = str(case_id)
-        prompt_embedding_str = str(prompt_embedding) # pgvector expects array literal format e.g., '[1.0, 2.0, ...]'
-
-        # Construct the raw SQL query
-        # Using parameterized query to prevent SQL injection
-        sql_query = """
-        SELECT
-            chunk.id,
-            chunk.content,
-            chunk.document_id,
-            chunk.embedding <-> :prompt_embedding AS similarity
-        FROM chunk
-        JOIN document ON chunk.document_id = document.id
-        WHERE document.case_id = :case_id
-        ORDER BY similarity
-        LIMIT 10; -- Get top 10 most similar chunks for RAG context
-        """
-
-        # Execute the raw SQL query
-        from sqlalchemy import text
-        results = session.exec(
-            text(sql_query),
-            {"prompt_embedding": prompt_embedding_str, "case_id": case_id_str}
-        ).all()
-
-        # Extract content from relevant chunks
-        relevant_chunks_content = [row[1] for row in results]
-        print(f"Found {len(relevant_chunks_content)} relevant chunks for case {case_id}.")
-        print("Vector similarity search completed.")
-
-    except Exception as e:
-        # Log the error and raise an HTTPException
-        print(f"Error during vector search for case {case_id}: {e}")
-        raise HTTPException(status_code=status.HTTP_500_INTERNAL_SERVER_ERROR, detail=f"Vector search failed: {e}")
-
-
-    # 5. Prepare context for the LLM
-    context = "\n\n".join(relevant_chunks_content) # Join chunks with double newline
-    print(f"Prepared context for LLM from {len(relevant_chunks_content)} chunks.")
-
-    # 6. Generate report content using an LLM (RAG)
-    # Integrate with OpenRouter API using OpenAI SDK
-    try:
-        print("Attempting LLM report generation via OpenRouter...")
-        # Construct the messages for the LLM, including the context and user prompt
-        messages = [
-            {"role": "system", "content": "You are a helpful assistant that generates report sections based on provided context."},
-            {"role": "user", "content": f"""
-            Based on the following document excerpts (context) and the user's request (prompt), generate a draft report section.
-
-            Context:
-            {context}
-
-            User Request:
-            {prompt}
-
-            Generated Report Section:
-            """}
-        ]
-
-        # Generate content using the LLM via OpenRouter
-        response = client.chat.completions.create(
-            model=GENERATION_MODEL,
-            messages=messages,
-            # Add optional headers for OpenRouter if needed for tracking/ranking
-            # extra_headers={
-            #     "HTTP-Referer": "YOUR_SITE_URL", # Replace with your site URL
-            #     "X-Title": "AD-Rapport Generator AI", # Replace with your site name
-            # },
-        )
-
-        # Extract generated text from the response
-        generated_text = response.choices[0].message.content
-        print(f"Generated report content using {GENERATION_MODEL} via OpenRouter.")
-
-        # Structure the generated content (this might need refinement based on template)
-        generated_content = {
-            "prompt": prompt,
-            "generated_text": generated_text,
-            "used_chunks_count": len(relevant_chunks_content),
-            # You might want to include chunk IDs or other metadata here
-        }
-
-    except Exception as e:
-        raise HTTPException(status_code=status.HTTP_500_INTERNAL_SERVER_ERROR, detail=f"LLM report generation failed: {e}")
+            generated_content = await generate_report_content_async(session, case_id, prompt, use_cache=use_cache)
+    except ReportGenerationError as e:
+        raise HTTPException(status_code=status.HTTP_500_INTERNAL_SERVER_ERROR, detail=e.detail)
 
     # 7. Save the generated report to the database
     print("Attempting to save generated report to database...")
@@ -181,15 +97,133 @@ async def generate_report(
         case_id=case_id,
         template_id=template_id, # Can be None if no template is used
         content=generated_content,
-        generation_status="completed" # Assuming generation is synchronous for now
+        generation_status="completed" # Generated inline
     )
-
     session.add(new_report)
-    session.commit()
-    session.refresh(new_report)
+    with timed(REPORT_STAGE_SECONDS, "report.save", stage="save"):
+        await session.commit()
     print(f"Saved generated report {new_report.id} for case {case_id}.")
 
     return {"report_id": new_report.id, "content": new_report.content}
 
+def _sse_event(event: str, data: dict) -> str:
+    """Format a Server-Sent Event."""
+    return f"event: {event}\ndata: {json.dumps(data, default=str)}\n\n"
+
+@router.post("/generate/{case_id}/stream")
+async def generate_report_stream(
+    case_id: UUID,
+    prompt: str, # User's prompt for the report
+    template_id: Optional[UUID] = None, # Optional template to use
+    session: AsyncSession = Depends(get_async_session),
+    user: dict = Depends(get_current_user)
+):
+    """
+    Generates a report like /reports/generate/{case_id}, but streams the generated text as Server-Sent Events
+    while the LLM produces it:
+    - `event: section` with `{"id": ..., "title": ...}` before the text of every template section (templates only),
+    - `event: token` with `{"text": ...}` for every piece of generated text,
+    - `event: done` with `{"report_id": ..., "used_chunks_count": ...}` once the report has been saved,
+    - `event: error` with `{"detail": ...}` if generation or saving the report fails after the stream has started.
+    With a template the sections are streamed one after another (not concurrently, so their text does not interleave)
+    and saved with the same content structure as /reports/generate/{case_id}.
+    """
+    print(f"Received streaming generate report request for case_id: {case_id}")
+    case = (await session.exec(select(Case).where(Case.id == case_id, Case.user_id == user.id))).first()
+    if not case:
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Case not found or not owned by user")
+
+    template = None
+    if template_id:
+        template = (await session.exec(select(ReportTemplate).where(ReportTemplate.id == template_id))).first()
+        if not template:
+            raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Report template not found")
+
+    # Retrieval happens before the response starts, so its errors are still returned as regular HTTP errors
+    try:
+        if template:
+            prepared = await prepare_template_generation_async(session, case_id, template.template_schema, prompt)
+        else:
+            prepared = [(None, *(await prepare_generation_async(session, case_id, prompt)))]
+    except ReportGenerationError as e:
+        raise HTTPException(status_code=status.HTTP_500_INTERNAL_SERVER_ERROR, detail=e.detail)
+
+    async def events():
+        results = []
+        for section, messages, context in prepared:
+            if section:
+                yield _sse_event("section", {"id": section["id"], "title": section["title"]})
+            parts = []
+            try:
+                async for text in stream_completion(messages):
+                    parts.append(text)
+                    yield _sse_event("token", {"text": text})
+            except Exception as e:
+                print(f"Streaming report generation failed for case {case_id}: {e}")
+                yield _sse_event("error", {"detail": f"LLM report generation failed: {e}"})
+                return
+            results.append({"section": section, "generated_text": "".join(parts), "context": context})
+
+        if template:
+            content = assemble_template_content(prompt, [{
+                "id": result["section"]["id"],
+                "title": result["section"]["title"],
+                "generated_text": result["generated_text"],
+                "used_chunks_count": len(result["context"].chunks),
+                "context": result["context"].stats(),
+            } for result in results])
+        else:
+            content = build_content(prompt, results[0]["generated_text"], len(results[0]["context"].chunks), results[0]["context"])
+
+        # The request's session may already be closed once the response is streaming, so the report is saved in its own session
+        new_report = GeneratedReport(
+            case_id=case_id,
+            template_id=template_id, # Can be None if no template is used
+            content=content,
+            generation_status="completed"
+        )
+        try:
+            with timed(REPORT_STAGE_SECONDS, "report.save", stage="save"):
+                async with AsyncSession(get_async_engine(), expire_on_commit=False) as report_session:
+                    report_session.add(new_report)
+                    await report_session.commit()
+        except Exception as e:
+            # The tokens were already sent: end the stream with an error event instead of breaking off the response
+            print(f"Saving streamed report failed for case {case_id}: {e}")
+            yield _sse_event("error", {"detail": f"Saving the generated report failed: {e}"})
+            return
+        print(f"Saved streamed report {new_report.id} for case {case_id}.")
+        yield _sse_event("done", {"report_id": new_report.id, "used_chunks_count": content["used_chunks_count"]})
+
+    return StreamingResponse(
+        events(),
+        media_type="text/event-stream",
+        # Disable caching and proxy buffering (nginx) so tokens reach the client immediately
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
+
+@router.get("/response_cache/stats")
+def get_response_cache_stats(session: Session = Depends(get_session), user: dict = Depends(get_current_user)):
+    """Hit rate of the report response cache in this API process, and the size of the (shared) cache table."""
+    return {**response_cache_stats.snapshot(), **response_cache.summary(session)}
+
+@router.get("/{report_id}/status")
+def get_report_status(report_id: UUID, session: Session = Depends(get_session), user: dict = Depends(get_current_user)):
+    """
+    Returns the generation status of a report, and its content once generation has completed or failed.
+    """
+    report = session.exec(
+        select(GeneratedReport)
+        .join(Case)
+        .where(GeneratedReport.id == report_id, Case.user_id == user.id)
+    ).first()
+    if not report:
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Report not found or not owned by user")
+
+    response = {"report_id": report.id, "generation_status": report.generation_status, "generated_at": report.generated_at}
+    if report.generation_status in ("completed", "failed"):
+        response["content"] = report.content
+    return response
+
 # TODO: Add endpoints for listing, retrieving, updating, and deleting reports
 # Similar to the cases and documents routers.
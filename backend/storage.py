@@ -0,0 +1,162 @@
+"""
+Streaming uploads to and downloads from Supabase Storage.
+
+Uploads are sent with Supabase's resumable (TUS) upload endpoint in fixed-size parts, so a file is never
+held in memory as a whole. All storage I/O uses an async HTTP client and does not block the event loop.
+The SHA-256 content hash and the size are computed while the parts are sent.
+
+The files of deleted documents are removed in batches by the worker (see backend/deletion.py).
+"""
+from typing import List, Optional
+import base64
+import hashlib
+import os
+import httpx
+from dotenv import load_dotenv
+
+load_dotenv()
+
+STORAGE_BUCKET = "documents"
+# Supabase requires every part except the last one to be exactly 6 MB
+STORAGE_UPLOAD_PART_SIZE = 6 * 1024 * 1024
+STORAGE_UPLOAD_TIMEOUT = float(os.getenv("STORAGE_UPLOAD_TIMEOUT", "60"))
+# Largest file accepted by the streaming upload endpoint (bytes)
+UPLOAD_MAX_BYTES = int(os.getenv("UPLOAD_MAX_BYTES", str(100 * 1024 * 1024)))
+# Objects removed per request; Supabase Storage accepts at most 1000
+STORAGE_DELETE_BATCH_SIZE = int(os.getenv("STORAGE_DELETE_BATCH_SIZE", "1000"))
+
+
+class StorageUploadError(Exception):
+    """Raised when Supabase Storage rejects a streaming upload, a download or a removal."""
+
+
+def _metadata_value(value: str) -> str:
+    return base64.b64encode(value.encode("utf-8")).decode("ascii")
+
+
+class StreamingStorageUpload:
+    """
+    Resumable upload of a single object. Data is added with `write()`; every full part is sent
+    immediately, so at most one part (plus the incoming chunk) is buffered.
+
+        upload = StreamingStorageUpload(storage_path, content_type)
+        await upload.write(data)   # repeated
+        await upload.finish()
+    """
+
+    def __init__(self, storage_path: str, content_type: str, bucket: str = STORAGE_BUCKET, part_size: int = STORAGE_UPLOAD_PART_SIZE,
+                 supabase_url: Optional[str] = None, supabase_key: Optional[str] = None):
+        if supabase_url is None or supabase_key is None:
+            from backend.container import SUPABASE_URL, SUPABASE_KEY
+            supabase_url = supabase_url or SUPABASE_URL
+            supabase_key = supabase_key or SUPABASE_KEY
+        self.storage_path = storage_path
+        self.content_type = content_type
+        self.bucket = bucket
+        self.part_size = part_size
+        self.endpoint = f"{supabase_url.rstrip('/')}/storage/v1/upload/resumable"
+        self.headers = {"Authorization": f"Bearer {supabase_key}", "apikey": supabase_key, "Tus-Resumable": "1.0.0"}
+        self.client = httpx.AsyncClient(timeout=STORAGE_UPLOAD_TIMEOUT)
+        self.location = None
+        self.offset = 0 # Bytes acknowledged by storage
+        self.size = 0 # Bytes received from the client
+        self.sha256 = hashlib.sha256()
+        self._buffer = bytearray()
+
+    async def _create(self):
+        metadata = ",".join([
+            f"bucketName {_metadata_value(self.bucket)}",
+            f"objectName {_metadata_value(self.storage_path)}",
+            f"contentType {_metadata_value(self.content_type)}",
+        ])
+        # The total size is not known yet; it is sent with the last part
+        response = await self.client.post(self.endpoint, headers={**self.headers, "Upload-Defer-Length": "1", "Upload-Metadata": metadata})
+        if response.status_code != 201 or "location" not in response.headers:
+            raise StorageUploadError(f"Could not create upload ({response.status_code}): {response.text}")
+        self.location = httpx.URL(self.endpoint).join(response.headers["location"])
+
+    async def _send_part(self, part: bytes, final: bool = False):
+        if self.location is None:
+            await self._create()
+        headers = {**self.headers, "Upload-Offset": str(self.offset), "Content-Type": "application/offset+octet-stream"}
+        if final:
+            headers["Upload-Length"] = str(self.size)
+        response = await self.client.patch(self.location, headers=headers, content=part)
+        if response.status_code != 204:
+            raise StorageUploadError(f"Upload of part at offset {self.offset} failed ({response.status_code}): {response.text}")
+        self.offset += len(part)
+
+    async def write(self, data: bytes):
+        self.size += len(data)
+        self.sha256.update(data)
+        self._buffer.extend(data)
+        while len(self._buffer) >= self.part_size:
+            part = bytes(self._buffer[:self.part_size])
+            del self._buffer[:self.part_size]
+            await self._send_part(part)
+
+    async def finish(self) -> dict:
+        """Send the remaining data and return the storage path, size and content hash."""
+        await self._send_part(bytes(self._buffer), final=True)
+        self._buffer.clear()
+        await self.client.aclose() # On failure the client stays open so abort() can clean up
+        return {"storage_path": self.storage_path, "size": self.size, "sha256": self.sha256.hexdigest()}
+
+    async def abort(self):
+        """Cancel the upload and remove the parts that were already stored."""
+        if self.client.is_closed:
+            return
+        try:
+            if self.location is not None:
+                await self.client.delete(self.location, headers=self.headers)
+        except httpx.HTTPError as e:
+            print(f"Failed to abort upload of {self.storage_path}: {e}")
+        finally:
+            await self.client.aclose()
+
+
+def download_to_file(storage_path: str, fileobj, bucket: str = STORAGE_BUCKET, chunk_size: int = 1024 * 1024,
+                     supabase_url: Optional[str] = None, supabase_key: Optional[str] = None) -> int:
+    """
+    Stream an object from Supabase Storage into `fileobj` (e.g. a temporary file) without holding it in memory.
+    Synchronous, for use in the Celery worker. Returns the number of bytes written.
+    """
+    if supabase_url is None or supabase_key is None:
+        from backend.container import SUPABASE_URL, SUPABASE_KEY
+        supabase_url = supabase_url or SUPABASE_URL
+        supabase_key = supabase_key or SUPABASE_KEY
+    url = f"{supabase_url.rstrip('/')}/storage/v1/object/{bucket}/{storage_path.lstrip('/')}"
+    headers = {"Authorization": f"Bearer {supabase_key}", "apikey": supabase_key}
+    size = 0
+    with httpx.stream("GET", url, headers=headers, timeout=STORAGE_UPLOAD_TIMEOUT) as response:
+        if response.status_code != 200:
+            response.read()
+            raise StorageUploadError(f"Supabase Storage download failed ({response.status_code}): {response.text}")
+        for data in response.iter_bytes(chunk_size):
+            fileobj.write(data)
+            size += len(data)
+    fileobj.seek(0)
+    return size
+
+
+def remove_objects(storage_paths: List[str], bucket: str = STORAGE_BUCKET, batch_size: int = STORAGE_DELETE_BATCH_SIZE,
+                   supabase_url: Optional[str] = None, supabase_key: Optional[str] = None) -> int:
+    """
+    Remove objects from Supabase Storage with one request per `batch_size` paths. Synchronous, for use in the
+    Celery worker. Paths that do not exist (any more) are skipped. Returns the number of objects removed.
+    """
+    if supabase_url is None or supabase_key is None:
+        from backend.container import SUPABASE_URL, SUPABASE_KEY
+        supabase_url = supabase_url or SUPABASE_URL
+        supabase_key = supabase_key or SUPABASE_KEY
+    url = f"{supabase_url.rstrip('/')}/storage/v1/object/{bucket}"
+    headers = {"Authorization": f"Bearer {supabase_key}", "apikey": supabase_key}
+    removed = 0
+    with httpx.Client(headers=headers, timeout=STORAGE_UPLOAD_TIMEOUT) as client:
+        for start in range(0, len(storage_paths), batch_size):
+            batch = [path.lstrip("/") for path in storage_paths[start:start + batch_size]]
+            response = client.request("DELETE", url, json={"prefixes": batch})
+            if response.status_code != 200:
+                raise StorageUploadError(f"Supabase Storage removal failed ({response.status_code}): {response.text}")
+            removed += len(response.json())
+    return removed
@@ -0,0 +1,35 @@
+"""
+Shared fixtures. Run with `python -m pytest backend/tests`.
+
+Tests that need PostgreSQL (with pgvector) use the database in DATABASE_URL, in a scratch schema ('backend_tests')
+that is dropped afterwards; they are skipped when DATABASE_URL is not set.
+"""
+import os
+import pytest
+from dotenv import load_dotenv
+from sqlalchemy import text
+from sqlmodel import SQLModel
+
+load_dotenv()
+
+TEST_SCHEMA = "backend_tests"
+
+
+@pytest.fixture(scope="session")
+def engine():
+    database_url = os.getenv("DATABASE_URL")
+    if not database_url:
+        pytest.skip("DATABASE_URL is not set")
+    from backend.database import create_db_engine
+    import backend.models # noqa: F401 - registers all tables on SQLModel.metadata
+
+    engine = create_db_engine(database_url, connect_args={"options": f"-csearch_path={TEST_SCHEMA},public,extensions"})
+    with engine.begin() as connection:
+        connection.execute(text(f"DROP SCHEMA IF EXISTS {TEST_SCHEMA} CASCADE"))
+        connection.execute(text(f"CREATE SCHEMA {TEST_SCHEMA}"))
+    # checkfirst=False: the application's tables in public are visible through the search path and would be taken as existing
+    SQLModel.metadata.create_all(engine, checkfirst=False)
+    yield engine
+    with engine.begin() as connection:
+        connection.execute(text(f"DROP SCHEMA IF EXISTS {TEST_SCHEMA} CASCADE"))
+    engine.dispose()
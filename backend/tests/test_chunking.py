@@ -0,0 +1,17 @@
+from backend.chunking import CHUNK_MAX_TOKENS, chunk_paragraphs, chunk_units, count_tokens
+
+
+def test_word_without_whitespace_is_split_to_max_tokens():
+    url = "https://example.org/bijlage?data=" + "QUJDRA" * 1000 # 6000 characters, about 1700 tokens
+    paragraphs = ["Zie de bijlage bij dit rapport: " + url + " voor de volledige gegevens.", "De werknemer is volledig hersteld."]
+    chunks = list(chunk_paragraphs(paragraphs))
+    assert all(count_tokens(chunk) <= CHUNK_MAX_TOKENS for chunk in chunks)
+    # Nothing of the word is lost; the pieces are only separated by spaces
+    assert url in "".join(chunk.replace(" ", "") for chunk in chunks)
+
+
+def test_chunk_units_splits_a_long_word_within_max_tokens():
+    units = chunk_units("x" * 5000, max_tokens=100)
+    assert len(units) > 1
+    assert all(tokens <= 100 and count_tokens(text) <= 100 for text, tokens, _ in units)
+    assert "".join(text for text, _, _ in units) == "x" * 5000
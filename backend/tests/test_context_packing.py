@@ -0,0 +1,42 @@
+import uuid
+import numpy as np
+from sqlmodel import Session
+from backend.context_packing import pack_context
+from backend.models import Case, Chunk, Document
+
+# Longer than the 200 characters the packer used to look up in the parsed text
+BOILERPLATE = ("Dit rapport is opgesteld door de arbeidsdeskundige op verzoek van de werkgever en is uitsluitend bestemd "
+               "voor de werknemer, de werkgever en de bedrijfsarts in het kader van de re-integratie na ziekte.")
+
+
+def _embedding(seed: int) -> list:
+    return np.random.default_rng(seed).standard_normal(1536).tolist()
+
+
+def test_reading_order_follows_chunk_position_when_prefixes_repeat(engine):
+    with Session(engine) as session:
+        case = Case(user_id=uuid.uuid4(), name="Test")
+        session.add(case)
+        session.flush()
+        document = Document(case_id=case.id, file_name="rapport.txt", file_path="test/rapport.txt", file_type="text/plain")
+        session.add(document)
+        session.flush()
+        # Saved in reverse order (as parallel batches can be), so creation time does not give the reading order
+        second = Chunk(document_id=document.id, position=1, embedding=_embedding(1),
+                       content=BOILERPLATE + " Tweede deel: de werknemer kan vier uur per dag aangepast werk doen, zonder tillen boven tien kilo.")
+        session.add(second)
+        session.flush()
+        first = Chunk(document_id=document.id, position=0, embedding=_embedding(2),
+                      content=BOILERPLATE + " Eerste deel: de werknemer is sinds maart volledig arbeidsongeschikt door ernstige rugklachten.")
+        session.add(first)
+        session.flush()
+        assert first.content[:200] == second.content[:200]
+
+        # The second chunk is the most relevant one
+        rows = [(second.id, second.content, document.id, 0.9), (first.id, first.content, document.id, 0.8)]
+        for _ in range(3):
+            context = pack_context(session, rows, token_budget=1000)
+            assert len(context.chunks) == 2
+            assert "Eerste deel" in context.chunks[0]
+            assert "Tweede deel" in context.chunks[1]
+        session.rollback()
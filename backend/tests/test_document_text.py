@@ -0,0 +1,39 @@
+import tempfile
+import uuid
+import pytest
+from sqlmodel import Session
+from backend import document_text
+from backend.document_text import compress_pieces, decompress, load_parsed_content, save_parsed_content
+from backend.models import Case, Document, DocumentText
+
+# Several READ_CHARS pieces long, with multi-byte characters
+TEXT = "Belastbaarheid: beperkt tot vier uur per dag — geen tillen boven tien kilo. " * 40000
+
+
+@pytest.mark.parametrize("codec", ["zstd", "zlib", "none"])
+def test_compressed_pieces_decompress_to_the_whole_text(codec):
+    pieces = [TEXT[start:start + 100001] for start in range(0, len(TEXT), 100001)]
+    used_codec, data, size = compress_pieces(pieces, codec)
+    assert size == len(TEXT.encode("utf-8"))
+    assert decompress(used_codec, data) == TEXT
+
+
+def test_parsed_text_is_saved_from_a_spooled_file(engine, monkeypatch):
+    monkeypatch.setattr(document_text, "READ_CHARS", 100000)
+    with Session(engine) as session:
+        case = Case(user_id=uuid.uuid4(), name="Test")
+        session.add(case)
+        session.flush()
+        document = Document(case_id=case.id, file_name="rapport.txt", file_path="test/rapport.txt", file_type="text/plain")
+        session.add(document)
+        session.flush()
+
+        with tempfile.SpooledTemporaryFile(max_size=1024 * 1024, mode="w+", encoding="utf-8") as parsed_text:
+            parsed_text.write(TEXT)
+            parsed_text.seek(0)
+            save_parsed_content(session, document.id, parsed_text)
+
+        row = session.get(DocumentText, document.id)
+        assert row.size == len(TEXT.encode("utf-8"))
+        assert load_parsed_content(session, document.id) == TEXT
+        session.rollback()
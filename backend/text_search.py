@@ -0,0 +1,193 @@
+"""
+Dutch full-text search on chunk.content and hybrid (lexical + vector) retrieval.
+
+chunk.content_tsv is a generated column, to_tsvector(TEXT_SEARCH_CONFIG, content), with a GIN index
+(ix_chunk_content_tsv). New databases get both from SQLModel.metadata.create_all; add them to an existing
+database with:
+
+    python -m backend.text_search migrate     # Rewrites the chunk table once (ACCESS EXCLUSIVE lock)
+    python -m backend.text_search status
+
+Vector search alone often misses exact terms such as employer names, dates or "WIA". `retrieve_chunks`
+supports three modes:
+- "vector": embedding distance only (backend/vector_index.py),
+- "hybrid": the best HYBRID_SEARCH_CANDIDATES lexical matches (ts_rank) and nearest chunks are fused with
+  reciprocal rank fusion (score = sum of 1 / (HYBRID_RRF_K + rank)) in a single SQL round trip,
+- "prefilter": only the best LEXICAL_PREFILTER_CANDIDATES lexical matches (found through the GIN index) are
+  ranked by embedding distance; a cheap alternative to vector search for very large cases. Falls back to
+  vector search when no chunk matches.
+
+The query terms are OR-ed (a chunk matching more terms ranks higher), because natural-language prompts
+rarely have chunks containing every word. A common term can then match most of a case, so the lexical stage
+ranks with ts_rank, which is several times cheaper per row than ts_rank_cd (cover density). Without the content_tsv column, hybrid modes fall back to vector search.
+The vector stages use the embedding column of EMBEDDING_STORAGE (backend/vector_storage.py).
+"""
+from functools import lru_cache
+from typing import List, Optional
+import argparse
+import os
+from dotenv import load_dotenv
+from sqlalchemy import text
+from backend.vector_index import choose_strategy, configure_ann_search, hamming_operator_available, search_chunks
+from backend.vector_storage import EMBEDDING_STORAGE, distance_sql, nearest_chunks_sql, query_params
+
+load_dotenv()
+
+TEXT_SEARCH_CONFIG = os.getenv("TEXT_SEARCH_CONFIG", "dutch") # PostgreSQL text search configuration (stemming, stop words)
+SEARCH_MODE = os.getenv("SEARCH_MODE", "hybrid") # Default mode of the search endpoint and report retrieval
+HYBRID_SEARCH_CANDIDATES = int(os.getenv("HYBRID_SEARCH_CANDIDATES", "50")) # Candidates per stage before fusion
+HYBRID_RRF_K = int(os.getenv("HYBRID_RRF_K", "60"))
+LEXICAL_PREFILTER_CANDIDATES = int(os.getenv("LEXICAL_PREFILTER_CANDIDATES", "200"))
+
+SEARCH_MODES = ("vector", "hybrid", "prefilter")
+TSVECTOR_EXPRESSION = f"to_tsvector('{TEXT_SEARCH_CONFIG}', content)"
+TSVECTOR_INDEX_NAME = "ix_chunk_content_tsv"
+
+# The terms of the query OR-ed together. The lexemes are already stemmed by plainto_tsquery, so the text is cast
+# to tsquery (to_tsquery would normalize them a second time, e.g. re-splitting 're-integratie')
+_QUERY_CTE = """
+query AS MATERIALIZED (
+    SELECT CAST(replace(plainto_tsquery(CAST(:config AS regconfig), :query_text)::text, ' & ', ' | ') AS tsquery) AS terms
+)"""
+
+# Lexical candidates of the case, through the GIN index
+_LEXICAL_CTE = """
+lexical AS (
+    SELECT chunk.id, row_number() OVER (ORDER BY ts_rank(chunk.content_tsv, query.terms) DESC, chunk.id) AS rank
+    FROM chunk, query
+    WHERE chunk.content_tsv @@ query.terms
+      AND chunk.document_id IN (SELECT document.id FROM document WHERE document.case_id = :case_id)
+    ORDER BY rank
+    LIMIT :candidates
+)"""
+
+# Vector candidates: all chunks of the case ranked exactly (small cases) or the nearest chunks from the ANN
+# index (large cases; configured by vector_index.configure_ann_search)
+_SEMANTIC_CTE = """
+nearest AS ({nearest}),
+semantic AS (
+    SELECT id, row_number() OVER (ORDER BY similarity, id) AS rank FROM nearest
+)"""
+
+_FUSION_SQL = """
+fused AS (
+    SELECT id, sum(1.0 / (:rrf_k + rank)) AS score
+    FROM (SELECT id, rank FROM lexical UNION ALL SELECT id, rank FROM semantic) AS ranked
+    GROUP BY id
+)
+SELECT chunk.id, chunk.content, chunk.document_id, {distance} AS similarity
+FROM fused
+JOIN chunk ON chunk.id = fused.id
+ORDER BY fused.score DESC, similarity
+LIMIT :limit
+"""
+
+_PREFILTER_SQL = """
+SELECT chunk.id, chunk.content, chunk.document_id, {distance} AS similarity
+FROM lexical
+JOIN chunk ON chunk.id = lexical.id
+ORDER BY similarity
+LIMIT :limit
+"""
+
+
+@lru_cache(maxsize=None)
+def hybrid_sql(storage: str, strategy: str, hamming_operator: bool = True) -> str:
+    semantic = _SEMANTIC_CTE.format(nearest=nearest_chunks_sql(storage, strategy, hamming_operator, limit=":candidates"))
+    return f"WITH {_QUERY_CTE},{_LEXICAL_CTE},{semantic},{_FUSION_SQL.format(distance=distance_sql(storage))}"
+
+
+@lru_cache(maxsize=None)
+def prefilter_sql(storage: str) -> str:
+    return f"WITH {_QUERY_CTE},{_LEXICAL_CTE} {_PREFILTER_SQL.format(distance=distance_sql(storage))}"
+
+
+HYBRID_EXACT_SQL = hybrid_sql("vector", "exact")
+HYBRID_ANN_SQL = hybrid_sql("vector", "ann")
+PREFILTER_SQL = prefilter_sql("vector")
+
+
+_text_search_available = None
+
+
+def text_search_available(session) -> bool:
+    """Whether chunk.content_tsv exists (checked once per process)."""
+    global _text_search_available
+    if _text_search_available is None:
+        _text_search_available = session.execute(text("""
+            SELECT EXISTS (SELECT 1 FROM information_schema.columns
+                           WHERE table_schema = current_schema() AND table_name = 'chunk' AND column_name = 'content_tsv')
+        """)).scalar()
+        if not _text_search_available:
+            print("chunk.content_tsv does not exist; hybrid search falls back to vector search (run `python -m backend.text_search migrate`).")
+    return _text_search_available
+
+
+def retrieve_chunks(session, case_id, query_text: str, query_embedding: List[float], limit: int = 10, mode: str = SEARCH_MODE,
+                    ef_search: Optional[int] = None, probes: Optional[int] = None, strategy: str = "auto", storage: Optional[str] = None):
+    """
+    Return the `limit` best chunks of a case for a query as (id, content, document_id, similarity) rows, together with
+    the strategy that was used ('exact' or 'ann', prefixed with 'hybrid/' or 'prefilter/' for those modes).
+    `similarity` is always the L2 distance to the query embedding; hybrid results are ordered by the fused score.
+    """
+    if mode not in SEARCH_MODES:
+        raise ValueError(f"Unknown search mode: {mode}")
+    storage = storage or EMBEDDING_STORAGE
+    if mode == "vector" or not query_text or not text_search_available(session):
+        return search_chunks(session, case_id, query_embedding, limit, ef_search=ef_search, probes=probes, strategy=strategy, storage=storage)
+
+    params = {"case_id": str(case_id), "limit": limit, "config": TEXT_SEARCH_CONFIG, "query_text": query_text, "rrf_k": HYBRID_RRF_K}
+    if mode == "prefilter":
+        params["query_embedding"] = str(list(query_embedding)) # Lexical candidates are ranked exactly, no binary pass
+        params["candidates"] = max(LEXICAL_PREFILTER_CANDIDATES, limit)
+        rows = session.execute(text(prefilter_sql(storage)), params).all()
+        if rows:
+            return rows, "prefilter/lexical"
+        rows, used_strategy = search_chunks(session, case_id, query_embedding, limit, ef_search=ef_search, probes=probes, strategy=strategy, storage=storage)
+        return rows, f"prefilter/{used_strategy}"
+
+    params["candidates"] = max(HYBRID_SEARCH_CANDIDATES, limit)
+    params.update(query_params(query_embedding, storage, params["candidates"]))
+    used_strategy, share = choose_strategy(session, case_id, strategy)
+    sql = hybrid_sql(storage, used_strategy, hamming_operator_available(session) if storage == "binary" else True)
+    if used_strategy == "ann":
+        configure_ann_search(session, params.get("rerank_candidates", params["candidates"]), share, ef_search, probes)
+    return session.execute(text(sql), params).all(), f"hybrid/{used_strategy}"
+
+
+def migrate(engine):
+    """Add chunk.content_tsv and its GIN index to an existing database."""
+    with engine.connect().execution_options(isolation_level="AUTOCOMMIT") as connection:
+        # Adding a stored generated column rewrites the table; the index is then built without blocking writes
+        connection.execute(text(f"ALTER TABLE chunk ADD COLUMN IF NOT EXISTS content_tsv tsvector GENERATED ALWAYS AS ({TSVECTOR_EXPRESSION}) STORED"))
+        connection.execute(text(f"CREATE INDEX CONCURRENTLY IF NOT EXISTS {TSVECTOR_INDEX_NAME} ON chunk USING gin (content_tsv)"))
+    print(f"chunk.content_tsv and {TSVECTOR_INDEX_NAME} are in place.")
+
+
+def status(engine) -> dict:
+    with engine.connect() as connection:
+        expression = connection.execute(text("""
+            SELECT generation_expression FROM information_schema.columns
+            WHERE table_schema = current_schema() AND table_name = 'chunk' AND column_name = 'content_tsv'
+        """)).scalar()
+        index_size = connection.execute(text("""
+            SELECT pg_relation_size(format('%I.%I', schemaname, indexname)::regclass)
+            FROM pg_indexes WHERE schemaname = current_schema() AND indexname = :name
+        """), {"name": TSVECTOR_INDEX_NAME}).scalar()
+    return {"content_tsv": expression, "index": TSVECTOR_INDEX_NAME if index_size is not None else None, "index_size_bytes": index_size}
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Manage the full-text search column and index on chunk.content.")
+    parser.add_argument("action", choices=["migrate", "status"])
+    args = parser.parse_args()
+
+    from backend.container import get_engine
+    engine = get_engine()
+    if args.action == "migrate":
+        migrate(engine)
+    print(status(engine))
+
+
+if __name__ == "__main__":
+    main()
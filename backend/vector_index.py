@@ -0,0 +1,232 @@
+"""
+Approximate nearest neighbour (ANN) index management and case-filtered vector search for Chunk.embedding.
+
+The search queries order by L2 distance (`<->`), so the indexes are built with the matching
+`vector_l2_ops` operator class. With compact embedding storage (EMBEDDING_STORAGE, see backend/vector_storage.py)
+the index is built on the compact column instead (`halfvec_l2_ops` or `bit_hamming_ops`).
+Indexes are managed explicitly with this module:
+
+    python -m backend.vector_index create --type hnsw --m 16 --ef-construction 64
+    python -m backend.vector_index create --type ivfflat --lists 100
+    python -m backend.vector_index rebuild --type ivfflat   # e.g. after the table has grown
+    python -m backend.vector_index drop --type hnsw
+    python -m backend.vector_index status
+
+Filtered search: an ANN index returns the nearest chunks of the *whole* table, and the case filter is
+applied afterwards. When a case only holds a small share of the table, most candidates are filtered out
+and results go missing. `search_chunks` therefore picks a strategy per request:
+- "exact": the case's chunks are selected first and ranked exactly. Used when the case holds at most
+  VECTOR_EXACT_SEARCH_MAX_ROWS chunks, which is both accurate and fast for typical cases.
+- "ann": the index is used, with ef_search / probes scaled up by the inverse of the case's share of the
+  table (and iterative index scans enabled on pgvector >= 0.8), so enough candidates survive the filter.
+"""
+from typing import List, Optional
+import argparse
+import math
+import os
+from dotenv import load_dotenv
+from sqlalchemy import text
+from backend.vector_storage import EMBEDDING_STORAGE, STORAGE_MODES, index_column, nearest_chunks_sql, query_params
+
+load_dotenv()
+
+VECTOR_INDEX_TYPE = os.getenv("VECTOR_INDEX_TYPE", "hnsw") # 'hnsw' or 'ivfflat'
+HNSW_M = int(os.getenv("HNSW_M", "16"))
+HNSW_EF_CONSTRUCTION = int(os.getenv("HNSW_EF_CONSTRUCTION", "64"))
+HNSW_EF_SEARCH = int(os.getenv("HNSW_EF_SEARCH", "40")) # pgvector default
+IVFFLAT_PROBES = int(os.getenv("IVFFLAT_PROBES", "10"))
+VECTOR_SEARCH_MAX_EF_SEARCH = 1000 # Upper limit accepted by pgvector
+VECTOR_SEARCH_MAX_PROBES = 32768 # Upper limit accepted by pgvector (the maximum number of IVFFlat lists)
+VECTOR_EXACT_SEARCH_MAX_ROWS = int(os.getenv("VECTOR_EXACT_SEARCH_MAX_ROWS", "20000"))
+VECTOR_INDEX_MAINTENANCE_WORK_MEM = os.getenv("VECTOR_INDEX_MAINTENANCE_WORK_MEM") # e.g. '1GB', speeds up index builds
+
+INDEX_TYPES = ("hnsw", "ivfflat")
+SEARCH_STRATEGIES = ("auto", "exact", "ann")
+OPERATOR_CLASS = "vector_l2_ops" # Matches the '<->' operator used by the search queries
+
+
+def index_name(index_type: str, storage: str = "vector") -> str:
+    if index_type not in INDEX_TYPES:
+        raise ValueError(f"Unknown vector index type: {index_type}")
+    column, _ = index_column(storage)
+    return f"ix_chunk_{column}_{index_type}"
+
+
+def default_ivfflat_lists(row_count: int) -> int:
+    # pgvector guidance: rows / 1000 up to 1M rows, sqrt(rows) above that
+    if row_count <= 1_000_000:
+        return max(row_count // 1000, 1)
+    return int(math.sqrt(row_count))
+
+
+def _index_ddl(name: str, index_type: str, m: int, ef_construction: int, lists: Optional[int], storage: str = "vector") -> str:
+    if index_type == "hnsw":
+        options = f"m = {int(m)}, ef_construction = {int(ef_construction)}"
+    else:
+        options = f"lists = {int(lists)}"
+    column, operator_class = index_column(storage)
+    return f"CREATE INDEX CONCURRENTLY IF NOT EXISTS {name} ON chunk USING {index_type} ({column} {operator_class}) WITH ({options})"
+
+
+def _autocommit(engine):
+    # CREATE/DROP INDEX CONCURRENTLY cannot run inside a transaction block
+    return engine.connect().execution_options(isolation_level="AUTOCOMMIT")
+
+
+def create_vector_index(engine, index_type: str = VECTOR_INDEX_TYPE, m: int = HNSW_M, ef_construction: int = HNSW_EF_CONSTRUCTION, lists: Optional[int] = None, name: Optional[str] = None,
+                        storage: str = EMBEDDING_STORAGE):
+    """Create the ANN index on the embedding column of `storage` without blocking writes."""
+    name = name or index_name(index_type, storage)
+    with _autocommit(engine) as connection:
+        if index_type == "ivfflat" and lists is None:
+            # IVFFlat centroids are computed from the existing rows, so build it after loading data
+            lists = default_ivfflat_lists(connection.execute(text("SELECT count(*) FROM chunk")).scalar_one())
+        if VECTOR_INDEX_MAINTENANCE_WORK_MEM:
+            connection.execute(text("SELECT set_config('maintenance_work_mem', :value, false)"), {"value": VECTOR_INDEX_MAINTENANCE_WORK_MEM})
+        connection.execute(text(_index_ddl(name, index_type, m, ef_construction, lists, storage)))
+    print(f"Created vector index {name}.")
+
+
+def drop_vector_index(engine, index_type: str = VECTOR_INDEX_TYPE, storage: str = EMBEDDING_STORAGE):
+    name = index_name(index_type, storage)
+    with _autocommit(engine) as connection:
+        connection.execute(text(f"DROP INDEX CONCURRENTLY IF EXISTS {name}"))
+    print(f"Dropped vector index {name}.")
+
+
+def rebuild_vector_index(engine, index_type: str = VECTOR_INDEX_TYPE, m: int = HNSW_M, ef_construction: int = HNSW_EF_CONSTRUCTION, lists: Optional[int] = None,
+                         storage: str = EMBEDDING_STORAGE):
+    """
+    Build a fresh index next to the existing one and swap it in, so searches keep using an index
+    during the rebuild. Use this to change index parameters or to recompute IVFFlat centroids
+    after the table has grown.
+    """
+    name = index_name(index_type, storage)
+    new_name = f"{name}_new"
+    with _autocommit(engine) as connection:
+        connection.execute(text(f"DROP INDEX CONCURRENTLY IF EXISTS {new_name}")) # Left over from an interrupted rebuild
+    create_vector_index(engine, index_type, m=m, ef_construction=ef_construction, lists=lists, name=new_name, storage=storage)
+    with _autocommit(engine) as connection:
+        connection.execute(text(f"DROP INDEX CONCURRENTLY IF EXISTS {name}"))
+        connection.execute(text(f"ALTER INDEX {new_name} RENAME TO {name}"))
+    print(f"Rebuilt vector index {name}.")
+
+
+def vector_index_status(engine) -> List[dict]:
+    with engine.connect() as connection:
+        rows = connection.execute(text("""
+            SELECT indexname, indexdef, pg_relation_size(format('%I.%I', schemaname, indexname)::regclass) AS size_bytes
+            FROM pg_indexes
+            WHERE schemaname = current_schema() AND tablename = 'chunk' AND (indexdef ILIKE '%USING hnsw%' OR indexdef ILIKE '%USING ivfflat%')
+        """)).all()
+    return [{"name": row[0], "definition": row[1], "size_bytes": row[2]} for row in rows]
+
+
+_pgvector_version = None
+
+
+def pgvector_version(session) -> tuple:
+    global _pgvector_version
+    if _pgvector_version is None:
+        version = session.execute(text("SELECT extversion FROM pg_extension WHERE extname = 'vector'")).scalar()
+        _pgvector_version = tuple(int(part) for part in (version or "0").split("."))
+    return _pgvector_version
+
+
+# Searches on full-precision embeddings; vector_storage.nearest_chunks_sql builds them for every storage mode
+EXACT_SEARCH_SQL = nearest_chunks_sql("vector", "exact")
+ANN_SEARCH_SQL = nearest_chunks_sql("vector", "ann")
+
+
+def _case_share(session, case_id: str) -> tuple:
+    case_rows = session.execute(
+        text("SELECT count(*) FROM chunk JOIN document ON chunk.document_id = document.id WHERE document.case_id = :case_id"),
+        {"case_id": case_id},
+    ).scalar_one()
+    # Planner estimate of the table size; avoids a full count(*) on every search
+    total_rows = session.execute(text("SELECT reltuples::bigint FROM pg_class WHERE oid = 'chunk'::regclass")).scalar() or 0
+    total_rows = max(total_rows, case_rows, 1)
+    return case_rows, case_rows / total_rows
+
+
+def choose_strategy(session, case_id, strategy: str = "auto") -> tuple:
+    """Resolve the search strategy for a case ('auto' -> 'exact' or 'ann'); returns it with the case's share of the table."""
+    if strategy not in SEARCH_STRATEGIES:
+        raise ValueError(f"Unknown search strategy: {strategy}")
+    if strategy == "exact":
+        return strategy, None
+    case_rows, share = _case_share(session, str(case_id))
+    if strategy == "auto" and case_rows <= VECTOR_EXACT_SEARCH_MAX_ROWS:
+        return "exact", share
+    return "ann", share
+
+
+def configure_ann_search(session, limit: int, share: float, ef_search: Optional[int] = None, probes: Optional[int] = None):
+    """
+    Tune the ANN index for a case-filtered search in the current transaction. Explicit `ef_search` / `probes` are
+    used as given (within pgvector's limits); otherwise they are derived from the defaults and the case's share.
+    """
+    # Scale the candidate list with the inverse selectivity of the case filter.
+    # set_config(..., true) only applies to the current transaction, like SET LOCAL.
+    scale = min(1.0 / max(share, 1e-6), 25.0)
+    if ef_search is None:
+        ef_search = max(HNSW_EF_SEARCH, math.ceil(limit * scale))
+    if probes is None:
+        probes = math.ceil(IVFFLAT_PROBES * min(scale, 10.0))
+    ef_search = min(max(ef_search, 1), VECTOR_SEARCH_MAX_EF_SEARCH)
+    probes = min(max(probes, 1), VECTOR_SEARCH_MAX_PROBES)
+    session.execute(text("SELECT set_config('hnsw.ef_search', :value, true)"), {"value": str(ef_search)})
+    session.execute(text("SELECT set_config('ivfflat.probes', :value, true)"), {"value": str(probes)})
+    if pgvector_version(session) >= (0, 8):
+        # Keep scanning the index until enough rows pass the case filter
+        session.execute(text("SELECT set_config('hnsw.iterative_scan', 'strict_order', true)"))
+        session.execute(text("SELECT set_config('ivfflat.iterative_scan', 'relaxed_order', true)"))
+
+
+def hamming_operator_available(session) -> bool:
+    """Whether the indexable Hamming distance operator `<~>` exists (pgvector >= 0.7)."""
+    return pgvector_version(session) >= (0, 7)
+
+
+def search_chunks(session, case_id, query_embedding: List[float], limit: int = 10, ef_search: Optional[int] = None, probes: Optional[int] = None, strategy: str = "auto",
+                  storage: Optional[str] = None):
+    """
+    Return the `limit` chunks of a case closest to `query_embedding` as (id, content, document_id, similarity) rows,
+    together with the strategy that was used ('exact' or 'ann').
+    `ef_search` (HNSW) and `probes` (IVFFlat) tune recall vs latency for this request only.
+    `storage` selects the embedding column (default: EMBEDDING_STORAGE).
+    """
+    storage = storage or EMBEDDING_STORAGE
+    strategy, share = choose_strategy(session, case_id, strategy)
+    params = {**query_params(query_embedding, storage, limit), "case_id": str(case_id), "limit": limit}
+    sql = nearest_chunks_sql(storage, strategy, hamming_operator_available(session) if storage == "binary" else True)
+    if strategy == "ann":
+        # The index has to produce enough candidates for the binary rerank, not just `limit`
+        configure_ann_search(session, params.get("rerank_candidates", limit), share, ef_search, probes)
+    return session.execute(text(sql), params).all(), strategy
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Manage the ANN index on chunk.embedding.")
+    parser.add_argument("action", choices=["create", "rebuild", "drop", "status"])
+    parser.add_argument("--type", choices=INDEX_TYPES, default=VECTOR_INDEX_TYPE)
+    parser.add_argument("--storage", choices=STORAGE_MODES, default=EMBEDDING_STORAGE, help="Embedding column to index")
+    parser.add_argument("--m", type=int, default=HNSW_M)
+    parser.add_argument("--ef-construction", type=int, default=HNSW_EF_CONSTRUCTION)
+    parser.add_argument("--lists", type=int, default=None, help="IVFFlat lists (default: derived from the row count)")
+    args = parser.parse_args()
+
+    from backend.container import get_engine
+    engine = get_engine()
+    if args.action == "create":
+        create_vector_index(engine, args.type, m=args.m, ef_construction=args.ef_construction, lists=args.lists, storage=args.storage)
+    elif args.action == "rebuild":
+        rebuild_vector_index(engine, args.type, m=args.m, ef_construction=args.ef_construction, lists=args.lists, storage=args.storage)
+    elif args.action == "drop":
+        drop_vector_index(engine, args.type, storage=args.storage)
+    for index in vector_index_status(engine):
+        print(f"{index['name']}: {index['size_bytes']} bytes -- {index['definition']}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,308 @@
+"""
+Compact storage of chunk embeddings: half-precision and binary-quantized vectors.
+
+EMBEDDING_STORAGE selects which column the searches (and the ANN index) use:
+- 'vector' (default): chunk.embedding, float32 (6 KB per chunk at 1536 dimensions),
+- 'halfvec': chunk.embedding_half, float16 (3 KB); needs pgvector >= 0.7,
+- 'binary': chunk.embedding_bq, one bit per dimension (192 bytes). A first pass ranks by Hamming distance, then
+  the best EMBEDDING_RERANK_FACTOR x limit candidates are reranked exactly on EMBEDDING_RERANK_COLUMN
+  ('halfvec' or 'vector'). On pgvector < 0.7 the Hamming distance is computed with bit_count and cannot be indexed.
+
+The application keeps writing chunk.embedding; a trigger fills the compact columns. Migrating a database:
+
+    python -m backend.vector_storage migrate --mode halfvec   # Columns + trigger, backfill in batches, ANN index
+    # Set EMBEDDING_STORAGE=halfvec and restart the API and the workers
+    python -m backend.vector_storage compact --mode halfvec   # Clear the float32 values, then VACUUM FULL chunk
+    python -m backend.vector_storage status
+
+After `compact` the trigger also clears chunk.embedding of new rows, so only the compact values are stored
+(not possible for 'binary' with EMBEDDING_RERANK_COLUMN=vector). `restore` rebuilds chunk.embedding from the
+half-precision values and removes the trigger, to go back to 'vector'.
+"""
+from functools import lru_cache
+from typing import List
+import argparse
+import os
+import time
+from dotenv import load_dotenv
+from sqlalchemy import text
+from backend.embeddings import EMBEDDING_DIMENSIONS
+
+load_dotenv()
+
+EMBEDDING_STORAGE = os.getenv("EMBEDDING_STORAGE", "vector") # 'vector', 'halfvec' or 'binary'
+EMBEDDING_RERANK_COLUMN = os.getenv("EMBEDDING_RERANK_COLUMN", "halfvec") # Rerank column of 'binary': 'halfvec' or 'vector'
+EMBEDDING_RERANK_FACTOR = int(os.getenv("EMBEDDING_RERANK_FACTOR", "10")) # Binary candidates per requested result
+EMBEDDING_BACKFILL_BATCH_SIZE = int(os.getenv("EMBEDDING_BACKFILL_BATCH_SIZE", "1000"))
+
+STORAGE_MODES = ("vector", "halfvec", "binary")
+TRIGGER_NAME = "chunk_compact_embedding"
+
+# Column, SQL type of the query parameter and operator class per stored representation
+_COLUMNS = {
+    "vector": ("embedding", "vector", "vector_l2_ops"),
+    "halfvec": ("embedding_half", f"halfvec({EMBEDDING_DIMENSIONS})", "halfvec_l2_ops"),
+    "binary": ("embedding_bq", f"bit({EMBEDDING_DIMENSIONS})", "bit_hamming_ops"),
+}
+
+
+def check_storage(storage: str):
+    if storage not in STORAGE_MODES:
+        raise ValueError(f"Unknown embedding storage: {storage}")
+
+
+def rerank_storage(storage: str) -> str:
+    """The representation exact distances are computed on ('binary' is reranked on EMBEDDING_RERANK_COLUMN)."""
+    return EMBEDDING_RERANK_COLUMN if storage == "binary" else storage
+
+
+def index_column(storage: str) -> tuple:
+    """(column, operator class) of the ANN index for a storage mode."""
+    check_storage(storage)
+    column, _, operator_class = _COLUMNS[storage]
+    return column, operator_class
+
+
+def distance_sql(storage: str) -> str:
+    """Exact L2 distance between a chunk (alias `chunk`) and :query_embedding."""
+    column, sql_type, _ = _COLUMNS[rerank_storage(storage)]
+    return f"chunk.{column} <-> CAST(:query_embedding AS {sql_type})"
+
+
+def embedding_sql(storage: str) -> str:
+    """A chunk's (alias `chunk`) embedding as a vector, read from the column exact distances are computed on."""
+    column = _COLUMNS[rerank_storage(storage)][0]
+    return f"chunk.{column}" if column == "embedding" else f"CAST(chunk.{column} AS vector)"
+
+
+def hamming_sql(hamming_operator: bool) -> str:
+    """Hamming distance between chunk.embedding_bq and :query_bits (pgvector >= 0.7 has the indexable <~> operator)."""
+    if hamming_operator:
+        return f"chunk.embedding_bq <~> CAST(:query_bits AS bit({EMBEDDING_DIMENSIONS}))"
+    return f"bit_count(chunk.embedding_bq # CAST(:query_bits AS bit({EMBEDDING_DIMENSIONS})))"
+
+
+def rerank_candidates(limit: int) -> int:
+    return max(limit * EMBEDDING_RERANK_FACTOR, 40)
+
+
+def query_params(query_embedding: List[float], storage: str, limit: int) -> dict:
+    """Query parameters of nearest_chunks_sql for `limit` results."""
+    params = {"query_embedding": str(list(query_embedding))}
+    if storage == "binary":
+        # Same quantization as pgvector's binary_quantize: 1 for positive values
+        params["query_bits"] = "".join("1" if value > 0 else "0" for value in query_embedding)
+        params["rerank_candidates"] = rerank_candidates(limit)
+    return params
+
+
+@lru_cache(maxsize=None)
+def nearest_chunks_sql(storage: str, strategy: str, hamming_operator: bool = True, limit: str = ":limit") -> str:
+    """
+    SELECT of the `limit` chunks of :case_id nearest to :query_embedding as (id, content, document_id, similarity).
+    'exact' ranks the case's chunks; 'ann' lets the ANN index produce candidates for the case filter.
+    For 'binary' the first pass (:rerank_candidates rows) uses the Hamming distance, followed by an exact rerank.
+    """
+    check_storage(storage)
+    if strategy == "exact":
+        case_rows = "FROM chunk JOIN document ON chunk.document_id = document.id WHERE document.case_id = :case_id"
+    else:
+        case_rows = "FROM chunk WHERE chunk.document_id IN (SELECT document.id FROM document WHERE document.case_id = :case_id)"
+
+    if storage != "binary":
+        column, sql_type, _ = _COLUMNS[storage]
+        if strategy == "exact":
+            # Materialized, so the case filter is applied before the distances are computed
+            return f"""
+                WITH case_chunks AS MATERIALIZED (
+                    SELECT chunk.id, chunk.content, chunk.document_id, chunk.{column} AS embedding {case_rows}
+                )
+                SELECT id, content, document_id, embedding <-> CAST(:query_embedding AS {sql_type}) AS similarity
+                FROM case_chunks
+                ORDER BY similarity
+                LIMIT {limit}
+            """
+        return f"""
+            SELECT chunk.id, chunk.content, chunk.document_id, {distance_sql(storage)} AS similarity
+            {case_rows}
+            ORDER BY {distance_sql(storage)}
+            LIMIT {limit}
+        """
+
+    return f"""
+        WITH candidates AS MATERIALIZED (
+            SELECT chunk.id {case_rows}
+            ORDER BY {hamming_sql(hamming_operator)}
+            LIMIT :rerank_candidates
+        )
+        SELECT chunk.id, chunk.content, chunk.document_id, {distance_sql(storage)} AS similarity
+        FROM candidates
+        JOIN chunk ON chunk.id = candidates.id
+        ORDER BY similarity
+        LIMIT {limit}
+    """
+
+
+# --- Migration -----------------------------------------------------------------------------------------------
+
+
+def _pgvector_version(connection) -> tuple:
+    version = connection.execute(text("SELECT extversion FROM pg_extension WHERE extname = 'vector'")).scalar()
+    return tuple(int(part) for part in (version or "0").split("."))
+
+
+def _required_columns(storage: str) -> List[str]:
+    if storage == "halfvec":
+        return ["halfvec"]
+    if storage == "binary":
+        return ["binary", "halfvec"] if EMBEDDING_RERANK_COLUMN == "halfvec" else ["binary"]
+    return []
+
+
+def _quantize_sql(version: tuple) -> str:
+    if version >= (0, 7):
+        return f"binary_quantize(NEW.embedding)::bit({EMBEDDING_DIMENSIONS})"
+    return (f"(SELECT string_agg(CASE WHEN value > 0 THEN '1' ELSE '0' END, '' ORDER BY position) "
+            f"FROM unnest(NEW.embedding::real[]) WITH ORDINALITY AS v(value, position))::bit({EMBEDDING_DIMENSIONS})")
+
+
+def _install_trigger(connection, storage: str, version: tuple, clear_full: bool):
+    assignments = []
+    for representation in _required_columns(storage):
+        if representation == "halfvec":
+            assignments.append(f"NEW.embedding_half := NEW.embedding::halfvec({EMBEDDING_DIMENSIONS});")
+        else:
+            assignments.append(f"NEW.embedding_bq := {_quantize_sql(version)};")
+    if clear_full:
+        assignments.append("NEW.embedding := NULL;")
+    connection.execute(text(f"""
+        CREATE OR REPLACE FUNCTION {TRIGGER_NAME}() RETURNS trigger AS $$
+        BEGIN
+            IF NEW.embedding IS NOT NULL THEN
+                {' '.join(assignments)}
+            END IF;
+            RETURN NEW;
+        END
+        $$ LANGUAGE plpgsql
+    """))
+    connection.execute(text(f"DROP TRIGGER IF EXISTS {TRIGGER_NAME} ON chunk"))
+    connection.execute(text(f"""
+        CREATE TRIGGER {TRIGGER_NAME} BEFORE INSERT OR UPDATE OF embedding ON chunk
+        FOR EACH ROW EXECUTE FUNCTION {TRIGGER_NAME}()
+    """))
+
+
+def _in_batches(engine, statement: str, batch_size: int, label: str) -> int:
+    """Run an UPDATE ... LIMIT-style statement until it changes no rows, one transaction per batch."""
+    total = 0
+    start = time.perf_counter()
+    while True:
+        with engine.begin() as connection:
+            updated = connection.execute(text(statement), {"batch_size": batch_size}).rowcount
+        total += updated
+        if updated:
+            print(f"{label}: {total} rows ({time.perf_counter() - start:.1f} s)")
+        if updated < batch_size:
+            return total
+
+
+def migrate(engine, storage: str, batch_size: int = EMBEDDING_BACKFILL_BATCH_SIZE, index_type: str = None):
+    """Add the compact columns and the trigger, backfill existing rows in batches and build the ANN index."""
+    check_storage(storage)
+    with engine.begin() as connection:
+        version = _pgvector_version(connection)
+        columns = _required_columns(storage)
+        if "halfvec" in columns and version < (0, 7):
+            raise RuntimeError(f"halfvec needs pgvector >= 0.7 (installed: {'.'.join(map(str, version))})")
+        if "halfvec" in columns:
+            connection.execute(text(f"ALTER TABLE chunk ADD COLUMN IF NOT EXISTS embedding_half halfvec({EMBEDDING_DIMENSIONS})"))
+        if "binary" in columns:
+            connection.execute(text(f"ALTER TABLE chunk ADD COLUMN IF NOT EXISTS embedding_bq bit({EMBEDDING_DIMENSIONS})"))
+        if columns:
+            _install_trigger(connection, storage, version, clear_full=False)
+
+    # Setting embedding to itself fires the trigger, which fills the compact columns
+    missing = " OR ".join(f"{_COLUMNS[representation][0]} IS NULL" for representation in columns) or "false"
+    _in_batches(engine, f"""
+        UPDATE chunk SET embedding = embedding
+        WHERE id IN (SELECT id FROM chunk WHERE embedding IS NOT NULL AND ({missing}) LIMIT :batch_size)
+    """, batch_size, "Backfilled")
+
+    if index_type:
+        if storage == "binary" and version < (0, 7):
+            print("Skipping the ANN index: indexing bit vectors needs pgvector >= 0.7.")
+        else:
+            from backend.vector_index import create_vector_index
+            create_vector_index(engine, index_type, storage=storage)
+    print(f"Migrated to '{storage}' storage. Set EMBEDDING_STORAGE={storage} and restart the API and the workers.")
+
+
+def compact(engine, storage: str, batch_size: int = EMBEDDING_BACKFILL_BATCH_SIZE):
+    """Stop storing float32 embeddings: clear chunk.embedding of existing rows and (via the trigger) of new rows."""
+    check_storage(storage)
+    if storage == "vector" or rerank_storage(storage) == "vector":
+        raise RuntimeError(f"'{storage}' storage needs chunk.embedding; nothing to compact")
+    with engine.begin() as connection:
+        _install_trigger(connection, storage, _pgvector_version(connection), clear_full=True)
+    # Only rows whose compact values are complete are cleared
+    complete = " AND ".join(f"{_COLUMNS[representation][0]} IS NOT NULL" for representation in _required_columns(storage))
+    _in_batches(engine, f"""
+        UPDATE chunk SET embedding = NULL
+        WHERE id IN (SELECT id FROM chunk WHERE embedding IS NOT NULL AND {complete} LIMIT :batch_size)
+    """, batch_size, "Cleared float32 embeddings")
+    print("Run VACUUM FULL chunk (or pg_repack) to return the freed space to the operating system.")
+
+
+def restore(engine, batch_size: int = EMBEDDING_BACKFILL_BATCH_SIZE):
+    """Rebuild chunk.embedding from the half-precision values and remove the trigger (back to 'vector' storage)."""
+    with engine.begin() as connection:
+        connection.execute(text(f"DROP TRIGGER IF EXISTS {TRIGGER_NAME} ON chunk"))
+    _in_batches(engine, """
+        UPDATE chunk SET embedding = embedding_half::vector
+        WHERE id IN (SELECT id FROM chunk WHERE embedding IS NULL AND embedding_half IS NOT NULL LIMIT :batch_size)
+    """, batch_size, "Restored")
+    print("Restored chunk.embedding. Set EMBEDDING_STORAGE=vector; the compact columns can then be dropped.")
+
+
+def status(engine) -> dict:
+    with engine.connect() as connection:
+        columns = connection.execute(text("""
+            SELECT column_name FROM information_schema.columns
+            WHERE table_schema = current_schema() AND table_name = 'chunk' AND column_name IN ('embedding', 'embedding_half', 'embedding_bq')
+        """)).scalars().all()
+        counts = connection.execute(text(f"""
+            SELECT count(*) AS rows, {', '.join(f"count({column}) AS {column}" for column in columns)} FROM chunk
+        """)).mappings().one()
+        trigger = connection.execute(text("SELECT pg_get_functiondef(oid) FROM pg_proc WHERE proname = :name"), {"name": TRIGGER_NAME}).scalar()
+        sizes = connection.execute(text("""
+            SELECT pg_table_size('chunk') AS table_bytes, pg_indexes_size('chunk') AS index_bytes
+        """)).mappings().one()
+    return {
+        "configured_storage": EMBEDDING_STORAGE,
+        "rows": dict(counts),
+        "trigger": None if trigger is None else ("fills compact columns, clears embedding" if "NEW.embedding := NULL" in trigger else "fills compact columns"),
+        **dict(sizes),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("action", choices=["migrate", "compact", "restore", "status"])
+    parser.add_argument("--mode", choices=STORAGE_MODES, default=EMBEDDING_STORAGE)
+    parser.add_argument("--batch-size", type=int, default=EMBEDDING_BACKFILL_BATCH_SIZE)
+    parser.add_argument("--index", choices=["hnsw", "ivfflat", "none"], default="hnsw", help="ANN index to build after migrating")
+    args = parser.parse_args()
+
+    from backend.container import get_engine
+    engine = get_engine()
+    if args.action == "migrate":
+        migrate(engine, args.mode, args.batch_size, None if args.index == "none" else args.index)
+    elif args.action == "compact":
+        compact(engine, args.mode, args.batch_size)
+    elif args.action == "restore":
+        restore(engine, args.batch_size)
+    print(status(engine))
+
+
+if __name__ == "__main__":
+    main()